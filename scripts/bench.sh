@@ -0,0 +1,247 @@
+#!/usr/bin/env bash
+# bench.sh - offline benchmark of the patch engine on synthetic smali corpora
+#
+# Runs the real patch_framework/patch_services/patch_miui_services of one
+# patcher against generated apktool trees (fptools bench-corpus) and appends
+# the per-stage timings to a history file, flagging stages that got slower
+# since the last entry with the same settings. Needs no network, device JARs
+# or Java: the decompile cache is seeded with the synthetic tree, and the
+# apktool build and d8 steps are replaced by the check of which smali roots
+# changed that the incremental recompile starts with.
+
+set -euo pipefail
+
+BENCH_SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+BENCH_API=16
+BENCH_JARS="framework,services,miui-services"
+BENCH_FEATURES="signature,cn,secure"
+BENCH_RUNS=3
+BENCH_SCALE=1.0
+BENCH_SEED=1
+BENCH_HISTORY="bench_results/history.jsonl"
+BENCH_LABEL=""
+BENCH_THRESHOLD=10
+BENCH_FAIL=0
+: "${BENCH_DIR:=${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/bench}"
+
+usage() {
+    cat <<EOF
+Usage: $0 [OPTIONS]
+
+OPTIONS:
+  --api N                 Patcher to run: 13, 14, 15 or 16 (default: $BENCH_API)
+  --jars LIST             Comma-separated JARs (default: $BENCH_JARS)
+  --features LIST         Comma-separated from signature, cn, secure (default: $BENCH_FEATURES)
+  --runs N                Runs per JAR; the history keeps the median (default: $BENCH_RUNS)
+  --scale X               Corpus size as a fraction of a full JAR (default: $BENCH_SCALE)
+  --seed N                Corpus seed (default: $BENCH_SEED)
+  --history FILE          Result history (default: $BENCH_HISTORY)
+  --label TEXT            Note stored with the result
+  --threshold PCT         Slowdown to flag against the previous result (default: $BENCH_THRESHOLD)
+  --fail-on-regression    Exit 1 when a stage is slower by more than the threshold
+
+Corpora, the seeded decompile cache and the run timelines live under
+BENCH_DIR (default: \${XDG_CACHE_HOME:-\$HOME/.cache}/FrameworkPatcher/bench).
+
+EXAMPLES:
+  # Full-size Android 16 run, compared with the last run on this machine
+  $0
+
+  # Quick services-only check of the signature patches
+  $0 --jars services --features signature --scale 0.1 --runs 5
+EOF
+}
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --api | --jars | --features | --runs | --scale | --seed | --history | --label | --threshold)
+            if [ $# -lt 2 ]; then
+                echo "Missing value for $1" >&2
+                exit 1
+            fi
+            case "$1" in
+                --api) BENCH_API="$2" ;;
+                --jars) BENCH_JARS="$2" ;;
+                --features) BENCH_FEATURES="$2" ;;
+                --runs) BENCH_RUNS="$2" ;;
+                --scale) BENCH_SCALE="$2" ;;
+                --seed) BENCH_SEED="$2" ;;
+                --history) BENCH_HISTORY="$2" ;;
+                --label) BENCH_LABEL="$2" ;;
+                --threshold) BENCH_THRESHOLD="$2" ;;
+            esac
+            shift
+            ;;
+        --fail-on-regression)
+            BENCH_FAIL=1
+            ;;
+        -h | --help)
+            usage
+            exit 0
+            ;;
+        *)
+            echo "Unknown option: $1" >&2
+            usage >&2
+            exit 1
+            ;;
+    esac
+    shift
+done
+
+case "$BENCH_API" in
+    13 | 14 | 15 | 16) ;;
+    *)
+        echo "Invalid --api: $BENCH_API (expected 13, 14, 15 or 16)" >&2
+        exit 1
+        ;;
+esac
+
+if ! [[ "$BENCH_RUNS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Invalid --runs: $BENCH_RUNS" >&2
+    exit 1
+fi
+
+BENCH_HISTORY="$(mkdir -p "$(dirname "$BENCH_HISTORY")" && cd "$(dirname "$BENCH_HISTORY")" && pwd)/$(basename "$BENCH_HISTORY")"
+
+# Load the patcher's functions without running its main, and remember the
+# shell options it sets for itself (only patcher_a16.sh uses set -e)
+PATCHER_SOURCE_ONLY=1
+set +euo pipefail
+# shellcheck source=/dev/null
+source "${BENCH_SCRIPT_DIR}/patcher_a${BENCH_API}.sh"
+bench_patcher_opts=$(set +o)
+set -euo pipefail
+
+FEATURE_DISABLE_SIGNATURE_VERIFICATION=0
+FEATURE_CN_NOTIFICATION_FIX=0
+FEATURE_DISABLE_SECURE_FLAG=0
+FEATURE_KAORIOS_TOOLBOX=0
+
+IFS=',' read -ra bench_features <<<"$BENCH_FEATURES"
+for feature in "${bench_features[@]}"; do
+    case "$feature" in
+        signature) FEATURE_DISABLE_SIGNATURE_VERIFICATION=1 ;;
+        cn) FEATURE_CN_NOTIFICATION_FIX=1 ;;
+        secure) FEATURE_DISABLE_SECURE_FLAG=1 ;;
+        *)
+            # Kaorios needs the downloaded toolbox classes, so it is not benchmarked
+            err "Unknown feature: $feature (expected signature, cn or secure)"
+            exit 1
+            ;;
+    esac
+done
+
+IFS=',' read -ra bench_jars <<<"$BENCH_JARS"
+for jar in "${bench_jars[@]}"; do
+    case "$jar" in
+        framework | services | miui-services) ;;
+        *)
+            err "Unknown JAR: $jar (expected framework, services or miui-services)"
+            exit 1
+            ;;
+    esac
+done
+
+# ----------------------------------------------
+# Java-free stand-ins for the build steps
+# ----------------------------------------------
+
+# Report the smali roots an incremental recompile would reassemble and leave
+# an empty patched JAR behind for the callers
+recompile_jar() {
+    local jar_file="$1"
+    local base_name output_dir changed
+    base_name=$(basename "$jar_file" .jar)
+    output_dir="${WORK_DIR}/${base_name}_decompile"
+
+    if changed=$(decompile_changed_dex "$output_dir"); then
+        log "bench: would reassemble ${changed//$'\n'/ } for ${base_name}.jar"
+    else
+        log "bench: would run a full apktool build for ${base_name}.jar"
+    fi
+    rm -f "$(decompile_snapshot_file "$output_dir")"
+    : >"${base_name}_patched.jar"
+    echo "${base_name}_patched.jar"
+}
+
+d8_optimize_jar() {
+    return 0
+}
+
+# ----------------------------------------------
+# Corpora and decompile cache
+# ----------------------------------------------
+
+PATCH_MODE=apktool
+DECOMPILE_CACHE=1
+DECOMPILE_CACHE_DIR="${BENCH_DIR}/decompile"
+TOOLS_DIR="${BENCH_DIR}/tools"
+unset APKTOOL_DIGEST
+mkdir -p "$TOOLS_DIR" "$DECOMPILE_CACHE_DIR"
+# Only hashed into the cache keys
+printf "bench\n" >"${TOOLS_DIR}/apktool.jar"
+
+for jar in "${bench_jars[@]}"; do
+    corpus="${BENCH_DIR}/corpus/${jar}-x${BENCH_SCALE}-s${BENCH_SEED}"
+    log "Preparing $jar corpus in $corpus..."
+    files=$(fptools bench-corpus "$corpus" --jar "$jar" --scale "$BENCH_SCALE" --seed "$BENCH_SEED")
+    log "$jar corpus: $files smali files"
+    decompile_cache_store "$(decompile_cache_key "${corpus}/${jar}.jar")" "${corpus}/tree"
+done
+
+# ----------------------------------------------
+# Runs
+# ----------------------------------------------
+
+bench_timelines="${BENCH_DIR}/timelines"
+rm -rf "$bench_timelines"
+mkdir -p "$bench_timelines"
+
+PATCH_TIMELINE="${bench_timelines}/run1.jsonl"
+: "${PATCH_TIMELINE_INTERVAL:=0.1}"
+export PATCH_TIMELINE_INTERVAL
+timeline_instrument
+timeline_wrap smali_plan_apply smali_index_build patch_return_void_methods_all manifest_apply
+
+for run in $(seq 1 "$BENCH_RUNS"); do
+    PATCH_TIMELINE="${bench_timelines}/run${run}.jsonl"
+    for jar in "${bench_jars[@]}"; do
+        log "Run $run/$BENCH_RUNS: $jar.jar (Android $BENCH_API)"
+        WORK_DIR="${BENCH_DIR}/work"
+        BACKUP_DIR="${WORK_DIR}/backup"
+        rm -rf "$WORK_DIR"
+        mkdir -p "$BACKUP_DIR"
+        cp "${BENCH_DIR}/corpus/${jar}-x${BENCH_SCALE}-s${BENCH_SEED}/${jar}.jar" "$WORK_DIR/"
+        # Waited on rather than tested, so a patcher's set -e still applies
+        (
+            eval "$bench_patcher_opts"
+            cd "$WORK_DIR"
+            "patch_${jar//-/_}"
+        ) >"${bench_timelines}/run${run}-${jar}.log" 2>&1 &
+        wait $! || {
+            err "patch_${jar//-/_} failed, see ${bench_timelines}/run${run}-${jar}.log"
+            exit 1
+        }
+    done
+done
+rm -rf "${BENCH_DIR}/work"
+
+# ----------------------------------------------
+# Results
+# ----------------------------------------------
+
+bench_commit=$(git -C "$BENCH_SCRIPT_DIR" rev-parse --short HEAD 2>/dev/null || echo unknown)
+if [ -n "$(git -C "$BENCH_SCRIPT_DIR" status --porcelain --untracked-files=no 2>/dev/null)" ]; then
+    bench_commit="${bench_commit}-dirty"
+fi
+
+bench_record_args=(
+    --config "api=$BENCH_API" --config "jars=$BENCH_JARS" --config "features=$BENCH_FEATURES"
+    --config "scale=$BENCH_SCALE" --config "seed=$BENCH_SEED" --config "host=$(uname -n)"
+    --commit "$bench_commit" --label "$BENCH_LABEL" --threshold "$BENCH_THRESHOLD"
+)
+[ $BENCH_FAIL -eq 1 ] && bench_record_args+=(--fail-on-regression)
+
+fptools bench-record "$BENCH_HISTORY" "$bench_timelines"/run*.jsonl "${bench_record_args[@]}"
+log "Results appended to $BENCH_HISTORY (patcher logs in $bench_timelines)"
@@ -6,12 +6,95 @@ backup_original_jar() {
     local jar_file="$1"
     local base_name
     base_name=$(basename "$jar_file" .jar)
-    mkdir -p "$BACKUP_DIR/$base_name"
-    # Save META-INF and res if present (silently ignore missing)
-    unzip -o "$jar_file" "META-INF/*" "res/*" -d "$BACKUP_DIR/$base_name" >/dev/null 2>&1 || true
-    # Also copy whole jar for safety
-    cp -a "$jar_file" "$BACKUP_DIR/${base_name}.orig.jar"
-    log "Backed up $jar_file -> $BACKUP_DIR/$base_name"
+    mkdir -p "$BACKUP_DIR"
+    # Every writer replaces the JAR (fptools writes aside and renames), so a
+    # hardlink keeps the original without copying it
+    ln -f "$jar_file" "$BACKUP_DIR/${base_name}.orig.jar" 2>/dev/null ||
+        cp -a "$jar_file" "$BACKUP_DIR/${base_name}.orig.jar"
+    log "Backed up $jar_file -> $BACKUP_DIR/${base_name}.orig.jar"
+}
+
+# ----------------------------------------------
+# Decompile cache
+# ----------------------------------------------
+# Pristine apktool output is kept under DECOMPILE_CACHE_DIR, keyed by the
+# SHA-256 of the input JAR and of apktool.jar, so re-patching the same ROM
+# build skips the decode. Restores use reflinks or hardlinks; every in-tree
+# writer replaces files instead of rewriting them, so edits never reach the
+# cached copy. Set DECOMPILE_CACHE_LINK=copy when running patches that write
+# files in place, or DECOMPILE_CACHE=0 to disable the cache.
+
+decompile_cache_dir() {
+    printf "%s\n" "${DECOMPILE_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/decompile}"
+}
+
+decompile_cache_key() {
+    local jar_file="$1"
+    local jar_sum
+
+    if [ -z "${APKTOOL_DIGEST:-}" ]; then
+        APKTOOL_DIGEST=$(sha256sum "${TOOLS_DIR}/apktool.jar" 2>/dev/null | cut -c1-16) || return 1
+        [ -n "$APKTOOL_DIGEST" ] || return 1
+    fi
+    jar_sum=$(sha256sum "$jar_file" | cut -d' ' -f1) || return 1
+    printf "%s\n" "${jar_sum}-apktool-${APKTOOL_DIGEST}"
+}
+
+# Populate dst (must not exist) from src: reflink, hardlink or plain copy
+decompile_cache_link() {
+    local src="$1"
+    local dst="$2"
+    local mode="${DECOMPILE_CACHE_LINK:-auto}"
+    local attempt
+
+    case "$mode" in
+        auto) set -- reflink hard copy ;;
+        reflink | hard | copy) set -- "$mode" ;;
+        *)
+            warn "Unknown DECOMPILE_CACHE_LINK=$mode, copying"
+            set -- copy
+            ;;
+    esac
+
+    for attempt in "$@"; do
+        rm -rf "$dst"
+        case "$attempt" in
+            reflink) cp -a --reflink=always "$src" "$dst" 2>/dev/null && return 0 ;;
+            hard) cp -al "$src" "$dst" 2>/dev/null && return 0 ;;
+            copy) cp -a "$src" "$dst" && return 0 ;;
+        esac
+    done
+    rm -rf "$dst"
+    return 1
+}
+
+decompile_cache_restore() {
+    local key="$1"
+    local output_dir="$2"
+    local entry
+    entry="$(decompile_cache_dir)/$key"
+
+    [ -d "$entry/tree" ] || return 1
+    decompile_cache_link "$entry/tree" "$output_dir" || return 1
+    touch "$entry"
+}
+
+decompile_cache_store() {
+    local key="$1"
+    local output_dir="$2"
+    local root staging
+    root=$(decompile_cache_dir)
+
+    [ -d "$root/$key" ] && return 0
+    mkdir -p "$root" || return 1
+    staging=$(mktemp -d "$root/.${key}.XXXXXX") || return 1
+
+    # Build the entry aside and rename it in, so concurrent jobs never see half a tree
+    if decompile_cache_link "$output_dir" "$staging/tree" && mv -T "$staging" "$root/$key" 2>/dev/null; then
+        log "Cached decompiled tree for $(basename "$output_dir") ($key)"
+    fi
+    rm -rf "$staging"
+    cache_evict_lru "$root" "${DECOMPILE_CACHE_MAX_MB:-4096}"
 }
 
 decompile_jar() {
@@ -19,22 +102,35 @@ decompile_jar() {
     local base_name
     base_name=$(basename "$jar_file" .jar)
     local output_dir="${WORK_DIR}/${base_name}_decompile"
+    local cache_key=""
 
-    log "Decompiling $jar_file -> $output_dir (apktool)"
     rm -rf "$output_dir" "$base_name" >/dev/null 2>&1 || true
-    mkdir -p "$output_dir"
 
     backup_original_jar "$jar_file"
 
-    java -jar "${TOOLS_DIR}/apktool.jar" d -q -f "$jar_file" -o "$output_dir" || {
-        err "apktool failed to decompile $jar_file"
-        return 1
-    }
+    if [ "${DECOMPILE_CACHE:-1}" != "0" ]; then
+        cache_key=$(decompile_cache_key "$jar_file") || cache_key=""
+    fi
 
-    # copy META-INF and res into unknown/ (keeps resources for later)
-    mkdir -p "$output_dir/unknown"
-    cp -r "$BACKUP_DIR/$base_name/res" "$output_dir/unknown/" 2>/dev/null || true
-    cp -r "$BACKUP_DIR/$base_name/META-INF" "$output_dir/unknown/" 2>/dev/null || true
+    if [ -n "$cache_key" ] && decompile_cache_restore "$cache_key" "$output_dir"; then
+        log "Restored $jar_file -> $output_dir from decompile cache ($cache_key)"
+    else
+        log "Decompiling $jar_file -> $output_dir (apktool)"
+        mkdir -p "$output_dir"
+
+        apktool_run d -q -f ${APKTOOL_FRAME_DIR:+-p "$APKTOOL_FRAME_DIR"} "$jar_file" -o "$output_dir" || {
+            err "apktool failed to decompile $jar_file"
+            return 1
+        }
+
+        # Keep META-INF and res in unknown/ so the rebuild carries them
+        mkdir -p "$output_dir/unknown"
+        unzip -q -o "$jar_file" "META-INF/*" "res/*" -d "$output_dir/unknown" >/dev/null 2>&1 || true
+
+        if [ -n "$cache_key" ]; then
+            decompile_cache_store "$cache_key" "$output_dir" || warn "Could not cache decompiled tree for $jar_file"
+        fi
+    fi
 
     log "Decompile finished: $output_dir"
 
@@ -49,9 +145,107 @@ decompile_jar() {
         fi
     done
 
+    # Index every class/method once so patch helpers never rescan the tree
+    rm -rf "$(smali_index_dir "$output_dir")"
+    smali_index_build "$output_dir" || true
+
+    decompile_snapshot "$output_dir" >"$(decompile_snapshot_file "$output_dir")" ||
+        rm -f "$(decompile_snapshot_file "$output_dir")"
+
     echo "$output_dir"
 }
 
+# ----------------------------------------------
+# Incremental recompile
+# ----------------------------------------------
+# decompile_jar records a digest of each top-level entry of the tree, every
+# smali root on its own. recompile_jar compares against it, reassembles only
+# the smali roots that changed and splices their classesN.dex into a copy of
+# the original JAR, so untouched dex entries stay byte-identical. Anything
+# else changing (apktool.yml, unknown/, a removed root) means a full apktool
+# build, as does INCREMENTAL_RECOMPILE=0.
+
+decompile_snapshot_file() {
+    printf "%s\n" "${1%/}.roots"
+}
+
+# Print "entry<TAB>digest" for each top-level entry; the digest covers the
+# path, inode, size and mtime of everything below it, which every writer
+# (sed -i, fptools, the Kaorios heredocs) changes
+decompile_snapshot() {
+    local dir="$1"
+    local entry
+    for entry in "$dir"/*; do
+        # classes -> smali compatibility symlinks are not roots of their own
+        [ -L "$entry" ] && continue
+        printf "%s\t%s\n" "$(basename "$entry")" \
+            "$(find "$entry" -printf '%P\t%i\t%s\t%T@\n' | sort | sha256sum | cut -c1-16)"
+    done
+}
+
+# Print the dex name (classes.dex, classes2.dex, ...) of each smali root
+# changed since decompile_jar; fails when a full build is needed
+decompile_changed_dex() {
+    local dir="$1"
+    local snapshot name
+    snapshot=$(decompile_snapshot_file "$dir")
+    [ -f "$snapshot" ] || return 1
+
+    while IFS= read -r name; do
+        [ -d "$dir/$name" ] || return 1
+        case "$name" in
+            smali) printf "classes.dex\n" ;;
+            smali_classes[0-9]*) printf "classes%s.dex\n" "${name#smali_classes}" ;;
+            *) return 1 ;;
+        esac
+    done < <(
+        decompile_snapshot "$dir" | awk -F'\t' '
+            NR == FNR { old[$1] = $2; next }
+            { if (old[$1] != $2) print $1; delete old[$1] }
+            END { for (name in old) print name }
+        ' "$snapshot" -
+    )
+}
+
+# Reassemble the listed dex files and splice them into a copy of jar_file.
+# The names go to <patched_jar>.rebuilt so d8_optimize_jar only touches them.
+recompile_jar_incremental() {
+    local jar_file="$1"
+    local output_dir="$2"
+    local patched_jar="$3"
+    shift 3
+
+    local stage="${output_dir}.rebuild"
+    local dex root
+    local -a entries=()
+
+    if [ $# -eq 0 ]; then
+        log "No smali changes in $output_dir, reusing $(basename "$jar_file")"
+        ln -f "$jar_file" "$patched_jar" 2>/dev/null || cp "$jar_file" "$patched_jar" || return 1
+        : >"${patched_jar}.rebuilt"
+        return 0
+    fi
+
+    rm -rf "$stage"
+    mkdir -p "$stage/dex"
+    cp "$output_dir/apktool.yml" "$stage/" || return 1
+    for dex in "$@"; do
+        root="smali_${dex%.dex}"
+        [ "$dex" = "classes.dex" ] && root="smali"
+        cp -al "$output_dir/$root" "$stage/$root" 2>/dev/null || cp -a "$output_dir/$root" "$stage/$root" || return 1
+        entries+=("$dex=$stage/dex/$dex")
+    done
+
+    log "Reassembling $* for $(basename "$jar_file")"
+    apktool_run b -q -f ${APKTOOL_FRAME_DIR:+-p "$APKTOOL_FRAME_DIR"} "$stage" -o "$stage/build.jar" &&
+        unzip -q -o "$stage/build.jar" "$@" -d "$stage/dex" &&
+        fptools jar-splice "$jar_file" "$patched_jar" "${entries[@]}" &&
+        printf "%s\n" "$@" >"${patched_jar}.rebuilt"
+    local status=$?
+    rm -rf "$stage"
+    return "$status"
+}
+
 recompile_jar() {
     local jar_file="$1" # original jar file path (used only for name)
     local base_name
@@ -65,15 +259,241 @@ recompile_jar() {
         return 1
     fi
 
-    java -jar "${TOOLS_DIR}/apktool.jar" b -q -f "$output_dir" -o "$patched_jar" || {
+    local snapshot changed
+    snapshot=$(decompile_snapshot_file "$output_dir")
+    rm -f "${patched_jar}.rebuilt"
+    if [ "${INCREMENTAL_RECOMPILE:-1}" != "0" ] && [ -f "$jar_file" ] &&
+        changed=$(decompile_changed_dex "$output_dir"); then
+        # shellcheck disable=SC2086 # dex names never contain spaces
+        if recompile_jar_incremental "$jar_file" "$output_dir" "$patched_jar" $changed; then
+            rm -f "$snapshot"
+            patch_output_built "$patched_jar"
+            log "Created patched JAR: $patched_jar"
+            echo "$patched_jar"
+            return 0
+        fi
+        rm -f "${patched_jar}.rebuilt"
+        warn "Incremental recompile failed, rebuilding all of $output_dir"
+    fi
+    rm -f "$snapshot"
+
+    apktool_run b -q -f ${APKTOOL_FRAME_DIR:+-p "$APKTOOL_FRAME_DIR"} "$output_dir" -o "$patched_jar" || {
         err "apktool build failed for $output_dir"
         return 1
     }
 
+    patch_output_built "$patched_jar"
     log "Created patched JAR: $patched_jar"
     echo "$patched_jar"
 }
 
+# dex_patch_jar <jar> <plan_fn>
+#
+# With PATCH_MODE=dex, edits the classes*.dex of the JAR in place from the
+# dex_op lines plan_fn prints and writes <jar>_patched.jar, skipping the
+# apktool decode/rebuild and d8. Returns 1 when the mode is off, plan_fn has no
+# in-place plan for the selected features, or an edit would need to resize
+# code; the caller then runs the apktool pipeline instead.
+dex_patch_jar() {
+    local jar_file="$1"
+    local plan_fn="$2"
+    local base_name plan status=0
+    base_name=$(basename "$jar_file" .jar)
+
+    [ "${PATCH_MODE:-apktool}" = "dex" ] || return 1
+
+    plan=$(mktemp "${TMPDIR:-/tmp}/dex_plan.XXXXXX")
+    if ! "$plan_fn" >"$plan"; then
+        rm -f "$plan"
+        log "${base_name}.jar needs apktool for the selected features"
+        return 1
+    fi
+
+    log "Patching ${base_name}.jar at DEX level"
+    fptools dex-patch "$jar_file" "${base_name}_patched.jar" "$plan" || status=$?
+    rm -f "$plan"
+
+    case "$status" in
+        0)
+            patch_output_built "${base_name}_patched.jar"
+            log "Created patched JAR: ${base_name}_patched.jar"
+            return 0
+            ;;
+        3) ;; # fptools already explained which edit did not fit
+        *) warn "DEX patch of ${base_name}.jar failed (status $status)" ;;
+    esac
+    log "Falling back to apktool for ${base_name}.jar"
+    return 1
+}
+
+# ----------------------------------------------
+# d8
+# ----------------------------------------------
+# Every classesN.dex goes through d8 on its own, D8_JOBS at a time (default:
+# one per CPU), and the outputs are spliced into the JAR in one write. Each
+# single-dex output is cached under D8_CACHE_DIR by the digest of its input
+# dex, the d8 build and the flags, so dex files that did not change since an
+# earlier run (or an interrupted one) are never re-dexed. A shard that d8
+# splits into several dex files makes the whole JAR go through one merged d8
+# run instead. D8_CACHE=0 disables the cache.
+
+d8_cache_dir() {
+    printf "%s\n" "${D8_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/d8}"
+}
+
+# Digest of the d8 build: its launcher and the d8.jar next to it (memoized
+# in D8_DIGEST)
+d8_digest() {
+    local d8_cmd="$1"
+    local launcher
+    if [ -z "${D8_DIGEST:-}" ]; then
+        launcher=$(readlink -f "$(command -v "$d8_cmd")") || return 1
+        D8_DIGEST=$(cat "$launcher" "$(dirname "$launcher")/lib/d8.jar" 2>/dev/null | sha256sum | cut -c1-16)
+    fi
+    printf "%s\n" "$D8_DIGEST"
+}
+
+# d8_dex <d8_cmd> <min_api> <in.dex> <out.dex>
+# Returns 2 when d8 splits the dex, 1 when it fails
+d8_dex() {
+    local d8_cmd="$1"
+    local min_api="$2"
+    local in_dex="$3"
+    local out_dex="$4"
+    local key="" entry="" out_dir staging status=0
+
+    if [ "${D8_CACHE:-1}" != "0" ]; then
+        key="$(sha256sum "$in_dex" | cut -d' ' -f1)-$(d8_digest "$d8_cmd")-api${min_api}-release" || key=""
+    fi
+    if [ -n "$key" ]; then
+        entry="$(d8_cache_dir)/$key"
+        if [ -f "$entry/classes.dex" ] && cp "$entry/classes.dex" "$out_dex"; then
+            touch "$entry"
+            echo "[INFO] Reusing cached D8 output for $(basename "$in_dex")"
+            return 0
+        fi
+    fi
+
+    out_dir="${out_dex}.d8"
+    rm -rf "$out_dir"
+    mkdir -p "$out_dir"
+    # --release: Removes debug information (lines, source files) to reduce size.
+    # --min-api: Ensures proper multidex partitioning.
+    if ! d8_run "$d8_cmd" "$in_dex" --output "$out_dir" --min-api "$min_api" --release; then
+        status=1
+    elif [ "$(ls "$out_dir")" != "classes.dex" ]; then
+        status=2
+    else
+        mv "$out_dir/classes.dex" "$out_dex" || status=1
+    fi
+    rm -rf "$out_dir"
+    [ "$status" -eq 0 ] || return "$status"
+
+    if [ -n "$key" ] && mkdir -p "$(d8_cache_dir)" &&
+        staging=$(mktemp -d "$(d8_cache_dir)/.${key}.XXXXXX"); then
+        # Built aside and renamed in, so concurrent runs never see a partial entry
+        cp "$out_dex" "$staging/classes.dex" && mv -T "$staging" "$entry" 2>/dev/null
+        rm -rf "$staging"
+    fi
+    return 0
+}
+
+# d8_run_shards <work_dir> <d8_cmd> <min_api> <dex>...
+# d8 each <work_dir>/raw/<dex> into <work_dir>/out/<dex>; the exit status of
+# each shard is left in <work_dir>/status/<dex>
+d8_run_shards() {
+    local work_dir="$1"
+    local d8_cmd="$2"
+    local min_api="$3"
+    shift 3
+    local jobs running=0 dex
+
+    jobs=$(resolve_job_count "${D8_JOBS:-auto}") || jobs=1
+    mkdir -p "$work_dir/out" "$work_dir/status"
+    for dex in "$@"; do
+        (
+            shard_status=0
+            d8_dex "$d8_cmd" "$min_api" "$work_dir/raw/$dex" "$work_dir/out/$dex" || shard_status=$?
+            echo "$shard_status" >"$work_dir/status/$dex"
+        ) &
+        running=$((running + 1))
+        if [ "$running" -ge "$jobs" ]; then
+            wait -n || true
+            running=$((running - 1))
+        fi
+    done
+    wait || true
+    [ "${D8_CACHE:-1}" = "0" ] || cache_evict_lru "$(d8_cache_dir)" "${D8_CACHE_MAX_MB:-2048}"
+}
+
+d8_shard_status() {
+    cat "$1/status/$2" 2>/dev/null || echo 1
+}
+
+# Run d8 over the dex files an incremental recompile reassembled and splice
+# the results back; the original dex entries are left alone
+d8_optimize_rebuilt() {
+    local jar_file="$1"
+    local d8_cmd="$2"
+    local min_api="$3"
+    local work_dir="${jar_file}_opt_work"
+    local dex status=0
+    local -a dexes=() entries=()
+
+    mapfile -t dexes <"${jar_file}.rebuilt"
+    rm -f "${jar_file}.rebuilt"
+    if [ ${#dexes[@]} -eq 0 ]; then
+        echo "[INFO] No reassembled DEX files in $(basename "$jar_file"). Skipping optimization."
+        return 0
+    fi
+
+    echo "[INFO] Starting D8 DEX optimization for ${dexes[*]} in $(basename "$jar_file")"
+    rm -rf "$work_dir"
+    mkdir -p "$work_dir/raw"
+    unzip -q -o "$jar_file" "${dexes[@]}" -d "$work_dir/raw" || status=1
+
+    if [ "$status" -eq 0 ]; then
+        d8_run_shards "$work_dir" "$d8_cmd" "$min_api" "${dexes[@]}"
+        for dex in "${dexes[@]}"; do
+            if [ "$(d8_shard_status "$work_dir" "$dex")" = "0" ]; then
+                entries+=("$dex=$work_dir/out/$dex")
+            else
+                echo "[WARN] D8 did not produce a single DEX for $dex. Keeping the assembled one."
+            fi
+        done
+    fi
+
+    if [ "$status" -eq 0 ] && [ ${#entries[@]} -gt 0 ]; then
+        fptools jar-splice "$jar_file" "$jar_file" "${entries[@]}" || status=1
+    fi
+    rm -rf "$work_dir"
+
+    if [ "$status" -ne 0 ]; then
+        echo "[ERROR] D8 optimization of reassembled DEX files failed."
+        return 1
+    fi
+    echo "[INFO] Optimization completed successfully."
+    echo "[INFO] Final file size: $(du -h "$jar_file" | cut -f1)"
+}
+
+# One d8 over every dex of the JAR, free to redistribute classes; used when a
+# shard does not fit a single dex. Prints the NAME=FILE splice arguments.
+d8_merge_all() {
+    local work_dir="$1"
+    local d8_cmd="$2"
+    local min_api="$3"
+    local dex
+
+    rm -rf "$work_dir/merged"
+    mkdir -p "$work_dir/merged"
+    echo "[INFO] Executing D8 merge and redivision..." >&2
+    d8_run "$d8_cmd" "$work_dir/raw"/*.dex --output "$work_dir/merged" --min-api "$min_api" --release >&2 || return 1
+    for dex in "$work_dir/merged"/classes*.dex; do
+        [ -f "$dex" ] || return 1
+        printf "%s=%s\n" "$(basename "$dex")" "$dex"
+    done
+}
+
 d8_optimize_jar() {
     local jar_file="$1"
     
@@ -87,55 +507,78 @@ d8_optimize_jar() {
     
     if ! command -v "$d8_cmd" >/dev/null 2>&1; then
         echo "[ERROR] d8 command not found. Skipping optimization."
+        rm -f "${jar_file}.rebuilt"
         return 1
     fi
+    # Resolved here so the shard subshells inherit it
+    d8_digest "$d8_cmd" >/dev/null || true
+
+    # After an incremental recompile only the reassembled dex files need d8
+    if [ -f "${jar_file}.rebuilt" ]; then
+        d8_optimize_rebuilt "$jar_file" "$d8_cmd" "$MIN_API"
+        return
+    fi
 
     echo "[INFO] Starting D8 DEX optimization for target: $(basename "$jar_file")"
 
     local work_dir="${jar_file}_opt_work"
+    local dex shard_status merged=0
+    local -a dexes=() entries=() removals=()
     rm -rf "$work_dir"
     mkdir -p "$work_dir/raw"
-    mkdir -p "$work_dir/out"
 
     # 1. Extract DEX files
     # We ignore resources and META-INF to process code only.
     echo "[INFO] Extracting DEX files..."
-    unzip -q -j "$jar_file" "*.dex" -d "$work_dir/raw"
-    
-    # Verify extraction
-    if [ -z "$(ls -A "$work_dir/raw" 2>/dev/null)" ]; then
+    mapfile -t dexes < <(unzip -Z1 "$jar_file" 2>/dev/null | grep -E '^classes[0-9]*\.dex$')
+    if [ ${#dexes[@]} -eq 0 ]; then
         echo "[WARN] No DEX files found in JAR. Skipping optimization."
         rm -rf "$work_dir"
         return 0
     fi
-
-    # 2. Execute D8
-    # --release: Removes debug information (lines, source files) to reduce size.
-    # --min-api: Ensures proper multidex partitioning.
-    echo "[INFO] Executing D8 merge and redivision..."
-    "$d8_cmd" "$work_dir/raw"/*.dex \
-        --output "$work_dir/out" \
-        --min-api "$MIN_API" \
-        --release
-
-    if [ $? -ne 0 ]; then
-        echo "[ERROR] D8 compilation failed. Retaining original file."
+    unzip -q -o "$jar_file" "${dexes[@]}" -d "$work_dir/raw" || {
+        echo "[ERROR] Could not extract DEX files. Retaining original file."
         rm -rf "$work_dir"
         return 1
+    }
+
+    # 2. Execute D8, one shard per dex
+    echo "[INFO] Executing D8 on ${#dexes[@]} DEX shards..."
+    d8_run_shards "$work_dir" "$d8_cmd" "$MIN_API" "${dexes[@]}"
+    for dex in "${dexes[@]}"; do
+        shard_status=$(d8_shard_status "$work_dir" "$dex")
+        case "$shard_status" in
+            0) entries+=("$dex=$work_dir/out/$dex") ;;
+            2) merged=1 ;;
+            *)
+                echo "[ERROR] D8 compilation failed for $dex. Retaining original file."
+                rm -rf "$work_dir"
+                return 1
+                ;;
+        esac
+    done
+
+    if [ "$merged" -eq 1 ]; then
+        echo "[INFO] A DEX shard outgrew a single DEX file, merging all shards instead"
+        mapfile -t entries < <(d8_merge_all "$work_dir" "$d8_cmd" "$MIN_API")
+        if [ ${#entries[@]} -eq 0 ]; then
+            echo "[ERROR] D8 compilation failed. Retaining original file."
+            rm -rf "$work_dir"
+            return 1
+        fi
+        # The merged output may have fewer DEX files than the input
+        for dex in "${dexes[@]}"; do
+            removals+=(--remove "$dex")
+        done
     fi
 
-    # 3. Update the JAR archive
-    # Existing DEX files must be deleted first as the optimized output 
-    # may contain fewer DEX files than the input.
+    # 3. Update the JAR archive in one write
     echo "[INFO] Updating JAR archive..."
-    
-    # Remove all existing .dex files from the archive
-    zip -d -q "$jar_file" "*.dex" 2>/dev/null
-    
-    # Inject optimized .dex files
-    cd "$work_dir/out" || return 1
-    zip -u -q -0 "../../$(basename "$jar_file")" classes*.dex
-    cd - >/dev/null
+    fptools jar-splice "$jar_file" "$jar_file" "${entries[@]}" "${removals[@]}" || {
+        echo "[ERROR] Could not update $(basename "$jar_file"). Retaining original file."
+        rm -rf "$work_dir"
+        return 1
+    }
 
     # 4. Cleanup and Reporting
     local new_size
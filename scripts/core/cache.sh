@@ -0,0 +1,138 @@
+#!/usr/bin/env bash
+# scripts/core/cache.sh
+# Content-addressed caches shared by the patchers
+
+# Drop least recently used entries of a cache root until it fits max_mb.
+# Entries are the top-level directories; their mtime is the last use.
+cache_evict_lru() {
+    local root="$1"
+    local max_kb=$((${2:-4096} * 1024))
+    local total=0 newest=1 size entry
+
+    [ -d "$root" ] || return 0
+    # Newest first; the most recent entry is always kept
+    while IFS= read -r entry; do
+        size=$(du -sk "$entry" 2>/dev/null | cut -f1)
+        total=$((total + ${size:-0}))
+        if [ "$newest" -eq 0 ] && [ "$total" -gt "$max_kb" ]; then
+            rm -rf "$entry"
+            log "Evicted cache entry $(basename "$entry")"
+        fi
+        newest=0
+    done < <(find "$root" -mindepth 1 -maxdepth 1 -type d ! -name '.*' -printf '%T@ %p\n' | sort -rn | cut -d' ' -f2-)
+}
+
+# ----------------------------------------------
+# Patched output cache
+# ----------------------------------------------
+# A patched JAR depends only on the input JAR, the selected features, the
+# patcher sources and the toolchain, so identical requests (same ROM build and
+# feature set) reuse the <jar>_patched.jar of an earlier run and skip the
+# decompile/patch/recompile chain entirely. PATCH_CACHE=0 disables it.
+
+# Only the patched JARs this run built get cached; anything else in the
+# current dir is a leftover. The file's age cannot tell: without smali changes
+# an incremental recompile hardlinks the input JAR, which keeps its old mtime.
+PATCH_RUN_ID="$(date +%s).$$"
+
+# Record that this run built patched_jar (<jar>_patched.jar)
+patch_output_built() {
+    printf "%s\n" "$PATCH_RUN_ID" >"${1}.built"
+}
+
+patch_cache_dir() {
+    printf "%s\n" "${PATCH_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/patched}"
+}
+
+# Digest of every file that can change patch output: the scripts, the
+# fptools package and the Kaorios payload
+patcher_revision() {
+    if [ -z "${PATCHER_REVISION:-}" ]; then
+        local repo_root
+        repo_root="$(cd "${FPTOOLS_PYTHONPATH}/.." && pwd)"
+        PATCHER_REVISION=$(
+            cd "$repo_root" &&
+                find scripts kaorios_toolbox -type f ! -path '*/__pycache__/*' -print0 2>/dev/null |
+                sort -z | xargs -0 sha256sum | sha256sum | cut -c1-16
+        )
+    fi
+    printf "%s\n" "$PATCHER_REVISION"
+}
+
+# Enabled FEATURE_* flags as a sorted, lower-case list (e.g. cn_notification_fix+disable_secure_flag)
+patch_feature_list() {
+    local flag list=""
+    for flag in $(compgen -v FEATURE_ | sort); do
+        [ "${!flag}" = "1" ] || continue
+        list="${list:+$list+}$(printf "%s" "${flag#FEATURE_}" | tr '[:upper:]' '[:lower:]')"
+    done
+    printf "%s\n" "${list:-none}"
+}
+
+patch_cache_key() {
+    local jar_file="$1"
+    local jar_sum toolchain
+
+    jar_sum=$(sha256sum "$jar_file" | cut -d' ' -f1) || return 1
+    toolchain=$(
+        {
+            basename "$0"
+            printf "%s\n" "${PATCH_MODE:-apktool}"
+            sha256sum "${TOOLS_DIR}/apktool.jar" 2>/dev/null | cut -d' ' -f1
+            command -v "${D8_CMD:-d8}" 2>/dev/null
+        } | sha256sum | cut -c1-16
+    )
+    printf "%s\n" "$(basename "$jar_file" .jar)-${jar_sum}-$(patch_feature_list | sha256sum | cut -c1-12)-$(patcher_revision)-${toolchain}"
+}
+
+# Runs against an existing decompile dir (SERVICES_DECOMPILE_DIR, a leftover
+# services_decompile/, ...) only verify patches and are never cached
+patch_cache_usable() {
+    local jar_file="$1"
+    local base_name decompile_var
+    base_name=$(basename "$jar_file" .jar)
+    decompile_var="$(printf "%s" "$base_name" | tr '[:lower:]-' '[:upper:]_')_DECOMPILE_DIR"
+
+    [ "${PATCH_CACHE:-1}" != "0" ] &&
+        [ -f "$jar_file" ] &&
+        [ -z "${!decompile_var:-}" ] &&
+        [ ! -d "${WORK_DIR}/${base_name}_decompile" ]
+}
+
+# Copy a cached <jar>_patched.jar into the current dir; returns 1 on a miss
+patch_cache_restore() {
+    local jar_file="$1"
+    local base_name key entry
+    base_name=$(basename "$jar_file" .jar)
+
+    patch_cache_usable "$jar_file" || return 1
+    key=$(patch_cache_key "$jar_file") || return 1
+    entry="$(patch_cache_dir)/$key"
+    [ -f "$entry/${base_name}_patched.jar" ] || return 1
+
+    cp "$entry/${base_name}_patched.jar" "${base_name}_patched.jar" || return 1
+    touch "$entry"
+    log "Reusing cached ${base_name}_patched.jar ($key)"
+}
+
+# Call only after the JAR's pipeline succeeded in this run
+patch_cache_store() {
+    local jar_file="$1"
+    local base_name key root staging
+    base_name=$(basename "$jar_file" .jar)
+
+    patch_cache_usable "$jar_file" && [ -f "${base_name}_patched.jar" ] || return 0
+    [ "$(cat "${base_name}_patched.jar.built" 2>/dev/null)" = "$PATCH_RUN_ID" ] || return 0
+
+    key=$(patch_cache_key "$jar_file") || return 1
+    root=$(patch_cache_dir)
+    [ -d "$root/$key" ] && return 0
+
+    mkdir -p "$root" || return 1
+    staging=$(mktemp -d "$root/.${key}.XXXXXX") || return 1
+    if cp "${base_name}_patched.jar" "$staging/" && mv -T "$staging" "$root/$key" 2>/dev/null; then
+        log "Cached ${base_name}_patched.jar ($key)"
+    fi
+    rm -rf "$staging"
+    cache_evict_lru "$root" "${PATCH_CACHE_MAX_MB:-1024}"
+}
@@ -0,0 +1,120 @@
+#!/usr/bin/env bash
+# scripts/core/jobs.sh
+# Bounded parallel runner for independent per-JAR pipelines
+
+# Resolve a --jobs value: "auto" (or 0) means one worker per CPU
+resolve_job_count() {
+    local requested="${1:-1}"
+    if [ "$requested" = "auto" ] || [ "$requested" = "0" ]; then
+        requested=$(nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)
+    fi
+    case "$requested" in
+        '' | *[!0-9]*)
+            err "Invalid job count: $1"
+            return 1
+            ;;
+    esac
+    printf "%s\n" "$requested"
+}
+
+# Terminate a job and everything it spawned (apktool/d8 JVMs included)
+kill_job_tree() {
+    local pid="$1"
+    local child
+    for child in $(pgrep -P "$pid" 2>/dev/null); do
+        kill_job_tree "$child"
+    done
+    kill -TERM "$pid" 2>/dev/null || true
+}
+
+# run_jar_jobs <max_jobs> <name:function>...
+#
+# Runs each function in its own subshell, at most max_jobs at a time. Every job
+# gets a private TMPDIR and apktool framework dir under ${WORK_DIR}/.jobs/<name>
+# and writes its output to ${JOB_LOG_DIR}/<name>.log, which is replayed with a
+# "[name]" prefix once the job finishes. The first failing job stops the rest
+# and the call returns non-zero.
+#
+# Bash ignores set -e inside anything run from an if/&&/|| context, subshells
+# included, so callers relying on errexit must not call this as a condition.
+run_jar_jobs() {
+    local max_jobs="$1"
+    shift
+
+    local log_dir="${JOB_LOG_DIR:-${WORK_DIR}/patch_logs}"
+    local jobs_root="${WORK_DIR}/.jobs"
+    mkdir -p "$log_dir"
+
+    local -A running=()
+    local -a queue=("$@")
+    local failed="" status=0 spec name fn pid job_dir
+
+    [ "$max_jobs" -ge 1 ] 2>/dev/null || max_jobs=1
+
+    while [ ${#queue[@]} -gt 0 ] || [ ${#running[@]} -gt 0 ]; do
+        # Fill free worker slots unless a job already failed
+        while [ -z "$failed" ] && [ ${#queue[@]} -gt 0 ] && [ ${#running[@]} -lt "$max_jobs" ]; do
+            spec="${queue[0]}"
+            queue=("${queue[@]:1}")
+            name="${spec%%:*}"
+            fn="${spec#*:}"
+            job_dir="${jobs_root}/${name}"
+            rm -rf "$job_dir"
+            mkdir -p "$job_dir/tmp" "$job_dir/apktool-framework"
+
+            (
+                export TMPDIR="$job_dir/tmp"
+                export APKTOOL_FRAME_DIR="$job_dir/apktool-framework"
+                "$fn"
+            ) >"$log_dir/${name}.log" 2>&1 &
+            running[$!]="$name"
+            log "Started ${name} pipeline (pid $!, log: $log_dir/${name}.log)"
+        done
+
+        [ ${#running[@]} -gt 0 ] || break
+
+        pid=""
+        if wait -n -p pid "${!running[@]}"; then
+            status=0
+        else
+            status=$?
+        fi
+        if [ -z "${pid:-}" ]; then
+            # wait -n only comes back without a pid when no children are left
+            err "Lost track of pipelines: ${running[*]}"
+            failed="${running[*]}"
+            break
+        fi
+
+        name="${running[$pid]}"
+        unset "running[$pid]"
+        sed "s/^/[${name}] /" "$log_dir/${name}.log" >&2
+
+        if [ "$status" -eq 0 ]; then
+            rm -rf "${jobs_root:?}/${name}"
+            log "✓ ${name} pipeline finished"
+            continue
+        fi
+
+        err "${name} pipeline failed (exit $status), see $log_dir/${name}.log"
+        failed="$name"
+        queue=()
+
+        # Fail fast: stop every other pipeline, then collect them
+        for pid in "${!running[@]}"; do
+            kill_job_tree "$pid"
+        done
+        for pid in "${!running[@]}"; do
+            wait "$pid" 2>/dev/null || true
+            sed "s/^/[${running[$pid]}] /" "$log_dir/${running[$pid]}.log" >&2
+            warn "Stopped ${running[$pid]} pipeline after ${failed} failed"
+        done
+        running=()
+    done
+
+    rm -rf "$jobs_root"
+    if [ -n "$failed" ]; then
+        err "JAR patching stopped: ${failed} pipeline failed"
+        return 1
+    fi
+}
@@ -0,0 +1,161 @@
+#!/usr/bin/env bash
+# scripts/core/jvm.sh
+# apktool and d8 through a long-lived JVM
+
+# ----------------------------------------------
+# JVM daemon (scripts/jvm/PatcherDaemon.java)
+# ----------------------------------------------
+# apktool and d8 run inside the daemon listening on JVM_DAEMON_SOCKET when
+# one answers, so their classes stay loaded and JIT-compiled across JARs and
+# jobs; otherwise (or when the daemon goes away mid-call) each call starts a
+# JVM of its own as before. JVM_DAEMON=start starts a daemon when none is
+# running; it outlives the patcher and exits after JVM_DAEMON_IDLE seconds
+# without requests (default 1800), so later jobs on the same runner reuse it.
+# JVM_DAEMON=0 never uses one.
+#
+# The daemon runs up to JVM_DAEMON_SLOTS tools at once (the patchers default
+# it to their --jobs count) and queues the rest; its heap is
+# JVM_DAEMON_RUN_HEAP_MB (default 4096) per slot, the -Xmx a one-shot run
+# would get. Slots that would take the heap past 3/4 of the memory are
+# dropped. JVM_DAEMON_OPTS replaces the -Xmx flag.
+#
+# The daemon keeps a tool's System.exit from ending it with a SecurityManager,
+# which JDK 24 removed; with such a java (or one older than 16, without Unix
+# sockets) no daemon is started and every tool runs one-shot.
+
+jvm_daemon_socket() {
+    printf "%s\n" "${JVM_DAEMON_SOCKET:-${XDG_RUNTIME_DIR:-/tmp}/FrameworkPatcher-jvm-$(id -u).sock}"
+}
+
+jvm_daemon_ping() {
+    fptools jvm "$(jvm_daemon_socket)" ping >/dev/null 2>&1
+}
+
+# Succeeds when java can host the daemon (JDK 16 to 23)
+jvm_daemon_supported() {
+    local version
+    version=$(java -XshowSettings:properties -version 2>&1 |
+        awk -F' = ' '/java.specification.version/ { print $2 }')
+    version="${version%%.*}"
+    [ "${version:-0}" -ge 16 ] 2>/dev/null && [ "$version" -lt 24 ]
+}
+
+# Prints "<slots> <heap MB>" for a new daemon
+jvm_daemon_budget() {
+    local slots="${JVM_DAEMON_SLOTS:-1}"
+    local per_run="${JVM_DAEMON_RUN_HEAP_MB:-4096}"
+    local mem_kb fit
+
+    [ "$slots" -ge 1 ] 2>/dev/null || slots=1
+    mem_kb=$(awk '/^MemTotal:/ { print $2 }' /proc/meminfo 2>/dev/null || true)
+    if [ -n "$mem_kb" ]; then
+        fit=$((mem_kb * 3 / 4 / 1024 / per_run))
+        [ "$fit" -ge 1 ] || fit=1
+        [ "$slots" -le "$fit" ] || slots=$fit
+    fi
+    printf "%s %s\n" "$slots" "$((slots * per_run))"
+}
+
+jvm_daemon_launch() {
+    local socket="$1"
+    local daemon_log i slots heap_mb
+    # Someone else may have started it while we waited for the lock
+    jvm_daemon_ping && return 0
+
+    daemon_log="${socket%.sock}.log"
+    read -r slots heap_mb < <(jvm_daemon_budget)
+    # Detached from the caller, so stopping a job never takes the daemon with
+    # it. java.security.manager=allow lets it catch System.exit from a tool.
+    # shellcheck disable=SC2086 # JVM_DAEMON_OPTS is a list of JVM flags
+    if command -v setsid >/dev/null 2>&1; then
+        setsid -f java ${JVM_DAEMON_OPTS:--Xmx${heap_mb}m} -Djava.security.manager=allow \
+            "${FPTOOLS_PYTHONPATH}/jvm/PatcherDaemon.java" "$socket" "${JVM_DAEMON_IDLE:-1800}" "$slots" \
+            >"$daemon_log" 2>&1 </dev/null
+    else
+        nohup java ${JVM_DAEMON_OPTS:--Xmx${heap_mb}m} -Djava.security.manager=allow \
+            "${FPTOOLS_PYTHONPATH}/jvm/PatcherDaemon.java" "$socket" "${JVM_DAEMON_IDLE:-1800}" "$slots" \
+            >"$daemon_log" 2>&1 </dev/null &
+    fi
+
+    for i in $(seq 1 60); do
+        if jvm_daemon_ping; then
+            log "Started JVM daemon on $socket ($slots concurrent runs, ${heap_mb} MB heap)"
+            return 0
+        fi
+        sleep 0.5
+    done
+    warn "JVM daemon did not come up (see $daemon_log), running tools one-shot"
+    return 1
+}
+
+jvm_daemon_start() {
+    local socket
+    socket=$(jvm_daemon_socket)
+    jvm_daemon_ping && return 0
+    command -v java >/dev/null 2>&1 || return 1
+    if ! jvm_daemon_supported; then
+        warn "This java cannot host the JVM daemon (needs JDK 16 to 23), running tools one-shot"
+        return 1
+    fi
+
+    # Parallel jobs may all ask at once; the lock lets one of them launch it
+    if command -v flock >/dev/null 2>&1; then
+        (flock 9 && jvm_daemon_launch "$socket") 9>"${socket}.lock"
+    else
+        jvm_daemon_launch "$socket"
+    fi
+}
+
+jvm_daemon_stop() {
+    jvm_daemon_ping || return 0
+    fptools jvm "$(jvm_daemon_socket)" stop >/dev/null 2>&1 || true
+    log "Stopped JVM daemon on $(jvm_daemon_socket)"
+}
+
+# Succeeds when tool calls should go to the daemon
+jvm_daemon_wanted() {
+    case "${JVM_DAEMON:-auto}" in
+        0 | off | no) return 1 ;;
+        start)
+            # One attempt per shell; a failed start means one-shot runs
+            [ -z "${JVM_DAEMON_FAILED:-}" ] || return 1
+            jvm_daemon_start && return 0
+            JVM_DAEMON_FAILED=1
+            return 1
+            ;;
+        *) [ -S "$(jvm_daemon_socket)" ] ;;
+    esac
+}
+
+# jvm_daemon_run <skip> <tool.jar> <main class> <args...>
+# Returns 75 when no daemon took the call
+jvm_daemon_run() {
+    local skip="$1"
+    shift
+    jvm_daemon_wanted || return 75
+    fptools jvm --skip "$skip" "$(jvm_daemon_socket)" run "$@"
+}
+
+# apktool_run <args...>: apktool.jar from TOOLS_DIR
+apktool_run() {
+    local status=0
+    # The first argument is the apktool command (d, b, ...), never a path
+    jvm_daemon_run 1 "${TOOLS_DIR}/apktool.jar" brut.apktool.Main "$@" || status=$?
+    [ "$status" -eq 75 ] || return "$status"
+    java -jar "${TOOLS_DIR}/apktool.jar" "$@"
+}
+
+# d8_run <d8_cmd> <args...>: the daemon runs the d8.jar next to the launcher
+d8_run() {
+    local d8_cmd="$1"
+    shift
+    local launcher d8_jar status=75
+
+    if launcher=$(readlink -f "$(command -v "$d8_cmd")") &&
+        d8_jar="$(dirname "$launcher")/lib/d8.jar" && [ -f "$d8_jar" ]; then
+        status=0
+        jvm_daemon_run 0 "$d8_jar" com.android.tools.r8.D8 "$@" || status=$?
+    fi
+    [ "$status" -eq 75 ] || return "$status"
+    "$d8_cmd" "$@"
+}
@@ -2,803 +2,146 @@
 # kaorios_patches.sh - Kaorios Toolbox framework patching functions
 # Follows Guide.md exactly - makes minimal surgical additions only
 
-# Inject Kaorios utility classes into decompiled framework
-inject_kaorios_utility_classes() {
-    local decompile_dir="$1"
-    local kaorios_source="${SCRIPT_DIR}/../kaorios_toolbox/utils/kaorios"
-    
-    if [ ! -d "$kaorios_source" ]; then
-        err "Kaorios utility classes not found at $kaorios_source"
-        return 1
-    fi
-    
-    log "Injecting Kaorios utility classes into framework..."
-    
-    # Find the highest numbered smali_classes directory (the LAST one)
-    local target_smali_dir="smali"
-    local max_num=0
-    
-    # Check for smali_classes2, smali_classes3, etc.
-    for dir in "$decompile_dir"/smali_classes*; do
-        if [ -d "$dir" ]; then
-            # Extract the number from smali_classesN
-            local num=$(basename "$dir" | sed 's/smali_classes//')
-            if [[ "$num" =~ ^[0-9]+$ ]] && [ "$num" -gt "$max_num" ]; then
-                max_num=$num
-                target_smali_dir="smali_classes${num}"
-            fi
-        fi
-    done
-    
-    log "Injecting into last existing directory: $target_smali_dir"
-    
-    # Create the package directory structure in com/android/internal/util/kaorios/
-    local target_dir="$decompile_dir/$target_smali_dir/com/android/internal/util/kaorios"
-    mkdir -p "$target_dir"
-    
-    # Copy all utility classes
-    if ! cp -r "$kaorios_source"/* "$target_dir/"; then
-        err "Failed to copy Kaorios utility classes"
-        return 1
-    fi
-    
-    local copied_count=$(find "$target_dir" -name "*.smali" | wc -l)
-    log "✓ Injected $copied_count Kaorios utility classes into $target_smali_dir/com/android/internal/util/kaorios/"
-    
-    return 0
+# ----------------------------------------------
+# Prebuilt Kaorios dex
+# ----------------------------------------------
+# The utility classes are the same for every job of a toolbox version, so they
+# are assembled into a dex of their own once per version.txt (and apktool
+# build) and cached under KAORIOS_DEX_CACHE_DIR. A job then appends that dex
+# to the patched framework.jar as its next classesN.dex instead of copying
+# ~160 smali files into the tree for apktool to assemble again; platform JARs
+# load every classesN.dex, so the patched classes still resolve them.
+# KAORIOS_PREBUILT_DEX=0, or a dex that cannot be built, injects the smali.
+
+kaorios_dex_cache_dir() {
+    printf "%s\n" "${KAORIOS_DEX_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/kaorios}"
 }
 
-# Patch ApplicationPackageManager.hasSystemFeature - Following Guide.md exactly
-# Per Guide: 
-#   1. Replace .locals X with .registers 12
-#   2. Find mHasSystemFeatureCache line
-#   3. Insert entire Kaorios block (from template lines 72-407) ABOVE that line
-patch_application_package_manager_has_system_feature() {
-    local decompile_dir="$1"
-    
-    log "Patching ApplicationPackageManager.hasSystemFeature (per Guide.md)..."
-    
-    # Find the ApplicationPackageManager.smali file
-    local target_file
-    target_file=$(find "$decompile_dir" -type f -path "*/android/app/ApplicationPackageManager.smali" | head -n1)
-    
-    if [ -z "$target_file" ]; then
-        warn "ApplicationPackageManager.smali not found"
-        return 0
-    fi
-
-    # Relocate ApplicationPackageManager to the last smali directory to avoid DEX limit in the primary dex
-    local current_smali_dir=$(echo "$target_file" | sed -E 's|(.*/smali(_classes[0-9]*)?)/.*|\1|')
-    
-    # Identify the last smali directory
-    local last_smali_dir="smali"
-    local max_num=0
-    for dir in "$decompile_dir"/smali_classes*; do
-        if [ -d "$dir" ]; then
-            local num=$(basename "$dir" | sed 's/smali_classes//')
-            if [[ "$num" =~ ^[0-9]+$ ]] && [ "$num" -gt "$max_num" ]; then
-                max_num=$num
-                last_smali_dir="smali_classes${num}"
-            fi
-        fi
-    done
-    
-    local target_root="$decompile_dir/$last_smali_dir"
-    
-    # Only move if it's not already in the last directory
-    if [ "$current_smali_dir" != "$target_root" ]; then
-        log "Relocating ApplicationPackageManager to $last_smali_dir to avoid DEX limit..."
-        
-        # Create destination directory
-        local rel_path="android/app"
-        local new_dir="$target_root/$rel_path"
-        mkdir -p "$new_dir"
-        
-        # Move the main class and all inner classes
-        local src_dir=$(dirname "$target_file")
-        mv "$src_dir"/ApplicationPackageManager*.smali "$new_dir/"
-        
-        # Update target_file to point to the new location
-        target_file="$new_dir/ApplicationPackageManager.smali"
-        log "✓ Relocated ApplicationPackageManager and inner classes to $last_smali_dir"
-    fi
-    
-    # Use Python to implement the exact changes
-    python3 - "$target_file" <<'PYTHON'
-import sys
-import re
-from pathlib import Path
-
-target_file = Path(sys.argv[1])
-
-if not target_file.exists():
-    sys.exit(1)
-
-lines = target_file.read_text().splitlines()
-modified = False
-
-# Find the existing mContext field signature
-mcontext_field = None
-for line in lines:
-    if '.field' in line and 'mContext:' in line:
-        # Extract the full field signature, e.g., mContext:Landroid/app/ContextImpl;
-        match = re.search(r'mContext:[\w/$]+;', line)
-        if match:
-            mcontext_field = match.group(0)
-            print(f"✓ Found existing mContext field: {mcontext_field}")
-            break
-
-if not mcontext_field:
-    # Fallback if not found (unlikely for ApplicationPackageManager)
-    print("⚠ Could not find existing mContext field, assuming Landroid/content/Context;")
-    mcontext_field = "mContext:Landroid/content/Context;"
-
-# 3. Patch hasSystemFeature(String, int)
-kaorios_block = r"""
-    invoke-static {}, Landroid/app/ActivityThread;->currentPackageName()Ljava/lang/String;
-
-    move-result-object v0
-
-    iget-object v1, p0, Landroid/app/ApplicationPackageManager;->M_CONTEXT_PLACEHOLDER
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getAppLog()Ljava/lang/String;
-
-    move-result-object v2
-
-    const/4 v3, 0x1
-
-    invoke-static {v1, v2, v3}, Lcom/android/internal/util/kaorios/SettingsHelper;->isToggleEnabled(Landroid/content/Context;Ljava/lang/String;Z)Z
-
-    move-result v1
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getFeaturesPixel()[Ljava/lang/String;
-
-    move-result-object v2
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getFeaturesPixelOthers()[Ljava/lang/String;
-
-    move-result-object v4
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getFeaturesTensor()[Ljava/lang/String;
-
-    move-result-object v5
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getFeaturesNexus()[Ljava/lang/String;
-
-    move-result-object v6
-
-    if-eqz v0, :cond_9f
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackageGsa()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-nez v7, :cond_6f
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackagePixelAgent()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-nez v7, :cond_6f
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackagePixelCreativeAssistant()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-nez v7, :cond_6f
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackagePixelDialer()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-nez v7, :cond_6f
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackagePhotos()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-eqz v7, :cond_9f
-
-    if-nez v1, :cond_9f
-
-    :cond_6f
-    invoke-static {v2}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v7
-
-    invoke-interface {v7, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-eqz v7, :cond_7b
-
-    goto/16 :goto_14d
-
-    :cond_7b
-    invoke-static {v4}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v7
-
-    invoke-interface {v7, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-eqz v7, :cond_87
-
-    goto/16 :goto_14d
-
-    :cond_87
-    invoke-static {v5}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v7
-
-    invoke-interface {v7, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-eqz v7, :cond_93
-
-    goto/16 :goto_14d
-
-    :cond_93
-    invoke-static {v6}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v7
-
-    invoke-interface {v7, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v7
-
-    if-eqz v7, :cond_9f
-
-    goto/16 :goto_14d
-
-    :cond_9f
-    const/4 v7, 0x0
-
-    if-eqz v0, :cond_dc
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackagePhotos()Ljava/lang/String;
-
-    move-result-object v8
-
-    invoke-virtual {v0, v8}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v8
-
-    if-eqz v8, :cond_dc
-
-    if-eqz v1, :cond_dc
-
-    invoke-static {v2}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v1
-
-    invoke-interface {v1, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v1
-
-    if-eqz v1, :cond_b9
-
-    goto :goto_cf
-
-    :cond_b9
-    invoke-static {v4}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v1
-
-    invoke-interface {v1, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v1
-
-    if-eqz v1, :cond_c5
-
-    goto/16 :goto_14d
-
-    :cond_c5
-    invoke-static {v5}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v1
-
-    invoke-interface {v1, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v1
-
-    if-eqz v1, :cond_d0
-
-    :goto_cf
-    return v7
-
-    :cond_d0
-    invoke-static {v6}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v1
-
-    invoke-interface {v1, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v1
-
-    if-eqz v1, :cond_dc
-
-    goto/16 :goto_14d
-
-    :cond_dc
-    iget-object p0, p0, Landroid/app/ApplicationPackageManager;->M_CONTEXT_PLACEHOLDER
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getSystemLog()Ljava/lang/String;
-
-    move-result-object v1
-
-    invoke-static {p0, v1, v7}, Lcom/android/internal/util/kaorios/SettingsHelper;->isToggleEnabled(Landroid/content/Context;Ljava/lang/String;Z)Z
-
-    move-result p0
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getModelInfoProperty()Ljava/lang/String;
-
-    move-result-object v1
-
-    invoke-static {v1}, Landroid/os/SystemProperties;->get(Ljava/lang/String;)Ljava/lang/String;
-
-    move-result-object v1
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPixelTensorModelRegex()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v1, v7}, Ljava/lang/String;->matches(Ljava/lang/String;)Z
-
-    move-result v1
-
-    if-eqz v0, :cond_11e
-
-    invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getPackageGoogleAs()Ljava/lang/String;
-
-    move-result-object v7
-
-    invoke-virtual {v0, v7}, Ljava/lang/String;->equals(Ljava/lang/Object;)Z
-
-    move-result v0
-
-    if-eqz v0, :cond_11e
-
-    if-eqz v1, :cond_10f
-
-    invoke-static {v5}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v0
-
-    invoke-interface {v0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v0
-
-    if-eqz v0, :cond_10f
-
-    goto :goto_14d
-
-    :cond_10f
-    if-nez v1, :cond_11e
-
-    if-eqz p0, :cond_11e
-
-    invoke-static {v5}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v0
-
-    invoke-interface {v0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v0
-
-    if-eqz v0, :cond_11e
-
-    goto :goto_14d
-
-    :cond_11e
-    if-eqz p1, :cond_12d
-
-    invoke-static {v5}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object v0
-
-    invoke-interface {v0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result v0
-
-    if-eqz v0, :cond_12d
-
-    if-nez v1, :cond_12d
-
-    return p0
-
-    :cond_12d
-    invoke-static {v6}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object p0
-
-    invoke-interface {p0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result p0
-
-    if-eqz p0, :cond_138
-
-    goto :goto_14d
-
-    :cond_138
-    invoke-static {v2}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object p0
-
-    invoke-interface {p0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result p0
-
-    if-eqz p0, :cond_143
-
-    goto :goto_14d
-
-    :cond_143
-    invoke-static {v4}, Ljava/util/Arrays;->asList([Ljava/lang/Object;)Ljava/util/List;
-
-    move-result-object p0
-
-    invoke-interface {p0, p1}, Ljava/util/List;->contains(Ljava/lang/Object;)Z
-
-    move-result p0
-
-    if-eqz p0, :cond_14e
-
-    :goto_14d
-    return v3
-
-    :cond_14e
-""".replace("M_CONTEXT_PLACEHOLDER", mcontext_field).splitlines()
-
-# Find hasSystemFeature(String, int) method
-method_start = None
-for i, line in enumerate(lines):
-    if '.method ' in line and 'hasSystemFeature(Ljava/lang/String;I)Z' in line:
-        method_start = i
-        break
-
-if method_start is not None:
-    # Change .locals to .registers 12
-    registers_line = None
-    for i in range(method_start, method_start + 10):
-        if '.locals' in lines[i] or '.registers' in lines[i]:
-            registers_line = i
-            break
-    
-    if registers_line:
-        old_value = lines[registers_line].strip()
-        if '.registers 12' not in lines[registers_line]:
-            indent = re.match(r'^\s*', lines[registers_line]).group(0)
-            lines[registers_line] = f'{indent}.registers 12'
-            print(f"✓ Changed '{old_value}' to '.registers 12'")
-            modified = True
-            
-    # Find mHasSystemFeatureCache
-    cache_line = None
-    for i in range(method_start, len(lines)):
-        if 'mHasSystemFeatureCache' in lines[i] and 'sget-object' in lines[i]:
-            cache_line = i
-            break
-            
-    if cache_line:
-        # Check if already patched
-        already_patched = False
-        for i in range(method_start, cache_line):
-            if 'KaoriFeaturesUtils' in lines[i]:
-                already_patched = True
-                break
-        
-        if not already_patched:
-            # Insert Kaorios block
-            for line in reversed(kaorios_block):
-                lines.insert(cache_line, line)
-            print("✓ Inserted Kaorios logic block")
-            modified = True
-
-if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
-    print("✓ Successfully patched ApplicationPackageManager.smali")
-else:
-    print("No changes needed or already patched")
-PYTHON
-
-    if [ $? -eq 0 ]; then
-        log "✓ Patched ApplicationPackageManager.hasSystemFeature"
-    else
-        warn "ApplicationPackageManager patch failed"
-    fi
-    
-    return 0
+# <version>-<digest of the utility smali and apktool.jar>
+kaorios_dex_key() {
+    local kaorios_source="$1"
+    local version digest
+    version=$(tr -cd '[:alnum:]._-' <"${SCRIPT_DIR}/../kaorios_toolbox/version.txt" 2>/dev/null) || version=""
+    digest=$(
+        {
+            (cd "$kaorios_source" && find . -type f -name '*.smali' -print0 | sort -z | xargs -0 sha256sum)
+            sha256sum <"${TOOLS_DIR}/apktool.jar"
+        } | sha256sum | cut -c1-16
+    ) || return 1
+    printf "%s-%s\n" "${version:-unversioned}" "$digest"
 }
 
-# Patch Instrumentation.newApplication methods
-# Guide says: Find "return-object v0" before ".end method" and add invoke-static line above it
-patch_instrumentation_new_application() {
-    local decompile_dir="$1"
-    
-    log "Patching Instrumentation.newApplication methods..."
-    
-    # Find the Instrumentation.smali file
-    local target_file
-    target_file=$(find "$decompile_dir" -type f -path "*/android/app/Instrumentation.smali" | head -n1)
-    
-    if [ -z "$target_file" ]; then
-        warn "Instrumentation.smali not found"
+# Prints the path of the cached dex for kaorios_source, building it first
+# when this version has none yet
+kaorios_prebuilt_dex() {
+    local kaorios_source="$1"
+    local key entry stage status=0
+
+    key=$(kaorios_dex_key "$kaorios_source") || return 1
+    entry="$(kaorios_dex_cache_dir)/$key"
+    if [ -f "$entry/classes.dex" ]; then
+        touch "$entry"
+        log "Reusing prebuilt Kaorios dex $key"
+        printf "%s\n" "$entry/classes.dex"
         return 0
     fi
-    
-    # Patch: Add invoke-static line before "return-object v0" in both newApplication methods
-    python3 - "$target_file" <<'PYTHON'
-import sys
-import re
-from pathlib import Path
-
-target_file = Path(sys.argv[1])
-
-if not target_file.exists():
-    sys.exit(1)
-
-lines = target_file.read_text().splitlines()
-modified = False
-
-# Track which newApplication method we're in
-in_new_app_method = False
-method_param = None  # Will be 'p1' or 'p3' depending on which method
-i = 0
-
-while i < len(lines):
-    line = lines[i]
-    
-    # Check if we're entering a newApplication method
-    if '.method ' in line and 'newApplication' in line:
-        if 'Ljava/lang/Class;Landroid/content/Context;' in line:
-            in_new_app_method = True
-            method_param = 'p1'  # Context parameter is p1
-        elif 'Ljava/lang/ClassLoader;Ljava/lang/String;Landroid/content/Context;' in line:
-            in_new_app_method = True
-            method_param = 'p3'  # Context parameter is p3
-    
-    # If we're in a newApplication method and find "return-object v0"
-    if in_new_app_method and 'return-object v0' in line:
-        # Check if next line is .end method (to ensure we're at method end)
-        if i + 1 < len(lines) and '.end method' in lines[i+1]:
-            # Check if patch already exists
-            if i > 0 and 'ToolboxUtils;->KaoriosProps' in lines[i-1]:
-                in_new_app_method = False
-                i += 1
-                continue
-            
-            # Get indentation from current line
-            indent = re.match(r'^\s*', line).group(0)
-            
-            # Insert the patch line before return-object
-            patch_line = f'{indent}invoke-static {{{method_param}}}, Lcom/android/internal/util/kaorios/ToolboxUtils;->KaoriosProps(Landroid/content/Context;)V'
-            lines.insert(i, '')  # Add blank line
-            lines.insert(i, patch_line)
-            modified = True
-            i += 2  # Skip past the inserted lines
-            in_new_app_method = False
-            method_param = None
-            continue
-    
-    # Exit method
-    if '.end method' in line:
-        in_new_app_method = False
-        method_param = None
-    
-    i += 1
 
-if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
-    print("✓ Patched Instrumentation.newApplication methods")
-else:
-    print("No changes needed or patch already applied")
-PYTHON
+    mkdir -p "$(kaorios_dex_cache_dir)" &&
+        stage=$(mktemp -d "$(kaorios_dex_cache_dir)/.${key}.XXXXXX") || return 1
+    log "Assembling Kaorios utility classes into a dex ($key)"
+    # Built aside and renamed in, so concurrent jobs never see a partial entry
+    mkdir -p "$stage/build/smali/com/android/internal/util" &&
+        cp -r "$kaorios_source" "$stage/build/smali/com/android/internal/util/kaorios" &&
+        printf "%s\n" '!!brut.androlib.meta.MetaInfo' 'apkFileName: kaorios.jar' 'isFrameworkApk: false' \
+            'usesFramework:' '  ids:' '  - 1' >"$stage/build/apktool.yml" &&
+        apktool_run b -q -f ${APKTOOL_FRAME_DIR:+-p "$APKTOOL_FRAME_DIR"} "$stage/build" -o "$stage/build.jar" >&2 &&
+        unzip -q -o "$stage/build.jar" classes.dex -d "$stage" &&
+        rm -rf "$stage/build" "$stage/build.jar" &&
+        { mv -T "$stage" "$entry" 2>/dev/null || [ -f "$entry/classes.dex" ]; } || status=1
+    rm -rf "$stage"
+    [ "$status" -eq 0 ] || return 1
+
+    cache_evict_lru "$(kaorios_dex_cache_dir)" "${KAORIOS_DEX_CACHE_MAX_MB:-64}"
+    printf "%s\n" "$entry/classes.dex"
+}
 
-    if [ $? -eq 0 ]; then
-        log "✓ Patched Instrumentation.newApplication methods"
-    else
-        warn "Failed to patch Instrumentation.newApplication methods"
-    fi
-    
-    return 0
+# Add the prebuilt dex to a patched JAR as its next classesN.dex; nothing to
+# do when the classes went in as smali
+kaorios_append_dex() {
+    local jar_file="$1"
+    local last name
+
+    [ -n "${KAORIOS_DEX:-}" ] || return 0
+    last=$(unzip -Z1 "$jar_file" | sed -n 's/^classes\([0-9]*\)\.dex$/\1/p' | sort -n | tail -n 1)
+    name="classes$((${last:-1} + 1)).dex"
+    fptools jar-splice "$jar_file" "$jar_file" "$name=$KAORIOS_DEX" || return 1
+    # After an incremental recompile d8 only looks at the listed entries
+    [ ! -f "${jar_file}.rebuilt" ] || echo "$name" >>"${jar_file}.rebuilt"
+    log "Added the Kaorios utility classes to $(basename "$jar_file") as $name"
 }
 
-# Patch KeyStore2.getKeyEntry method
-# Guide says: Find "return-object v0" before ".end method" and add two lines above it
-patch_keystore2_get_key_entry() {
+# Inject Kaorios utility classes into decompiled framework
+inject_kaorios_utility_classes() {
     local decompile_dir="$1"
-    
-    log "Patching KeyStore2.getKeyEntry..."
-    
-    # Find the KeyStore2.smali file
-    local target_file
-    target_file=$(find "$decompile_dir" -type f -path "*/android/security/KeyStore2.smali" | head -n1)
-    
-    if [ -z "$target_file" ]; then
-        warn "KeyStore2.smali not found"
-        return 0
-    fi
-    
-    python3 - "$target_file" <<'PYTHON'
-import sys
-import re
-from pathlib import Path
-
-target_file = Path(sys.argv[1])
-
-if not target_file.exists():
-    sys.exit(1)
+    local kaorios_source="${SCRIPT_DIR}/../kaorios_toolbox/utils/kaorios"
+    local counts
+    local -a place=(--relocate android/app/ApplicationPackageManager)
 
-lines = target_file.read_text().splitlines()
-modified = False
+    if [ ! -d "$kaorios_source" ]; then
+        err "Kaorios utility classes not found at $kaorios_source"
+        return 1
+    fi
 
-# Find getKeyEntry method
-in_method = False
-i = 0
+    KAORIOS_DEX=""
+    if [ "${KAORIOS_PREBUILT_DEX:-1}" != "0" ]; then
+        KAORIOS_DEX=$(kaorios_prebuilt_dex "$kaorios_source") ||
+            warn "Could not build the Kaorios dex, injecting the smali instead"
+    fi
+    if [ -n "$KAORIOS_DEX" ]; then
+        log "Kaorios utility classes will be added as a prebuilt dex"
+    else
+        KAORIOS_DEX=""
+        log "Injecting Kaorios utility classes into framework..."
+        place+=(--inject "$kaorios_source" com/android/internal/util/kaorios)
+    fi
 
-while i < len(lines):
-    line = lines[i]
-    
-    # Check if we're entering getKeyEntry method
-    if '.method ' in line and 'getKeyEntry' in line and 'KeyDescriptor' in line and 'lambda' not in line:
-        in_method = True
-    
-    # If we're in the method and find "return-object v0"
-    if in_method and 'return-object v0' in line:
-        # Check if next line is .end method
-        if i + 1 < len(lines) and '.end method' in lines[i+1]:
-            # Check if patch already exists
-            if i > 0 and 'ToolboxUtils;->KaoriosKeybox' in lines[i-1]:
-                in_method = False
-                i += 1
-                continue
-            
-            # Get indentation
-            indent = re.match(r'^\s*', line).group(0)
-            
-            # Insert the two patch lines before return-object
-            patch_lines = [
-                '',
-                f'{indent}invoke-static {{v0}}, Lcom/android/internal/util/kaorios/ToolboxUtils;->KaoriosKeybox(Landroid/system/keystore2/KeyEntryResponse;)Landroid/system/keystore2/KeyEntryResponse;',
-                f'{indent}move-result-object v0'
-            ]
-            
-            for j, patch_line in enumerate(patch_lines):
-                lines.insert(i + j, patch_line)
-            
-            modified = True
-            i += len(patch_lines)
-            in_method = False
-            continue
-    
-    if '.end method' in line:
-        in_method = False
-    
-    i += 1
+    # Each smali root is one dex with at most 65536 method/field references.
+    # Place the classes in roots with room for them (opening a new
+    # smali_classesN when none has), and move ApplicationPackageManager,
+    # which the hasSystemFeature patch grows, out of a root without headroom.
+    counts=$(fptools dex-place "$decompile_dir" "${place[@]}" \
+        --jar "${WORK_DIR:-.}/framework.jar" --jobs "${SMALI_JOBS:-0}") || {
+        err "No room for the Kaorios patches within the dex reference limit"
+        return 1
+    }
 
-if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
-    print("✓ Patched KeyStore2.getKeyEntry")
-else:
-    print("No changes needed or patch already applied")
-PYTHON
+    local root methods fields
+    while IFS=$'\t' read -r root methods fields; do
+        log "  $root: $methods method / $fields field references"
+    done <<<"$counts"
 
-    if [ $? -eq 0 ]; then
-        log "✓ Patched KeyStore2.getKeyEntry"
-    else
-        warn "Failed to patch KeyStore2.getKeyEntry"
-    fi
-    
     return 0
 }
 
-# Patch AndroidKeyStoreSpi.engineGetCertificateChain method
-# Guide says: Below ".registers XX" add invoke-static line
-patch_android_keystore_spi_engine_get_certificate_chain() {
+# Patch the framework classes the toolbox hooks into. The additions come from
+# the class templates in kaorios_toolbox/ (marked "kousei added"), compiled
+# once per toolbox version into insertion plans (anchor, registers, block)
+# and applied in one read and one write per class. Fails when any insertion
+# finds no class, method or anchor, so a partial patch never reports success:
+#   ApplicationPackageManager.hasSystemFeature - feature spoofing block
+#   Instrumentation.newApplication - property spoofing initialization
+#   KeyStore2.getKeyEntry - keybox attestation spoofing
+#   AndroidKeyStoreSpi.engineGetCertificateChain - certificate chain handling
+patch_kaorios_framework_classes() {
     local decompile_dir="$1"
-    
-    log "Patching AndroidKeyStoreSpi.engineGetCertificateChain..."
-    
-    # Find the AndroidKeyStoreSpi.smali file
-    local target_file
-    target_file=$(find "$decompile_dir" -type f -path "*/android/security/keystore2/AndroidKeyStoreSpi.smali" | head -n1)
-    
-    if [ -z "$target_file" ]; then
-        warn "AndroidKeyStoreSpi.smali not found"
-        return 0
-    fi
-    
-    python3 - "$target_file" <<'PYTHON'
-import sys
-import re
-from pathlib import Path
-
-target_file = Path(sys.argv[1])
-
-if not target_file.exists():
-    sys.exit(1)
-
-lines = target_file.read_text().splitlines()
-modified = False
 
-# Find engineGetCertificateChain method
-in_method = False
-i = 0
-
-while i < len(lines):
-    line = lines[i]
-    
-    # Check if we're entering engineGetCertificateChain method
-    if '.method ' in line and 'engineGetCertificateChain' in line:
-        in_method = True
-    
-    # If we're in the method and find .registers or .locals line
-    if in_method and ('.registers' in line or '.locals' in line):
-        # Check if patch already exists on next line
-        if i + 1 < len(lines) and 'ToolboxUtils;->KaoriosPropsEngineGetCertificateChain' in lines[i+1]:
-            in_method = False
-            i += 1
-            continue
-
-        # Get indentation
-        indent = re.match(r'^\s*', line).group(0)
-
-        # Insert the patch line after .registers
-        patch_lines = [
-            '',
-            f'{indent}invoke-static {{}}, Lcom/android/internal/util/kaorios/ToolboxUtils;->KaoriosPropsEngineGetCertificateChain()V'
-        ]
-
-        for j, patch_line in enumerate(patch_lines):
-            lines.insert(i + 1 + j, patch_line)
-
-        modified = True
-        i += len(patch_lines) + 1
-        in_method = False
-        continue
-
-    if '.end method' in line:
-        in_method = False
-
-    i += 1
-
-if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
-    print("✓ Patched AndroidKeyStoreSpi.engineGetCertificateChain")
-else:
-    print("No changes needed or patch already applied")
-PYTHON
-
-    if [ $? -eq 0 ]; then
-        log "✓ Patched AndroidKeyStoreSpi.engineGetCertificateChain"
-    else
-        warn "Failed to patch AndroidKeyStoreSpi.engineGetCertificateChain"
-    fi
-
-    return 0
+    log "Patching framework classes from the Kaorios templates..."
+    ensure_smali_index "$decompile_dir" || return 1
+    fptools kaorios-apply "$decompile_dir" "${SCRIPT_DIR}/../kaorios_toolbox" \
+        --cache-dir "$(kaorios_dex_cache_dir)" || {
+        err "Kaorios template patches failed"
+        return 1
+    }
 }
 
 # Main function to apply all Kaorios Toolbox patches
@@ -813,13 +156,8 @@ apply_kaorios_toolbox_patches() {
     inject_kaorios_utility_classes "$decompile_dir" || return 1
 
     # Apply surgical patches based on Guide.md
-    # NOTE: ApplicationPackageManager patch disabled due to DEX 65k limit in this framework
-    patch_application_package_manager_has_system_feature "$decompile_dir"
+    patch_kaorios_framework_classes "$decompile_dir" || return 1
 
-    patch_instrumentation_new_application "$decompile_dir"
-    patch_keystore2_get_key_entry "$decompile_dir"
-    patch_android_keystore_spi_engine_get_certificate_chain "$decompile_dir"
-    
     log "✓ Kaorios Toolbox patches applied successfully (4/4 core patches)"
     log "  ✓ Instrumentation.newApplication - Property spoofing initialization"
     log "  ✓ KeyStore2.getKeyEntry - Keybox attestation spoofing"
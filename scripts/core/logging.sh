@@ -27,3 +27,137 @@ end_timer() {
     local duration=$((TIMER_END - TIMER_START))
     log "Operation completed in ${duration}s"
 }
+
+# ----------------------------------------------
+# Stage timeline (PATCH_TIMELINE=<file>)
+# ----------------------------------------------
+# Every timed stage appends JSON lines to $PATCH_TIMELINE: a "begin" event
+# when it starts and an "end" event with wall and CPU seconds, bytes read and
+# written, and the peak RSS of the stage's process tree. A stage that aborts
+# under set -e only leaves its "begin" line. Nested stages are named
+# "parent/child". Each line is written with a single append, so parallel JAR
+# jobs can share the file. `fptools timeline` turns it into a report.
+
+TIMELINE_STAGE=""
+TIMELINE_PARENT=""
+TIMELINE_SEQ=0
+
+# Set TIMELINE_COUNTERS to "user_ticks sys_ticks read_bytes write_bytes" for
+# this shell and its reaped children (no subshell: it would measure itself)
+_timeline_counters() {
+    local stat key value rchar=0 wchar=0
+    local -a fields
+    read -r stat <"/proc/$BASHPID/stat" || return 1
+    # Fields after "pid (comm) ": utime, stime, cutime, cstime are 14-17
+    read -ra fields <<<"${stat##*) }"
+    while read -r key value; do
+        case "$key" in
+            rchar:) rchar="$value" ;;
+            wchar:) wchar="$value" ;;
+        esac
+    done <"/proc/$BASHPID/io"
+    TIMELINE_COUNTERS="$((fields[11] + fields[13])) $((fields[12] + fields[14])) $rchar $wchar"
+}
+
+# Record the peak RSS (KiB) of root's process tree into out until root exits
+_timeline_rss_sampler() {
+    local root="$1"
+    local out="$2"
+    local self="$BASHPID" peak=0 rss
+    while kill -0 "$root" 2>/dev/null; do
+        rss=$(ps -e -o pid=,ppid=,rss= 2>/dev/null | awk -v root="$root" -v self="$self" '
+            { parent[$1] = $2; mem[$1] = $3 }
+            END {
+                for (p in mem) {
+                    q = p
+                    while (q != root && q != self && q in parent && q > 1) q = parent[q]
+                    if (q == root) sum += mem[p]
+                }
+                print sum + 0
+            }')
+        if [ "${rss:-0}" -gt "$peak" ]; then
+            peak="$rss"
+            printf "%s\n" "$peak" >"$out"
+        fi
+        sleep "${PATCH_TIMELINE_INTERVAL:-0.5}"
+    done
+}
+
+# timed_stage <name> <command> [args...]
+# Runs the command in the current shell and records it on the timeline. The
+# command is not run as a condition, so set -e keeps working inside it.
+timed_stage() {
+    local name="$1"
+    shift
+    if [ -z "${PATCH_TIMELINE:-}" ]; then
+        "$@"
+        return
+    fi
+
+    local parent="$TIMELINE_STAGE" parent_id="$TIMELINE_PARENT"
+    local id start end before after rss_file sampler status peak
+    TIMELINE_SEQ=$((TIMELINE_SEQ + 1))
+    id="${BASHPID}.${TIMELINE_SEQ}"
+    TIMELINE_STAGE="${parent:+$parent/}$name"
+    start="${EPOCHREALTIME:-$(date +%s.%N)}"
+    TIMELINE_PARENT="$id"
+    printf '{"event":"begin","id":"%s","parent":"%s","stage":"%s","start":%s}\n' \
+        "$id" "$parent_id" "$TIMELINE_STAGE" "$start" >>"$PATCH_TIMELINE"
+
+    rss_file=$(mktemp "${TMPDIR:-/tmp}/timeline_rss.XXXXXX")
+    _timeline_rss_sampler "$BASHPID" "$rss_file" >/dev/null 2>&1 &
+    sampler=$!
+    _timeline_counters
+    before="$TIMELINE_COUNTERS"
+
+    "$@"
+    status=$?
+
+    _timeline_counters
+    after="$TIMELINE_COUNTERS"
+    end="${EPOCHREALTIME:-$(date +%s.%N)}"
+    kill "$sampler" 2>/dev/null || true
+    wait "$sampler" 2>/dev/null || true
+    peak=$(cat "$rss_file" 2>/dev/null)
+    rm -f "$rss_file"
+
+    awk -v id="$id" -v stage="$TIMELINE_STAGE" -v start="$start" -v end="$end" \
+        -v status="$status" -v peak="${peak:-0}" -v hz="${TIMELINE_HZ:=$(getconf CLK_TCK 2>/dev/null || echo 100)}" \
+        -v before="$before" -v after="$after" 'BEGIN {
+            split(before, b, " "); split(after, a, " ")
+            printf "{\"event\":\"end\",\"id\":\"%s\",\"stage\":\"%s\",\"start\":%s,\"wall_s\":%.3f,", id, stage, start, end - start
+            printf "\"cpu_user_s\":%.2f,\"cpu_sys_s\":%.2f,\"peak_rss_kb\":%d,", (a[1] - b[1]) / hz, (a[2] - b[2]) / hz, peak
+            printf "\"read_bytes\":%d,\"write_bytes\":%d,\"status\":%d}\n", a[3] - b[3], a[4] - b[4], status
+        }' >>"$PATCH_TIMELINE"
+
+    TIMELINE_STAGE="$parent"
+    TIMELINE_PARENT="$parent_id"
+    return "$status"
+}
+
+# Time every call of the named functions as a stage of the same name
+timeline_wrap() {
+    [ -n "${PATCH_TIMELINE:-}" ] || return 0
+    local fn
+    for fn in "$@"; do
+        declare -F "$fn" >/dev/null || continue
+        declare -F "__timed_$fn" >/dev/null && continue
+        eval "$(declare -f "$fn" | sed "1s/^$fn /__timed_$fn /")"
+        eval "$fn() { timed_stage $fn __timed_$fn \"\$@\"; }"
+    done
+}
+
+# Called by the patchers right before main: instruments the pipeline stages
+# (decompile, build, d8, module zip) and every apply_* patch function
+timeline_instrument() {
+    [ -n "${PATCH_TIMELINE:-}" ] || return 0
+    mkdir -p "$(dirname "$PATCH_TIMELINE")"
+    PATCH_TIMELINE="$(cd "$(dirname "$PATCH_TIMELINE")" && pwd)/$(basename "$PATCH_TIMELINE")"
+    export PATCH_TIMELINE
+
+    # shellcheck disable=SC2046 # function names have no spaces
+    timeline_wrap patch_framework patch_services patch_miui_services \
+        decompile_jar recompile_jar d8_optimize_jar dex_patch_jar \
+        modify_invoke_custom_methods create_module create_magisk_module run_jar_jobs \
+        $(compgen -A function apply_)
+}
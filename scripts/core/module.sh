@@ -2,6 +2,18 @@
 # scripts/core/module.sh
 # Module creation functions
 
+# The module archive is written straight from the template, the patched JARs
+# and the Kaorios files by fptools module-zip; only the template files that
+# get edited are copied (to a scratch dir). See fptools/module_zip.py for the
+# plan lines module_entry queues.
+
+# Queue one plan line: module_entry <tree|exclude|file|zip> [args...]
+module_entry() {
+    local entry
+    entry=$(printf "%s\t" "$@")
+    printf "%s\n" "${entry%$'\t'}" >>"$MODULE_PLAN"
+}
+
 create_module() {
     # local api_level="$1"  # Currently unused but kept for future use
     local device_name="$2"
@@ -9,25 +21,29 @@ create_module() {
 
     log "Creating module using FrameworkPatcherModule for $device_name (v$version_name)"
 
-    local build_dir="build_module"
-    rm -rf "$build_dir"
-
-    # Copy FrameworkPatcherModule template
-    cp -r "templates/framework-patcher-module" "$build_dir" || {
-        err "FrameworkPatcherModule template not found: templates/framework-patcher-module"
+    local template="templates/framework-patcher-module"
+    if [ ! -d "$template" ]; then
+        err "FrameworkPatcherModule template not found: $template"
         return 1
-    }
+    fi
 
-    # Clean up unnecessary files from FrameworkPatcherModule template
-    rm -f "$build_dir/.git" "$build_dir/.gitignore" "$build_dir/.gitattributes"
-    rm -f "$build_dir/README.md" "$build_dir/changelog.md" "$build_dir/LICENSE"
-    rm -f "$build_dir/update.json" "$build_dir/install.zip"
-    rm -rf "$build_dir/common/addon" "$build_dir/zygisk"
-    rm -f "$build_dir/system/placeholder" "$build_dir/common/addon/placeholder" "$build_dir/zygisk/placeholder"
+    local overlay
+    overlay=$(mktemp -d "${TMPDIR:-/tmp}/module_overlay.XXXXXX") || return 1
+    MODULE_PLAN="$overlay/plan"
+    : >"$MODULE_PLAN"
+
+    module_entry tree "$template"
+    # Leave out the template's own repository and installer files
+    local skip
+    for skip in .git .gitignore .gitattributes README.md changelog.md LICENSE update.json install.zip \
+        common/addon zygisk system/placeholder; do
+        module_entry exclude "$skip"
+    done
 
     # Update module.prop for universal compatibility
-    local module_prop="$build_dir/module.prop"
-    if [ -f "$module_prop" ]; then
+    if [ -f "$template/module.prop" ]; then
+        local module_prop="$overlay/module.prop"
+        cp "$template/module.prop" "$module_prop"
         # Update basic properties
         sed -i "s/^id=.*/id=mod_frameworks/" "$module_prop"
         sed -i "s/^name=.*/name=Framework Patch V2/" "$module_prop"
@@ -51,32 +67,29 @@ create_module() {
             echo "requireReboot=true"
             echo "support=https://t.me/Jefino9488"
         } >>"$module_prop"
+        module_entry file module.prop "$module_prop"
     fi
 
     # Update customize.sh with framework replacements
-    # Update customize.sh with framework replacements
-    local customize_sh="$build_dir/customize.sh"
-    if [ -f "$customize_sh" ]; then
+    if [ -f "$template/customize.sh" ]; then
+        local customize_sh="$overlay/customize.sh"
+        cp "$template/customize.sh" "$customize_sh"
         # Construct dynamic REPLACE list
         local replace_list=""
-        
-        # Create required directories and copy patched files
-        mkdir -p "$build_dir/system/framework"
-        mkdir -p "$build_dir/system/system_ext/framework"
 
-        # copy patched files (if present in cwd) and add to REPLACE list
+        # add patched files (if present in cwd) and add to REPLACE list
         if [ -f "framework_patched.jar" ]; then
-            cp "framework_patched.jar" "$build_dir/system/framework/framework.jar"
+            module_entry file system/framework/framework.jar "framework_patched.jar"
             replace_list="${replace_list}/system/framework/framework.jar\n"
         fi
-        
+
         if [ -f "services_patched.jar" ]; then
-            cp "services_patched.jar" "$build_dir/system/framework/services.jar"
+            module_entry file system/framework/services.jar "services_patched.jar"
             replace_list="${replace_list}/system/framework/services.jar\n"
         fi
-        
+
         if [ -f "miui-services_patched.jar" ]; then
-            cp "miui-services_patched.jar" "$build_dir/system/system_ext/framework/miui-services.jar"
+            module_entry file system/system_ext/framework/miui-services.jar "miui-services_patched.jar"
             replace_list="${replace_list}/system/system_ext/framework/miui-services.jar\n"
         fi
 
@@ -93,50 +106,57 @@ create_module() {
                 print
             }
         }' "$customize_sh" > "${customize_sh}.tmp" && mv "${customize_sh}.tmp" "$customize_sh"
+        module_entry file customize.sh "$customize_sh"
     fi
 
-    # Copy Kaorios Toolbox files if present
+    # Add Kaorios Toolbox files if present
     if [ -d "kaorios_toolbox" ]; then
         log "Including Kaorios Toolbox components in module"
-        
+
         # 1. Install APK as system app (priv-app)
         if [ -f "kaorios_toolbox/KaoriosToolbox.apk" ]; then
-            mkdir -p "$build_dir/system/product/priv-app/KaoriosToolbox"
-            cp "kaorios_toolbox/KaoriosToolbox.apk" "$build_dir/system/product/priv-app/KaoriosToolbox/KaoriosToolbox.apk"
-            
-            # Extract native libraries
-            log "  • Extracting native libraries from APK..."
-            mkdir -p "$build_dir/system/product/priv-app/KaoriosToolbox/lib"
-            # Extract lib/arm64-v8a or lib/armeabi-v7a to lib/
-            unzip -q "kaorios_toolbox/KaoriosToolbox.apk" "lib/*" -d "$build_dir/system/product/priv-app/KaoriosToolbox/" || true
+            local app_dir="system/product/priv-app/KaoriosToolbox"
+            module_entry file "$app_dir/KaoriosToolbox.apk" "kaorios_toolbox/KaoriosToolbox.apk"
+
+            # Native libraries (lib/arm64-v8a, lib/armeabi-v7a) are copied
+            # from the APK as they are stored there
+            log "  • Adding native libraries from APK..."
+            module_entry zip "$app_dir/" "kaorios_toolbox/KaoriosToolbox.apk" "lib/"
         fi
 
         # 2. Install permissions
         if [ -f "kaorios_toolbox/privapp_whitelist_com.kousei.kaorios.xml" ]; then
-            mkdir -p "$build_dir/system/product/etc/permissions"
-            cp "kaorios_toolbox/privapp_whitelist_com.kousei.kaorios.xml" "$build_dir/system/product/etc/permissions/"
+            module_entry file system/product/etc/permissions/privapp_whitelist_com.kousei.kaorios.xml \
+                "kaorios_toolbox/privapp_whitelist_com.kousei.kaorios.xml"
         fi
-        
+
         # 3. Configure system properties
+        local system_prop="$overlay/system.prop"
+        if [ -f "$template/system.prop" ]; then
+            cp "$template/system.prop" "$system_prop"
+        fi
         {
             echo ""
             echo "# Kaorios Toolbox"
             echo "persist.sys.kaorios=kousei"
             echo "ro.control_privapp_permissions="
-        } >> "$build_dir/system.prop"
+        } >> "$system_prop"
+        module_entry file system.prop "$system_prop"
 
         # 4. Add service script for user app update
         # service.sh is already in the template, but we ensure it's executable
-        if [ -f "$build_dir/service.sh" ]; then
-            chmod +x "$build_dir/service.sh"
+        if [ -f "$template/service.sh" ]; then
+            cp "$template/service.sh" "$overlay/service.sh"
+            chmod +x "$overlay/service.sh"
+            module_entry file service.sh "$overlay/service.sh"
         fi
-        
+
         # Version info for tracking (optional, maybe in module.prop description or just log)
         if [ -f "kaorios_toolbox/version.txt" ]; then
              local k_ver=$(cat "kaorios_toolbox/version.txt")
              log "  • Kaorios Version: $k_ver"
         fi
-        
+
         log "✓ Kaorios Toolbox files added to module"
     fi
 
@@ -144,18 +164,15 @@ create_module() {
     safe_version=$(printf "%s" "$version_name" | sed 's/[. ]/-/g')
     local zip_name="Framework-Patcher-${device_name}-${safe_version}.zip"
 
-    if command -v 7z >/dev/null 2>&1; then
-        (cd "$build_dir" && 7z a -tzip "../$zip_name" "*" >/dev/null) || {
-            err "7z failed to create $zip_name"
-            return 1
-        }
-    elif command -v zip >/dev/null 2>&1; then
-        (cd "$build_dir" && zip -r "../$zip_name" . >/dev/null) || {
-            err "zip failed to create $zip_name"
-            return 1
-        }
-    else
-        err "No archiver found (7z or zip). Install one to create module archive."
+    # JARs, the APK and its libraries are stored; text files are deflated in
+    # parallel. Timestamps are fixed (SOURCE_DATE_EPOCH or 1980), so the same
+    # inputs give a byte-identical archive.
+    local status=0
+    fptools module-zip "$zip_name" "$MODULE_PLAN" || status=$?
+    rm -rf "$overlay"
+    MODULE_PLAN=""
+    if [ "$status" -ne 0 ]; then
+        err "Failed to create $zip_name"
         return 1
     fi
 
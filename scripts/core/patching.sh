@@ -2,79 +2,297 @@
 # scripts/core/patching.sh
 # Smali patching functions
 
+# ----------------------------------------------
+# Method index (built once per decompile dir)
+# ----------------------------------------------
+
+smali_index_dir() {
+    printf "%s\n" "${1%/}.index"
+}
+
+smali_index_build() {
+    local decompile_dir="$1"
+    fptools index-build "$decompile_dir" >/dev/null || {
+        warn "Failed to build method index for $decompile_dir"
+        return 1
+    }
+}
+
+# Re-index files after a helper rewrote them so line ranges stay accurate
+smali_index_refresh() {
+    local decompile_dir="$1"
+    shift
+    [ -d "$(smali_index_dir "$decompile_dir")" ] || return 0
+    fptools index-refresh "$decompile_dir" "$@" >/dev/null 2>&1 || true
+}
+
+ensure_smali_index() {
+    local decompile_dir="$1"
+    [ -d "$(smali_index_dir "$decompile_dir")" ] && return 0
+    smali_index_build "$decompile_dir"
+}
+
+# Print "path<TAB>start<TAB>end" for the first method whose declaration contains $2
+lookup_smali_method() {
+    local decompile_dir="$1"
+    local method="$2"
+    local index_dir name bucket hit=""
+
+    ensure_smali_index "$decompile_dir" || return 1
+    index_dir=$(smali_index_dir "$decompile_dir")
+
+    name="${method%%(*}"
+    name="${name##* }"
+    bucket="${name:0:2}"
+    bucket="${bucket//[^[:alnum:]]/_}"
+
+    local awk_prog='index($6, m) && (system("test -f \"" $5 "\"") == 0) { print $5 "\t" $3 "\t" $4; exit }'
+    if [ -f "$index_dir/methods/${bucket:-_}.tsv" ]; then
+        hit=$(awk -F'\t' -v m="$method" "$awk_prog" "$index_dir/methods/${bucket:-_}.tsv")
+    fi
+    # Queries that are not a method-name prefix need the full index
+    if [ -z "$hit" ]; then
+        hit=$(cat "$index_dir"/methods/*.tsv 2>/dev/null | awk -F'\t' -v m="$method" "$awk_prog")
+    fi
+    if [ -n "$hit" ]; then
+        printf "%s\n" "$hit"
+    fi
+}
+
 find_smali_method_file() {
     local decompile_dir="$1"
     local method="$2"
     # returns first match (stdout)
-    find "$decompile_dir" -type f -name "*.smali" -print0 |
-        xargs -0 grep -s -l -- ".method" 2>/dev/null |
-        xargs -r -I{} sh -c "grep -s -q \"[[:space:]]*\\.method.*${method}\" \"{}\" && printf '%s\n' \"{}\"" |
-        head -n1
+    lookup_smali_method "$decompile_dir" "$method" | cut -f1
 }
 
-add_static_return_patch() {
-    local method="$1"
-    local ret_val="$2" # expect hex nibble w/o 0x OR decimal (we assume hex nibble for const/4 usage)
-    local decompile_dir="$3"
-    local file
+# Print every indexed file with a method declaration containing $2
+find_smali_method_files() {
+    local decompile_dir="$1"
+    local method="$2"
+    local index_dir
+    ensure_smali_index "$decompile_dir" || return 1
+    index_dir=$(smali_index_dir "$decompile_dir")
+    cat "$index_dir"/methods/*.tsv 2>/dev/null |
+        awk -F'\t' -v m="$method" 'index($6, m) && !seen[$5]++ { print $5 }'
+}
 
-    [ -z "$method" ] || true
-    [ -z "$decompile_dir" ] && {
-        err "add_static_return_patch: missing decompile_dir"
-        return 1m
+# Resolve a class file by its path relative to a smali root (e.g. android/app/Foo.smali)
+find_smali_class_file() {
+    local decompile_dir="$1"
+    local rel="$2"
+    local index_dir
+    ensure_smali_index "$decompile_dir" || return 1
+    index_dir=$(smali_index_dir "$decompile_dir")
+    awk -F'\t' -v rel="/$rel" 'substr($2, length($2) - length(rel) + 1) == rel { print $2; exit }' \
+        "$index_dir/classes.tsv"
+}
+
+# ----------------------------------------------
+# Content search (fptools scan)
+# ----------------------------------------------
+
+# Search the tree for several grep patterns in one parallel pass, on
+# SMALI_JOBS worker processes (default: one per CPU). The hits are kept with
+# the method index and follow later edits, so queue every pattern a patch
+# step needs up front and read them back with smali_scan_file(s)/_lines.
+smali_scan() {
+    local decompile_dir="$1"
+    shift
+    ensure_smali_index "$decompile_dir" || return 1
+    fptools scan "$decompile_dir" "$@" --cache --jobs "${SMALI_JOBS:-0}" || {
+        warn "Failed to scan $decompile_dir"
+        return 1
     }
+}
 
-    file=$(find_smali_method_file "$decompile_dir" "$method")
-    [ -z "$file" ] && {
-        warn "Method $method not found in $decompile_dir"
+# Print the cached "path<TAB>lineno<TAB>line" hits for $2, scanning first if
+# the pattern was not part of an earlier smali_scan
+smali_scan_hits() {
+    local decompile_dir="$1"
+    local pattern="$2"
+    local cache
+    cache="$(smali_index_dir "$decompile_dir")/scan.tsv"
+
+    if ! SCAN_PATTERN="$pattern" awk -F'\t' '$1 == ENVIRON["SCAN_PATTERN"] && $2 == "" { found = 1; exit }
+        END { exit !found }' "$cache" 2>/dev/null; then
+        smali_scan "$decompile_dir" "$pattern" || return 1
+    fi
+    SCAN_PATTERN="$pattern" awk -F'\t' '$1 == ENVIRON["SCAN_PATTERN"] && $2 != "" {
+        print substr($0, length($1) + 2)
+    }' "$cache"
+}
+
+# Print every file with a line matching $2, like grep -rl
+smali_scan_files() {
+    smali_scan_hits "$1" "$2" | awk -F'\t' '!seen[$1]++ { print $1 }'
+}
+
+# Print the first file with a line matching $2
+smali_scan_file() {
+    smali_scan_files "$1" "$2" | head -n1
+}
+
+# Print matching lines as "path:lineno:line", like grep -rn
+smali_scan_lines() {
+    smali_scan_hits "$1" "$2" | awk -F'\t' '{ print $1 ":" $2 ":" substr($0, length($1) + length($2) + 3) }'
+}
+
+# ----------------------------------------------
+# Batched smali edits (fptools smali-apply)
+# ----------------------------------------------
+
+# Start queueing smali_op calls; they run together on smali_plan_apply
+smali_plan_begin() {
+    SMALI_PLAN=$(mktemp "${TMPDIR:-/tmp}/smali_plan.XXXXXX")
+}
+
+# Queue one edit: smali_op <op> <file> [args...]
+# Runs immediately when no plan is open.
+smali_op() {
+    local entry
+    entry=$(printf "%s\t" "$@")
+    entry="${entry%$'\t'}"
+
+    if [ -n "${SMALI_PLAN:-}" ]; then
+        printf "%s\n" "$entry" >>"$SMALI_PLAN"
         return 0
+    fi
+
+    printf "%s\n" "$entry" | fptools smali-apply - || {
+        err "smali op $1 failed for $2"
+        return 1
     }
+}
 
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* ${method}" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        warn "Method $method start not found"
-        return 0
+# Apply every queued edit: each file is read and written once
+smali_plan_apply() {
+    local plan="${SMALI_PLAN:-}"
+    SMALI_PLAN=""
+    [ -n "$plan" ] || return 0
+
+    local status=0
+    fptools smali-apply "$plan" || status=$?
+    rm -f "$plan"
+    [ "$status" -eq 0 ] || err "Failed to apply queued smali edits (status $status)"
+    return "$status"
+}
+
+# ----------------------------------------------
+# Patch manifests (fptools manifest-apply)
+# ----------------------------------------------
+
+# The edits each Android release needs are listed in scripts/manifests/
+# (see fptools/manifest.py for the format); a patcher points PATCH_MANIFEST
+# at its release's file.
+
+# Apply the manifest rows for one JAR and feature as a single plan:
+# manifest_apply <decompile_dir> <jar> <feature>
+manifest_apply() {
+    local decompile_dir="$1"
+    local jar="$2"
+    local feature="$3"
+
+    if [ -z "${PATCH_MANIFEST:-}" ] || [ ! -f "$PATCH_MANIFEST" ]; then
+        err "manifest_apply: patch manifest not found: ${PATCH_MANIFEST:-(unset)}"
+        return 1
+    fi
+
+    ensure_smali_index "$decompile_dir" || return 1
+    fptools manifest-apply "$PATCH_MANIFEST" "$decompile_dir" --jar "$jar" --feature "$feature" \
+        --jobs "${SMALI_JOBS:-0}" || {
+        err "Failed to apply $(basename "$PATCH_MANIFEST") to $jar ($feature)"
+        return 1
     }
+}
 
-    local total_lines end=0 i="$start" line
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
+# Manifest features for the FEATURE_* flags a patcher set
+manifest_features() {
+    [ "${FEATURE_DISABLE_SIGNATURE_VERIFICATION:-0}" -eq 1 ] && printf "%s\n" signature
+    [ "${FEATURE_CN_NOTIFICATION_FIX:-0}" -eq 1 ] && printf "%s\n" cn
+    [ "${FEATURE_DISABLE_SECURE_FLAG:-0}" -eq 1 ] && printf "%s\n" secure
+    return 0
+}
+
+# Dry run: check every manifest row the selected features need against the
+# dex tables of ${WORK_DIR}/<jar>.jar, without decoding anything. Prints one
+# "status jar feature op target where" line per row and fails when any row
+# does not resolve (optional "?" rows are reported as "skip" instead);
+# PATCH_PLAN_JSON also gets the report as JSON.
+# manifest_plan <jar>...
+manifest_plan() {
+    local -a jar_args=() feature_args=()
+    local jar feature
+
+    if [ -z "${PATCH_MANIFEST:-}" ] || [ ! -f "$PATCH_MANIFEST" ]; then
+        err "manifest_plan: patch manifest not found: ${PATCH_MANIFEST:-(unset)}"
+        return 1
+    fi
+
+    for jar in "$@"; do
+        if [ -f "${WORK_DIR}/${jar}.jar" ]; then
+            jar_args+=(--jar "${jar}=${WORK_DIR}/${jar}.jar")
+        else
+            warn "${jar}.jar not found in ${WORK_DIR}, not checked"
+        fi
     done
+    while IFS= read -r feature; do
+        feature_args+=(--feature "$feature")
+    done < <(manifest_features)
 
-    [ "$end" -eq 0 ] && {
-        warn "End not found for $method in $file"
+    if [ "${FEATURE_KAORIOS_TOOLBOX:-0}" -eq 1 ]; then
+        warn "Kaorios Toolbox edits are not part of the patch manifest, not checked"
+    fi
+    if [ ${#jar_args[@]} -eq 0 ] || [ ${#feature_args[@]} -eq 0 ]; then
+        log "Nothing to plan"
         return 0
-    }
+    fi
 
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
+    fptools manifest-plan "$PATCH_MANIFEST" "${jar_args[@]}" "${feature_args[@]}" \
+        ${PATCH_PLAN_JSON:+--json "$PATCH_PLAN_JSON"}
+}
 
-    # Replace method body with a simple const/return
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    const/4 v0, 0x${ret_val}\\
-    return v0\\
-.end method" "$file"
+# ----------------------------------------------
+# DEX-level plans (fptools dex-patch)
+# ----------------------------------------------
+
+# Print one DEX plan line: dex_op <op> <classes> [args...]
+# <classes> is a comma separated list of class descriptors tried in order,
+# "*" standing for every class (see fptools/dex_engine.py for the ops).
+dex_op() {
+    local entry
+    entry=$(printf "%s\t" "$@")
+    printf "%s\n" "${entry%$'\t'}"
+}
 
-    log "Patched $method in $file to return 0x${ret_val}"
+# Print the DEX plan of the manifest rows for one JAR and the selected
+# features (fptools/manifest_dex.py), so the DEX path makes the manifest's
+# edits; fails when a row has no in-place DEX equivalent.
+# manifest_dex_plan <jar>
+manifest_dex_plan() {
+    local jar="$1"
+    local -a feature_args=()
+    local feature
+
+    if [ -z "${PATCH_MANIFEST:-}" ] || [ ! -f "$PATCH_MANIFEST" ]; then
+        err "manifest_dex_plan: patch manifest not found: ${PATCH_MANIFEST:-(unset)}"
+        return 1
+    fi
+
+    while IFS= read -r feature; do
+        feature_args+=(--feature "$feature")
+    done < <(manifest_features)
+    fptools manifest-dex "$PATCH_MANIFEST" --jar "$jar" "${feature_args[@]}"
 }
 
-patch_return_void_method() {
+add_static_return_patch() {
     local method="$1"
-    local decompile_dir="$2"
+    local ret_val="$2" # expect hex nibble w/o 0x OR decimal (we assume hex nibble for const/4 usage)
+    local decompile_dir="$3"
     local file
 
     [ -z "$decompile_dir" ] && {
-        err "patch_return_void_method: missing decompile_dir"
+        err "add_static_return_patch: missing decompile_dir"
         return 1
     }
 
@@ -84,97 +302,45 @@ patch_return_void_method() {
         return 0
     }
 
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* ${method}" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        warn "Method $method start not found"
-        return 0
-    }
+    # Replace method body with a simple const/return (single pass over the file)
+    smali_op replace_method_body "$file" " ${method}" first \
+        "    .registers 8\\n    const/4 v0, 0x${ret_val}\\n    return v0" \
+        "Patched $method in $file to return 0x${ret_val}"
+}
 
-    local total_lines end=0 i="$start" line
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
-    done
+patch_return_void_method() {
+    local method="$1"
+    local decompile_dir="$2"
+    local file
 
-    [ "$end" -eq 0 ] && {
-        warn "Method $method end not found"
-        return 0
+    [ -z "$decompile_dir" ] && {
+        err "patch_return_void_method: missing decompile_dir"
+        return 1
     }
 
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    return-void\\
-.end method" "$file"
+    file=$(find_smali_method_file "$decompile_dir" "$method")
+    [ -z "$file" ] && {
+        warn "Method $method not found in $decompile_dir"
+        return 0
+    }
 
-    log "Patched $method in $file to return-void"
+    smali_op replace_method_body "$file" " ${method}" first \
+        "    .registers 8\\n    return-void" \
+        "Patched $method in $file to return-void"
 }
 
+# Stub out the invoke-custom bodies of record equals/hashCode/toString. The
+# candidates come from the method index and each file is rewritten once, on
+# SMALI_JOBS worker processes (default: one per CPU).
 modify_invoke_custom_methods() {
     local decompile_dir="$1"
     echo "Checking for invoke-custom in $decompile_dir..."
 
-    # Use find with + instead of \; to batch files and suppress all grep errors
-    local smali_files
-    # Redirect both stdout and stderr, and use || true to prevent failures
-    smali_files=$(find "$decompile_dir" -type f -name "*.smali" 2>/dev/null | while read -r f; do
-        if [ -f "$f" ] && grep -s -q "invoke-custom" "$f" 2>/dev/null; then
-            echo "$f"
-        fi
-    done)
-
-    [ -z "$smali_files" ] && {
-        log "No invoke-custom found"
-        return 0
+    ensure_smali_index "$decompile_dir" || true
+    fptools invoke-custom "$decompile_dir" --jobs "${SMALI_JOBS:-0}" || {
+        err "Failed to rewrite invoke-custom methods in $decompile_dir"
+        return 1
     }
-
-    local count=0
-    while IFS= read -r smali_file; do
-        # Skip if file doesn't exist (extra safety check)
-        [ ! -f "$smali_file" ] && continue
-
-        count=$((count + 1))
-
-        # equals
-        sed -i "/.method.*equals(/,/^.end method$/ {
-            /^    .registers/c\\    .registers 2
-            /^    invoke-custom/d
-            /^    move-result/d
-            /^    return/c\\    const/4 v0, 0x0\\n\\n    return v0
-        }" "$smali_file" 2>/dev/null || true
-
-        # hashCode
-        sed -i "/.method.*hashCode(/,/^.end method$/ {
-            /^    .registers/c\\    .registers 2
-            /^    invoke-custom/d
-            /^    move-result/d
-            /^    return/c\\    const/4 v0, 0x0\\n\\n    return v0
-        }" "$smali_file" 2>/dev/null || true
-
-        # toString
-        sed -i "/.method.*toString(/,/^.end method$/ {
-            s/^[[:space:]]*\\.registers.*/    .registers 1/
-            /^    invoke-custom/d
-            /^    move-result.*/d
-            /^    return.*/c\\    const/4 v0, 0x0\\n\\n    return-object v0
-        }" "$smali_file" 2>/dev/null || true
-    done <<<"$smali_files"
-
-    if [ "$count" -gt 0 ]; then
-        log "Modified $count files with invoke-custom"
-    else
-        log "No invoke-custom found"
-    fi
 }
 
 patch_return_void_methods_all() {
@@ -188,52 +354,30 @@ patch_return_void_methods_all() {
 
     # Find all files containing the method
     local files
-    files=$(find "$decompile_dir" -type f -name "*.smali" -exec grep -s -l "^[[:space:]]*\\.method.*${method_name}" {} + 2>/dev/null || true)
+    files=$(find_smali_method_files "$decompile_dir" "$method_name")
 
     [ -z "$files" ] && {
         warn "No occurrences of ${method_name} found in $decompile_dir"
         return 0
     }
 
+    # Queue every file into one plan unless the caller already opened one
+    local own_plan=0
+    if [ -z "${SMALI_PLAN:-}" ]; then
+        smali_plan_begin
+        own_plan=1
+    fi
+
     local file
-    for file in $files; do
-        # Patch each occurrence within the file
-        # We iterate from bottom to top to keep line numbers stable
-        local starts
-        starts=$(grep -n "^[[:space:]]*\\.method.*${method_name}" "$file" | cut -d: -f1 | sort -nr)
-        [ -z "$starts" ] && continue
-
-        local start end total_lines i line method_head method_head_escaped
-        total_lines=$(wc -l <"$file")
-
-        for start in $starts; do
-            end=0
-            i="$start"
-            while [ "$i" -le "$total_lines" ]; do
-                line=$(sed -n "${i}p" "$file")
-                [[ "$line" == *".end method"* ]] && {
-                    end="$i"
-                    break
-                }
-                i=$((i + 1))
-            done
-            [ "$end" -eq 0 ] && {
-                warn "End not found for ${method_name} in $file (start $start)"
-                continue
-            }
-
-            method_head=$(sed -n "${start}p" "$file")
-            method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-            sed -i "${start},${end}c\\
-${method_head_escaped}\\
-    .registers 8\\
-    return-void\\
-.end method" "$file"
-        done
-
-        log "Patched all ${method_name} overloads in $(basename "$file") to return-void"
-    done
+    while IFS= read -r file; do
+        smali_op replace_method_body "$file" "${method_name}" all \
+            "    .registers 8\\n    return-void" \
+            "Patched all ${method_name} overloads in {file} to return-void"
+    done <<<"$files"
+
+    if [ "$own_plan" -eq 1 ]; then
+        smali_plan_apply || return 1
+    fi
 
     return 0
 }
@@ -2,6 +2,14 @@
 # scripts/core/tools.sh
 # Environment initialization and tool checks
 
+# Directory holding the fptools Python package (scripts/)
+FPTOOLS_PYTHONPATH="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+
+# Run a stdlib-only Python helper: fptools <command> [args...]
+fptools() {
+    PYTHONPATH="${FPTOOLS_PYTHONPATH}${PYTHONPATH:+:$PYTHONPATH}" python3 -m fptools "$@"
+}
+
 init_env() {
     # Allow overriding from environment before calling init_env
     : "${TOOLS_DIR:=${PWD}/tools}"
@@ -12,7 +20,7 @@ init_env() {
 }
 
 ensure_tools() {
-    # Checks for java, apktool.jar and 7z (optional)
+    # Checks for java and apktool.jar
     if ! command -v java >/dev/null 2>&1; then
         err "java not found in PATH"
         return 1
@@ -23,10 +31,6 @@ ensure_tools() {
         return 1
     fi
 
-    if ! command -v 7z >/dev/null 2>&1; then
-        warn "7z not found in PATH — create_magisk_module will try to use zip if available"
-    fi
-
     # Check for d8 (needed for optimization)
     if [ -z "${D8_CMD:-}" ]; then
         if command -v d8 >/dev/null 2>&1; then
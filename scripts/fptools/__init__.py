@@ -0,0 +1,6 @@
+"""Python helpers used by the shell patchers.
+
+Everything in here is stdlib-only so it runs on a bare CI runner with just
+``python3``. The shell side calls into it through the ``fptools`` wrapper
+defined in ``scripts/core/tools.sh``.
+"""
@@ -0,0 +1,398 @@
+"""Command-line entry point: ``python3 -m fptools <command> ...``."""
+
+import argparse
+import os
+import sys
+
+from fptools import (bench, dex_engine, dex_place, download, invoke_custom, jar, jvm, kaorios, manifest, manifest_dex,
+                     manifest_plan, module_zip, release_store, scan, smali_engine, smali_index, timeline)
+
+
+def cmd_index_build(args) -> int:
+    print(smali_index.build(args.decompile_dir))
+    return 0
+
+
+def cmd_index_refresh(args) -> int:
+    smali_index.refresh_many(args.decompile_dir, args.files, [args.old_path])
+    return 0
+
+
+def cmd_smali_apply(args) -> int:
+    if args.plan == "-":
+        ops = smali_engine.read_plan(sys.stdin)
+    else:
+        with open(args.plan, encoding="utf-8", errors="surrogateescape") as handle:
+            ops = smali_engine.read_plan(handle)
+    smali_engine.apply_plan(ops)
+    return 0
+
+
+def cmd_manifest_apply(args) -> int:
+    manifest.apply(args.manifest, args.decompile_dir, args.jar, args.feature, args.jobs)
+    return 0
+
+
+def cmd_manifest_plan(args) -> int:
+    jars = []
+    for spec in args.jar:
+        name, sep, path = spec.partition("=")
+        if not sep:
+            print(f"fptools: expected NAME=JAR, got {spec}", file=sys.stderr)
+            return 2
+        jars.append((name, path))
+    report = manifest_plan.plan(args.manifest, jars, args.feature)
+    manifest_plan.write_report(report, sys.stdout)
+    if args.json:
+        manifest_plan.write_json(report, args.json, args.manifest)
+    missing = [entry for entry in report if entry["status"] in manifest_plan.FAILED]
+    skipped = [entry for entry in report if entry["status"] == manifest_plan.SKIP]
+    if skipped:
+        smali_engine.warn(f"{len(skipped)} optional manifest rows do not resolve")
+    if missing:
+        smali_engine.warn(f"{len(missing)} of {len(report)} manifest rows do not resolve")
+        return 1
+    smali_engine.log(f"All {len(report) - len(skipped)} required manifest rows resolve")
+    return 0
+
+
+def cmd_manifest_dex(args) -> int:
+    rows = manifest.select(manifest.load(args.manifest), args.jar, args.feature)
+    try:
+        ops = manifest_dex.dex_ops(rows)
+    except manifest_dex.NoDexEquivalent as exc:
+        smali_engine.log(f"No DEX plan for {args.jar}: {exc}")
+        return 3
+    manifest_dex.write_plan(ops, sys.stdout)
+    return 0
+
+
+def cmd_invoke_custom(args) -> int:
+    changed = invoke_custom.rewrite_tree(args.decompile_dir, args.jobs)
+    if changed:
+        smali_engine.log(f"Modified {len(changed)} files with invoke-custom")
+    else:
+        smali_engine.log("No invoke-custom found")
+    return 0
+
+
+def cmd_scan(args) -> int:
+    if args.cache:
+        scan.update_cache(args.decompile_dir, args.patterns, args.jobs)
+    else:
+        scan.write_results(scan.scan(args.decompile_dir, args.patterns, args.jobs), sys.stdout)
+    return 0
+
+
+def cmd_dex_patch(args) -> int:
+    with open(args.plan, encoding="utf-8", errors="surrogateescape") as handle:
+        ops = smali_engine.read_plan(handle, dex_engine.OPS)
+    try:
+        dex_engine.patch_jar(args.jar, args.out, ops)
+    except dex_engine.Unsupported as exc:
+        smali_engine.warn(f"DEX patch not possible in place: {exc}")
+        return 3
+    return 0
+
+
+def cmd_dex_place(args) -> int:
+    try:
+        counts = dex_place.place(args.decompile_dir, args.inject, args.relocate, args.jar or "", args.reserve, args.jobs)
+    except dex_place.Overflow as exc:
+        print(f"fptools: {exc}", file=sys.stderr)
+        return 1
+    for name, (methods, fields) in counts.items():
+        print(f"{name}\t{methods}\t{fields}")
+    return 0
+
+
+def cmd_kaorios_apply(args) -> int:
+    try:
+        _, missed = kaorios.apply(args.decompile_dir, args.toolbox_dir, args.cache_dir or "")
+    except ValueError as exc:
+        print(f"fptools: {exc}", file=sys.stderr)
+        return 1
+    for rel, method in missed:
+        print(f"fptools: Kaorios insertion into {rel} {method} did not apply", file=sys.stderr)
+    return 1 if missed else 0
+
+
+def _pairs(specs, what: str):
+    pairs = []
+    for spec in specs:
+        name, sep, value = spec.partition("=")
+        if not sep:
+            raise ValueError(f"expected {what}, got {spec}")
+        pairs.append((name, value))
+    return pairs
+
+
+def cmd_release_fetch(args) -> int:
+    store = release_store.Store(args.store)
+    try:
+        assets = dict(_pairs(args.asset, "NAME=REGEX"))
+        tag, paths = release_store.fetch(store, args.api_url, assets, os.environ.get("GITHUB_TOKEN", ""),
+                                         args.offline, args.tag or "", not args.no_download)
+    except (ValueError, release_store.StoreError) as exc:
+        print(f"fptools: {exc}", file=sys.stderr)
+        return 1
+    print(f"tag\t{tag}")
+    for name, path in paths.items():
+        print(f"{name}\t{path}")
+    return 0
+
+
+def cmd_release_verify(args) -> int:
+    try:
+        files = _pairs(args.file, "NAME=PATH")
+        trees = _pairs(args.tree, "NAME=DIR")
+    except ValueError as exc:
+        print(f"fptools: {exc}", file=sys.stderr)
+        return 2
+    problems = release_store.verify(release_store.Store(args.store), args.tag, files, trees)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+def cmd_jar_fetch(args) -> int:
+    try:
+        downloads = _pairs(args.downloads, "NAME=URL")
+        expected = dict(_pairs(args.sha256, "NAME=SHA256"))
+    except ValueError as exc:
+        print(f"fptools: {exc}", file=sys.stderr)
+        return 2
+    results, errors = download.fetch_all(downloads, args.out_dir, expected, args.min_size, args.retries,
+                                         args.retry_delay)
+    for name, (path, digest, size) in results.items():
+        print(f"{name}\t{digest}\t{size}\t{path}")
+    for name, error in errors.items():
+        print(f"fptools: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_jar_splice(args) -> int:
+    replacements = {}
+    for spec in args.entries:
+        name, sep, path = spec.partition("=")
+        if not sep:
+            print(f"fptools: expected NAME=FILE, got {spec}", file=sys.stderr)
+            return 2
+        replacements[name] = path
+    jar.replace_entries(args.jar, args.out, replacements, args.remove)
+    return 0
+
+
+def cmd_module_zip(args) -> int:
+    if args.plan == "-":
+        files, copies = module_zip.read_plan(sys.stdin)
+    else:
+        with open(args.plan, encoding="utf-8", errors="surrogateescape") as handle:
+            files, copies = module_zip.read_plan(handle)
+    module_zip.build(args.out, files, copies, args.jobs)
+    return 0
+
+
+def cmd_jvm(args) -> int:
+    if args.action == "run":
+        if len(args.tool) < 2:
+            print("fptools: jvm run needs JAR MAIN [args...]", file=sys.stderr)
+            return 2
+        return jvm.run(args.socket, args.tool[0], args.tool[1], args.tool[2:], args.skip)
+    if args.tool:
+        print(f"fptools: jvm {args.action} takes no tool arguments", file=sys.stderr)
+        return 2
+    return jvm.request(args.socket, [f"--{args.action}"])
+
+
+def cmd_timeline(args) -> int:
+    stages = timeline.load(args.timeline)
+    if args.json:
+        timeline.write_json(stages, args.json)
+    sys.stdout.write(timeline.markdown(stages))
+    return 0
+
+
+def cmd_bench_corpus(args) -> int:
+    count = bench.corpus(args.out, args.jar, args.scale, args.seed)
+    print(count)
+    return 0
+
+
+def cmd_bench_record(args) -> int:
+    config = {}
+    for spec in args.config:
+        key, sep, value = spec.partition("=")
+        if not sep:
+            print(f"fptools: expected KEY=VALUE, got {spec}", file=sys.stderr)
+            return 2
+        config[key] = value
+    runs = [timeline.load(path) for path in args.timelines]
+    entry, previous = bench.record(args.history, runs, config, args.commit, args.label)
+    sys.stdout.write(bench.markdown(entry, previous, args.threshold))
+    slower = bench.regressions(entry, previous, args.threshold)
+    if slower and args.fail_on_regression:
+        print(f"fptools: slower than {previous['commit']}: {', '.join(slower)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="fptools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index-build", help="index every method/class in a decompile dir")
+    p.add_argument("decompile_dir")
+    p.set_defaults(func=cmd_index_build)
+
+    p = sub.add_parser("index-refresh", help="re-index files after they were edited or moved")
+    p.add_argument("decompile_dir")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--old-path", default="", help="previous location of a moved file")
+    p.set_defaults(func=cmd_index_refresh)
+
+    p = sub.add_parser("smali-apply", help="apply a queued plan of smali line edits")
+    p.add_argument("plan", help="plan file, or - for stdin")
+    p.set_defaults(func=cmd_smali_apply)
+
+    p = sub.add_parser("manifest-apply", help="apply the patch manifest rows for one JAR to its decompile dir")
+    p.add_argument("manifest")
+    p.add_argument("decompile_dir")
+    p.add_argument("--jar", required=True, help="framework, services or miui-services")
+    p.add_argument("--feature", action="append", required=True, help="feature whose rows apply (repeatable)")
+    p.add_argument("--jobs", type=int, default=0, help="scan worker processes (default: one per CPU)")
+    p.set_defaults(func=cmd_manifest_apply)
+
+    p = sub.add_parser("manifest-plan", help="check the patch manifest rows against the dex tables of the input JARs")
+    p.add_argument("manifest")
+    p.add_argument("--jar", action="append", required=True, metavar="NAME=JAR",
+                   help="JAR name (framework, services, miui-services) and file (repeatable)")
+    p.add_argument("--feature", action="append", required=True, help="feature whose rows are checked (repeatable)")
+    p.add_argument("--json", help="also write the report as one JSON document")
+    p.set_defaults(func=cmd_manifest_plan)
+
+    p = sub.add_parser("manifest-dex", help="print the dex-patch plan of the patch manifest rows for one JAR")
+    p.add_argument("manifest")
+    p.add_argument("--jar", required=True, help="framework, services or miui-services")
+    p.add_argument("--feature", action="append", default=[], help="feature whose rows are planned (repeatable)")
+    p.set_defaults(func=cmd_manifest_dex)
+
+    p = sub.add_parser("invoke-custom", help="stub out invoke-custom in record equals/hashCode/toString")
+    p.add_argument("decompile_dir")
+    p.add_argument("--jobs", type=int, default=0, help="worker processes (default: one per CPU)")
+    p.set_defaults(func=cmd_invoke_custom)
+
+    p = sub.add_parser("scan", help="find lines matching any of several grep patterns in one pass")
+    p.add_argument("decompile_dir")
+    p.add_argument("patterns", nargs="+", metavar="pattern")
+    p.add_argument("--jobs", type=int, default=0, help="worker processes (default: one per CPU)")
+    p.add_argument("--cache", action="store_true", help="store the results with the method index instead of printing them")
+    p.set_defaults(func=cmd_scan)
+
+    p = sub.add_parser("dex-patch", help="apply a dex plan directly to the classes*.dex of a JAR")
+    p.add_argument("jar")
+    p.add_argument("out")
+    p.add_argument("plan")
+    p.set_defaults(func=cmd_dex_patch)
+
+    p = sub.add_parser("dex-place", help="place new or growing classes in smali roots with dex reference headroom")
+    p.add_argument("decompile_dir")
+    p.add_argument("--inject", nargs=2, metavar=("SRC_DIR", "PACKAGE"),
+                   help="copy the classes under SRC_DIR into PACKAGE (e.g. com/android/foo)")
+    p.add_argument("--relocate", action="append", default=[], metavar="CLASS",
+                   help="move CLASS (e.g. android/app/Foo) and its inner classes if its root is full (repeatable)")
+    p.add_argument("--jar", help="the decoded JAR, whose dex id tables give the counts")
+    p.add_argument("--reserve", type=int, default=dex_place.DEFAULT_RESERVE,
+                   help=f"references kept free per root (default {dex_place.DEFAULT_RESERVE})")
+    p.add_argument("--jobs", type=int, default=0, help="worker processes for roots counted from smali")
+    p.set_defaults(func=cmd_dex_place)
+
+    p = sub.add_parser("kaorios-apply", help="apply the Kaorios Toolbox template insertions to an indexed decompile dir")
+    p.add_argument("decompile_dir")
+    p.add_argument("toolbox_dir", help="directory with the toolbox's class templates and version.txt")
+    p.add_argument("--cache-dir", help="where compiled insertion plans are kept per toolbox version")
+    p.set_defaults(func=cmd_kaorios_apply)
+
+    p = sub.add_parser("release-fetch", help="bring a GitHub release's assets into a content-addressed store")
+    p.add_argument("store")
+    p.add_argument("api_url", help="releases API URL (.../releases/latest or .../releases/tags/TAG)")
+    p.add_argument("--asset", action="append", required=True, metavar="NAME=REGEX",
+                   help="local name and a regex over the release's asset names (repeatable)")
+    p.add_argument("--offline", action="store_true", help="use the stored response and objects only")
+    p.add_argument("--tag", help="with --offline, the release record to use instead of the stored response")
+    p.add_argument("--no-download", action="store_true", help="only resolve; assets not stored print an empty path")
+    p.set_defaults(func=cmd_release_fetch)
+
+    p = sub.add_parser("release-verify", help="rehash a stored release and compare installed copies with it")
+    p.add_argument("store")
+    p.add_argument("tag")
+    p.add_argument("--file", action="append", default=[], metavar="NAME=PATH",
+                   help="installed copy of an asset (repeatable)")
+    p.add_argument("--tree", action="append", default=[], metavar="NAME=DIR",
+                   help="installed copy of the tree derived from an asset (repeatable)")
+    p.set_defaults(func=cmd_release_verify)
+
+    p = sub.add_parser("jar-fetch", help="download input JARs in parallel, resuming, and check their integrity")
+    p.add_argument("out_dir")
+    p.add_argument("downloads", nargs="+", metavar="NAME=URL")
+    p.add_argument("--sha256", action="append", default=[], metavar="NAME=SHA256",
+                   help="expected digest of a download (repeatable)")
+    p.add_argument("--min-size", type=int, default=0, help="smallest acceptable size in bytes")
+    p.add_argument("--retries", type=int, default=download.DEFAULT_RETRIES,
+                   help=f"resume attempts per file (default {download.DEFAULT_RETRIES})")
+    p.add_argument("--retry-delay", type=float, default=1.0, help="first retry delay in seconds, doubled each time")
+    p.set_defaults(func=cmd_jar_fetch)
+
+    p = sub.add_parser("jar-splice", help="copy a JAR, replacing, adding or removing entries")
+    p.add_argument("jar")
+    p.add_argument("out")
+    p.add_argument("entries", nargs="*", metavar="NAME=FILE")
+    p.add_argument("--remove", action="append", default=[], metavar="NAME", help="drop this entry (repeatable)")
+    p.set_defaults(func=cmd_jar_splice)
+
+    p = sub.add_parser("module-zip", help="write a module archive from a plan of trees, files and zip entries")
+    p.add_argument("out")
+    p.add_argument("plan", help="plan file, or - for stdin")
+    p.add_argument("--jobs", type=int, default=0, help="compression threads (default: one per CPU)")
+    p.set_defaults(func=cmd_module_zip)
+
+    p = sub.add_parser("jvm", help="talk to the JVM daemon (exit 75 when it does not answer)")
+    p.add_argument("socket")
+    p.add_argument("action", choices=["ping", "stop", "run"])
+    p.add_argument("--skip", type=int, default=0, help="leading tool arguments that are never paths")
+    p.add_argument("tool", nargs=argparse.REMAINDER, metavar="JAR MAIN ARG", help="for run: tool JAR, main class and arguments")
+    p.set_defaults(func=cmd_jvm)
+
+    p = sub.add_parser("timeline", help="summarize a PATCH_TIMELINE file as Markdown")
+    p.add_argument("timeline")
+    p.add_argument("--json", help="also write the paired stages as one JSON document")
+    p.set_defaults(func=cmd_timeline)
+
+    p = sub.add_parser("bench-corpus", help="write a synthetic decompiled tree and JAR for benchmarks")
+    p.add_argument("out")
+    p.add_argument("--jar", required=True, choices=sorted(bench.SIZES))
+    p.add_argument("--scale", type=float, default=1.0, help="fraction of a full-size JAR (default 1.0)")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_bench_corpus)
+
+    p = sub.add_parser("bench-record", help="append benchmark timelines to a history and compare")
+    p.add_argument("history")
+    p.add_argument("timelines", nargs="+", help="one PATCH_TIMELINE file per run")
+    p.add_argument("--config", action="append", default=[], metavar="KEY=VALUE",
+                   help="benchmark setting; entries only compare against the same settings")
+    p.add_argument("--commit", default="unknown")
+    p.add_argument("--label", default="")
+    p.add_argument("--threshold", type=float, default=10.0, help="slowdown in percent to flag (default 10)")
+    p.add_argument("--fail-on-regression", action="store_true")
+    p.set_defaults(func=cmd_bench_record)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
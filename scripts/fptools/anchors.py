@@ -0,0 +1,115 @@
+"""One-pass matching of many literal anchors.
+
+``Automaton`` holds every anchor in a trie and compiles the trie into a single
+regular expression, so one scan of a file finds where any anchor starts. The
+scan runs inside ``re`` rather than stepping a Python state machine per byte,
+and at each start the trie is walked to report every anchor that begins
+there, overlapping ones included. The cost follows the bytes scanned and the
+hits found, not bytes times anchors.
+
+The ``re`` scan is slower per byte than a plain substring search, so small
+sets (up to ``FIND_LIMIT`` anchors) are located with one ``find`` per anchor
+instead; on a 14 MB tree the two cost the same at about 32 anchors.
+
+Files are scanned as bytes (a ``bytes`` object or an ``mmap``); hits come back
+as line indexes that agree with ``str.splitlines`` on the decoded text.
+"""
+
+import bisect
+import heapq
+import re
+
+FIND_LIMIT = 32
+
+# What str.splitlines breaks on besides "\n", in UTF-8
+_OTHER_BREAKS = (b"\r", b"\x0b", b"\x0c", b"\x1c", b"\x1d", b"\x1e", b"\xc2\x85", b"\xe2\x80\xa8", b"\xe2\x80\xa9")
+_BREAKS = re.compile(rb"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+
+_END = -1  # trie key for "an anchor ends here"
+
+
+def _encode(text: str) -> bytes:
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _trie_regex(node) -> bytes:
+    if _END in node:
+        # Some anchor starts here; longer ones are found by the trie walk
+        return b""
+    alts = [re.escape(bytes([byte])) + _trie_regex(child) for byte, child in sorted(node.items())]
+    return alts[0] if len(alts) == 1 else b"(?:" + b"|".join(alts) + b")"
+
+
+def _find_all(data, anchor: str):
+    needle = _encode(anchor)
+    offset = data.find(needle)
+    while offset != -1:
+        yield offset, anchor
+        offset = data.find(needle, offset + 1)
+
+
+class Automaton:
+    """Matcher for a fixed set of literal anchors.
+
+    Empty anchors and anchors spanning a line break are left out of
+    ``anchors``, so callers fall back to their own search for those.
+    """
+
+    def __init__(self, anchors):
+        self.anchors = frozenset(anchor for anchor in anchors if anchor and anchor.splitlines() == [anchor])
+        self._trie = {}
+        for anchor in self.anchors:
+            node = self._trie
+            for byte in _encode(anchor):
+                node = node.setdefault(byte, {})
+            node[_END] = anchor
+        self._start = None
+        if len(self.anchors) > FIND_LIMIT:
+            self._start = re.compile(_trie_regex(self._trie), re.DOTALL)
+
+    def finditer(self, data):
+        """Yields (offset, anchor) for every occurrence, in offset order."""
+        if self._start is None:
+            yield from heapq.merge(*(_find_all(data, anchor) for anchor in sorted(self.anchors)))
+            return
+        size = len(data)
+        pos = 0
+        while True:
+            match = self._start.search(data, pos)
+            if match is None:
+                return
+            start = match.start()
+            node = self._trie
+            end = start
+            while True:
+                if _END in node:
+                    yield start, node[_END]
+                if end >= size:
+                    break
+                node = node.get(data[end])
+                if node is None:
+                    break
+                end += 1
+            pos = start + 1
+
+    def line_hits(self, data):
+        """Returns {anchor: [line index, ...]} for the anchors found in data."""
+        hits = {}
+        if all(data.find(sep) == -1 for sep in _OTHER_BREAKS):
+            line = 0
+            last = 0
+            for offset, anchor in self.finditer(data):
+                line += data[last:offset].count(b"\n")
+                last = offset
+                lines = hits.setdefault(anchor, [])
+                if not lines or lines[-1] != line:
+                    lines.append(line)
+            return hits
+
+        starts = [0] + [match.end() for match in _BREAKS.finditer(data)]
+        for offset, anchor in self.finditer(data):
+            line = bisect.bisect_right(starts, offset) - 1
+            lines = hits.setdefault(anchor, [])
+            if not lines or lines[-1] != line:
+                lines.append(line)
+        return hits
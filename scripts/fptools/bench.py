@@ -0,0 +1,507 @@
+"""Offline patch-engine benchmark: synthetic corpora and a result history.
+
+``scripts/bench.sh`` seeds the decompile cache with a tree from ``corpus`` and
+runs the real ``patch_*`` functions against it with ``PATCH_TIMELINE`` set.
+``record`` folds the timelines of the runs into one history entry and compares
+it with the previous entry for the same configuration.
+
+Corpora are apktool-shaped (``apktool.yml``, ``smali``, ``smali_classesN``,
+``unknown``) and deterministic for a given seed. Filler classes have a spread
+of method counts and sizes, a few very large methods and an occasional
+``invoke-custom`` record; the classes the patchers look for carry the exact
+anchor lines every patcher (Android 13-16) searches for.
+"""
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import time
+import zipfile
+
+# Bump when the generated trees change so cached corpora are rebuilt
+CORPUS_VERSION = 1
+
+# jar -> (filler classes at scale 1.0, smali roots)
+SIZES = {
+    "framework": (30000, 4),
+    "services": (20000, 3),
+    "miui-services": (4000, 1),
+}
+
+_PACKAGES = {
+    "framework": ("android/app", "android/content", "android/content/pm", "android/os", "android/view",
+                  "android/widget", "android/util", "com/android/internal/os", "com/android/internal/util"),
+    "services": ("com/android/server", "com/android/server/am", "com/android/server/pm", "com/android/server/wm",
+                 "com/android/server/power", "com/android/server/display", "com/android/server/net"),
+    "miui-services": ("com/android/server/am", "com/android/server/pm", "com/android/server/wm",
+                      "com/miui/server", "com/miui/server/security"),
+}
+
+_INTL = "Lmiui/os/Build;->IS_INTERNATIONAL_BUILD:Z"
+_IS_EQUAL = "Ljava/security/MessageDigest;->isEqual([B[B)Z"
+_SHARED_USER = "<manifest> specifies bad sharedUserId name"
+
+
+def _returns(kind: str):
+    return {
+        "V": ["    return-void"],
+        "Z": ["    const/4 v0, 0x1", "", "    return v0"],
+        "I": ["    const/4 v0, 0x0", "", "    return v0"],
+    }[kind]
+
+
+def _method(decl: str, body, registers: int = 8):
+    return [f".method {decl}", f"    .registers {registers}", "", *body, ".end method", ""]
+
+
+def _anchors():
+    """jar -> [(root index, class path, [method lines...])] with the patch anchors."""
+    verifier = "Landroid/util/apk/ApkSignatureVerifier;"
+    return {
+        "framework": [
+            (0, "android/content/pm/PackageParser", [
+                _method("private parseBaseApkCommon(Landroid/content/pm/PackageParser$Package;"
+                        "Landroid/content/res/Resources;Landroid/content/res/XmlResourceParser;I[Ljava/lang/String;)"
+                        "Landroid/content/pm/PackageParser$Package;", [
+                            "    invoke-static {v14}, Landroid/content/pm/PackageParser;->validateName(Ljava/lang/String;)Z",
+                            "    move-result v5",
+                            "    if-nez v14, :cond_5",
+                            "    const/4 v0, 0x0",
+                            f'    const-string v1, "{_SHARED_USER}"',
+                            "    :cond_5",
+                            "    const/4 v0, 0x0",
+                            "    return-object v0",
+                        ], 20),
+                _method("public static collectCertificates(Landroid/content/pm/PackageParser$Package;Z)V", [
+                    "    const/4 v1, 0x0",
+                    f"    invoke-static {{p0, v1}}, {verifier}->unsafeGetCertsWithoutVerification"
+                    "(Ljava/lang/String;I)Landroid/content/pm/PackageParser$SigningDetails;",
+                    "    move-result-object v0",
+                    "    return-void",
+                ]),
+            ]),
+            (0, "android/content/pm/PackageParser$PackageParserException", [
+                _method("public constructor <init>(ILjava/lang/String;)V", [
+                    "    invoke-direct {p0, p2}, Ljava/lang/Exception;-><init>(Ljava/lang/String;)V",
+                    "    iput p1, p0, Landroid/content/pm/PackageParser$PackageParserException;->error:I",
+                    "    return-void",
+                ], 3),
+            ]),
+            (0, "android/content/pm/PackageParser$SigningDetails", [
+                _method("public checkCapability(Landroid/content/pm/PackageParser$SigningDetails;I)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public checkCapability(Ljava/lang/String;I)Z", ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public checkCapabilityRecover(Landroid/content/pm/PackageParser$SigningDetails;I)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public hasAncestorOrSelf(Landroid/content/pm/PackageParser$SigningDetails;)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+            ]),
+            (0, "android/content/pm/SigningDetails", [
+                _method("public checkCapability(Landroid/content/pm/SigningDetails;I)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public checkCapability(Ljava/lang/String;I)Z", ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public checkCapabilityRecover(Landroid/content/pm/SigningDetails;I)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+                _method("public hasAncestorOrSelf(Landroid/content/pm/SigningDetails;)Z",
+                        ["    const/4 v0, 0x0", "", "    return v0"]),
+            ]),
+            (0, "android/content/pm/ApplicationInfo", [
+                _method("public isPackageWhitelistedForHiddenApis()Z", ["    const/4 v0, 0x0", "", "    return v0"]),
+            ]),
+            (1, "android/util/apk/ApkSignatureSchemeV2Verifier", [
+                _method("private static verifyAdditionalAttributes(Ljava/nio/ByteBuffer;)V", [
+                    f"    invoke-static {{v8, v4}}, {_IS_EQUAL}",
+                    "    move-result v0",
+                    f"    invoke-static {{v8, v7}}, {_IS_EQUAL}",
+                    "    move-result v0",
+                    "    return-void",
+                ], 12),
+            ]),
+            (1, "android/util/apk/ApkSignatureSchemeV3Verifier", [
+                _method("private static verifySigner(Ljava/nio/ByteBuffer;)V", [
+                    f"    invoke-static {{v9, v3}}, {_IS_EQUAL}",
+                    "    move-result v0",
+                    f"    invoke-static {{v12, v6}}, {_IS_EQUAL}",
+                    "    move-result v0",
+                    "    return-void",
+                ], 14),
+            ]),
+            (3, "android/util/apk/ApkSignatureVerifier", [
+                _method("public static getMinimumSignatureSchemeVersionForTargetSdk(I)I",
+                        ["    const/4 v0, 0x2", "", "    return v0"]),
+                _method("private static verifySignaturesInternal(Landroid/content/pm/parsing/result/ParseInput;"
+                        "Ljava/lang/String;IZ)Landroid/content/pm/parsing/result/ParseResult;", [
+                            f"    invoke-static {{p0, p1, p3}}, {verifier}->verifyV1Signature"
+                            "(Landroid/content/pm/parsing/result/ParseInput;Ljava/lang/String;Z)"
+                            "Landroid/content/pm/parsing/result/ParseResult;",
+                            "    move-result-object v0",
+                            "    return-object v0",
+                        ]),
+            ]),
+            (1, "android/util/apk/ApkSigningBlockUtils", [
+                _method("static verifyIntegrityFor1MbChunkBasedAlgorithm([B)V", [
+                    f"    invoke-static {{v5, v6}}, {_IS_EQUAL}",
+                    "    move-result v7",
+                    "    return-void",
+                ], 10),
+            ]),
+            (3, "android/util/jar/StrictJarVerifier", [
+                _method("private static verifyMessageDigest([B[B)Z", [f"    invoke-static {{p0, p1}}, {_IS_EQUAL}",
+                                                                    "    move-result v0", "", "    return v0"]),
+            ]),
+            (2, "android/util/jar/StrictJarFile", [
+                _method("private constructor <init>(Ljava/lang/String;Ljava/io/FileDescriptor;ZZ)V", [
+                    "    const-string v5, \"AndroidManifest.xml\"",
+                    "    invoke-virtual {p0, v5}, Landroid/util/jar/StrictJarFile;->findEntry"
+                    "(Ljava/lang/String;)Ljava/util/zip/ZipEntry;",
+                    "    move-result-object v6",
+                    "    if-eqz v6, :cond_4",
+                    "    const/4 v0, 0x1",
+                    "    :cond_4",
+                    "    return-void",
+                ], 10),
+            ]),
+            (3, "com/android/internal/pm/pkg/parsing/ParsingPackageUtils", [
+                _method("private parseSharedUser(Landroid/content/pm/parsing/result/ParseInput;"
+                        "Lcom/android/internal/pm/parsing/pkg/ParsingPackage;Landroid/content/res/TypedArray;)"
+                        "Landroid/content/pm/parsing/result/ParseResult;", [
+                            "    invoke-interface {v2}, Landroid/content/pm/parsing/result/ParseResult;->isError()Z",
+                            "    move-result v4",
+                            "    if-eqz v4, :cond_2",
+                            f'    const-string v5, "{_SHARED_USER}"',
+                            "    :cond_2",
+                            "    return-object p1",
+                        ], 8),
+            ]),
+        ],
+        "services": [
+            (1, "com/android/server/pm/PackageManagerServiceUtils", [
+                _method("public static checkDowngrade(Lcom/android/server/pm/pkg/AndroidPackage;"
+                        "Landroid/content/pm/PackageInfoLite;)V", _returns("V")),
+                _method("public static checkDowngrade(Lcom/android/server/pm/PackageSetting;"
+                        "Landroid/content/pm/PackageInfoLite;)V", _returns("V")),
+                _method("public static verifySignatures(Lcom/android/server/pm/PackageSetting;"
+                        "Lcom/android/server/pm/SharedUserSetting;Lcom/android/server/pm/PackageSetting;"
+                        "Landroid/content/pm/SigningDetails;ZZZ)Z", _returns("Z")),
+                _method("public static compareSignatures([Landroid/content/pm/Signature;"
+                        "[Landroid/content/pm/Signature;)I", _returns("I")),
+                _method("private static matchSignaturesCompat(Ljava/lang/String;"
+                        "Lcom/android/server/pm/PackageSignatures;Landroid/content/pm/SigningDetails;)Z",
+                        _returns("Z")),
+            ]),
+            (1, "com/android/server/pm/KeySetManagerService", [
+                _method("public shouldCheckUpgradeKeySetLocked(Lcom/android/server/pm/pkg/PackageStateInternal;"
+                        "Lcom/android/server/pm/pkg/SharedUserApi;I)Z", _returns("Z")),
+            ]),
+            (1, "com/android/server/pm/InstallPackageHelper", [
+                _method("private preparePackageLI(Lcom/android/server/pm/InstallRequest;)V", [
+                    "    iget-boolean v3, p0, Lcom/android/server/pm/InstallPackageHelper;->mShared:Z",
+                    "    if-eqz v3, :cond_9",
+                    "    invoke-interface {p5}, Lcom/android/server/pm/pkg/AndroidPackage;->isLeavingSharedUser()Z",
+                    "    move-result v3",
+                    "    invoke-virtual {v5, v9}, Ljava/lang/Object;->equals(Ljava/lang/Object;)Z",
+                    "    move-result v12",
+                    "    :cond_9",
+                    "    return-void",
+                ], 16),
+            ]),
+            (1, "com/android/server/pm/ReconcilePackageUtils", [
+                _method("static constructor <clinit>()V", [
+                    "    const/4 v0, 0x0",
+                    "    sput-boolean v0, Lcom/android/server/pm/ReconcilePackageUtils;->ALLOW_NON_PRELOADS_SYSTEM_SHAREDUIDS:Z",
+                    "    return-void",
+                ], 1),
+            ]),
+            (2, "com/android/server/wm/WindowState", [
+                _method("isSecureLocked()Z", [
+                    "    iget-object v0, p0, Lcom/android/server/wm/WindowState;->mAttrs:Landroid/view/WindowManager$LayoutParams;",
+                    "    iget v0, v0, Landroid/view/WindowManager$LayoutParams;->flags:I",
+                    "    and-int/lit16 v0, v0, 0x2000",
+                    "    return v0",
+                ], 6),
+            ]),
+        ],
+        "miui-services": [
+            (0, "com/android/server/pm/PackageManagerServiceImpl", [
+                _method("public verifyIsolationViolation(Lcom/android/server/pm/InstallRequest;)V",
+                        ["    invoke-static {p1}, Lcom/android/server/pm/PackageManagerServiceImpl;->check(Ljava/lang/Object;)V",
+                         "    return-void"]),
+                _method("public canBeUpdate(Ljava/lang/String;)V", _returns("V")),
+            ]),
+            (0, "com/android/server/am/BroadcastQueueModernStubImpl", [
+                _method("public isAllowed(Landroid/content/Intent;)Z",
+                        [f"    sget-boolean v2, {_INTL}", "    return v2"]),
+            ]),
+            (0, "com/android/server/am/ActivityManagerServiceImpl", [
+                _method("public checkRunning(Ljava/lang/String;)Z",
+                        [f"    sget-boolean v1, {_INTL}", f"    sget-boolean v4, {_INTL}", "    return v1"]),
+            ]),
+            (0, "com/android/server/am/ProcessManagerService", [
+                _method("public isAllowAutoStart(Ljava/lang/String;)Z", [f"    sget-boolean v0, {_INTL}", "    return v0"]),
+            ]),
+            (0, "com/android/server/am/ProcessSceneCleaner", [
+                _method("public clean(Ljava/lang/String;)Z", [f"    sget-boolean v4, {_INTL}", "    return v4"]),
+            ]),
+            (0, "com/android/server/wm/WindowManagerServiceImpl", [
+                _method("public notAllowCaptureDisplay(Lcom/android/server/wm/RootWindowContainer;I)Z",
+                        ["    const/4 v0, 0x1", "", "    return v0"], 9),
+            ]),
+        ],
+    }
+
+
+# ----------------------------------------------
+# Filler classes
+# ----------------------------------------------
+
+_TYPES = ("Ljava/lang/String;", "I", "Z", "J", "Landroid/content/Context;", "Landroid/os/Bundle;",
+          "Ljava/util/List;", "Landroid/content/Intent;")
+
+
+def _filler_method(rng: random.Random, cls: str, index: int, size: int):
+    params = "".join(rng.choice(_TYPES) for _ in range(rng.randint(0, 3)))
+    ret = rng.choice("VZI")
+    lines = [f".method public method{index}({params}){ret}", f"    .registers {rng.randint(4, 16)}", ""]
+    label = 0
+    for n in range(size):
+        kind = rng.randrange(8)
+        if kind == 0:
+            lines.append(f"    .line {100 + index * 40 + n}")
+        elif kind == 1:
+            lines.append(f"    iget-object v{n % 6}, p0, L{cls};->mField{n % 5}:Ljava/lang/Object;")
+        elif kind == 2:
+            lines.append(f"    invoke-virtual {{v{n % 6}, p1}}, Ljava/lang/Object;->equals(Ljava/lang/Object;)Z")
+            lines.append(f"    move-result v{n % 6}")
+        elif kind == 3:
+            lines.append(f"    if-eqz v{n % 6}, :cond_{label}")
+            lines.append(f'    const-string v{(n + 1) % 6}, "{cls.rsplit("/", 1)[-1]}#{index}.{n}"')
+            lines.append(f"    :cond_{label}")
+            label += 1
+        elif kind == 4:
+            lines.append(f"    sget-object v{n % 6}, L{cls};->sInstance:L{cls};")
+        elif kind == 5:
+            lines.append(f"    invoke-static {{v{n % 6}}}, Landroid/text/TextUtils;->isEmpty(Ljava/lang/CharSequence;)Z")
+            lines.append(f"    move-result v{n % 6}")
+        elif kind == 6:
+            lines.append(f"    const/4 v{n % 6}, 0x{n % 8:x}")
+        else:
+            lines.append("")
+    lines.extend(_returns(ret))
+    lines.extend([".end method", ""])
+    return lines
+
+
+def _invoke_custom_methods(cls: str):
+    """The equals/hashCode/toString trio javac emits for a record."""
+    bootstrap = ("Ljava/lang/runtime/ObjectMethods;->bootstrap(Ljava/lang/invoke/MethodHandles$Lookup;"
+                 "Ljava/lang/String;Ljava/lang/invoke/TypeDescriptor;Ljava/lang/Class;Ljava/lang/String;"
+                 "[Ljava/lang/invoke/MethodHandle;)Ljava/lang/Object;")
+    out = []
+    for name, sig, move, ret in (("equals", "(Ljava/lang/Object;)Z", "move-result", "return"),
+                                 ("hashCode", "()I", "move-result", "return"),
+                                 ("toString", "()Ljava/lang/String;", "move-result-object", "return-object")):
+        out.extend([
+            f".method public final {name}{sig}",
+            "    .registers 2",
+            f'    invoke-custom {{p0}}, call_site_0("{name}", ({sig[1:].split(")")[0]}L{cls};)'
+            f'{sig.split(")")[1]}, L{cls};, "a;b", {bootstrap})@{bootstrap.split("(")[0]}',
+            f"    {move} v0",
+            f"    {ret} v0",
+            ".end method",
+            "",
+        ])
+    return out
+
+
+def _class_text(cls: str, methods) -> str:
+    header = [f".class public L{cls};", ".super Ljava/lang/Object;", f'.source "{cls.rsplit("/", 1)[-1]}.java"', ""]
+    fields = [f".field private mField{n}:Ljava/lang/Object;" for n in range(5)]
+    fields.append(f".field private static sInstance:L{cls};")
+    return "\n".join(header + fields + [""] + methods) + "\n"
+
+
+def _filler_methods(rng: random.Random, cls: str):
+    lines = []
+    # Heavy tail: most classes are small, a few carry very large methods
+    for index in range(max(1, int(rng.expovariate(1 / 6)))):
+        size = 2400 if rng.random() < 0.002 else int(rng.expovariate(1 / 18)) + 3
+        lines.extend(_filler_method(rng, cls, index, size))
+    return lines
+
+
+def corpus(out: str, jar: str, scale: float = 1.0, seed: int = 1) -> int:
+    """Writes a synthetic decompiled tree for jar to out/tree plus out/<jar>.jar.
+
+    The JAR only needs a stable digest per corpus, since the benchmark seeds
+    the decompile cache rather than running apktool. An existing corpus with
+    the same parameters is reused. Returns the number of smali files. The
+    corpus appears under out only once complete.
+    """
+    stamp = {"version": CORPUS_VERSION, "jar": jar, "scale": scale, "seed": seed}
+    try:
+        with open(os.path.join(out, "corpus.json"), encoding="utf-8") as handle:
+            existing = json.load(handle)
+        if {key: existing.get(key) for key in stamp} == stamp:
+            return existing["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    classes, roots = SIZES[jar]
+    classes = max(1, int(classes * scale))
+    rng = random.Random(f"{jar}:{seed}")
+    staging = f"{out}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    tree = os.path.join(staging, "tree")
+    root_dirs = ["smali"] + [f"smali_classes{n}" for n in range(2, roots + 1)]
+
+    written = 0
+    for root, cls, methods in _anchors()[jar]:
+        root = min(root, roots - 1)
+        lines = _filler_methods(rng, cls) + [line for method in methods for line in method]
+        path = os.path.join(tree, root_dirs[root], f"{cls}.smali")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(_class_text(cls, lines))
+        written += 1
+
+    packages = _PACKAGES[jar]
+    for n in range(classes):
+        cls = f"{rng.choice(packages)}/gen{n // 500}/Gen{n}"
+        lines = _filler_methods(rng, cls)
+        if rng.random() < 0.01:
+            lines.extend(_invoke_custom_methods(cls))
+        path = os.path.join(tree, root_dirs[n % roots], f"{cls}.smali")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(_class_text(cls, lines))
+        written += 1
+
+    os.makedirs(os.path.join(tree, "unknown", "META-INF"), exist_ok=True)
+    with open(os.path.join(tree, "apktool.yml"), "w", encoding="utf-8") as handle:
+        handle.write(f"!!brut.androlib.meta.MetaInfo\napkFileName: {jar}.jar\nisFrameworkApk: false\n"
+                     "usesFramework:\n  ids:\n  - 1\nversion: 2.9.3\n")
+
+    info = zipfile.ZipInfo("META-INF/MANIFEST.MF", date_time=(1980, 1, 1, 0, 0, 0))
+    with zipfile.ZipFile(os.path.join(staging, f"{jar}.jar"), "w") as zout:
+        zout.writestr(info, f"Manifest-Version: 1.0\nBench-Corpus: {jar} v{CORPUS_VERSION} "
+                            f"scale={scale} seed={seed}\n")
+
+    with open(os.path.join(staging, "corpus.json"), "w", encoding="utf-8") as handle:
+        json.dump(dict(stamp, files=written), handle)
+
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(staging, out)
+    return written
+
+
+# ----------------------------------------------
+# Result history
+# ----------------------------------------------
+
+def _run_totals(stages):
+    """Sums the stages of one run by name (a helper may be called repeatedly)."""
+    totals = {}
+    for stage in stages:
+        if stage["status"] is None:
+            continue
+        entry = totals.setdefault(stage["stage"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_kb": 0})
+        entry["calls"] += 1
+        entry["wall_s"] += stage["wall_s"]
+        entry["cpu_s"] += stage["cpu_user_s"] + stage["cpu_sys_s"]
+        entry["peak_rss_kb"] = max(entry["peak_rss_kb"], stage["peak_rss_kb"])
+    return totals
+
+
+def summarize(runs):
+    """Median wall/CPU and max peak RSS per stage over runs (lists of stages)."""
+    per_run = [_run_totals(stages) for stages in runs]
+    names = []
+    for totals in per_run:
+        names.extend(name for name in totals if name not in names)
+    summary = {}
+    for name in names:
+        samples = [totals[name] for totals in per_run if name in totals]
+        summary[name] = {
+            "runs": len(samples),
+            "calls": samples[0]["calls"],
+            "wall_s": round(statistics.median(s["wall_s"] for s in samples), 3),
+            "cpu_s": round(statistics.median(s["cpu_s"] for s in samples), 2),
+            "peak_rss_kb": max(s["peak_rss_kb"] for s in samples),
+        }
+    return summary
+
+
+def _config_key(config) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_history(path: str):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def record(history: str, runs, config, commit: str, label: str = ""):
+    """Appends a result entry to history; returns (entry, previous entry or None)."""
+    entry = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "label": label,
+        "config": config,
+        "config_key": _config_key(config),
+        "stages": summarize(runs),
+    }
+    previous = None
+    for old in load_history(history):
+        if old.get("config_key") == entry["config_key"]:
+            previous = old
+    os.makedirs(os.path.dirname(os.path.abspath(history)), exist_ok=True)
+    with open(history, "a", encoding="utf-8") as handle:
+        handle.write(json.dumps(entry, sort_keys=True) + "\n")
+    return entry, previous
+
+
+def regressions(entry, previous, threshold: float):
+    """Stage names whose median wall time grew by more than threshold percent.
+
+    Stages under 50 ms are ignored; their timings are mostly noise.
+    """
+    if previous is None:
+        return []
+    slower = []
+    for name, now in entry["stages"].items():
+        before = previous["stages"].get(name)
+        if not before or max(before["wall_s"], now["wall_s"]) < 0.05:
+            continue
+        if now["wall_s"] > before["wall_s"] * (1 + threshold / 100):
+            slower.append(name)
+    return slower
+
+
+def markdown(entry, previous, threshold: float) -> str:
+    """Renders entry as a table, with the change against previous when known."""
+    slower = set(regressions(entry, previous, threshold))
+    against = f" vs {previous['commit']}" if previous else ""
+    lines = [
+        f"Benchmark {entry['commit']}{' (' + entry['label'] + ')' if entry['label'] else ''}: "
+        + ", ".join(f"{key}={value}" for key, value in sorted(entry["config"].items())),
+        "",
+        f"| Stage | Calls | Wall (s) | Change{against} | CPU (s) | Peak RSS (MiB) |",
+        "|---|---:|---:|---:|---:|---:|",
+    ]
+    for name, now in entry["stages"].items():
+        depth = name.count("/")
+        label = "&nbsp;&nbsp;" * depth + name.rsplit("/", 1)[-1]
+        change = ""
+        before = previous["stages"].get(name) if previous else None
+        if before and before["wall_s"] > 0:
+            change = f"{(now['wall_s'] - before['wall_s']) / before['wall_s'] * 100:+.0f}%"
+            if name in slower:
+                change += " **slower**"
+        rss = f"{now['peak_rss_kb'] / 1024:.0f}" if now["peak_rss_kb"] else "-"
+        lines.append(f"| {label} | {now['calls']} | {now['wall_s']:.2f} | {change} | {now['cpu_s']:.2f} | {rss} |")
+    return "\n".join(lines) + "\n"
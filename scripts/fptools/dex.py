@@ -0,0 +1,384 @@
+"""Minimal DEX reader for in-place code edits.
+
+Covers what the DEX patch mode needs: the id tables, class data, code items
+and enough of the Dalvik instruction set to walk code and render the
+instructions the patches anchor on in baksmali syntax. Edits never change the
+size of a code item, so every offset in the file stays valid; ``finish``
+recomputes the signature and checksum afterwards.
+"""
+
+import hashlib
+import struct
+import zipfile
+import zlib
+
+# Code units per opcode (payload pseudo-instructions are handled separately)
+_WIDTHS = [1] * 256
+for _op, _width in (
+    (0x02, 2), (0x03, 3), (0x05, 2), (0x06, 3), (0x08, 2), (0x09, 3),
+    (0x13, 2), (0x14, 3), (0x15, 2), (0x16, 2), (0x17, 3), (0x18, 5), (0x19, 2),
+    (0x1A, 2), (0x1B, 3), (0x1C, 2), (0x1F, 2), (0x20, 2), (0x22, 2), (0x23, 2),
+    (0x24, 3), (0x25, 3), (0x26, 3), (0x29, 2), (0x2A, 3), (0x2B, 3), (0x2C, 3),
+    (0xFA, 4), (0xFB, 4), (0xFC, 3), (0xFD, 3), (0xFE, 2), (0xFF, 2),
+):
+    _WIDTHS[_op] = _width
+for _first, _last, _width in (
+    (0x2D, 0x3D, 2),  # cmp*, if-*, if-*z
+    (0x44, 0x6D, 2),  # aget/aput, iget/iput, sget/sput
+    (0x6E, 0x72, 3),  # invoke-*
+    (0x74, 0x78, 3),  # invoke-*/range
+    (0x90, 0xAF, 2),  # binop
+    (0xD0, 0xE2, 2),  # binop/lit16, binop/lit8
+):
+    for _op in range(_first, _last + 1):
+        _WIDTHS[_op] = _width
+
+_INVOKE = {0x6E: "invoke-virtual", 0x6F: "invoke-super", 0x70: "invoke-direct",
+           0x71: "invoke-static", 0x72: "invoke-interface"}
+_INVOKE_RANGE = {op + 6: f"{name}/range" for op, name in _INVOKE.items()}
+_SFIELD = dict(zip(range(0x60, 0x6E), (
+    "sget", "sget-wide", "sget-object", "sget-boolean", "sget-byte", "sget-char", "sget-short",
+    "sput", "sput-wide", "sput-object", "sput-boolean", "sput-byte", "sput-char", "sput-short",
+)))
+_IFIELD = dict(zip(range(0x52, 0x60), (
+    "iget", "iget-wide", "iget-object", "iget-boolean", "iget-byte", "iget-char", "iget-short",
+    "iput", "iput-wide", "iput-object", "iput-boolean", "iput-byte", "iput-char", "iput-short",
+)))
+_IF = dict(zip(range(0x32, 0x38), ("if-eq", "if-ne", "if-lt", "if-ge", "if-gt", "if-le")))
+_IFZ = dict(zip(range(0x38, 0x3E), ("if-eqz", "if-nez", "if-ltz", "if-gez", "if-gtz", "if-lez")))
+_MOVE_RESULT = {0x0A: "move-result", 0x0B: "move-result-wide", 0x0C: "move-result-object"}
+
+OP_NOP = 0x00
+OP_RETURN_VOID = 0x0E
+OP_RETURN = 0x0F
+OP_CONST4 = 0x12
+OP_CONST16 = 0x13
+OP_CONST = 0x14
+OP_CONST_STRING = 0x1A
+OP_CONST_STRING_JUMBO = 0x1B
+OP_GOTO = 0x28
+OP_INVOKE_CUSTOM = 0xFC
+OP_INVOKE_CUSTOM_RANGE = 0xFD
+
+# Method access flags in the order baksmali prints them
+_METHOD_FLAGS = (
+    (0x1, "public"), (0x2, "private"), (0x4, "protected"), (0x8, "static"), (0x10, "final"),
+    (0x20, "synchronized"), (0x40, "bridge"), (0x80, "varargs"), (0x100, "native"),
+    (0x400, "abstract"), (0x800, "strictfp"), (0x1000, "synthetic"), (0x10000, "constructor"),
+    (0x20000, "declared-synchronized"),
+)
+
+
+def read_uleb128(data, off: int):
+    result = shift = 0
+    while True:
+        byte = data[off]
+        off += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, off
+        shift += 7
+
+
+def read_sleb128(data, off: int):
+    value, end = read_uleb128(data, off)
+    return _signed(value, 7 * (end - off)), end
+
+
+def _signed(value: int, bits: int) -> int:
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+def _mutf8(raw: bytes) -> str:
+    text = raw.replace(b"\xc0\x80", b"\x00").decode("utf-8", "surrogatepass")
+    return text.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+
+
+# baksmali's escapes for string literals; other units outside printable ASCII
+# become \uXXXX
+_STRING_ESCAPES = {0x09: "\\t", 0x0A: "\\n", 0x0D: "\\r", 0x22: '\\"', 0x27: "\\'", 0x5C: "\\\\"}
+
+
+def smali_string(text: str) -> str:
+    """Escapes text as baksmali writes a string literal, without the quotes."""
+    raw = text.encode("utf-16-le", "surrogatepass")
+    out = []
+    for (unit,) in struct.iter_unpack("<H", raw):
+        if unit in _STRING_ESCAPES:
+            out.append(_STRING_ESCAPES[unit])
+        elif 0x20 <= unit < 0x7F:
+            out.append(chr(unit))
+        else:
+            out.append(f"\\u{unit:04x}")
+    return "".join(out)
+
+
+def const4(reg: int, value: int) -> int:
+    """Encodes ``const/4 vA, #value`` (value in -8..7)."""
+    return OP_CONST4 | (reg << 8) | ((value & 0xF) << 12)
+
+
+class CodeItem:
+    """A method's code item; ``units`` is a live view of its instructions."""
+
+    def __init__(self, dex: "DexFile", off: int):
+        self.dex = dex
+        self.off = off
+        (self.registers, self.ins, self.outs, self.tries,
+         _debug, self.insns_size) = struct.unpack_from("<4HII", dex.data, off)
+        self.units = memoryview(dex.data)[off + 16:off + 16 + 2 * self.insns_size].cast("H")
+
+    def reg(self, num: int) -> str:
+        """Names a register like baksmali does (parameters become pN)."""
+        first_param = self.registers - self.ins
+        return f"p{num - first_param}" if num >= first_param else f"v{num}"
+
+    def instructions(self):
+        """Yields (pc, opcode) for each real instruction, skipping payloads."""
+        units = self.units
+        pc = 0
+        while pc < len(units):
+            unit = units[pc]
+            op = unit & 0xFF
+            if op == OP_NOP and unit in (0x0100, 0x0200, 0x0300):
+                if unit == 0x0100:
+                    pc += units[pc + 1] * 2 + 4
+                elif unit == 0x0200:
+                    pc += units[pc + 1] * 4 + 2
+                else:
+                    width, count = units[pc + 1], units[pc + 2] | (units[pc + 3] << 16)
+                    pc += (width * count + 1) // 2 + 4
+                continue
+            yield pc, op
+            pc += _WIDTHS[op]
+
+    def render(self, pc: int, op: int) -> str:
+        """Renders an instruction in smali syntax ("" for unsupported ones)."""
+        units = self.units
+        unit = units[pc]
+        if op in _INVOKE:
+            count = unit >> 12
+            args = units[pc + 2]
+            regs = [args & 0xF, (args >> 4) & 0xF, (args >> 8) & 0xF, args >> 12, (unit >> 8) & 0xF]
+            names = ", ".join(self.reg(r) for r in regs[:count])
+            return f"{_INVOKE[op]} {{{names}}}, {self.dex.method_ref(units[pc + 1])}"
+        if op in _INVOKE_RANGE:
+            count, first = unit >> 8, units[pc + 2]
+            names = f"{self.reg(first)} .. {self.reg(first + count - 1)}" if count else ""
+            return f"{_INVOKE_RANGE[op]} {{{names}}}, {self.dex.method_ref(units[pc + 1])}"
+        if op in _SFIELD:
+            return f"{_SFIELD[op]} {self.reg(unit >> 8)}, {self.dex.field_ref(units[pc + 1])}"
+        if op in _IFIELD:
+            regs = f"{self.reg((unit >> 8) & 0xF)}, {self.reg(unit >> 12)}"
+            return f"{_IFIELD[op]} {regs}, {self.dex.field_ref(units[pc + 1])}"
+        if op in _IF:
+            regs = f"{self.reg((unit >> 8) & 0xF)}, {self.reg(unit >> 12)}"
+            return f"{_IF[op]} {regs}, :addr_{pc + self.branch_offset(pc):x}"
+        if op in _IFZ:
+            return f"{_IFZ[op]} {self.reg(unit >> 8)}, :addr_{pc + self.branch_offset(pc):x}"
+        if op in (OP_CONST_STRING, OP_CONST_STRING_JUMBO):
+            if op == OP_CONST_STRING:
+                name, idx = "const-string", units[pc + 1]
+            else:
+                name, idx = "const-string/jumbo", units[pc + 1] | (units[pc + 2] << 16)
+            return f'{name} {self.reg(unit >> 8)}, "{smali_string(self.dex.string(idx))}"'
+        if op in _MOVE_RESULT:
+            return f"{_MOVE_RESULT[op]} {self.reg(unit >> 8)}"
+        if op in (OP_CONST4, OP_CONST16, OP_CONST):
+            name, reg, value = self.const_value(pc, op)
+            sign = "-" if value < 0 else ""
+            return f"{name} {self.reg(reg)}, {sign}0x{abs(value):x}"
+        return ""
+
+    def const_value(self, pc: int, op: int):
+        """Returns (mnemonic, register, value) of a const/4, const/16 or const."""
+        units = self.units
+        unit = units[pc]
+        if op == OP_CONST4:
+            return "const/4", (unit >> 8) & 0xF, _signed(unit >> 12, 4)
+        if op == OP_CONST16:
+            return "const/16", unit >> 8, _signed(units[pc + 1], 16)
+        return "const", unit >> 8, _signed(units[pc + 1] | (units[pc + 2] << 16), 32)
+
+    def branch_offset(self, pc: int) -> int:
+        return _signed(self.units[pc + 1], 16)
+
+    def branch_targets(self):
+        """Returns every pc reachable by a jump: branches, switch cases and catch handlers."""
+        units = self.units
+        targets = set()
+        for pc, op in self.instructions():
+            unit = units[pc]
+            if op == OP_GOTO:
+                targets.add(pc + _signed(unit >> 8, 8))
+            elif op == 0x29 or 0x32 <= op <= 0x3D:
+                targets.add(pc + self.branch_offset(pc))
+            elif op == 0x2A:
+                targets.add(pc + _signed(units[pc + 1] | (units[pc + 2] << 16), 32))
+            elif op in (0x2B, 0x2C):
+                payload = pc + _signed(units[pc + 1] | (units[pc + 2] << 16), 32)
+                size = units[payload + 1]
+                first = payload + (4 if op == 0x2B else 2 + 2 * size)
+                for i in range(size):
+                    targets.add(pc + _signed(units[first + 2 * i] | (units[first + 2 * i + 1] << 16), 32))
+        if self.tries:
+            data = self.dex.data
+            off = self.off + 16 + 2 * self.insns_size + (2 if self.insns_size % 2 else 0)
+            off += 8 * self.tries
+            count, off = read_uleb128(data, off)
+            for _ in range(count):
+                size, off = read_sleb128(data, off)
+                for _ in range(abs(size)):
+                    _, off = read_uleb128(data, off)
+                    addr, off = read_uleb128(data, off)
+                    targets.add(addr)
+                if size <= 0:
+                    addr, off = read_uleb128(data, off)
+                    targets.add(addr)
+        return targets
+
+    def write(self, pc: int, new_units) -> None:
+        for i, unit in enumerate(new_units):
+            self.units[pc + i] = unit
+        self.dex.dirty = True
+
+
+class DexFile:
+    """Parsed view over one classes*.dex image held in a bytearray."""
+
+    def __init__(self, data: bytes, name: str = "classes.dex"):
+        if data[:4] != b"dex\n":
+            raise ValueError(f"{name}: not a dex file")
+        self.name = name
+        self.data = bytearray(data)
+        self.dirty = False
+        (self.string_ids_size, self.string_ids_off, self.type_ids_size, self.type_ids_off,
+         self.proto_ids_size, self.proto_ids_off, self.field_ids_size, self.field_ids_off,
+         self.method_ids_size, self.method_ids_off, self.class_defs_size,
+         self.class_defs_off) = struct.unpack_from("<12I", self.data, 0x38)
+        self._strings = {}
+        self._class_defs = None
+
+    # -- id tables -------------------------------------------------------
+
+    def string(self, idx: int) -> str:
+        cached = self._strings.get(idx)
+        if cached is None:
+            off = struct.unpack_from("<I", self.data, self.string_ids_off + 4 * idx)[0]
+            _, start = read_uleb128(self.data, off)
+            end = self.data.index(0, start)
+            cached = self._strings[idx] = _mutf8(bytes(self.data[start:end]))
+        return cached
+
+    def type_name(self, idx: int) -> str:
+        return self.string(struct.unpack_from("<I", self.data, self.type_ids_off + 4 * idx)[0])
+
+    def proto(self, idx: int):
+        """Returns (parameter descriptors, return descriptor)."""
+        _, return_idx, params_off = struct.unpack_from("<3I", self.data, self.proto_ids_off + 12 * idx)
+        params = []
+        if params_off:
+            size = struct.unpack_from("<I", self.data, params_off)[0]
+            params = [self.type_name(t) for t in struct.unpack_from(f"<{size}H", self.data, params_off + 4)]
+        return params, self.type_name(return_idx)
+
+    def method_id(self, idx: int):
+        """Returns (class descriptor, name, params, return type)."""
+        class_idx, proto_idx, name_idx = struct.unpack_from("<HHI", self.data, self.method_ids_off + 8 * idx)
+        params, ret = self.proto(proto_idx)
+        return self.type_name(class_idx), self.string(name_idx), params, ret
+
+    def method_name(self, idx: int) -> str:
+        return self.string(struct.unpack_from("<I", self.data, self.method_ids_off + 8 * idx + 4)[0])
+
+    def method_ref(self, idx: int) -> str:
+        cls, name, params, ret = self.method_id(idx)
+        return f"{cls}->{name}({''.join(params)}){ret}"
+
+    def field_ref(self, idx: int) -> str:
+        class_idx, type_idx, name_idx = struct.unpack_from("<HHI", self.data, self.field_ids_off + 8 * idx)
+        return f"{self.type_name(class_idx)}->{self.string(name_idx)}:{self.type_name(type_idx)}"
+
+    # -- classes ---------------------------------------------------------
+
+    def class_defs(self):
+        """Maps class descriptor -> class_data_off for classes defined here."""
+        if self._class_defs is None:
+            self._class_defs = {}
+            for i in range(self.class_defs_size):
+                base = self.class_defs_off + 32 * i
+                class_idx = struct.unpack_from("<I", self.data, base)[0]
+                data_off = struct.unpack_from("<I", self.data, base + 24)[0]
+                self._class_defs[self.type_name(class_idx)] = data_off
+        return self._class_defs
+
+    def methods(self, descriptor: str):
+        """Yields (method_idx, code_off) for every method of a class with code."""
+        for method_idx, _flags, code_off in self.method_entries(descriptor):
+            if code_off:
+                yield method_idx, code_off
+
+    def method_entries(self, descriptor: str):
+        """Yields (method_idx, access_flags, code_off) for every method of a class."""
+        data_off = self.class_defs().get(descriptor, 0)
+        if not data_off:
+            return
+        off = data_off
+        counts = []
+        for _ in range(4):
+            value, off = read_uleb128(self.data, off)
+            counts.append(value)
+        for _ in range(2 * (counts[0] + counts[1])):
+            _, off = read_uleb128(self.data, off)
+        for count in counts[2:]:
+            method_idx = 0
+            for _ in range(count):
+                diff, off = read_uleb128(self.data, off)
+                flags, off = read_uleb128(self.data, off)
+                code_off, off = read_uleb128(self.data, off)
+                method_idx += diff
+                yield method_idx, flags, code_off
+
+    def declaration(self, method_idx: int, flags: int) -> str:
+        """Renders a method's ``.method`` line as baksmali writes it."""
+        _, name, params, ret = self.method_id(method_idx)
+        words = [word for bit, word in _METHOD_FLAGS if flags & bit]
+        return " ".join([".method"] + words + [f"{name}({''.join(params)}){ret}"])
+
+    def has_call_sites(self) -> bool:
+        """True when the map lists call_site_id items (invoke-custom targets)."""
+        map_off = struct.unpack_from("<I", self.data, 0x34)[0]
+        size = struct.unpack_from("<I", self.data, map_off)[0]
+        for i in range(size):
+            item_type, _, count, _ = struct.unpack_from("<HHII", self.data, map_off + 4 + 12 * i)
+            if item_type == 0x0007 and count:
+                return True
+        return False
+
+    def code(self, code_off: int) -> CodeItem:
+        return CodeItem(self, code_off)
+
+    # -- output ----------------------------------------------------------
+
+    def finish(self) -> bytes:
+        """Recomputes signature and checksum and returns the dex bytes."""
+        self.data[12:32] = hashlib.sha1(self.data[32:]).digest()
+        struct.pack_into("<I", self.data, 8, zlib.adler32(self.data[12:]))
+        return bytes(self.data)
+
+
+def _dex_order(name: str) -> int:
+    stem = name[len("classes"):-len(".dex")]
+    return int(stem) if stem else 1
+
+
+def dex_names(names):
+    """Picks the classes*.dex entries of a JAR listing, in load order."""
+    return sorted((n for n in names if n.startswith("classes") and n.endswith(".dex") and "/" not in n),
+                  key=_dex_order)
+
+
+def load_jar(path: str):
+    """Returns a DexFile for each classes*.dex in the JAR at path."""
+    with zipfile.ZipFile(path) as archive:
+        return [DexFile(archive.read(name), name) for name in dex_names(archive.namelist())]
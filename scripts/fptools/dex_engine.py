@@ -0,0 +1,409 @@
+"""DEX-level patching: apply a plan straight to the classes*.dex of a JAR.
+
+Plan lines are tab separated like smali plans, with a class spec instead of a
+file: ``op<TAB>classes<TAB>args...``. ``classes`` is a comma separated list of
+alternatives (class descriptors or ``*`` for every class); the first
+alternative that matches anything is used, mirroring the "pinned file, then
+search the tree" lookups of the smali helpers.
+
+Every op rewrites instructions in place without growing a code item. Edits
+that would need more room raise ``Unsupported`` so the caller can fall back to
+the apktool pipeline instead of producing a partial patch.
+"""
+
+import re
+
+from fptools.dex import (OP_CONST, OP_CONST4, OP_CONST16, OP_GOTO, OP_INVOKE_CUSTOM,
+                         OP_INVOKE_CUSTOM_RANGE, OP_NOP, OP_RETURN, OP_RETURN_VOID, const4, load_jar)
+from fptools.jar import replace_entries
+from fptools.smali_engine import log, warn
+
+_INT_RETURNS = set("ZBSCI")
+_CONST_LINE = re.compile(r"const(?:/4|/16)? ([vp]\d+), (-?0x[0-9a-fA-F]+)$")
+_OP_RETURN_OBJECT = 0x11
+
+# if-*z opcode -> branch taken for a given register value
+_IFZ_TAKEN = {
+    0x38: lambda v: v == 0, 0x39: lambda v: v != 0, 0x3A: lambda v: v < 0,
+    0x3B: lambda v: v >= 0, 0x3C: lambda v: v > 0, 0x3D: lambda v: v <= 0,
+}
+
+
+class Unsupported(Exception):
+    """An edit that cannot be expressed without resizing code."""
+
+
+def _parse_value(text: str) -> int:
+    value = int(text, 16)
+    if value < 0:
+        return value
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+def _parse_reg(code, name: str) -> int:
+    num = int(name[1:])
+    return code.registers - code.ins + num if name[0] == "p" else num
+
+
+def _targets(dexes, spec: str):
+    """Yields (alternative, [(dex, descriptor), ...]) in spec order."""
+    for alternative in spec.split(","):
+        if alternative == "*":
+            found = [(dex, cls) for dex in dexes for cls in dex.class_defs()]
+        else:
+            found = [(dex, alternative) for dex in dexes if alternative in dex.class_defs()]
+        yield alternative, found
+
+
+def _methods(dex, cls, pattern: str):
+    """Yields (method_idx, code) for methods of cls matching pattern.
+
+    A pattern with "(" must prefix ``name(params)ret``; otherwise it is
+    matched as a substring of the method name, like ``.method.*<pattern>``.
+    """
+    exact = "(" in pattern
+    for method_idx, code_off in dex.methods(cls):
+        name = dex.method_name(method_idx)
+        if exact:
+            if not pattern.startswith(name + "("):
+                continue
+            _, _, params, ret = dex.method_id(method_idx)
+            if f"{name}({''.join(params)}){ret}" != pattern.strip():
+                continue
+        elif pattern not in name:
+            continue
+        yield method_idx, dex.code(code_off)
+
+
+def _parse_const(code, text: str, label: str):
+    """Parses a ``const/4 vN, 0xV`` line into (register number, value)."""
+    match = _CONST_LINE.match(text.strip())
+    if not match:
+        raise Unsupported(f"{label}: cannot encode '{text}'")
+    return _parse_reg(code, match.group(1)), _parse_value(match.group(2))
+
+
+def _const4(reg: int, value: int, label: str) -> int:
+    if reg > 15 or not -8 <= value <= 7:
+        raise Unsupported(f"{label}: const/4 v{reg}, 0x{value:x} cannot encode")
+    return const4(reg, value)
+
+
+def _stub(code, body, label: str) -> None:
+    if len(body) > code.insns_size:
+        raise Unsupported(f"{label}: {code.insns_size} code units, stub needs {len(body)}")
+    code.write(0, body + [OP_NOP] * (code.insns_size - len(body)))
+
+
+def _const_body(code, value: int, label: str):
+    if code.registers < 1:
+        raise Unsupported(f"{label}: no register for the constant")
+    if -8 <= value <= 7:
+        return [const4(0, value)]
+    if -32768 <= value <= 32767:
+        return [OP_CONST16, value & 0xFFFF]
+    raise Unsupported(f"{label}: constant 0x{value:x} does not fit in place")
+
+
+def _apply_by_class(dexes, spec, edit) -> int:
+    """Runs edit(dex, cls) over the first alternative with hits; returns the hit count."""
+    for _, found in _targets(dexes, spec):
+        hits = sum(edit(dex, cls) for dex, cls in found)
+        if hits:
+            return hits
+    return 0
+
+
+# ----------------------------------------------
+# Operations
+# ----------------------------------------------
+
+def return_const(dexes, spec: str, pattern: str, value: str, scope: str = "all") -> int:
+    """Replaces non-void methods matching pattern with ``return <value>``."""
+    const = _parse_value(value)
+
+    def edit(dex, cls):
+        hits = 0
+        for method_idx, code in _methods(dex, cls, pattern):
+            _, name, _, ret = dex.method_id(method_idx)
+            if ret == "V":
+                continue
+            label = f"{cls}->{name}"
+            if ret not in _INT_RETURNS:
+                raise Unsupported(f"{label}: returns {ret}, not an int-like value")
+            _stub(code, _const_body(code, const, label) + [OP_RETURN], label)
+            hits += 1
+            if scope == "first":
+                break
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def return_void(dexes, spec: str, pattern: str, scope: str = "all") -> int:
+    """Replaces methods matching pattern with ``return-void``."""
+
+    def edit(dex, cls):
+        hits = 0
+        for method_idx, code in _methods(dex, cls, pattern):
+            _, name, _, ret = dex.method_id(method_idx)
+            if ret != "V":
+                raise Unsupported(f"{cls}->{name}: returns {ret}, cannot return-void")
+            _stub(code, [OP_RETURN_VOID], f"{cls}->{name}")
+            hits += 1
+            if scope == "first":
+                break
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def sget_to_const(dexes, spec: str, sget: str, register: str, value: str) -> int:
+    """Replaces an exact ``sget*`` instruction with ``const/4 <register>, <value>``."""
+    const = _parse_value(value)
+
+    def edit(dex, cls):
+        hits = 0
+        for _, code in _methods(dex, cls, ""):
+            for pc, op in list(code.instructions()):
+                if 0x60 <= op <= 0x66 and code.render(pc, op) == sget:
+                    code.write(pc, [_const4(_parse_reg(code, register), const, cls), OP_NOP])
+                    hits += 1
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def const_before_if(dexes, spec: str, anchor: str, condition_prefix: str, register: str,
+                    value: str, window: str = "5") -> int:
+    """Forces the register of the nearest ``if-*z`` before an anchor to value.
+
+    ``anchor`` is matched against the rendered instructions (an invoke, or a
+    ``const-string`` when searching near a string); ``window`` counts
+    instructions, not smali lines.
+
+    Same effect as inserting ``const/4`` ahead of the branch: the branch
+    becomes ``const/4`` + ``nop`` when never taken, or ``const/4`` + ``goto``
+    when always taken.
+    """
+    const = _parse_value(value)
+
+    def edit(dex, cls):
+        hits = 0
+        for _, code in _methods(dex, cls, ""):
+            insns = list(code.instructions())
+            for idx, (pc, op) in enumerate(insns):
+                if anchor not in code.render(pc, op):
+                    continue
+                for back_pc, back_op in reversed(insns[max(0, idx - int(window)):idx]):
+                    if back_op not in _IFZ_TAKEN or not code.render(back_pc, back_op).startswith(condition_prefix):
+                        continue
+                    head = _const4(_parse_reg(code, register), const, cls)
+                    if _IFZ_TAKEN[back_op](const):
+                        offset = code.branch_offset(back_pc) - 1
+                        if not -128 <= offset <= 127 or offset == 0:
+                            raise Unsupported(f"{cls}: branch at 0x{back_pc:x} too far for goto")
+                        tail = OP_GOTO | ((offset & 0xFF) << 8)
+                    else:
+                        tail = OP_NOP
+                    code.write(back_pc, [head, tail])
+                    hits += 1
+                    break
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def const_before(dexes, spec: str, anchor: str, const_line: str) -> int:
+    """Makes a register hold a constant when an instruction runs.
+
+    The smali patch inserts ``const_line`` right before the anchor. In place
+    that only works when the anchor is reached by falling through a ``const``
+    of the same register, which then gets the new value.
+    """
+
+    def edit(dex, cls):
+        hits = 0
+        for method_idx, code in _methods(dex, cls, ""):
+            label = f"{cls}->{dex.method_name(method_idx)}"
+            insns = list(code.instructions())
+            targets = None
+            for idx, (pc, op) in enumerate(insns):
+                if anchor not in code.render(pc, op):
+                    continue
+                reg, value = _parse_const(code, const_line, label)
+                prev_pc, prev_op = insns[idx - 1] if idx else (None, None)
+                if targets is None:
+                    targets = code.branch_targets()
+                if prev_op not in (OP_CONST4, OP_CONST16, OP_CONST) or pc in targets:
+                    raise Unsupported(f"{label}: no const to reuse before '{anchor}'")
+                _, prev_reg, _ = code.const_value(prev_pc, prev_op)
+                if prev_reg != reg:
+                    raise Unsupported(f"{label}: const before '{anchor}' sets v{prev_reg}, not v{reg}")
+                if prev_op == OP_CONST4:
+                    code.write(prev_pc, [_const4(reg, value, label)])
+                elif prev_op == OP_CONST16:
+                    if not -32768 <= value <= 32767:
+                        raise Unsupported(f"{label}: const/16 cannot hold 0x{value:x}")
+                    code.write(prev_pc + 1, [value & 0xFFFF])
+                else:
+                    code.write(prev_pc + 1, [value & 0xFFFF, (value >> 16) & 0xFFFF])
+                hits += 1
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def move_result_to_const(dexes, spec: str, invoke: str, const_line: str) -> int:
+    """Replaces the ``move-result`` of an invoke with a ``const/4``."""
+
+    def edit(dex, cls):
+        hits = 0
+        for method_idx, code in _methods(dex, cls, ""):
+            insns = list(code.instructions())
+            for idx, (pc, op) in enumerate(insns[:-1]):
+                if invoke not in code.render(pc, op):
+                    continue
+                next_pc, next_op = insns[idx + 1]
+                if code.render(next_pc, next_op).startswith("move-result"):
+                    label = f"{cls}->{dex.method_name(method_idx)}"
+                    code.write(next_pc, [_const4(*_parse_const(code, const_line, label), label)])
+                    hits += 1
+        return hits
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def drop_if_after(dexes, spec: str, anchor: str, condition_prefix: str, window: str = "6") -> int:
+    """Turns the first matching ``if-*`` after an anchor into ``nop`` so it falls through."""
+
+    def edit(dex, cls):
+        for _, code in _methods(dex, cls, ""):
+            insns = list(code.instructions())
+            for idx, (pc, op) in enumerate(insns):
+                if anchor not in code.render(pc, op):
+                    continue
+                for next_pc, next_op in insns[idx + 1:idx + 1 + int(window)]:
+                    if 0x32 <= next_op <= 0x3D and code.render(next_pc, next_op).startswith(condition_prefix):
+                        code.write(next_pc, [OP_NOP, OP_NOP])
+                        return 1
+                return 0
+        return 0
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def clinit_const_flip(dexes, spec: str) -> int:
+    """Turns the first ``const/4 v0, 0x0`` of <clinit> into ``0x1``."""
+
+    def edit(dex, cls):
+        for _, code in _methods(dex, cls, "<clinit>()V"):
+            for pc, op in code.instructions():
+                if code.render(pc, op) == "const/4 v0, 0x0":
+                    code.write(pc, [const4(0, 1)])
+                    return 1
+        return 0
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+def strip_invoke_custom(dexes, spec: str = "*") -> int:
+    """Stubs equals/hashCode/toString bodies that go through invoke-custom."""
+    stubs = {
+        "equals": [const4(0, 0), OP_RETURN],
+        "hashCode": [const4(0, 0), OP_RETURN],
+        "toString": [const4(0, 0), _OP_RETURN_OBJECT],
+    }
+    dexes = [dex for dex in dexes if dex.has_call_sites()]
+
+    def edit(dex, cls):
+        touched = 0
+        for method_idx, code_off in dex.methods(cls):
+            body = stubs.get(dex.method_name(method_idx))
+            if body is None:
+                continue
+            code = dex.code(code_off)
+            if any(op in (OP_INVOKE_CUSTOM, OP_INVOKE_CUSTOM_RANGE) for _, op in code.instructions()):
+                _stub(code, body, f"{cls}->{dex.method_name(method_idx)}")
+                touched = 1
+        return touched
+
+    return _apply_by_class(dexes, spec, edit)
+
+
+# op name -> (function, success message, no-match message)
+OPS = {
+    "return_const": (
+        return_const,
+        lambda n, c, a: f"Set return constant 0x{a[1]} for {n} methods containing '{a[0]}' in {c}",
+        lambda c, a: f"No methods containing '{a[0]}' found in {c}",
+    ),
+    "return_void": (
+        return_void,
+        lambda n, c, a: f"Patched {n} {a[0]} methods in {c} to return-void",
+        lambda c, a: f"No occurrences of {a[0]} found in {c}",
+    ),
+    "sget_to_const": (
+        sget_to_const,
+        lambda n, c, a: f"Replaced {n} x '{a[0]}' with const/4 {a[1]}, 0x{a[2]} in {c}",
+        lambda c, a: f"'{a[0]}' not found in {c}",
+    ),
+    "const_before_if": (
+        const_before_if,
+        lambda n, c, a: f"Forced {a[2]} to 0x{a[3]} before condition '{a[1]}' in {c}",
+        lambda c, a: f"Invoke pattern '{a[0]}' not found in {c}",
+    ),
+    "const_before": (
+        const_before,
+        lambda n, c, a: f"Set '{a[1]}' before {n} x '{a[0].rsplit('/', 1)[-1]}' in {c}",
+        lambda c, a: f"Pattern '{a[0]}' not found in {c}",
+    ),
+    "move_result_to_const": (
+        move_result_to_const,
+        lambda n, c, a: f"Replaced move-result after invoke '{a[0].rsplit('/', 1)[-1]}' in {c}",
+        lambda c, a: f"Invoke pattern '{a[0]}' not found in {c}",
+    ),
+    "drop_if_after": (
+        drop_if_after,
+        lambda n, c, a: f"Removed {a[1].split()[0]} guard after '{a[0].rsplit('/', 1)[-1]}' in {c}",
+        lambda c, a: f"'{a[1]}' after '{a[0]}' not found in {c}",
+    ),
+    "clinit_const_flip": (
+        clinit_const_flip,
+        lambda n, c, a: f"Updated <clinit> constant in {c}",
+        lambda c, a: f"<clinit> constant not found in {c}",
+    ),
+    "strip_invoke_custom": (
+        strip_invoke_custom,
+        lambda n, c, a: f"Modified {n} classes with invoke-custom",
+        lambda c, a: "No invoke-custom found",
+    ),
+}
+
+
+def apply_plan(dexes, ops) -> int:
+    """Runs plan ops against loaded dex files; returns the number of edits."""
+    total = 0
+    for op, spec, args in ops:
+        func, ok_msg, miss_msg = OPS[op]
+        hits = func(dexes, spec, *args)
+        if hits:
+            log(ok_msg(hits, spec, args))
+            total += hits
+        else:
+            warn(miss_msg(spec, args))
+    return total
+
+
+def patch_jar(jar: str, out: str, ops) -> int:
+    """Applies ops to the dex files of jar and writes the result to out.
+
+    Every other entry is copied unchanged; the output only exists once the
+    whole plan applied cleanly.
+    """
+    dexes = load_jar(jar)
+    if not dexes:
+        raise Unsupported(f"{jar}: no classes*.dex entries")
+    total = apply_plan(dexes, ops)
+    replace_entries(jar, out, {dex.name: dex.finish() for dex in dexes if dex.dirty})
+    return total
@@ -0,0 +1,240 @@
+"""Placement of injected classes by dex method/field reference budgets.
+
+Every smali root of a decompiled JAR (``smali``, ``smali_classes2``, ...)
+becomes one dex file again, and a dex holds at most 65536 method and 65536
+field references. ``place`` fits new classes (and classes that patches are
+about to grow) into roots that still have room for them, opening a new
+``smali_classesN+1`` when none has, so an overflow shows up here rather than
+as an apktool build failure at the end of the job.
+
+A root's references come from the id tables of its ``classesN.dex`` in the
+original JAR when one is given (exact, and read in a fraction of a second),
+otherwise from its smali text. Edits made to the tree after decoding are not
+counted, and a root keeps the references of classes moved out of it;
+``reserve`` references per root are kept free for those edits and for the
+code the patches add next to the placed classes.
+"""
+
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from fptools import dex, smali_index
+from fptools.smali import class_descriptor
+from fptools.smali_engine import log, warn
+
+LIMIT = 65536
+DEFAULT_RESERVE = 1024
+
+_ROOT = re.compile(r"smali(?:_classes(\d+))?$")
+# Lx;->name(params)ret and Lx;->name:type, arrays included
+_REF = re.compile(r"(?:\[*L[^;\s]+;|\[+[ZBSCIJFD])->[^\s(:]+(?:\([^)\s]*\)|:)[^\s,}]+")
+
+
+class Overflow(Exception):
+    """A root would exceed the dex reference limit."""
+
+
+def root_number(name: str) -> int:
+    match = _ROOT.match(name)
+    return int(match.group(1) or 1) if match else 0
+
+
+def smali_roots(decompile_dir: str):
+    """Returns the smali root names of a decompiled JAR in dex order."""
+    names = [name for name in os.listdir(decompile_dir)
+             if root_number(name) and os.path.isdir(os.path.join(decompile_dir, name))]
+    return sorted(names, key=root_number)
+
+
+def file_refs(path: str):
+    """Returns (method refs, field refs) a smali file defines or uses."""
+    with open(path, encoding="utf-8", errors="surrogateescape") as handle:
+        text = handle.read()
+    lines = text.splitlines()
+    descriptor = class_descriptor(lines)
+    methods, fields = set(), set()
+    for line in lines:
+        stripped = line.lstrip()
+        if stripped.startswith(".method "):
+            methods.add(f"{descriptor}->{stripped.rsplit(None, 1)[-1]}")
+        elif stripped.startswith(".field "):
+            member = next(word for word in stripped.split("=", 1)[0].split() if ":" in word)
+            fields.add(f"{descriptor}->{member}")
+    for ref in _REF.findall(text):
+        (methods if "(" in ref else fields).add(ref)
+    return methods, fields
+
+
+def _refs_of(paths):
+    methods, fields = set(), set()
+    for path in paths:
+        file_methods, file_fields = file_refs(path)
+        methods |= file_methods
+        fields |= file_fields
+    return methods, fields
+
+
+def _scan_root(root_dir: str, jobs: int):
+    paths = list(smali_index.iter_smali_files(root_dir))
+    jobs = jobs or os.cpu_count() or 1
+    size = max(1, -(-len(paths) // (jobs * 4)))
+    work = [paths[start:start + size] for start in range(0, len(paths), size)]
+    if jobs == 1 or len(work) < 2:
+        results = [_refs_of(item) for item in work]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+            results = list(pool.map(_refs_of, work))
+    methods, fields = set(), set()
+    for shard_methods, shard_fields in results:
+        methods |= shard_methods
+        fields |= shard_fields
+    return methods, fields
+
+
+def _dex_refs(dex_file):
+    methods = {dex_file.method_ref(idx) for idx in range(dex_file.method_ids_size)}
+    fields = {dex_file.field_ref(idx) for idx in range(dex_file.field_ids_size)}
+    return methods, fields
+
+
+class Roots:
+    """Reference sets per smali root, loaded the first time a root is asked for."""
+
+    def __init__(self, decompile_dir: str, jar: str = "", jobs: int = 0):
+        self.decompile_dir = decompile_dir
+        self.names = smali_roots(decompile_dir)
+        self.jobs = jobs
+        self._dexes = {}
+        if jar and os.path.isfile(jar):
+            self._dexes = {d.name: d for d in dex.load_jar(jar)}
+        self._refs = {}
+
+    def refs(self, name: str):
+        if name not in self._refs:
+            dex_name = "classes.dex" if name == "smali" else f"classes{root_number(name)}.dex"
+            if dex_name in self._dexes:
+                self._refs[name] = _dex_refs(self._dexes[dex_name])
+            else:
+                self._refs[name] = _scan_root(os.path.join(self.decompile_dir, name), self.jobs)
+        return self._refs[name]
+
+    def counted(self):
+        """Returns {root: (method refs, field refs)} for the roots loaded so far."""
+        return {name: tuple(map(len, self._refs[name])) for name in self.names if name in self._refs}
+
+    def fits(self, name: str, methods, fields, reserve: int) -> bool:
+        root_methods, root_fields = self.refs(name)
+        return (len(root_methods | methods) <= LIMIT - reserve
+                and len(root_fields | fields) <= LIMIT - reserve)
+
+    def add(self, name: str, methods, fields) -> None:
+        root_methods, root_fields = self.refs(name)
+        root_methods |= methods
+        root_fields |= fields
+
+    def new_root(self) -> str:
+        name = f"smali_classes{max(map(root_number, self.names), default=1) + 1}"
+        self.names.append(name)
+        self._refs[name] = (set(), set())
+        return name
+
+    def pick(self, methods, fields, reserve: int, exclude=()) -> str:
+        """Returns the last root with room for the refs, or a new one."""
+        for name in reversed(self.names):
+            if name not in exclude and self.fits(name, methods, fields, reserve):
+                return name
+        name = self.new_root()
+        if not self.fits(name, methods, fields, reserve):
+            raise Overflow(f"{len(methods)} method / {len(fields)} field refs do not fit in one dex")
+        return name
+
+
+def _groups(paths, key):
+    """Groups class files with their inner classes (Foo.smali with Foo$1.smali)."""
+    grouped = {}
+    for path in paths:
+        stem = os.path.splitext(key(path))[0]
+        grouped.setdefault(stem.split("$", 1)[0], []).append(path)
+    return grouped
+
+
+def _relocate(roots: Roots, rel: str, reserve: int):
+    """Moves class rel (and its inner classes) out of a root without headroom.
+
+    Returns [(old path, new path)].
+    """
+    for name in roots.names:
+        base = os.path.join(roots.decompile_dir, name, rel)
+        if os.path.isfile(base + ".smali"):
+            break
+    else:
+        warn(f"{rel}.smali not found in {roots.decompile_dir}")
+        return []
+
+    directory, stem = os.path.split(base)
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                   if f == stem + ".smali" or (f.startswith(stem + "$") and f.endswith(".smali")))
+    methods, fields = _refs_of(paths)
+    if roots.fits(name, set(), set(), reserve):
+        log(f"{rel} stays in {name}")
+        return []
+
+    target = roots.pick(methods, fields, reserve, exclude=(name,))
+    roots.add(target, methods, fields)
+    dest_dir = os.path.join(roots.decompile_dir, target, os.path.dirname(rel))
+    os.makedirs(dest_dir, exist_ok=True)
+    moves = [(path, os.path.join(dest_dir, os.path.basename(path))) for path in paths]
+    for old, new in moves:
+        os.replace(old, new)
+    log(f"Relocated {rel} and {len(paths) - 1} inner classes from {name} to {target}")
+    return moves
+
+
+def _inject(roots: Roots, src_dir: str, package: str, reserve: int):
+    """Copies the classes under src_dir into package, root by root; returns the new paths."""
+    sources = list(smali_index.iter_smali_files(src_dir))
+    grouped = _groups(sources, lambda path: os.path.relpath(path, src_dir))
+    footprints = {stem: _refs_of(paths) for stem, paths in grouped.items()}
+    placed = {}
+    written = []
+    # Largest first, so the big classes get the roots with the most room
+    for stem in sorted(grouped, key=lambda s: (-len(footprints[s][0]), s)):
+        methods, fields = footprints[stem]
+        target = roots.pick(methods, fields, reserve)
+        roots.add(target, methods, fields)
+        for path in grouped[stem]:
+            dest = os.path.join(roots.decompile_dir, target, package, os.path.relpath(path, src_dir))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(path, dest)
+            written.append(dest)
+        placed[target] = placed.get(target, 0) + len(grouped[stem])
+    for target in sorted(placed, key=root_number):
+        log(f"Injected {placed[target]} classes into {target}/{package}")
+    return written
+
+
+def place(decompile_dir: str, inject=None, relocate=(), jar: str = "", reserve: int = DEFAULT_RESERVE,
+          jobs: int = 0):
+    """Relocates classes and injects new ones where the reference budgets allow.
+
+    ``inject`` is (source dir, package path) or None, ``relocate`` a list of
+    class paths such as android/app/ApplicationPackageManager. Raises
+    Overflow when a root touched here ends up over the limit. Returns
+    {root: (method refs, field refs)} for the roots that were counted.
+    """
+    roots = Roots(decompile_dir, jar, jobs)
+    moves = []
+    for rel in relocate:
+        moves.extend(_relocate(roots, rel, reserve))
+    written = _inject(roots, *inject, reserve) if inject else []
+
+    if smali_index.index_dir_for(decompile_dir).is_dir() and (moves or written):
+        smali_index.refresh_many(decompile_dir, [new for _, new in moves] + written, [old for old, _ in moves])
+
+    counts = roots.counted()
+    for name, (methods, fields) in counts.items():
+        if methods > LIMIT or fields > LIMIT:
+            raise Overflow(f"{name} needs {methods} method / {fields} field refs, over {LIMIT}")
+    return counts
@@ -0,0 +1,199 @@
+"""Parallel, resumable downloads of the input JARs, checked before patching.
+
+``fetch_all`` pulls every (name, url) pair at once, one thread each: the
+transfers wait on the network, not on the CPU, and a slow host (PixelDrain
+often is) no longer holds back the other two JARs. Each file streams into
+``<name>.part`` while its SHA-256 is computed; when the connection drops or
+stalls, the next attempt asks for the rest with a ``Range`` request and keeps
+hashing where it stopped, and a server that ignores the range starts the file
+over. A ``.part`` left by an earlier run is resumed the same way.
+
+PixelDrain page links (``/u/<id>``) are fetched from the file API, which
+serves ranges. Google Drive links still go through ``gdown --continue``,
+since Drive wraps large files in a confirmation page; those are hashed
+after the transfer.
+
+A finished file must then match the expected SHA-256 when one is given, and
+pass ``check_zip``: the central directory parses, every entry's local header
+is where the directory says, and the archive holds a ``classes*.dex``. A
+truncated or HTML-instead-of-JAR download fails here, by name, rather than
+in apktool minutes later.
+"""
+
+import hashlib
+import http.client
+import os
+import re
+import shutil
+import subprocess
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from fptools.smali_engine import log, warn
+
+CHUNK = 1 << 20
+TIMEOUT = 60
+DEFAULT_RETRIES = 5
+
+_PIXELDRAIN = re.compile(r"https?://(?:www\.)?pixeldrain\.com/u/([\w-]+)")
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+_DEX = re.compile(r"classes\d*\.dex")
+
+
+class DownloadError(Exception):
+    """A file could not be downloaded, or what arrived is not the expected JAR."""
+
+
+def resolve_url(url: str) -> str:
+    """Returns the URL that serves the file itself (PixelDrain pages map to the file API)."""
+    match = _PIXELDRAIN.match(url)
+    if match:
+        return f"https://pixeldrain.com/api/file/{match.group(1)}?download"
+    return url
+
+
+def _hash_existing(path: str):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest, size
+
+
+def _retry(name: str, error, attempt: int, retries: int, delay: float, done: int) -> None:
+    if attempt > retries:
+        raise DownloadError(f"{name}: {error} (gave up after {retries} retries)")
+    warn(f"{name}: {error}; retrying from byte {done} ({attempt}/{retries})")
+    time.sleep(min(delay * 2 ** (attempt - 1), 30))
+
+
+def _http(name: str, url: str, dest: str, retries: int, delay: float):
+    """Downloads url to dest with range resumes; returns (sha256, size)."""
+    part = dest + ".part"
+    digest, done = _hash_existing(part) if os.path.isfile(part) else (hashlib.sha256(), 0)
+    if done:
+        log(f"{name}: resuming the {done} bytes of an earlier run")
+    attempt = 0
+    while True:
+        headers = {"User-Agent": "FrameworkPatcher"}
+        if done:
+            headers["Range"] = f"bytes={done}-"
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=TIMEOUT) as response:
+                total = None
+                if response.status == 206:
+                    match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                    if not match or int(match.group(1)) != done:
+                        raise DownloadError(f"{name}: unexpected Content-Range "
+                                            f"{response.headers.get('Content-Range')!r} for byte {done}")
+                    total = None if match.group(2) == "*" else int(match.group(2))
+                else:
+                    if done:
+                        warn(f"{name}: server ignored the range request, starting over")
+                        digest, done = hashlib.sha256(), 0
+                    length = response.headers.get("Content-Length")
+                    total = int(length) if length else None
+                with open(part, "ab" if done else "wb") as out:
+                    for chunk in iter(lambda: response.read(CHUNK), b""):
+                        out.write(chunk)
+                        digest.update(chunk)
+                        done += len(chunk)
+            if total is None or done == total:
+                break
+            error = f"connection closed at byte {done} of {total}"
+        except urllib.error.HTTPError as exc:
+            if exc.code == 416 and done:
+                # The partial file is no prefix of what the server has now
+                digest, done = hashlib.sha256(), 0
+                error = "stale partial file"
+            elif exc.code < 500 and exc.code not in (408, 429):
+                raise DownloadError(f"{name}: HTTP {exc.code} {exc.reason}") from exc
+            else:
+                error = f"HTTP {exc.code} {exc.reason}"
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as exc:
+            error = getattr(exc, "reason", None) or str(exc) or type(exc).__name__
+        attempt += 1
+        _retry(name, error, attempt, retries, delay, done)
+    os.replace(part, dest)
+    return digest.hexdigest(), done
+
+
+def _gdown(name: str, url: str, dest: str, retries: int, delay: float):
+    """Downloads a Google Drive link with gdown, which resumes on its own; returns (sha256, size)."""
+    if shutil.which("gdown") is None:
+        raise DownloadError(f"{name}: gdown is needed for Google Drive links")
+    attempt = 0
+    while subprocess.run(["gdown", "--fuzzy", "--continue", "-O", dest, url]).returncode != 0:
+        attempt += 1
+        _retry(name, "gdown failed", attempt, retries, delay, os.path.getsize(dest) if os.path.isfile(dest) else 0)
+    digest, size = _hash_existing(dest)
+    return digest.hexdigest(), size
+
+
+def check_zip(path: str):
+    """Returns the problems with a JAR's central directory; empty when it is sound."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            infos = archive.infolist()
+    except (zipfile.BadZipFile, OSError) as exc:
+        return [f"not a readable ZIP ({exc})"]
+    problems = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as handle:
+        for info in infos:
+            handle.seek(info.header_offset)
+            if info.header_offset + info.compress_size > size or handle.read(4) != zipfile.stringFileHeader:
+                problems.append(f"entry {info.filename} points outside the data")
+    if not any(_DEX.fullmatch(info.filename) for info in infos):
+        problems.append("no classes*.dex entry")
+    return problems
+
+
+def fetch(name: str, url: str, out_dir: str, expected: str = "", min_size: int = 0,
+          retries: int = DEFAULT_RETRIES, delay: float = 1.0):
+    """Downloads one JAR and checks it; returns (path, sha256, size)."""
+    dest = os.path.join(out_dir, name)
+    start = time.monotonic()
+    log(f"Downloading {name} from {url}")
+    if "drive.google.com" in url:
+        digest, size = _gdown(name, url, dest, retries, delay)
+    else:
+        digest, size = _http(name, resolve_url(url), dest, retries, delay)
+    elapsed = max(time.monotonic() - start, 1e-3)
+
+    if expected and digest != expected.lower():
+        raise DownloadError(f"{name}: sha256 {digest} does not match {expected}")
+    if size < min_size:
+        raise DownloadError(f"{name}: only {size} bytes, expected at least {min_size}")
+    problems = check_zip(dest)
+    if problems:
+        raise DownloadError(f"{name}: {'; '.join(problems)}")
+    log(f"{name}: {size} bytes in {elapsed:.1f}s ({size / elapsed / (1 << 20):.1f} MiB/s), sha256 {digest}")
+    return dest, digest, size
+
+
+def fetch_all(downloads, out_dir: str, expected=None, min_size: int = 0, retries: int = DEFAULT_RETRIES,
+              delay: float = 1.0):
+    """Downloads every (name, url) concurrently.
+
+    ``expected`` maps names to SHA-256 digests. Returns ({name: (path,
+    sha256, size)}, {name: error}); every download runs to its end even
+    when another one fails.
+    """
+    expected = expected or {}
+    os.makedirs(out_dir, exist_ok=True)
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, len(downloads))) as pool:
+        futures = {name: pool.submit(fetch, name, url, out_dir, expected.get(name, ""), min_size, retries, delay)
+                   for name, url in downloads}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except DownloadError as exc:
+                errors[name] = str(exc)
+    return results, errors
@@ -0,0 +1,101 @@
+"""Stubs out the invoke-custom bodies of record equals/hashCode/toString.
+
+This is the rewrite ``modify_invoke_custom_methods`` used to do with three
+``sed -i`` passes per file. Candidates come from the method index's
+invoke-custom list (or one scan of the tree when there is no index), every
+file is read and written once, and files are spread over a process pool.
+The edits are line-for-line what the sed scripts produced.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fptools import smali_index
+from fptools.smali_engine import Buffer
+
+# Mirrors the sed address /.method.*<name>(/,/^.end method$/
+_END = re.compile(r".end method")
+
+# (range start, [(line pattern, replacement lines)]) in the order sed ran them
+_PASSES = (
+    (re.compile(r".method.*equals\("), (
+        (re.compile(r"^    .registers"), ["    .registers 2"]),
+        (re.compile(r"^    invoke-custom"), []),
+        (re.compile(r"^    move-result"), []),
+        (re.compile(r"^    return"), ["    const/4 v0, 0x0", "", "    return v0"]),
+    )),
+    (re.compile(r".method.*hashCode\("), (
+        (re.compile(r"^    .registers"), ["    .registers 2"]),
+        (re.compile(r"^    invoke-custom"), []),
+        (re.compile(r"^    move-result"), []),
+        (re.compile(r"^    return"), ["    const/4 v0, 0x0", "", "    return v0"]),
+    )),
+    (re.compile(r".method.*toString\("), (
+        (re.compile(r"^[ \t\n\r\f\v]*\.registers"), ["    .registers 1"]),
+        (re.compile(r"^    invoke-custom"), []),
+        (re.compile(r"^    move-result"), []),
+        (re.compile(r"^    return"), ["    const/4 v0, 0x0", "", "    return-object v0"]),
+    )),
+)
+
+
+def _apply_pass(lines, start, rules):
+    out = []
+    active = False
+    for line in lines:
+        if not active:
+            if not start.search(line):
+                out.append(line)
+                continue
+            active = opening = True
+        else:
+            opening = False
+        for pattern, replacement in rules:
+            if pattern.search(line):
+                out.extend(replacement)
+                break
+        else:
+            out.append(line)
+        # Like sed, the range cannot close on the line that opened it
+        if not opening and _END.fullmatch(line):
+            active = False
+    return out
+
+
+def rewrite_file(path: str) -> bool:
+    """Rewrites one file; returns True when it changed."""
+    buf = Buffer(Path(path))
+    if not buf.contains("invoke-custom"):
+        return False
+    lines = buf.lines
+    for start, rules in _PASSES:
+        lines = _apply_pass(lines, start, rules)
+    if lines != buf.lines:
+        buf.lines = lines
+        buf.changed = True
+    return buf.save()
+
+
+def rewrite_tree(decompile_dir: str, jobs: int = 0):
+    """Rewrites every candidate file under decompile_dir; returns the changed paths.
+
+    ``jobs`` is the number of worker processes, 0 meaning one per CPU.
+    """
+    candidates = smali_index.invoke_custom_files(decompile_dir)
+    if candidates is None:
+        candidates = list(smali_index.iter_smali_files(decompile_dir))
+    candidates = [path for path in candidates if os.path.isfile(path)]
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(candidates) < 2:
+        results = [rewrite_file(path) for path in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(candidates))) as pool:
+            results = list(pool.map(rewrite_file, candidates, chunksize=max(1, len(candidates) // (jobs * 4))))
+
+    changed = [path for path, written in zip(candidates, results) if written]
+    if changed and smali_index.index_dir_for(decompile_dir).is_dir():
+        smali_index.refresh_many(decompile_dir, changed)
+    return changed
@@ -0,0 +1,255 @@
+"""JAR rewriting that keeps every untouched entry as it was.
+
+``replace_entries`` streams the archive: each kept entry's compressed bytes
+are copied straight from the source, without inflating or deflating them, and
+replaced or new entries are written in the same pass. Archives that need
+ZIP64 records go through ``zipfile`` instead, which recompresses.
+"""
+
+import copy
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+
+_CHUNK = 1 << 20
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+# Same layouts as zipfile's structFileHeader / structCentralDir / structEndArchive
+_LOCAL = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL = struct.Struct("<4s4B4HL2L5H2L")
+_END = struct.Struct("<4s4H2LH")
+_LOCAL_SIG = b"PK\003\004"
+_CENTRAL_SIG = b"PK\001\002"
+_END_SIG = b"PK\005\006"
+
+_DATA_DESCRIPTOR = 0x08
+_UTF8_NAME = 0x800
+
+
+def _dos_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+
+def _raw_name(info) -> bytes:
+    encoding = "utf-8" if info.flag_bits & _UTF8_NAME else "cp437"
+    return info.orig_filename.encode(encoding)
+
+
+def _open_source(data):
+    """Returns a binary stream for a replacement given as bytes or a file path."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return None
+    return open(data, "rb")
+
+
+def _source_size(data) -> int:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    return os.path.getsize(data)
+
+
+def _chunks(data):
+    handle = _open_source(data)
+    if handle is None:
+        yield bytes(data)
+        return
+    with handle:
+        while True:
+            chunk = handle.read(_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+class ZipWriter:
+    """Writes local entries to out and collects their central directory records.
+
+    Offsets are 32-bit, so the output has to stay below 4 GiB.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.central = []
+
+    def _local_header(self, info, name, extra, flags, crc, compress_size, file_size):
+        dostime, dosdate = _dos_time(info.date_time)
+        return _LOCAL.pack(_LOCAL_SIG, info.extract_version, info.reserved, flags, info.compress_type,
+                           dostime, dosdate, crc, compress_size, file_size, len(name), len(extra))
+
+    def _record(self, info, name, flags, offset, crc, compress_size, file_size):
+        dostime, dosdate = _dos_time(info.date_time)
+        comment = info.comment or b""
+        extra = info.extra or b""
+        self.central.append(
+            _CENTRAL.pack(_CENTRAL_SIG, info.create_version, info.create_system, info.extract_version,
+                          info.reserved, flags, info.compress_type, dostime, dosdate, crc, compress_size,
+                          file_size, len(name), len(extra), len(comment), 0, info.internal_attr,
+                          info.external_attr, offset)
+            + name + extra + comment)
+
+    def copy(self, src, info, target=None) -> None:
+        """Copies one entry's compressed bytes from src unchanged.
+
+        ``target`` (a ZipInfo) gives the entry another name, time or
+        attributes; the data, CRC and sizes always come from info.
+        """
+        target = target or info
+        src.seek(info.header_offset)
+        header = src.read(_LOCAL.size)
+        if len(header) != _LOCAL.size or header[:4] != _LOCAL_SIG:
+            raise zipfile.BadZipFile(f"bad local header for {info.orig_filename}")
+        fields = _LOCAL.unpack(header)
+        name_len, extra_len = fields[10], fields[11]
+        name = src.read(name_len)
+        extra = src.read(extra_len)
+        if target is not info:
+            name = _raw_name(target)
+
+        # The sizes and CRC come from the central directory, so a data
+        # descriptor after the data is not needed any more
+        flags = info.flag_bits & ~_DATA_DESCRIPTOR
+        offset = self.out.tell()
+        self.out.write(self._local_header(target, name, extra, flags, info.CRC, info.compress_size, info.file_size))
+        self.out.write(name + extra)
+        remaining = info.compress_size
+        while remaining:
+            chunk = src.read(min(remaining, _CHUNK))
+            if not chunk:
+                raise zipfile.BadZipFile(f"truncated data for {info.orig_filename}")
+            self.out.write(chunk)
+            remaining -= len(chunk)
+        self._record(target, name, flags, offset, info.CRC, info.compress_size, info.file_size)
+
+    def write(self, info, data) -> None:
+        """Writes data (bytes or a file path) as the entry described by info."""
+        name = _raw_name(info)
+        flags = info.flag_bits & ~_DATA_DESCRIPTOR
+        offset = self.out.tell()
+        # Sizes and CRC are patched in once the data has gone through
+        self.out.write(self._local_header(info, name, b"", flags, 0, 0, 0))
+        self.out.write(name)
+
+        compressor = None
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        elif info.compress_type != zipfile.ZIP_STORED:
+            raise NotImplementedError(f"cannot write {info.orig_filename} with compression {info.compress_type}")
+
+        crc = file_size = compress_size = 0
+        for chunk in _chunks(data):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            self.out.write(chunk)
+        if compressor is not None:
+            tail = compressor.flush()
+            compress_size += len(tail)
+            self.out.write(tail)
+
+        end = self.out.tell()
+        self.out.seek(offset + 14)
+        self.out.write(struct.pack("<3L", crc, compress_size, file_size))
+        self.out.seek(end)
+        self._record(info, name, flags, offset, crc, compress_size, file_size)
+
+    def add_compressed(self, info, payload: bytes, crc: int, file_size: int) -> None:
+        """Writes an entry whose data was already compressed per info.compress_type."""
+        name = _raw_name(info)
+        flags = info.flag_bits & ~_DATA_DESCRIPTOR
+        offset = self.out.tell()
+        self.out.write(self._local_header(info, name, b"", flags, crc, len(payload), file_size))
+        self.out.write(name)
+        self.out.write(payload)
+        self._record(info, name, flags, offset, crc, len(payload), file_size)
+
+    def finish(self, comment: bytes = b"") -> None:
+        start = self.out.tell()
+        for record in self.central:
+            self.out.write(record)
+        size = self.out.tell() - start
+        count = len(self.central)
+        self.out.write(_END.pack(_END_SIG, 0, 0, count, count, size, start, len(comment)) + comment)
+
+
+def _new_info(name: str):
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    if not name.isascii():
+        info.flag_bits |= _UTF8_NAME
+    return info
+
+
+def _needs_zip64(zin, replacements) -> bool:
+    infos = zin.infolist()
+    if len(infos) + len(replacements) >= 0xFFFF:
+        return True
+    total = sum(info.compress_size + 128 for info in infos)
+    total += sum(_source_size(data) + 128 for data in replacements.values())
+    return total >= _ZIP32_LIMIT or any(info.file_size >= _ZIP32_LIMIT for info in infos)
+
+
+def _rewrite_zipfile(zin, tmp, pending, remove) -> None:
+    """Fallback for ZIP64 archives: recompresses every entry through zipfile."""
+    with zipfile.ZipFile(tmp, "w", allowZip64=True) as zout:
+        for info in zin.infolist():
+            if info.filename in remove:
+                continue
+            data = pending.pop(info.filename, None)
+            # zout records the new offsets on the info it is given
+            with zout.open(copy.copy(info), "w", force_zip64=True) as dst:
+                if data is None:
+                    with zin.open(info) as src:
+                        shutil.copyfileobj(src, dst, _CHUNK)
+                else:
+                    for chunk in _chunks(data):
+                        dst.write(chunk)
+        for name in sorted(pending):
+            with zout.open(_new_info(name), "w", force_zip64=True) as dst:
+                for chunk in _chunks(pending[name]):
+                    dst.write(chunk)
+        zout.comment = zin.comment
+
+
+def replace_entries(jar: str, out: str, replacements, remove=()) -> None:
+    """Writes a copy of jar to out with some entries replaced, added or removed.
+
+    ``replacements`` maps entry names to their new content, as bytes or as
+    the path of a file holding it; ``remove`` lists entries to leave out (a
+    replacement wins over a removal). Untouched entries are copied without
+    recompression. Replaced entries keep the original entry's metadata and
+    compression; new entries are stored uncompressed like the dex files of a
+    platform JAR. The output only appears once it is complete, so out may be
+    jar itself.
+    """
+    pending = dict(replacements)
+    remove = set(remove) - set(pending)
+    tmp = f"{out}.tmp"
+    try:
+        with zipfile.ZipFile(jar) as zin:
+            if _needs_zip64(zin, pending):
+                _rewrite_zipfile(zin, tmp, pending, remove)
+            else:
+                with open(jar, "rb") as src, open(tmp, "wb") as dst:
+                    writer = ZipWriter(dst)
+                    for info in zin.infolist():
+                        if info.filename in remove:
+                            continue
+                        data = pending.pop(info.filename, None)
+                        if data is None:
+                            writer.copy(src, info)
+                        else:
+                            writer.write(info, data)
+                    for name in sorted(pending):
+                        writer.write(_new_info(name), pending[name])
+                    writer.finish(zin.comment)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, out)
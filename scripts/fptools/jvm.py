@@ -0,0 +1,89 @@
+"""Client for the JVM daemon in scripts/jvm/PatcherDaemon.java.
+
+A request is a count and that many length-prefixed UTF-8 strings (tool JAR,
+main class, arguments); the reply is a stream of (type, length, payload)
+frames for stdout, stderr and finally the exit status. See the daemon for the
+details.
+
+The daemon cannot change directory per request, so relative paths among the
+arguments are made absolute here. ``UNAVAILABLE`` is returned when no daemon
+answers or it goes away before reporting a status; the shell then runs the
+tool in a JVM of its own.
+"""
+
+import os
+import socket
+import struct
+import sys
+
+UNAVAILABLE = 75
+
+_OUT, _ERR, _EXIT = 1, 2, 3
+_HEADER = struct.Struct(">BI")
+
+# Options whose value is not a path (apktool and d8)
+_VALUE_OPTIONS = {"-t", "--frame-tag", "-api", "--api", "--api-level", "-j", "--jobs", "--min-api", "--thread-count"}
+
+
+def absolutize(args, skip: int = 0):
+    """Makes every path argument absolute; the first skip arguments are left alone."""
+    out = list(args[:skip])
+    previous = ""
+    for arg in args[skip:]:
+        if arg.startswith("-") or previous in _VALUE_OPTIONS or arg.isdigit():
+            out.append(arg)
+        else:
+            out.append(os.path.abspath(arg))
+        previous = arg
+    return out
+
+
+def _pack(strings) -> bytes:
+    parts = [struct.pack(">i", len(strings))]
+    for text in strings:
+        data = text.encode("utf-8", "surrogateescape")
+        parts.append(struct.pack(">i", len(data)) + data)
+    return b"".join(parts)
+
+
+def _read_exact(conn, size: int):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def request(sock_path: str, strings, stdout=None, stderr=None) -> int:
+    """Sends one request and relays its output; returns the tool's exit status."""
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr.buffer
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(sock_path)
+    except OSError:
+        return UNAVAILABLE
+    with conn:
+        try:
+            conn.sendall(_pack(strings))
+            while True:
+                header = _read_exact(conn, _HEADER.size)
+                if header is None:
+                    return UNAVAILABLE
+                kind, size = _HEADER.unpack(header)
+                payload = _read_exact(conn, size)
+                if payload is None:
+                    return UNAVAILABLE
+                if kind == _EXIT:
+                    return struct.unpack(">i", payload)[0] & 0xFF
+                stream = stdout if kind == _OUT else stderr
+                stream.write(payload)
+                stream.flush()
+        except OSError:
+            return UNAVAILABLE
+
+
+def run(sock_path: str, jar: str, main_class: str, args, skip: int = 0) -> int:
+    return request(sock_path, [os.path.abspath(jar), main_class] + absolutize(args, skip))
@@ -0,0 +1,196 @@
+"""Kaorios Toolbox framework edits, compiled from the toolbox's smali templates.
+
+``kaorios_toolbox/*.smali`` are trimmed copies of the framework classes the
+toolbox patches (ApplicationPackageManager, Instrumentation, KeyStore2,
+AndroidKeyStoreSpi), with each addition marked either by a ``# kousei added``
+... ``# end add`` pair or by a ``###Kousei added`` line in front of a single
+added instruction (and its ``move-result``). ``compile_templates`` turns every
+marked addition into an insertion:
+
+``class``, ``method``
+    the class file below a smali root and the method's name and descriptor
+``position``, ``anchor``
+    ``start`` when the addition opens the method, otherwise ``first`` or
+    ``last`` (when it closes the method) with the stock instruction it
+    precedes in the template; the op finds that instruction by its
+    ``register_shape`` and renames the block's registers after the ones the
+    target method uses there
+``locals``
+    the local registers the template method has, so the block's v registers
+    exist in the target
+``marker``, ``block``
+    the block's first line calling into the toolbox package, which tells an
+    already patched method apart, and the block itself
+
+Compiling reads the templates once per toolbox version: the result is kept
+as JSON under the cache dir, keyed by ``version.txt`` and the template
+digest. ``apply`` resolves the classes in the method index and hands every
+insertion to ``smali_engine.apply_plan`` as an ``insert_template_block`` op,
+so each class is read and written once however many insertions it takes,
+and reports the insertions that found no class, method or anchor.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from fptools import smali_engine, smali_index
+from fptools.smali import class_descriptor, method_spans, param_registers
+
+PACKAGE = "Lcom/android/internal/util/kaorios/"
+PLAN_FORMAT = 2
+
+_BEGIN = ("# kousei added", "###kousei added")
+_END = "# end add"
+_LABEL = re.compile(r"(?<![\w$-]):[\w$]+")
+
+
+def _instruction(line: str) -> bool:
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def _next_instruction(lines, i: int, end: int) -> int:
+    while i < end and not _instruction(lines[i]):
+        i += 1
+    return i
+
+
+def _block_end(lines, begin: int, end: int) -> int:
+    """Returns the index of the end marker, or of the stock line after a single-instruction addition."""
+    if lines[begin].strip().lower() == _BEGIN[0]:
+        for i in range(begin + 1, end):
+            if lines[i].strip().lower() == _END:
+                return i
+        raise ValueError(f"unterminated addition at line {begin + 1}")
+    i = _next_instruction(lines, begin + 1, end) + 1
+    after = _next_instruction(lines, i, end)
+    if after < end and lines[after].strip().startswith("move-result"):
+        return after + 1
+    return i
+
+
+def _insertion(lines, rel: str, start: int, end: int, decl: str, begin: int):
+    stop = _block_end(lines, begin, end)
+    block = lines[begin + 1:stop]
+    while block and not block[0].strip():
+        block.pop(0)
+    while block and not block[-1].strip():
+        block.pop()
+
+    before = begin - 1
+    while before > start and not _instruction(lines[before]):
+        before -= 1
+    anchor_idx = _next_instruction(lines, stop + (lines[stop].strip().lower() == _END), end)
+    # Blank lines around the block, as baksmali separates instructions
+    if lines[before].strip().startswith((".registers ", ".locals ")):
+        position, anchor = "start", ""
+        block = [""] + block
+    elif anchor_idx < end:
+        anchor = lines[anchor_idx].strip()
+        position = "last" if _next_instruction(lines, anchor_idx + 1, end) == end else "first"
+        block = block + [""]
+    else:
+        raise ValueError(f"{rel}: addition at line {begin + 1} has no instruction after it")
+
+    labels = {line.strip() for line in block if line.strip().startswith(":")}
+    jumps = {label for line in block if not line.strip().startswith(":") for label in _LABEL.findall(line)}
+    if jumps - labels:
+        raise ValueError(f"{rel}: addition at line {begin + 1} jumps to {', '.join(sorted(jumps - labels))} "
+                         "outside itself")
+    marker = next((line.strip() for line in block if PACKAGE in line), "")
+    if not marker:
+        raise ValueError(f"{rel}: addition at line {begin + 1} never calls into {PACKAGE}")
+
+    directive, count = next(lines[i].split() for i in range(start + 1, end)
+                            if lines[i].strip().startswith((".registers ", ".locals ")))
+    local_count = int(count) - param_registers(decl) if directive == ".registers" else int(count)
+    return {"class": rel, "method": decl.rsplit(None, 1)[-1], "position": position, "anchor": anchor,
+            "locals": local_count, "marker": marker, "block": block}
+
+
+def compile_template(path: str):
+    """Returns the insertions the additions marked in one template make."""
+    with open(path, encoding="utf-8") as handle:
+        lines = handle.read().splitlines()
+    rel = class_descriptor(lines)[1:-1] + ".smali"
+    insertions = []
+    for start, end, decl in method_spans(lines):
+        for i in range(start + 1, end):
+            if lines[i].strip().lower() in _BEGIN:
+                insertions.append(_insertion(lines, rel, start, end, decl, i))
+    return insertions
+
+
+def _templates(toolbox_dir: str):
+    return sorted(os.path.join(toolbox_dir, name) for name in os.listdir(toolbox_dir) if name.endswith(".smali"))
+
+
+def compile_templates(toolbox_dir: str):
+    """Returns the insertions of every template in toolbox_dir, class by class."""
+    insertions = []
+    for path in _templates(toolbox_dir):
+        insertions.extend(compile_template(path))
+    return insertions
+
+
+def plan_key(toolbox_dir: str) -> str:
+    """<version>-<digest of the templates and the plan format>."""
+    try:
+        with open(os.path.join(toolbox_dir, "version.txt"), encoding="utf-8") as handle:
+            version = re.sub(r"[^\w.-]", "", handle.read()) or "unversioned"
+    except OSError:
+        version = "unversioned"
+    digest = hashlib.sha256(f"format {PLAN_FORMAT}\n".encode())
+    for path in _templates(toolbox_dir):
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as handle:
+            digest.update(hashlib.sha256(handle.read()).digest())
+    return f"{version}-{digest.hexdigest()[:16]}"
+
+
+def load_plans(toolbox_dir: str, cache_dir: str = ""):
+    """Returns the compiled insertions, from cache_dir when this version was compiled before."""
+    cached = os.path.join(cache_dir, f"plan-{plan_key(toolbox_dir)}.json") if cache_dir else ""
+    if cached and os.path.isfile(cached):
+        with open(cached, encoding="utf-8") as handle:
+            return json.load(handle)
+
+    insertions = compile_templates(toolbox_dir)
+    if cached:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as handle:
+            json.dump(insertions, handle, indent=1)
+            handle.write("\n")
+        os.replace(tmp, cached)
+        smali_engine.log(f"Compiled {len(insertions)} Kaorios insertions into {cached}")
+    return insertions
+
+
+def apply(decompile_dir: str, toolbox_dir: str, cache_dir: str = ""):
+    """Applies the toolbox insertions to an indexed decompile dir.
+
+    Returns (files written, [(class, method)] of the insertions that did not apply).
+    """
+    ops = []
+    paths = {}
+    missed = []
+    for insertion in load_plans(toolbox_dir, cache_dir):
+        rel = insertion["class"]
+        if rel not in paths:
+            paths[rel] = smali_index.find_class(decompile_dir, rel)
+            if not paths[rel]:
+                smali_engine.warn(f"{rel} not found in {decompile_dir}")
+        if not paths[rel]:
+            missed.append((rel, insertion["method"]))
+            continue
+        ops.append(("insert_template_block", paths[rel],
+                    [insertion["method"], insertion["position"], insertion["anchor"], str(insertion["locals"]),
+                     insertion["marker"], "\n".join(insertion["block"])]))
+    misses = []
+    written = smali_engine.apply_plan(ops, misses)
+    rels = {path: rel for rel, path in paths.items() if path}
+    missed.extend((rels[path], args[0]) for _, path, args in misses)
+    return written, missed
@@ -0,0 +1,162 @@
+"""Per-API patch manifests.
+
+``scripts/manifests/apiNN.tsv`` lists the smali edits of one Android release,
+one tab separated row per edit, so every patcher runs its edits through the
+same lookups and the same engine (``fptools.smali_engine``):
+
+    jar  feature  target  op  args...
+
+``jar`` is framework, services or miui-services and ``feature`` one of
+signature, cn and secure; the patcher picks the rows for the JAR and the
+features it was asked for. ``target`` names the file an edit goes to, looked
+up in the method index and the scan cache:
+
+``class:<path>``
+    the class file at path below a smali root (android/app/Foo.smali)
+``method:<text>``
+    the first file declaring a method whose declaration contains text
+``methods:<text>``
+    every file declaring such a method
+``scan:<pattern>``
+    the first file with a line matching the grep pattern
+
+Alternatives separated by `` || `` are tried in order. A target starting
+with ``?`` is optional: the edit is still made when the target resolves, but
+a release without it only gets a warning, also from the dry run
+(``manifest_plan``), where other rows that do not resolve fail the job.
+``op`` is a smali
+engine op followed by its arguments, or one of the shorthands below for the
+method body rewrites the shell helpers used to queue:
+
+``return_const <method> <value>``
+    the first method matching `` <method>`` returns const/4 value
+``return_void <method>``
+    the first method matching `` <method>`` returns void
+``return_void_all <method>``
+    every method matching method returns void
+``replace_method <method> <body>``
+    the first method matching `` <method>`` gets body (``\\n`` separated)
+
+``include<TAB><file>`` reads another manifest (relative to the including
+one) in its place, and lines starting with ``#`` are comments. Every target
+is resolved before the first edit, so the rows for one JAR make a single
+plan in which each file is read and written once.
+"""
+
+import os
+
+from fptools import scan, smali_engine, smali_index
+
+_RETURN_VOID = "    .registers 8\\n    return-void"
+
+_SHORTHANDS = {
+    "return_const": lambda m, value: (
+        f" {m}", "first", f"    .registers 8\\n    const/4 v0, 0x{value}\\n    return v0",
+        f"Patched {m} in {{file}} to return 0x{value}"),
+    "return_void": lambda m: (f" {m}", "first", _RETURN_VOID, f"Patched {m} in {{file}} to return-void"),
+    "return_void_all": lambda m: (m, "all", _RETURN_VOID, f"Patched all {m} overloads in {{file}} to return-void"),
+    "replace_method": lambda m, body: (f" {m}", "first", body, f"Replaced entire method {m} in {{file}}"),
+}
+
+_KINDS = ("class", "method", "methods", "scan")
+
+
+def load(path: str, _seen=()):
+    """Reads a manifest into (jar, feature, target, op, args) rows, includes expanded."""
+    path = os.path.abspath(path)
+    if path in _seen:
+        raise ValueError(f"{path}: include loop")
+    rows = []
+    with open(path, encoding="utf-8") as handle:
+        for lineno, raw in enumerate(handle, 1):
+            raw = raw.rstrip("\n")
+            if not raw.strip() or raw.lstrip().startswith("#"):
+                continue
+            fields = raw.split("\t")
+            if fields[0] == "include" and len(fields) == 2:
+                rows.extend(load(os.path.join(os.path.dirname(path), fields[1]), _seen + (path,)))
+                continue
+            if len(fields) < 4:
+                raise ValueError(f"{path}:{lineno}: expected jar, feature, target and op")
+            jar, feature, target, op, *args = fields
+            if op not in smali_engine.OPS and op not in _SHORTHANDS:
+                raise ValueError(f"{path}:{lineno}: unknown op {op}")
+            for alternative in alternatives(target)[1]:
+                if alternative.split(":", 1)[0] not in _KINDS or ":" not in alternative:
+                    raise ValueError(f"{path}:{lineno}: bad target {alternative!r}")
+            rows.append((jar, feature, target, op, args))
+    return rows
+
+
+def alternatives(target: str):
+    """Returns (optional, [alternative, ...]) for a target column."""
+    optional = target.startswith("?")
+    return optional, target[optional:].split(" || ")
+
+
+def expand(op: str, args):
+    """Turns a shorthand into its smali engine op; other ops pass through."""
+    if op in _SHORTHANDS:
+        return "replace_method_body", list(_SHORTHANDS[op](*args))
+    return op, args
+
+
+def select(rows, jar: str, features):
+    """Keeps the rows for jar and any of features, in manifest order."""
+    return [row for row in rows if row[0] == jar and row[1] in features]
+
+
+def _scan_hits(decompile_dir: str, patterns, jobs: int):
+    """Returns {pattern: hits}, scanning the tree once for the uncached patterns."""
+    cache = smali_index.index_dir_for(decompile_dir) / smali_index.SCAN_CACHE
+    found = scan.read_results(cache)
+    missing = [pattern for pattern in dict.fromkeys(patterns) if pattern not in found]
+    if missing:
+        found.update(scan.update_cache(decompile_dir, missing, jobs))
+    return found
+
+
+def _lookup(decompile_dir: str, target: str, hits):
+    for alternative in alternatives(target)[1]:
+        kind, text = alternative.split(":", 1)
+        if kind == "class":
+            paths = [smali_index.find_class(decompile_dir, text)]
+        elif kind == "method":
+            paths = smali_index.find_methods(decompile_dir, text, first=True)
+        elif kind == "methods":
+            paths = smali_index.find_methods(decompile_dir, text)
+        else:
+            paths = [hits[text][0][0]] if hits[text] else []
+        paths = [path for path in paths if path]
+        if paths:
+            return paths
+    return []
+
+
+def resolve(decompile_dir: str, rows, jobs: int = 0):
+    """Turns manifest rows into smali_engine (op, path, args) tuples.
+
+    Targets that resolve to no file are reported and skipped.
+    """
+    patterns = [alternative.split(":", 1)[1] for _, _, target, _, _ in rows
+                for alternative in alternatives(target)[1] if alternative.startswith("scan:")]
+    hits = _scan_hits(decompile_dir, patterns, jobs) if patterns else {}
+
+    ops = []
+    for _, _, target, op, args in rows:
+        paths = _lookup(decompile_dir, target, hits)
+        if not paths:
+            optional = " (optional)" if alternatives(target)[0] else ""
+            smali_engine.warn(f"{target} not found in {decompile_dir}{optional}")
+            continue
+        op, args = expand(op, args)
+        ops.extend((op, path, args) for path in paths)
+    return ops
+
+
+def apply(manifest: str, decompile_dir: str, jar: str, features, jobs: int = 0) -> int:
+    """Applies the rows of manifest for jar and features; returns the files written."""
+    rows = select(load(manifest), jar, features)
+    if not rows:
+        return 0
+    return smali_engine.apply_plan(resolve(decompile_dir, rows, jobs))
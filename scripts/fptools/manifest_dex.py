@@ -0,0 +1,94 @@
+"""DEX plans generated from the patch manifest (``--patch-mode dex``).
+
+``dex_ops`` turns the manifest rows of one JAR into ``fptools.dex_engine``
+ops, so the in-place DEX path makes the same edits as the apktool path and
+never drifts from the manifest. A class target becomes its descriptor, and
+``method:``, ``methods:`` and ``scan:`` targets become ``*``, because the
+DEX ops find their anchor themselves. Alternatives keep their order.
+
+Rows whose edit has no in-place DEX equivalent (a method body other than
+``return <const>``, a text replacement other than an ``sget`` turned into a
+constant, ...) raise ``NoDexEquivalent``, and the patcher uses apktool for
+that JAR.
+"""
+
+import re
+
+from fptools import manifest
+from fptools.smali_engine import STRICT_JAR_ANCHOR
+
+_CONST_BODY = re.compile(r"\s*\.registers \d+(?:\\n)+\s*const/4 v0, 0x([0-9a-fA-F]+)(?:\\n)+\s*return v0\s*")
+_SGET = re.compile(r"sget(?:-boolean|-byte|-short|-char)? [vp]\d+, \S+")
+_CONST4 = re.compile(r"const/4 ([vp]\d+), 0x([0-9a-fA-F]+)")
+
+# The near-string search looks 20 smali lines back, about 10 instructions
+# with the blank lines between them; the register search fits dex_engine's
+# default window
+_NEAR_STRING_WINDOW = "10"
+
+
+class NoDexEquivalent(Exception):
+    """A manifest row that only the apktool pipeline can apply."""
+
+
+def _spec(target: str) -> str:
+    specs = []
+    for alternative in manifest.alternatives(target)[1]:
+        kind, text = alternative.split(":", 1)
+        spec = f"L{text[:-len('.smali')]};" if kind == "class" else "*"
+        if spec not in specs:
+            specs.append(spec)
+    return ",".join(specs)
+
+
+def _replace_method(method: str, body: str):
+    match = _CONST_BODY.fullmatch(body)
+    if not match:
+        raise NoDexEquivalent(f"replace_method {method}: only a 'return <const>' body fits in place")
+    return "return_const", [method, match.group(1), "first"]
+
+
+def _replace_text(old: str, new: str):
+    match = _CONST4.fullmatch(new)
+    if not _SGET.fullmatch(old) or not match:
+        raise NoDexEquivalent(f"replace_text {old!r}: only an sget turned into const/4 fits in place")
+    return "sget_to_const", [old, match.group(1), match.group(2)]
+
+
+# manifest op -> args -> (dex_engine op, args)
+_OPS = {
+    "insert_line_before_all": lambda anchor, line: ("const_before", [anchor, line]),
+    "insert_const_before_condition_near_string": lambda text, condition, register, value: (
+        "const_before_if", [text, condition, register, value, _NEAR_STRING_WINDOW]),
+    "ensure_const_before_if_for_register": lambda invoke, condition, register, value: (
+        "const_before_if", [invoke, condition, register, value]),
+    "force_methods_return_const": lambda method, value: ("return_const", [method, value]),
+    "replace_move_result_after_invoke": lambda invoke, line: ("move_result_to_const", [invoke, line]),
+    "replace_if_block_in_strict_jar_file": lambda: ("drop_if_after", [STRICT_JAR_ANCHOR, "if-eqz v6, :"]),
+    "patch_reconcile_clinit": lambda: ("clinit_const_flip", []),
+    "replace_text": _replace_text,
+    "return_const": lambda method, value: ("return_const", [method, value, "first"]),
+    "return_void": lambda method: ("return_void", [method, "first"]),
+    "return_void_all": lambda method: ("return_void", [method]),
+    "replace_method": _replace_method,
+}
+
+
+def dex_ops(rows):
+    """Returns the (op, classes, args) DEX plan for manifest rows, in row order."""
+    ops = []
+    for jar, feature, target, op, args in rows:
+        if op not in _OPS:
+            raise NoDexEquivalent(f"{jar}/{feature} {op} on {target}: no in-place DEX op")
+        try:
+            dex_op, dex_args = _OPS[op](*args)
+        except TypeError as exc:
+            raise ValueError(f"{jar}/{feature} {op}: bad arguments {args!r}") from exc
+        ops.append((dex_op, _spec(target), dex_args))
+    return ops
+
+
+def write_plan(ops, out) -> None:
+    """Writes ops as dex-patch plan lines."""
+    for op, spec, args in ops:
+        out.write("\t".join([op, spec, *args]) + "\n")
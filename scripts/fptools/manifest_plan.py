@@ -0,0 +1,203 @@
+"""Dry run of a patch manifest against the input JARs, without decoding them.
+
+Each row the selected JARs and features need is resolved from the dex files
+alone: ``class:`` targets against the class definitions, ``method:`` and
+``methods:`` targets against the method table (rendered as the ``.method``
+lines baksmali would write), and the row's anchor (see
+``smali_engine.op_anchor``) against the rendered instructions of the classes
+found. That takes seconds where a decode takes minutes, so a job can stop
+before the decode when a release moved something the manifest relies on.
+
+``scan:`` targets name a file only once the tree exists; the literals of
+their pattern (opcodes and registers aside, which no table holds) and the
+row's anchor are looked up in the method, field and string tables instead,
+which shows the code is there but not which class holds it.
+Anchors on instructions ``dex.CodeItem.render`` does not cover are reported
+missing, so manifests should anchor on invokes, field accesses, strings,
+constants, move-results or method declarations.
+
+Rows with an optional (``?``) target that do not resolve are reported as
+``skip`` rather than failing the plan.
+"""
+
+import json
+import re
+
+from fptools import dex, manifest, smali_engine
+from fptools.scan import bre_literals
+
+OK = "ok"
+NO_TARGET = "no-target"
+NO_ANCHOR = "no-anchor"
+SKIP = "skip"
+FAILED = (NO_TARGET, NO_ANCHOR)
+
+_MNEMONIC = re.compile(
+    r"(?:nop|move|return|const|monitor|check-cast|instance-of|array-length|new-instance|new-array"
+    r"|filled-new-array|fill-array-data|throw|goto|packed-switch|sparse-switch|cmp[lg]?|if|[ais](?:get|put)"
+    r"|invoke|neg|not|(?:int|long|float|double)-to|r?sub|add|mul|div|rem|and|x?or|u?sh[lr])(?:-[\w]+)*(?:/\w+)*")
+# A string literal as baksmali writes it, escapes included
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_REGISTERS = re.compile(r"[{,]*(?:[vp]\d+(?:\s*(?:,|\.\.)\s*[vp]\d+)*)?[},]*")
+
+
+class JarTables:
+    """The dex files of one JAR with the lookups a plan needs, built on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dexes = dex.load_jar(path)
+        self._paths = None
+        self._lines = {}
+        self._ids = None
+
+    def classes(self):
+        """Returns [(smali path, dex, descriptor)] in dex order."""
+        if self._paths is None:
+            self._paths = [(descriptor[1:-1] + ".smali", dex_file, descriptor)
+                           for dex_file in self.dexes for descriptor in dex_file.class_defs()]
+        return self._paths
+
+    def find_class(self, rel: str):
+        for path, dex_file, descriptor in self.classes():
+            if ("/" + path).endswith("/" + rel):
+                return [(dex_file, descriptor)]
+        return []
+
+    def find_methods(self, text: str):
+        """Returns every (dex, descriptor) declaring a method whose .method line contains text."""
+        name = text.split("(", 1)[0].rsplit(" ", 1)[-1]
+        found = {}
+        for dex_file in self.dexes:
+            defined = dex_file.class_defs()
+            for method_idx in range(dex_file.method_ids_size):
+                if name not in dex_file.method_name(method_idx):
+                    continue
+                descriptor = dex_file.method_id(method_idx)[0]
+                if descriptor in found or descriptor not in defined:
+                    continue
+                if any(text in line for line in self._declarations(dex_file, descriptor)):
+                    found[descriptor] = dex_file
+        return [(found[descriptor], descriptor) for descriptor in sorted(found)]
+
+    def _declarations(self, dex_file, descriptor: str):
+        return [dex_file.declaration(method_idx, flags)
+                for method_idx, flags, _ in dex_file.method_entries(descriptor)]
+
+    def lines(self, dex_file, descriptor: str):
+        """Renders a class's method declarations and instructions as smali lines."""
+        key = (dex_file.name, descriptor)
+        if key not in self._lines:
+            lines = []
+            for method_idx, flags, code_off in dex_file.method_entries(descriptor):
+                lines.append(dex_file.declaration(method_idx, flags))
+                if code_off:
+                    code = dex_file.code(code_off)
+                    lines.extend(filter(None, (code.render(pc, op) for pc, op in code.instructions())))
+            self._lines[key] = lines
+        return self._lines[key]
+
+    def in_tables(self, text: str) -> bool:
+        """True when text occurs in a method or field reference or a string (escaped like baksmali)."""
+        if self._ids is None:
+            ids = []
+            for dex_file in self.dexes:
+                ids.extend(dex_file.method_ref(idx) for idx in range(dex_file.method_ids_size))
+                ids.extend(dex_file.field_ref(idx) for idx in range(dex_file.field_ids_size))
+                ids.extend(dex.smali_string(dex_file.string(idx)) for idx in range(dex_file.string_ids_size))
+            self._ids = "\n".join(ids)
+        return text in self._ids
+
+
+def _symbol(anchor: str) -> str:
+    """The part of an anchor the id tables hold: a string, a reference or a name."""
+    text = anchor.strip()
+    quoted = _QUOTED.search(text)
+    if quoted:
+        return quoted.group(1)
+    if "->" in text:
+        return text[text.rfind(" ", 0, text.index("->")) + 1:]
+    return text.rsplit(" ", 1)[-1]
+
+
+def _scan_symbols(pattern: str):
+    """The parts of a scan pattern's literals the id tables can hold."""
+    symbols = []
+    for literal in bre_literals(pattern):
+        if '"' in literal:
+            symbols.extend(_QUOTED.findall(literal))
+            continue
+        symbols.extend(word.strip(",") for word in literal.split()
+                       if not _MNEMONIC.fullmatch(word) and not _REGISTERS.fullmatch(word))
+    return [symbol for symbol in symbols if symbol]
+
+
+def _locate(tables: JarTables, target: str):
+    """Returns (alternative, [(dex, descriptor)] or None for a scan hit) or (None, [])."""
+    for alternative in manifest.alternatives(target)[1]:
+        kind, text = alternative.split(":", 1)
+        if kind == "class":
+            found = tables.find_class(text)
+        elif kind == "method":
+            found = tables.find_methods(text)[:1]
+        elif kind == "methods":
+            found = tables.find_methods(text)
+        else:
+            symbols = _scan_symbols(text)
+            found = None if symbols and all(map(tables.in_tables, symbols)) else []
+        if found is None or found:
+            return alternative, found
+    return None, []
+
+
+def check_row(tables: JarTables, row):
+    """Resolves one manifest row; returns a report entry."""
+    jar, feature, target, op, args = row
+    entry = {"jar": jar, "feature": feature, "target": target, "op": op}
+    alternative, found = _locate(tables, target)
+    if alternative is None:
+        result = dict(entry, status=NO_TARGET, where=f"not in {tables.path}")
+    else:
+        anchor = smali_engine.op_anchor(*manifest.expand(op, args))
+        if found is None:
+            status = OK if tables.in_tables(_symbol(anchor)) else NO_ANCHOR
+            result = dict(entry, status=status, where=f"{alternative} (id tables)", anchor=anchor)
+        else:
+            where = ",".join(descriptor for _, descriptor in found)
+            hit = any(anchor in line for dex_file, descriptor in found
+                      for line in tables.lines(dex_file, descriptor))
+            result = dict(entry, status=OK if hit else NO_ANCHOR, where=where, anchor=anchor)
+    if result["status"] in FAILED and manifest.alternatives(target)[0]:
+        result.update(status=SKIP, where=f"optional, {result['status']}: {result['where']}")
+    return result
+
+
+def plan(manifest_path: str, jars, features):
+    """Checks the rows of manifest for each (jar name, JAR path) and features.
+
+    Returns the report entries in manifest order.
+    """
+    rows = manifest.load(manifest_path)
+    report = []
+    for jar, path in jars:
+        selected = manifest.select(rows, jar, features)
+        if not selected:
+            continue
+        tables = JarTables(path)
+        report.extend(check_row(tables, row) for row in selected)
+    return report
+
+
+def write_report(report, stream) -> None:
+    """Writes one "status<TAB>jar<TAB>feature<TAB>op<TAB>target<TAB>where" line per row."""
+    for entry in report:
+        stream.write("\t".join((entry["status"], entry["jar"], entry["feature"], entry["op"],
+                                entry["target"], entry["where"])) + "\n")
+
+
+def write_json(report, path: str, manifest_path: str) -> None:
+    missing = sum(entry["status"] in FAILED for entry in report)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump({"manifest": manifest_path, "ok": not missing, "missing": missing, "rows": report},
+                  handle, indent=2)
+        handle.write("\n")
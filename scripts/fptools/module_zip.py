@@ -0,0 +1,153 @@
+"""Module archive builder.
+
+The shell side describes the module as a plan instead of staging a copy of
+it: one tab separated line per instruction, read in order.
+
+``tree <dir>``
+    every file below dir, at its path relative to dir
+``exclude <path>``
+    leave out path and everything below it
+``file <path> <source>``
+    the file source at path (replaces an earlier entry)
+``zip <prefix> <archive> <entry prefix>``
+    every entry of archive whose name starts with entry prefix, copied
+    without recompression to prefix + its name
+
+Files that are already compressed (JARs, APKs, native libraries, ...) are
+stored, everything else is deflated on a thread pool. Every entry gets the
+same timestamp (SOURCE_DATE_EPOCH, or 1980-01-01) and the entries are sorted,
+so the same inputs always give a byte-identical archive.
+"""
+
+import copy
+import os
+import stat
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from fptools.jar import ZipWriter
+
+_STORED_SUFFIXES = (".apk", ".jar", ".zip", ".so", ".png", ".jpg", ".webp", ".gz", ".xz", ".br")
+
+_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+def _date_time():
+    epoch = os.environ.get("SOURCE_DATE_EPOCH", "")
+    if not epoch.isdigit():
+        return _EPOCH
+    return max(_EPOCH, time.gmtime(int(epoch))[:6])
+
+
+def read_plan(handle):
+    """Parses a module plan into ({path: source}, [(prefix, archive, entry prefix)])."""
+    files = {}
+    copies = []
+    excluded = []
+    for lineno, row in enumerate(handle, 1):
+        row = row.rstrip("\n")
+        if not row:
+            continue
+        kind, *args = row.split("\t")
+        if kind == "tree" and len(args) == 1:
+            root = args[0]
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                rel = os.path.relpath(dirpath, root)
+                for filename in sorted(filenames):
+                    path = filename if rel == "." else f"{rel}/{filename}".replace(os.sep, "/")
+                    files[path] = os.path.join(dirpath, filename)
+        elif kind == "exclude" and len(args) == 1:
+            excluded.append(args[0].rstrip("/"))
+        elif kind == "file" and len(args) == 2:
+            files[args[0]] = args[1]
+        elif kind == "zip" and len(args) == 3:
+            copies.append(tuple(args))
+        else:
+            raise ValueError(f"plan line {lineno}: cannot parse {row!r}")
+
+    def kept(path):
+        return not any(path == skip or path.startswith(skip + "/") for skip in excluded)
+
+    return {path: source for path, source in files.items() if kept(path)}, [c for c in copies if kept(c[0])]
+
+
+def _name(info, path: str, date_time, mode: int):
+    info.filename = info.orig_filename = path
+    info.date_time = date_time
+    info.create_system = 3
+    info.external_attr = mode << 16
+    if stat.S_ISDIR(mode):
+        info.external_attr |= 0x10  # MS-DOS directory flag, as zipfile sets it
+    if not path.isascii():
+        info.flag_bits |= 0x800
+    return info
+
+
+def _deflate(source):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    with open(source, "rb") as handle:
+        data = handle.read()
+    return compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+
+def build(out: str, files, copies, jobs: int = 0) -> int:
+    """Writes the module archive to out; returns the number of file entries."""
+    date_time = _date_time()
+    entries = {}
+    for path, source in files.items():
+        mode = 0o755 if os.stat(source).st_mode & stat.S_IXUSR else 0o644
+        entries[path] = ("file", source, mode)
+    archives = {}
+    for prefix, archive, entry_prefix in copies:
+        if archive not in archives:
+            archives[archive] = open(archive, "rb")
+        with zipfile.ZipFile(archives[archive]) as zin:
+            for info in zin.infolist():
+                if info.filename.startswith(entry_prefix) and not info.is_dir():
+                    entries[prefix + info.filename] = ("zip", archives[archive], info)
+
+    dirs = set()
+    for path in entries:
+        parts = path.split("/")[:-1]
+        dirs.update("/".join(parts[:n]) + "/" for n in range(1, len(parts) + 1))
+
+    deflate = sorted(path for path, entry in entries.items()
+                     if entry[0] == "file" and not path.lower().endswith(_STORED_SUFFIXES))
+    tmp = f"{out}.tmp"
+    try:
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            # zlib releases the GIL, so text entries compress side by side
+            compressed = dict(zip(deflate, pool.map(lambda path: _deflate(entries[path][1]), deflate)))
+            with open(tmp, "wb") as dst:
+                writer = ZipWriter(dst)
+                for path in sorted(dirs | set(entries)):
+                    if path in dirs:
+                        info = _name(zipfile.ZipInfo(), path, date_time, stat.S_IFDIR | 0o755)
+                        writer.add_compressed(info, b"", 0, 0)
+                        continue
+                    kind, source, extra = entries[path]
+                    if kind == "zip":
+                        # Keeps the compression of the source entry
+                        target = _name(copy.copy(extra), path, date_time, stat.S_IFREG | 0o644)
+                        target.extra = target.comment = b""
+                        writer.copy(source, extra, target)
+                        continue
+                    info = _name(zipfile.ZipInfo(), path, date_time, stat.S_IFREG | extra)
+                    if path in compressed:
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        writer.add_compressed(info, *compressed[path])
+                    else:
+                        writer.write(info, source)
+                writer.finish()
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        for handle in archives.values():
+            handle.close()
+    os.replace(tmp, out)
+    return len(entries)
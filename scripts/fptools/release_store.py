@@ -0,0 +1,261 @@
+"""Content-addressed store for GitHub release assets (the Kaorios Toolbox).
+
+Layout under the store root::
+
+    objects/<sha256>        asset contents, named by their digest
+    derived/<sha256>/       a tree made from the object of that digest
+                            (the utility smali baksmali writes for a classes.dex)
+    releases/<tag>.json     {"tag", "assets": {name: {"sha256", "file", "size", "id", "updated_at"}}}
+    api/<key>.json, .etag   the last releases API response for a URL and its ETag
+
+``fetch`` asks the API with If-None-Match, so an unchanged release costs a
+304 without a body, and downloads only assets whose digest is not stored yet:
+the API's ``digest`` field when the release has one, otherwise the digest
+recorded for the same asset (id and update time) on an earlier run. Downloads
+are hashed while they stream into the store. With ``offline`` nothing goes to
+the network; the cached response (or, for a tag, its release record) and the
+stored objects must cover the request. ``verify`` rehashes what a release
+record points at, and compares installed copies with it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import urllib.error
+import urllib.request
+
+from fptools.smali_engine import log
+
+CHUNK = 1 << 20
+TIMEOUT = 60
+
+
+class StoreError(Exception):
+    """The store cannot satisfy a request: an offline miss, an HTTP error or a bad digest."""
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_digest(path: str) -> str:
+    """Digest of the relative paths and contents of the files below path."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            digest.update(os.path.relpath(full, path).encode("utf-8", "surrogateescape") + b"\0")
+            digest.update(bytes.fromhex(sha256_file(full)))
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+
+
+class Store:
+    """One store root; see the module docstring for the layout."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest)
+
+    def derived_path(self, digest: str) -> str:
+        return os.path.join(self.root, "derived", digest)
+
+    def has(self, digest: str) -> bool:
+        return bool(digest) and os.path.isfile(self.object_path(digest))
+
+    def add_stream(self, stream, expected: str = "") -> str:
+        """Stores what stream yields under its digest; returns the digest."""
+        directory = os.path.join(self.root, "objects")
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=".", delete=False) as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+        value = digest.hexdigest()
+        if expected and value != expected:
+            os.remove(tmp.name)
+            raise StoreError(f"downloaded sha256 {value} does not match {expected}")
+        os.replace(tmp.name, self.object_path(value))
+        return value
+
+    def _release_path(self, tag: str) -> str:
+        return os.path.join(self.root, "releases", re.sub(r"[^\w.-]", "_", tag) + ".json")
+
+    def release(self, tag: str):
+        """Returns the record of tag, or None."""
+        try:
+            with open(self._release_path(tag), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def save_release(self, record) -> None:
+        _write_atomic(self._release_path(record["tag"]), (json.dumps(record, indent=2) + "\n").encode())
+
+
+def _request(url: str, token: str = "", etag: str = ""):
+    headers = {"User-Agent": "FrameworkPatcher", "Accept": "application/vnd.github+json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if etag:
+        headers["If-None-Match"] = etag
+    return urllib.request.Request(url, headers=headers)
+
+
+def api_get(store: Store, url: str, token: str = "", offline: bool = False):
+    """Returns the JSON at url, revalidating the stored copy with its ETag."""
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    body_path = os.path.join(store.root, "api", f"{key}.json")
+    etag_path = os.path.join(store.root, "api", f"{key}.etag")
+    cached = os.path.isfile(body_path)
+    if offline:
+        if not cached:
+            raise StoreError(f"{url} was never fetched into {store.root}")
+        with open(body_path, "rb") as handle:
+            return json.loads(handle.read())
+
+    etag = ""
+    if cached and os.path.isfile(etag_path):
+        with open(etag_path, encoding="utf-8") as handle:
+            etag = handle.read().strip()
+    try:
+        with urllib.request.urlopen(_request(url, token, etag), timeout=TIMEOUT) as response:
+            body = response.read()
+            etag = response.headers.get("ETag", "")
+    except urllib.error.HTTPError as exc:
+        if exc.code != 304 or not cached:
+            raise StoreError(f"{url}: HTTP {exc.code} {exc.reason}") from exc
+        log(f"Release info unchanged since the last check ({etag})")
+        with open(body_path, "rb") as handle:
+            return json.loads(handle.read())
+    except urllib.error.URLError as exc:
+        raise StoreError(f"{url}: {exc.reason}") from exc
+
+    release = json.loads(body)
+    _write_atomic(body_path, body)
+    if etag:
+        _write_atomic(etag_path, etag.encode())
+    elif os.path.exists(etag_path):
+        os.remove(etag_path)
+    return release
+
+
+def _download(store: Store, url: str, expected: str) -> str:
+    try:
+        with urllib.request.urlopen(_request(url), timeout=TIMEOUT) as response:
+            return store.add_stream(response, expected)
+    except urllib.error.HTTPError as exc:
+        raise StoreError(f"{url}: HTTP {exc.code} {exc.reason}") from exc
+    except urllib.error.URLError as exc:
+        raise StoreError(f"{url}: {exc.reason}") from exc
+
+
+def _from_record(store: Store, record, names):
+    paths = {}
+    for name in names:
+        entry = record["assets"].get(name)
+        if not entry or not store.has(entry["sha256"]):
+            raise StoreError(f"{name} of {record['tag']} is not in {store.root}")
+        paths[name] = store.object_path(entry["sha256"])
+    return paths
+
+
+def fetch(store: Store, api_url: str, assets, token: str = "", offline: bool = False, tag: str = "",
+          download: bool = True):
+    """Brings the release at api_url into the store.
+
+    ``assets`` maps local names to regexes over the release's asset names.
+    ``tag`` lets an offline run use the stored record instead of the API
+    response. Returns (tag, {name: object path}); without ``download`` the
+    assets not stored yet map to "".
+    """
+    record = store.release(tag) if offline and tag else None
+    if record:
+        return tag, _from_record(store, record, assets)
+
+    release = api_get(store, api_url, token, offline)
+    tag = release.get("tag_name") or ""
+    if not tag:
+        raise StoreError(f"{api_url}: no tag_name in the response")
+    known = (store.release(tag) or {}).get("assets", {})
+    record = {"tag": tag, "assets": dict(known)}
+    paths = {}
+    for name, pattern in assets.items():
+        regex = re.compile(pattern)
+        asset = next((a for a in release.get("assets", []) if regex.search(a.get("name", ""))), None)
+        if asset is None:
+            raise StoreError(f"{tag} has no asset matching {pattern}")
+        api_digest = asset.get("digest") or ""
+        digest = api_digest.split(":", 1)[1] if api_digest.startswith("sha256:") else ""
+        entry = known.get(name, {})
+        if not digest and (entry.get("id"), entry.get("updated_at")) == (asset.get("id"), asset.get("updated_at")):
+            digest = entry.get("sha256", "")
+
+        if store.has(digest):
+            log(f"{asset['name']} ({tag}) already in the store")
+        elif not download:
+            paths[name] = ""
+            continue
+        elif offline:
+            raise StoreError(f"{asset['name']} of {tag} is not in {store.root}")
+        else:
+            log(f"Downloading {asset['name']} ({tag})")
+            digest = _download(store, asset["browser_download_url"], digest)
+        record["assets"][name] = {"sha256": digest, "file": asset["name"], "size": asset.get("size"),
+                                  "id": asset.get("id"), "updated_at": asset.get("updated_at")}
+        paths[name] = store.object_path(digest)
+    if download:
+        store.save_release(record)
+    return tag, paths
+
+
+def verify(store: Store, tag: str, files=(), trees=()):
+    """Checks a release record against the store and installed copies.
+
+    ``files`` are (asset name, path) pairs whose contents must match the
+    asset; ``trees`` are (asset name, dir) pairs that must match the tree
+    derived from it. Returns a list of problems, empty when all is well.
+    """
+    record = store.release(tag)
+    if record is None:
+        return [f"no record of {tag} in {store.root}"]
+    problems = []
+    for name, entry in sorted(record["assets"].items()):
+        path = store.object_path(entry["sha256"])
+        if not os.path.isfile(path):
+            problems.append(f"{name}: object {entry['sha256']} missing")
+        elif sha256_file(path) != entry["sha256"]:
+            problems.append(f"{name}: object {entry['sha256']} is corrupt")
+    for name, path in files:
+        entry = record["assets"].get(name)
+        if entry is None:
+            problems.append(f"{name}: not part of {tag}")
+        elif not os.path.isfile(path):
+            problems.append(f"{name}: {path} missing")
+        elif sha256_file(path) != entry["sha256"]:
+            problems.append(f"{name}: {path} differs from {tag}")
+    for name, path in trees:
+        entry = record["assets"].get(name)
+        derived = store.derived_path(entry["sha256"]) if entry else ""
+        if not derived or not os.path.isdir(derived):
+            problems.append(f"{name}: nothing derived from it in the store")
+        elif not os.path.isdir(path) or tree_digest(path) != tree_digest(derived):
+            problems.append(f"{name}: {path} differs from the tree derived from {tag}")
+    return problems
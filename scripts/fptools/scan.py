@@ -0,0 +1,234 @@
+"""Parallel content search over a smali tree.
+
+``scan`` answers a batch of patterns in one pass: the file list is split into
+shards that a process pool reads once each, and every file is checked against
+all patterns. Patterns use grep's basic regex syntax, so the shell helpers can
+pass the expressions they used to hand to ``grep``. A literal taken from each
+pattern goes into one ``anchors.Automaton``, so every file is matched against
+all of them in a single pass and each regex only runs on the lines holding
+its literal.
+
+Results can be kept in the method index directory (``scan.tsv``), one batch
+of patterns per ``update_cache`` call. ``smali_index.refresh_many`` rescans
+the files it re-indexes, so the cached hits follow later edits.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from fptools import anchors, smali_index
+
+_POSIX_CLASSES = {
+    "[:space:]": r"\s",
+    "[:blank:]": r" \t",
+    "[:digit:]": "0-9",
+    "[:alpha:]": "a-zA-Z",
+    "[:alnum:]": "a-zA-Z0-9",
+    "[:upper:]": "A-Z",
+    "[:lower:]": "a-z",
+    "[:xdigit:]": "0-9A-Fa-f",
+}
+
+
+def _bracket(pattern: str, i: int):
+    """Translates the bracket expression starting at pattern[i]; returns (regex, next index)."""
+    j = i + 1
+    out = "["
+    if j < len(pattern) and pattern[j] == "^":
+        out += "^"
+        j += 1
+    if j < len(pattern) and pattern[j] == "]":
+        out += r"\]"
+        j += 1
+    while j < len(pattern) and pattern[j] != "]":
+        for name, translated in _POSIX_CLASSES.items():
+            if pattern.startswith(name, j):
+                out += translated
+                j += len(name)
+                break
+        else:
+            out += "\\\\" if pattern[j] == "\\" else pattern[j]
+            j += 1
+    if j >= len(pattern):
+        raise ValueError(f"unterminated bracket expression in {pattern!r}")
+    return out + "]", j + 1
+
+
+def _translate(pattern: str):
+    """Returns (Python regex source, literal runs every match contains) for a grep BRE."""
+    out = []
+    literals = []
+    run = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            i += 2
+            if nxt in "(){}|+?":
+                # GNU BRE operators; a quantifier also makes the previous char optional
+                if nxt in "{+?" and run:
+                    run = run[:-1]
+                out.append(nxt)
+                literals.append(run)
+                run = ""
+            elif nxt.isalnum():
+                out.append("\\" + nxt)
+                literals.append(run)
+                run = ""
+            else:
+                out.append(re.escape(nxt))
+                run += nxt
+            continue
+        if c == "[":
+            translated, i = _bracket(pattern, i)
+            out.append(translated)
+            literals.append(run)
+            run = ""
+            continue
+        if c == "*" and out:
+            out.append("*")
+            run = run[:-1]
+            literals.append(run)
+            run = ""
+        elif c == "." or (c == "^" and i == 0) or (c == "$" and i == len(pattern) - 1):
+            out.append(c)
+            literals.append(run)
+            run = ""
+        else:
+            out.append(re.escape(c))
+            run += c
+        i += 1
+    literals.append(run)
+    # Alternation or a quantified group can make any literal optional
+    if "\\|" in pattern or "\\(" in pattern:
+        literals = []
+    return "".join(out), [literal for literal in literals if literal]
+
+
+def compile_bre(pattern: str):
+    """Returns (compiled regex, longest literal every match contains) for a grep BRE."""
+    source, literals = _translate(pattern)
+    return re.compile(source), max(literals, key=len, default="")
+
+
+def bre_literals(pattern: str):
+    """Returns every literal run a match of the grep BRE contains, in pattern order."""
+    return _translate(pattern)[1]
+
+
+def _scan_shard(args):
+    paths, patterns = args
+    compiled = [compile_bre(pattern) for pattern in patterns]
+    automaton = anchors.Automaton(literal for _, literal in compiled)
+    hits = []
+    for path in paths:
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+        except OSError:
+            continue
+        found = automaton.line_hits(data)
+        lines = None
+        for index, (regex, literal) in enumerate(compiled):
+            if literal and literal not in found:
+                continue
+            if lines is None:
+                lines = data.decode("utf-8", "surrogateescape").splitlines()
+            # A match holds its pattern's literal, so only those lines can match
+            for lineno in found[literal] if literal else range(len(lines)):
+                line = lines[lineno]
+                if regex.search(line):
+                    hits.append((index, path, lineno + 1, line))
+    return hits
+
+
+def scan(decompile_dir: str, patterns, jobs: int = 0):
+    """Returns {pattern: [(path, lineno, line), ...]} in tree order for every pattern."""
+    for pattern in patterns:
+        compile_bre(pattern)  # report bad patterns before starting workers
+    paths = list(smali_index.iter_smali_files(decompile_dir))
+    jobs = jobs or os.cpu_count() or 1
+    shards = max(1, min(len(paths), jobs * 4))
+    size = -(-len(paths) // shards) if paths else 0
+    work = [(paths[start:start + size], list(patterns)) for start in range(0, len(paths), size or 1)]
+
+    if jobs == 1 or len(work) < 2:
+        results = [_scan_shard(item) for item in work]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+            results = list(pool.map(_scan_shard, work))
+
+    return _collect(patterns, results)
+
+
+def _collect(patterns, results):
+    found = {pattern: [] for pattern in patterns}
+    for shard in results:
+        for index, path, lineno, line in shard:
+            found[patterns[index]].append((path, lineno, line))
+    return found
+
+
+def write_results(found, stream) -> None:
+    """Writes ``pattern<TAB>path<TAB>lineno<TAB>line`` rows.
+
+    Each pattern also gets a row with an empty path, so readers can tell a
+    pattern without matches from one that was never scanned.
+    """
+    for pattern, hits in found.items():
+        stream.write(f"{pattern}\t\t0\t\n")
+        for path, lineno, line in hits:
+            stream.write(f"{pattern}\t{path}\t{lineno}\t{line}\n")
+
+
+def read_results(path):
+    """Reads a file written by write_results back into {pattern: hits}."""
+    found = {}
+    try:
+        handle = open(path, encoding="utf-8", errors="surrogateescape")
+    except FileNotFoundError:
+        return found
+    with handle:
+        for row in handle:
+            pattern, path_field, lineno, line = row.rstrip("\n").split("\t", 3)
+            hits = found.setdefault(pattern, [])
+            if path_field:
+                hits.append((path_field, int(lineno), line))
+    return found
+
+
+def _write_cache(cache, found) -> None:
+    tmp = cache.with_name(cache.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as handle:
+        write_results(found, handle)
+    os.replace(tmp, cache)
+
+
+def update_cache(decompile_dir: str, patterns, jobs: int = 0):
+    """Scans for patterns and stores the hits with the method index.
+
+    Patterns cached by earlier calls are kept; rescanned ones are replaced.
+    """
+    found = scan(decompile_dir, patterns, jobs)
+    cache = smali_index.index_dir_for(decompile_dir) / smali_index.SCAN_CACHE
+    merged = read_results(cache)
+    merged.update(found)
+    _write_cache(cache, merged)
+    return found
+
+
+def refresh_cache(index_dir, paths, drop) -> None:
+    """Rescans edited files for every cached pattern; drop holds stale paths."""
+    cache = index_dir / smali_index.SCAN_CACHE
+    found = read_results(cache)
+    if not found:
+        return
+    patterns = list(found)
+    fresh = _collect(patterns, [_scan_shard(([p for p in paths if os.path.isfile(p)], patterns))])
+    for pattern in patterns:
+        hits = [hit for hit in found[pattern] if hit[0] not in drop] + fresh[pattern]
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        found[pattern] = hits
+    _write_cache(cache, found)
@@ -0,0 +1,50 @@
+"""Small smali parsing primitives shared by the index and the patch engine."""
+
+
+def method_spans(lines):
+    """Yields (start, end, decl) for every method in one pass over lines.
+
+    ``start``/``end`` are 0-based indexes of the ``.method`` and ``.end method``
+    lines; ``decl`` is the stripped declaration.
+    """
+    start = -1
+    decl = ""
+    for idx, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped.startswith("."):
+            continue
+        if stripped.startswith(".method"):
+            start, decl = idx, stripped
+        elif stripped.startswith(".end method") and start >= 0:
+            yield start, idx, decl
+            start = -1
+
+
+def class_descriptor(lines) -> str:
+    """Returns the ``L...;`` descriptor from the ``.class`` line, or ""."""
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(".class"):
+            return stripped.rsplit(None, 1)[-1]
+    return ""
+
+
+def param_registers(decl: str) -> int:
+    """Returns how many registers the parameters of a .method declaration take.
+
+    ``this`` counts for non-static methods, ``J`` and ``D`` take two.
+    """
+    words = decl.split()
+    signature = words[-1]
+    params = signature[signature.index("(") + 1:signature.index(")")]
+    count = 0 if "static" in words[:-1] else 1
+    i = 0
+    while i < len(params):
+        first = i
+        while params[i] == "[":
+            i += 1
+        if params[i] == "L":
+            i = params.index(";", i)
+        count += 2 if params[first] in "JD" else 1
+        i += 1
+    return count
@@ -0,0 +1,706 @@
+"""Batched smali line edits.
+
+The shell helpers (``smali_op``) and the patch manifests (``fptools.manifest``)
+queue operations into a plan file (one op per line, tab separated:
+``op<TAB>file<TAB>args...``). ``apply_plan``
+groups them by file, loads each file once, runs every op against the same
+line buffer and writes the file back once.
+
+The file is memory-mapped and the anchors of all its ops are located in one
+scan (``anchors.Automaton``), so an op whose anchor does not occur returns
+without splitting the file into lines and the others start from the lines
+that hold their anchor. Ops record inserts and deletes as splices
+against the current line numbers; the splices of one op are applied in a
+single pass afterwards, and the result is streamed out line by line. That
+keeps an op linear in the file size however many lines it inserts.
+
+Each op returns ``OK``, ``NO_MATCH`` or ``NO_END``; log lines match the
+messages the standalone shell helpers used to print.
+"""
+
+import mmap
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+from fptools import anchors, smali_index
+from fptools.scan import compile_bre
+from fptools.smali import class_descriptor, method_spans, param_registers
+
+OK = 0
+NO_MATCH = 3
+NO_END = 5
+
+_INDENT = re.compile(r"\s*")
+_REGISTER = re.compile(r"\b[vp]\d+\b")
+
+
+def _indent(line: str) -> str:
+    return _INDENT.match(line).group(0)
+
+
+def log(msg: str) -> None:
+    print(f"[INFO] {msg}", file=sys.stderr)
+
+
+def warn(msg: str) -> None:
+    print(f"[WARN] {msg}", file=sys.stderr)
+
+
+class Buffer:
+    """Line buffer for one smali file with a dirty flag.
+
+    ``lines`` is read from a memory map on first use. Structural edits go
+    through ``splice``/``insert``/``delete`` and take effect on ``flush``.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.changed = False
+        self._lines = None
+        self._pending = []
+        self._anchors = frozenset()
+        self._anchor_hits = {}
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size:
+                self._data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = b""
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = bytes(self._data).decode("utf-8", "surrogateescape").splitlines()
+            self._release()
+        self.flush()
+        return self._lines
+
+    @lines.setter
+    def lines(self, value):
+        self._release()
+        self._pending = []
+        self._lines = value
+
+    def _release(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b""
+
+    def find_anchors(self, automaton) -> None:
+        """Locates the automaton's anchors with one scan of the unedited file."""
+        self._anchors = automaton.anchors
+        self._anchor_hits = automaton.line_hits(self._data if self._lines is None else
+                                                "\n".join(self._lines).encode("utf-8", "surrogateescape"))
+
+    def _knows(self, text: str) -> bool:
+        # The anchor scan describes the file as it was loaded
+        return text in self._anchors and not self.changed
+
+    def contains(self, text: str) -> bool:
+        """True when text occurs in the file; cheap before the lines are loaded."""
+        if self._knows(text):
+            return text in self._anchor_hits
+        if self._lines is None:
+            return self._data.find(text.encode("utf-8", "surrogateescape")) != -1
+        return any(text in line for line in self.lines)
+
+    def lines_with(self, text: str):
+        """Returns the indexes of the lines containing text."""
+        if self._knows(text):
+            return list(self._anchor_hits.get(text, ()))
+        return [i for i, line in enumerate(self.lines) if text in line]
+
+    def splice(self, start: int, end: int, new_lines) -> None:
+        """Queues replacing lines[start:end] (current numbering) with new_lines."""
+        self._pending.append((start, end, list(new_lines)))
+        self.changed = True
+
+    def insert(self, index: int, line: str) -> None:
+        self.splice(index, index, [line])
+
+    def delete(self, index: int) -> None:
+        self.splice(index, index + 1, [])
+
+    def flush(self) -> None:
+        """Applies the queued splices in one pass over the lines."""
+        if not self._pending:
+            return
+        lines = self._lines
+        out = []
+        cursor = 0
+        # Stable sort keeps several inserts at one index in queue order
+        for start, end, new_lines in sorted(self._pending, key=lambda splice: splice[0]):
+            out.extend(lines[cursor:start])
+            out.extend(new_lines)
+            cursor = max(cursor, end)
+        out.extend(lines[cursor:])
+        self._pending = []
+        self._lines = out
+
+    def save(self) -> bool:
+        """Writes the buffer back if it changed.
+
+        The new content goes to a sibling temp file that replaces the original,
+        so a tree hardlinked from the decompile cache never has the cached copy
+        rewritten underneath it.
+        """
+        self._release()
+        if not self.changed:
+            return False
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as handle:
+            handle.writelines(f"{line}\n" for line in self.lines)
+        os.replace(tmp, self.path)
+        return True
+
+
+# ----------------------------------------------
+# Operations
+# ----------------------------------------------
+
+STRICT_JAR_ANCHOR = ("invoke-virtual {p0, v5}, Landroid/util/jar/StrictJarFile;->findEntry"
+                      "(Ljava/lang/String;)Ljava/util/zip/ZipEntry;")
+_CLINIT_ANCHOR = ".method static constructor <clinit>()V"
+
+def insert_line_before_all(buf: Buffer, pattern: str, new_line: str) -> int:
+    if not buf.contains(pattern):
+        return NO_MATCH
+    lines = buf.lines
+    for i in buf.lines_with(pattern):
+        line = lines[i]
+        if i > 0 and lines[i - 1].strip() == new_line.strip():
+            continue
+        buf.insert(i, f"{_indent(line)}{new_line}")
+    return OK
+
+
+def _lines_before(inserted, idx: int, count: int, first_line: bool):
+    """Yields the indexes of the lines among the count lines before idx.
+
+    ``count`` is measured in the edited file, so lines queued in ``inserted``
+    (index -> lines queued before it) take up room in the window too. The
+    first line of the file is only looked at when ``first_line`` is set.
+    """
+    remaining = count - inserted[idx]
+    j = idx - 1
+    while remaining > 0 and j >= 0:
+        if j == 0 and not inserted[0] and not first_line:
+            return
+        yield j
+        remaining -= 1 + inserted[j]
+        j -= 1
+
+
+def _const_before_condition(buf: Buffer, anchor: str, condition_prefix: str, register: str,
+                            value: str, window: int, first_line: bool) -> int:
+    if not buf.contains(anchor):
+        return NO_MATCH
+    lines = buf.lines
+    const = f"const/4 {register}, 0x{value}"
+    inserted = Counter()
+    for idx in buf.lines_with(anchor):
+        for j in _lines_before(inserted, idx, window, first_line):
+            if lines[j].strip().startswith(condition_prefix):
+                # A const queued before j by an earlier anchor counts as present
+                if not inserted[j] and (j == 0 or lines[j - 1].strip() != const):
+                    buf.insert(j, f"{_indent(lines[j])}{const}")
+                    inserted[j] += 1
+                break
+    return OK
+
+
+def insert_const_before_condition_near_string(buf: Buffer, search_string: str, condition_prefix: str,
+                                              register: str, value: str) -> int:
+    return _const_before_condition(buf, search_string, condition_prefix, register, value, 20, True)
+
+
+def ensure_const_before_if_for_register(buf: Buffer, invoke_pattern: str, condition_prefix: str,
+                                        register: str, value: str) -> int:
+    return _const_before_condition(buf, invoke_pattern, condition_prefix, register, value, 9, False)
+
+
+def replace_move_result_after_invoke(buf: Buffer, invoke_pattern: str, replacement: str) -> int:
+    if not buf.contains(invoke_pattern):
+        return NO_MATCH
+    lines = buf.lines
+    for i in buf.lines_with(invoke_pattern):
+        for j in range(i + 1, min(i + 6, len(lines))):
+            target = lines[j].strip()
+            if target.startswith("move-result"):
+                if target != replacement:
+                    lines[j] = f"{_indent(lines[j])}{replacement}"
+                    buf.changed = True
+                break
+    return OK
+
+
+def force_methods_return_const(buf: Buffer, method_key: str, ret_val: str) -> int:
+    if not buf.contains(method_key):
+        return NO_MATCH
+    lines = buf.lines
+    const_line = f"const/4 v0, 0x{ret_val}"
+    found = 0
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].lstrip()
+        if not (stripped.startswith(".method") and method_key in stripped) or ")V" in stripped:
+            i += 1
+            continue
+        found += 1
+        j = i + 1
+        while j < len(lines) and not lines[j].lstrip().startswith(".end method"):
+            j += 1
+        if j >= len(lines):
+            break
+        body = lines[i:j + 1]
+        if not (len(body) >= 4 and body[1].strip() == ".registers 8"
+                and body[2].strip() == const_line and body[3].strip().startswith("return")):
+            buf.splice(i + 1, j + 1, ["    .registers 8", f"    {const_line}", "    return v0", ".end method"])
+        i = j + 1
+    return OK if found else NO_MATCH
+
+
+def replace_if_block_in_strict_jar_file(buf: Buffer, anchor: str = STRICT_JAR_ANCHOR) -> int:
+    if not buf.contains(anchor):
+        return OK
+    lines = buf.lines
+    for idx in buf.lines_with(anchor):
+        for j in range(idx + 1, min(idx + 12, len(lines))):
+            if lines[j].strip().startswith("if-eqz v6, :cond_"):
+                buf.delete(j)
+                # The label search below works on the lines after the removal
+                lines = buf.lines
+                break
+        for j in range(idx + 1, min(idx + 20, len(lines))):
+            stripped = lines[j].strip()
+            if re.match(r":cond_[0-9a-zA-Z_]+", stripped):
+                if j + 1 < len(lines) and lines[j + 1].strip() == "nop":
+                    break
+                indent = _indent(lines[j])
+                buf.insert(j + 1, f"{indent}nop")
+                lines[j] = f"{indent}{stripped}"
+                break
+        break
+    return OK
+
+
+def patch_reconcile_clinit(buf: Buffer) -> int:
+    if not buf.contains(_CLINIT_ANCHOR):
+        return OK
+    lines = buf.lines
+    for idx in buf.lines_with(_CLINIT_ANCHOR):
+        for j in range(idx + 1, len(lines)):
+            stripped = lines[j].strip()
+            if stripped == ".end method":
+                break
+            if stripped == "const/4 v0, 0x0":
+                lines[j] = lines[j].replace("0x0", "0x1")
+                buf.changed = True
+                break
+        break
+    return OK
+
+
+def insert_line_after_move_result(buf: Buffer, invoke_pattern: str, move_result: str, new_line: str,
+                                  window: str = "1", scope: str = "first") -> int:
+    """Inserts new_line after the move_result line within window lines of an invoke.
+
+    With ``scope`` ``first`` only the first invoke followed by move_result is
+    patched; a new_line already in place counts as patched.
+    """
+    if not buf.contains(invoke_pattern):
+        return NO_MATCH
+    lines = buf.lines
+    patched = 0
+    for i in buf.lines_with(invoke_pattern):
+        for j in range(i + 1, min(i + 1 + int(window), len(lines))):
+            stripped = lines[j].strip()
+            if stripped == new_line:
+                patched += 1
+                break
+            if stripped == move_result:
+                if j + 1 >= len(lines) or lines[j + 1].strip() != new_line:
+                    buf.insert(j + 1, f"{_indent(lines[j])}{new_line}")
+                patched += 1
+                break
+        if patched and scope == "first":
+            break
+    return OK if patched else NO_MATCH
+
+
+def _bre_lines(buf: Buffer, pattern: str):
+    """Returns the indexes of the lines matching a grep BRE."""
+    regex, literal = compile_bre(pattern)
+    if literal and not buf.contains(literal):
+        return []
+    lines = buf.lines
+    candidates = buf.lines_with(literal) if literal else range(len(lines))
+    return [i for i in candidates if regex.search(lines[i])]
+
+
+def insert_line_before_match(buf: Buffer, pattern: str, new_line: str, scope: str = "all") -> int:
+    """Like insert_line_before_all, for the lines matching a grep BRE."""
+    matches = _bre_lines(buf, pattern)
+    if not matches:
+        return NO_MATCH
+    lines = buf.lines
+    for i in matches[:1] if scope == "first" else matches:
+        if i > 0 and lines[i - 1].strip() == new_line.strip():
+            continue
+        buf.insert(i, f"{_indent(lines[i])}{new_line}")
+    return OK
+
+
+def delete_line_after_match(buf: Buffer, pattern: str, target: str) -> int:
+    """Deletes the first line containing target after the first line matching pattern."""
+    matches = _bre_lines(buf, pattern)
+    if not matches:
+        return NO_MATCH
+    lines = buf.lines
+    for j in range(matches[0] + 1, len(lines)):
+        if target in lines[j]:
+            buf.delete(j)
+            return OK
+    return NO_MATCH
+
+
+def insert_line_after_in_method(buf: Buffer, method_pattern: str, line_pattern: str, new_line: str) -> int:
+    """Inserts new_line after the first line containing line_pattern in a method."""
+    if not buf.contains(method_pattern):
+        return NO_MATCH
+    lines = buf.lines
+    matcher = re.compile(r"^\s*\.method.*" + re.escape(method_pattern))
+    for start, end, _ in method_spans(lines):
+        if not matcher.match(lines[start]):
+            continue
+        for j in range(start + 1, end):
+            if line_pattern in lines[j]:
+                if lines[j + 1].strip() != new_line:
+                    buf.insert(j + 1, f"{_indent(lines[j])}{new_line}")
+                return OK
+        break
+    return NO_MATCH
+
+
+def replace_text(buf: Buffer, old: str, new: str) -> int:
+    """Replaces every occurrence of old, like sed 's/old/new/g'."""
+    if not buf.contains(old):
+        return NO_MATCH
+    lines = buf.lines
+    for i in buf.lines_with(old):
+        lines[i] = lines[i].replace(old, new)
+    buf.changed = True
+    return OK
+
+
+def replace_method_body(buf: Buffer, pattern: str, scope: str, body: str, _message: str = "") -> int:
+    """Replaces the body of methods whose declaration matches pattern.
+
+    Method boundaries come from one pass over the buffer and each matching
+    body is queued as one splice, so large classes stay linear. ``pattern`` follows
+    the old ``grep '^\\s*\\.method.*<pattern>'`` lookup, ``scope`` is ``first``
+    or ``all`` and ``body`` uses ``\\n`` for line breaks.
+    """
+    if not buf.contains(pattern):
+        return NO_MATCH
+    lines = buf.lines
+    matcher = re.compile(r"^\s*\.method.*" + re.escape(pattern))
+    body_lines = body.replace("\\n", "\n").split("\n")
+
+    if not any(matcher.match(line) for line in lines):
+        return NO_MATCH
+
+    replaced = 0
+    for start, end, _ in method_spans(lines):
+        if not matcher.match(lines[start]):
+            continue
+        buf.splice(start + 1, end + 1, body_lines + [".end method"])
+        replaced += 1
+        if scope == "first":
+            break
+    return OK if replaced else NO_END
+
+
+def register_shape(line: str) -> str:
+    """The stripped line with its registers masked, to match an instruction in any method."""
+    return _REGISTER.sub("r", line.strip())
+
+
+def _own_fields(lines):
+    """Returns {name: name:type} for the fields the class declares."""
+    fields = {}
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(".field "):
+            member = next(word for word in stripped.split("=", 1)[0].split() if ":" in word)
+            fields[member.split(":", 1)[0]] = member
+    return fields
+
+
+def _retype_own_fields(text: str, descriptor: str, fields) -> str:
+    """Gives text's references to the class's own fields the types the class declares."""
+    return re.sub(re.escape(descriptor + "->") + r"([\w$]+):[^\s,]+",
+                  lambda m: descriptor + "->" + fields.get(m.group(1), m.group(0).split("->", 1)[1]), text)
+
+
+def _register_map(template: str, target: str):
+    """Maps the registers of template onto those of target, an instruction of the same shape.
+
+    Registers the target uses that the template does not map take the
+    template's freed ones, so the mapping renames a block one-to-one.
+    Returns None when one template register would need two names.
+    """
+    mapping = {}
+    for old, new in zip(_REGISTER.findall(template), _REGISTER.findall(target)):
+        if mapping.setdefault(old, new) != new:
+            return None
+    if len(set(mapping.values())) != len(mapping):
+        return None
+    freed = [old for old in mapping if old not in mapping.values()]
+    taken = [new for new in mapping.values() if new not in mapping]
+    mapping.update(zip(taken, freed))
+    return mapping
+
+
+def insert_template_block(buf: Buffer, method: str, position: str, anchor: str, locals_: str, marker: str,
+                          block: str) -> int:
+    """Inserts a block of template lines into the method whose signature is method.
+
+    ``position`` is ``start`` (right after ``.registers``/``.locals``), or
+    ``first``/``last`` for before the first/last instruction with the
+    ``register_shape`` of anchor, the template instruction the block
+    precedes; the block's registers are then renamed after the ones that
+    instruction uses. The method gets at least ``locals_`` local registers.
+    References of anchor and block to the class's own fields take the field
+    types the class declares, so they match by field name, and block labels
+    the method already uses are renamed. A method holding the marker line
+    (in any registers) counts as patched; ``block`` is newline separated.
+    """
+    if not buf.contains(method):
+        return NO_MATCH
+    lines = buf.lines
+    for start, end, decl in method_spans(lines):
+        if decl.rsplit(None, 1)[-1] == method:
+            break
+    else:
+        return NO_MATCH
+    if any(register_shape(lines[i]) == register_shape(marker) for i in range(start + 1, end)):
+        return OK
+
+    registers = next((i for i in range(start + 1, end)
+                      if lines[i].strip().startswith((".registers ", ".locals "))), None)
+    if registers is None:
+        return NO_MATCH
+    descriptor = class_descriptor(lines)
+    fields = _own_fields(lines)
+    text = _retype_own_fields(block, descriptor, fields)
+    if position == "start":
+        at = registers + 1
+    else:
+        anchor = _retype_own_fields(anchor.strip(), descriptor, fields)
+        shape = register_shape(anchor)
+        hits = [i for i in range(start + 1, end) if register_shape(lines[i]) == shape]
+        if not hits:
+            return NO_MATCH
+        at = hits[0] if position == "first" else hits[-1]
+        mapping = _register_map(anchor, lines[at].strip())
+        if mapping is None:
+            return NO_MATCH
+        text = _REGISTER.sub(lambda m: mapping.get(m.group(0), m.group(0)), text)
+
+    directive, count = lines[registers].split()
+    params = param_registers(decl)
+    have = int(count) - params if directive == ".registers" else int(count)
+    if have < int(locals_):
+        buf.splice(registers, registers + 1, [f"{_indent(lines[registers])}.registers {int(locals_) + params}"])
+
+    used = {lines[i].strip() for i in range(start + 1, end) if lines[i].strip().startswith(":")}
+    for label in sorted({line.strip() for line in text.split("\n") if line.strip().startswith(":")} & used):
+        text = re.sub(r"(?<![\w$-])" + re.escape(label) + r"\b", f"{label}_template", text)
+    buf.splice(at, at, text.split("\n"))
+    return OK
+
+
+# op name -> (function, success message, no-match message, missing-file message)
+OPS = {
+    "replace_method_body": (
+        replace_method_body,
+        lambda f, a: a[3].replace("{file}", f) if len(a) > 3 and a[3] else f"Replaced {a[0].strip()} in {f}",
+        lambda f, a: f"Method {a[0].strip()} start not found in {f}",
+        None,
+    ),
+    "insert_line_before_all": (
+        insert_line_before_all,
+        lambda f, a: f"Inserted '{a[1]}' before lines containing pattern '{a[0].rsplit('/', 1)[-1]}' in {f}",
+        lambda f, a: f"Pattern '{a[0]}' not found in {f}",
+        None,
+    ),
+    "insert_const_before_condition_near_string": (
+        insert_const_before_condition_near_string,
+        lambda f, a: f"Inserted const for {a[2]} near condition '{a[1]}' in {f}",
+        lambda f, a: f"Search string '{a[0]}' not found in {f}",
+        None,
+    ),
+    "replace_move_result_after_invoke": (
+        replace_move_result_after_invoke,
+        lambda f, a: f"Replaced move-result after invoke '{a[0].rsplit('/', 1)[-1]}' in {f}",
+        lambda f, a: f"Invoke pattern '{a[0]}' not found in {f}",
+        None,
+    ),
+    "force_methods_return_const": (
+        force_methods_return_const,
+        lambda f, a: f"Set return constant 0x{a[1]} for methods containing '{a[0]}' in {f}",
+        lambda f, a: f"No methods containing '{a[0]}' found in {f}",
+        None,
+    ),
+    "ensure_const_before_if_for_register": (
+        ensure_const_before_if_for_register,
+        lambda f, a: f"Forced {a[2]} to 0x{a[3]} before condition '{a[1]}' in {f}",
+        lambda f, a: f"Invoke pattern '{a[0]}' not found in {f}",
+        None,
+    ),
+    "insert_line_after_move_result": (
+        insert_line_after_move_result,
+        lambda f, a: f"Inserted '{a[2]}' after {a[1]} in {f}",
+        lambda f, a: f"{a[1]} after invoke '{a[0]}' not found in {f}",
+        None,
+    ),
+    "insert_line_before_match": (
+        insert_line_before_match,
+        lambda f, a: f"Inserted '{a[1].strip()}' before lines matching '{a[0]}' in {f}",
+        lambda f, a: f"Pattern '{a[0]}' not found in {f}",
+        None,
+    ),
+    "delete_line_after_match": (
+        delete_line_after_match,
+        lambda f, a: f"Removed '{a[1]}' after '{a[0]}' in {f}",
+        lambda f, a: f"No '{a[1]}' after '{a[0]}' in {f}",
+        None,
+    ),
+    "insert_line_after_in_method": (
+        insert_line_after_in_method,
+        lambda f, a: f"Inserted '{a[2]}' after {a[1]} in {a[0]} in {f}",
+        lambda f, a: f"{a[1]} not found in method {a[0]} in {f}",
+        None,
+    ),
+    "replace_text": (
+        replace_text,
+        lambda f, a: f"Replaced '{a[0]}' with '{a[1]}' in {f}",
+        lambda f, a: f"'{a[0]}' not found in {f}",
+        None,
+    ),
+    "replace_if_block_in_strict_jar_file": (
+        replace_if_block_in_strict_jar_file,
+        lambda f, a: f"Removed if-eqz guard in {f}",
+        None,
+        "StrictJarFile.smali not found",
+    ),
+    "patch_reconcile_clinit": (
+        patch_reconcile_clinit,
+        lambda f, a: f"Updated <clinit> constant in {f}",
+        None,
+        "ReconcilePackageUtils.smali not found",
+    ),
+    "insert_template_block": (
+        insert_template_block,
+        lambda f, a: f"Inserted {a[5].count(chr(10)) + 1} template lines into {a[0].split('(', 1)[0]} in {f}",
+        lambda f, a: f"Method {a[0]} or its anchor not found in {f}",
+        None,
+    ),
+}
+
+
+# op name -> the literal its edits are anchored on
+_OP_ANCHORS = {
+    "replace_method_body": lambda args: args[0],
+    "insert_line_before_all": lambda args: args[0],
+    "insert_const_before_condition_near_string": lambda args: args[0],
+    "replace_move_result_after_invoke": lambda args: args[0],
+    "force_methods_return_const": lambda args: args[0],
+    "ensure_const_before_if_for_register": lambda args: args[0],
+    "insert_line_after_move_result": lambda args: args[0],
+    "insert_line_before_match": lambda args: compile_bre(args[0])[1],
+    "delete_line_after_match": lambda args: compile_bre(args[0])[1],
+    "insert_line_after_in_method": lambda args: args[0],
+    "replace_text": lambda args: args[0],
+    "replace_if_block_in_strict_jar_file": lambda args: args[0] if args else STRICT_JAR_ANCHOR,
+    "patch_reconcile_clinit": lambda args: _CLINIT_ANCHOR,
+    "insert_template_block": lambda args: args[0],
+}
+
+
+def op_anchor(op: str, args) -> str:
+    """Returns the text every line an op edits (or starts from) contains."""
+    return _OP_ANCHORS[op](args)
+
+
+def read_plan(stream, known=None):
+    """Parses plan lines into (op, target, args) tuples, keeping their order.
+
+    ``known`` is the op table to validate against (smali ops by default).
+    """
+    known = OPS if known is None else known
+    ops = []
+    for raw in stream:
+        raw = raw.rstrip("\n")
+        if not raw:
+            continue
+        op, path, *args = raw.split("\t")
+        if op not in known:
+            raise ValueError(f"unknown op: {op}")
+        ops.append((op, path, args))
+    return ops
+
+
+def apply_plan(ops, misses=None) -> int:
+    """Applies ops grouped per file; returns the number of files written.
+
+    ``misses``, when given, collects the (op, path, args) that did not apply.
+    """
+    grouped = {}
+    for op, path, args in ops:
+        grouped.setdefault(path, []).append((op, args))
+
+    written = []
+    automata = {}
+    for path, file_ops in grouped.items():
+        target = Path(path)
+        if not target.is_file():
+            for op, op_args in file_ops:
+                missing = OPS[op][3]
+                warn(missing or f"File not found: {path}")
+                if misses is not None:
+                    misses.append((op, path, op_args))
+            continue
+
+        buf = Buffer(target)
+        file_anchors = frozenset(op_anchor(op, args) for op, args in file_ops)
+        if file_anchors not in automata:
+            automata[file_anchors] = anchors.Automaton(file_anchors)
+        buf.find_anchors(automata[file_anchors])
+        for op, args in file_ops:
+            func, ok_msg, miss_msg, _ = OPS[op]
+            status = func(buf, *args)
+            if status != OK and misses is not None:
+                misses.append((op, path, args))
+            if status == OK:
+                log(ok_msg(target.name, args))
+            elif status == NO_END:
+                warn(f"End not found for {args[0].strip()} in {target.name}")
+            elif miss_msg:
+                warn(miss_msg(target.name, args))
+
+        if buf.save():
+            written.append(path)
+
+    # Re-index per decompile dir, so each index file is rewritten once
+    roots = {}
+    for path in written:
+        root = smali_index.decompile_root_for(path)
+        if root:
+            roots.setdefault(root, []).append(path)
+    for root, paths in roots.items():
+        smali_index.refresh_many(root, paths)
+    return len(written)
@@ -0,0 +1,260 @@
+"""Persistent method/class index for a decompiled smali tree.
+
+The index lives next to the decompile dir (``<dir>.index/``) and is plain TSV
+so the shell helpers can query it with ``awk`` without starting Python:
+
+* ``classes.tsv``         - ``descriptor<TAB>path``
+* ``methods/<bucket>.tsv`` - ``name<TAB>descriptor<TAB>start<TAB>end<TAB>path<TAB>decl``
+* ``invoke-custom.txt``   - paths of the files that use ``invoke-custom``
+* ``buckets.tsv``         - ``bucket bucket ...<TAB>path``, the buckets holding a file's rows
+
+Methods are bucketed by the first two characters of their name, so a lookup
+only reads a small slice of the index instead of the whole tree.
+"""
+
+import os
+from pathlib import Path
+
+from fptools.smali import class_descriptor, method_spans
+
+INDEX_SUFFIX = ".index"
+INVOKE_CUSTOM = "invoke-custom.txt"
+# Lets a refresh find the rows of methods a file no longer declares
+BUCKETS = "buckets.tsv"
+# Written by fptools.scan; dropped when the index is rebuilt
+SCAN_CACHE = "scan.tsv"
+
+
+def index_dir_for(decompile_dir: str) -> Path:
+    """Returns the index location for a decompile dir."""
+    return Path(str(decompile_dir).rstrip("/") + INDEX_SUFFIX)
+
+
+def decompile_root_for(path: str) -> str:
+    """Finds the indexed decompile dir that contains path, or ""."""
+    for parent in Path(path).parents:
+        if index_dir_for(str(parent)).is_dir():
+            return str(parent)
+    return ""
+
+
+def bucket_for(name: str) -> str:
+    """Maps a method name to its bucket file stem."""
+    key = "".join(c if c.isalnum() else "_" for c in name[:2])
+    return key or "_"
+
+
+def method_name(decl: str) -> str:
+    """Extracts the bare method name from a ``.method`` declaration line."""
+    head = decl.split("(", 1)[0]
+    return head.rsplit(None, 1)[-1] if head.strip() else ""
+
+
+def iter_smali_files(root: str):
+    """Yields every .smali file under root, skipping symlinked dirs."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(".smali"):
+                yield os.path.normpath(os.path.join(dirpath, name))
+
+
+def _scan(path: str):
+    with open(path, encoding="utf-8", errors="surrogateescape") as handle:
+        text = handle.read()
+    lines = text.splitlines()
+    methods = [
+        (method_name(decl), start + 1, end + 1, decl)
+        for start, end, decl in method_spans(lines)
+    ]
+    return class_descriptor(lines), methods, "invoke-custom" in text
+
+
+def scan_methods(path: str):
+    """Returns (class_descriptor, [(name, start, end, decl), ...]) for a file.
+
+    Line numbers are 1-based and inclusive, matching ``grep -n``/``sed``.
+    """
+    descriptor, methods, _ = _scan(path)
+    return descriptor, methods
+
+
+def _bucket_line(path: str, rows) -> str:
+    buckets = sorted({bucket_for(name) for name, _ in rows})
+    return f"{' '.join(buckets)}\t{path}\n" if buckets else ""
+
+
+def _method_rows(path: str):
+    """Returns (class_descriptor, [(bucket name, row), ...], uses invoke-custom)."""
+    descriptor, methods, invoke_custom = _scan(path)
+    rows = [
+        (name, f"{name}\t{descriptor}\t{start}\t{end}\t{path}\t{decl}\n")
+        for name, start, end, decl in methods
+    ]
+    return descriptor, rows, invoke_custom
+
+
+def invoke_custom_files(decompile_dir: str):
+    """Returns the indexed files that use invoke-custom, or None without an index."""
+    listing = index_dir_for(decompile_dir) / INVOKE_CUSTOM
+    if not listing.is_file():
+        return None
+    with open(listing, encoding="utf-8", errors="surrogateescape") as handle:
+        return [line.rstrip("\n") for line in handle if line.strip()]
+
+
+def find_class(decompile_dir: str, rel: str) -> str:
+    """Returns the indexed file at rel below a smali root (e.g. android/app/Foo.smali), or ""."""
+    suffix = "/" + rel
+    with open(index_dir_for(decompile_dir) / "classes.tsv", encoding="utf-8", errors="surrogateescape") as handle:
+        for row in handle:
+            path = row.rstrip("\n").split("\t", 1)[-1]
+            if path.endswith(suffix):
+                return path
+    return ""
+
+
+def _method_paths(bucket_files, query: str):
+    for bucket_file in bucket_files:
+        if not bucket_file.is_file():
+            continue
+        with open(bucket_file, encoding="utf-8", errors="surrogateescape") as handle:
+            for row in handle:
+                fields = row.rstrip("\n").split("\t", 5)
+                if query in fields[5]:
+                    yield fields[4]
+
+
+def find_methods(decompile_dir: str, query: str, first: bool = False):
+    """Returns the files declaring a method whose declaration contains query.
+
+    Like the shell lookups, ``first`` reads the bucket of the query's method
+    name and only falls back to the whole index when that finds nothing.
+    """
+    methods_dir = index_dir_for(decompile_dir) / "methods"
+    every = sorted(methods_dir.glob("*.tsv"))
+    if first:
+        name = query.split("(", 1)[0].rsplit(" ", 1)[-1]
+        for bucket_files in ([methods_dir / f"{bucket_for(name)}.tsv"], every):
+            for path in _method_paths(bucket_files, query):
+                if os.path.isfile(path):
+                    return [path]
+        return []
+    return list(dict.fromkeys(_method_paths(every, query)))
+
+
+def build(decompile_dir: str) -> Path:
+    """Scans the whole tree once and writes a fresh index."""
+    index_dir = index_dir_for(decompile_dir)
+    methods_dir = index_dir / "methods"
+    methods_dir.mkdir(parents=True, exist_ok=True)
+    for stale in methods_dir.glob("*.tsv"):
+        stale.unlink()
+    (index_dir / SCAN_CACHE).unlink(missing_ok=True)
+
+    buckets = {}
+    class_lines = []
+    invoke_custom = []
+    bucket_lines = []
+    for path in iter_smali_files(decompile_dir):
+        descriptor, rows, uses_invoke_custom = _method_rows(path)
+        bucket_lines.append(_bucket_line(path, rows))
+        if descriptor:
+            class_lines.append(f"{descriptor}\t{path}\n")
+        if uses_invoke_custom:
+            invoke_custom.append(f"{path}\n")
+        for name, row in rows:
+            buckets.setdefault(bucket_for(name), []).append(row)
+
+    for bucket, rows in buckets.items():
+        (methods_dir / f"{bucket}.tsv").write_text("".join(rows), encoding="utf-8", errors="surrogateescape")
+    (index_dir / "classes.tsv").write_text("".join(class_lines), encoding="utf-8", errors="surrogateescape")
+    (index_dir / INVOKE_CUSTOM).write_text("".join(invoke_custom), encoding="utf-8", errors="surrogateescape")
+    (index_dir / BUCKETS).write_text("".join(bucket_lines), encoding="utf-8", errors="surrogateescape")
+    return index_dir
+
+
+def _rewrite_bucket(bucket_file: Path, drop_paths, new_rows):
+    kept = []
+    if bucket_file.exists():
+        with open(bucket_file, encoding="utf-8", errors="surrogateescape") as handle:
+            kept = [row for row in handle if row.split("\t", 5)[4] not in drop_paths]
+    kept.extend(new_rows)
+    bucket_file.write_text("".join(kept), encoding="utf-8", errors="surrogateescape")
+
+
+def _rewrite_listing(listing: Path, drop_paths, new_lines):
+    kept = []
+    if listing.exists():
+        with open(listing, encoding="utf-8", errors="surrogateescape") as handle:
+            kept = [line for line in handle if line.rstrip("\n").split("\t")[-1] not in drop_paths]
+    kept.extend(new_lines)
+    listing.write_text("".join(kept), encoding="utf-8", errors="surrogateescape")
+
+
+def _indexed_buckets(listing: Path, paths):
+    """Returns the buckets that hold rows of any of paths."""
+    buckets = set()
+    with open(listing, encoding="utf-8", errors="surrogateescape") as handle:
+        for line in handle:
+            names, _, path = line.rstrip("\n").rpartition("\t")
+            if path in paths:
+                buckets.update(names.split())
+    return buckets
+
+
+def refresh(decompile_dir: str, path: str, old_path: str = "") -> None:
+    """Re-indexes one file after it was edited, created or moved."""
+    refresh_many(decompile_dir, [path], [old_path] if old_path else [])
+
+
+def refresh_many(decompile_dir: str, paths, old_paths=()) -> None:
+    """Re-indexes files after they were edited, created or moved.
+
+    Each index file is rewritten once for the whole batch, and only the
+    buckets holding the files' methods, now or before the edit, are touched;
+    the old ones come from ``buckets.tsv``, so the rows of renamed, removed
+    and deleted methods go too. An index without that listing gets every
+    bucket rewritten.
+    """
+    index_dir = index_dir_for(decompile_dir)
+    if not index_dir.is_dir():
+        build(decompile_dir)
+        return
+
+    paths = [os.path.normpath(path) for path in paths]
+    drop = set(paths) | {os.path.normpath(path) for path in old_paths if path}
+    grouped = {}
+    class_lines = []
+    invoke_custom = []
+    bucket_lines = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        descriptor, rows, uses_invoke_custom = _method_rows(path)
+        bucket_lines.append(_bucket_line(path, rows))
+        for name, row in rows:
+            grouped.setdefault(bucket_for(name), []).append(row)
+        if descriptor:
+            class_lines.append(f"{descriptor}\t{path}\n")
+        if uses_invoke_custom:
+            invoke_custom.append(f"{path}\n")
+
+    methods_dir = index_dir / "methods"
+    listing = index_dir / BUCKETS
+    targets = set(grouped)
+    if listing.is_file():
+        targets.update(_indexed_buckets(listing, drop))
+    else:
+        targets.update(p.stem for p in methods_dir.glob("*.tsv"))
+    for bucket in sorted(targets):
+        _rewrite_bucket(methods_dir / f"{bucket}.tsv", drop, grouped.get(bucket, []))
+
+    _rewrite_listing(index_dir / "classes.tsv", drop, class_lines)
+    _rewrite_listing(index_dir / INVOKE_CUSTOM, drop, invoke_custom)
+    if listing.is_file():
+        _rewrite_listing(listing, drop, bucket_lines)
+
+    from fptools import scan  # scan builds on this module
+
+    scan.refresh_cache(index_dir, paths, drop)
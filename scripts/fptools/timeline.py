@@ -0,0 +1,79 @@
+"""Stage timeline written by ``timed_stage`` in ``scripts/core/logging.sh``.
+
+The shell appends one JSON object per line: a ``begin`` event when a stage
+starts and an ``end`` event with its measurements. ``load`` pairs them up so
+stages that never ended (the run aborted inside them) are still reported, and
+orders them depth first so the stages of parallel JAR jobs do not interleave.
+"""
+
+import json
+
+_FIELDS = ("wall_s", "cpu_user_s", "cpu_sys_s", "peak_rss_kb", "read_bytes", "write_bytes")
+
+
+def load(path: str):
+    """Returns stage dicts in tree order; unfinished ones have status None."""
+    stages = {}
+    with open(path, encoding="utf-8") as handle:
+        for raw in handle:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                continue  # a line cut short by a killed job
+            entry = stages.setdefault(event["id"], {
+                "id": event["id"], "parent": "", "stage": event["stage"], "start": event["start"], "status": None,
+            })
+            if event.get("event") == "end":
+                entry["status"] = event["status"]
+                entry.update({key: event[key] for key in _FIELDS})
+            else:
+                entry["parent"] = event.get("parent", "")
+
+    children = {}
+    for entry in sorted(stages.values(), key=lambda s: s["start"]):
+        parent = entry["parent"] if entry["parent"] in stages else ""
+        children.setdefault(parent, []).append(entry)
+
+    ordered = []
+    pending = list(reversed(children.get("", [])))
+    while pending:
+        entry = pending.pop()
+        ordered.append(entry)
+        pending.extend(reversed(children.get(entry["id"], [])))
+    return ordered
+
+
+def _mib(value) -> str:
+    return f"{value / 1048576:.1f}"
+
+
+def markdown(stages) -> str:
+    """Renders the stages as a Markdown table, nested stages indented."""
+    lines = [
+        "| Stage | Status | Wall (s) | CPU user+sys (s) | Peak RSS (MiB) | Read (MiB) | Written (MiB) |",
+        "|---|---|---:|---:|---:|---:|---:|",
+    ]
+    for stage in stages:
+        depth = stage["stage"].count("/")
+        name = "&nbsp;&nbsp;" * depth + stage["stage"].rsplit("/", 1)[-1]
+        if stage["status"] is None:
+            lines.append(f"| {name} | unfinished | | | | | |")
+            continue
+        status = "ok" if stage["status"] == 0 else f"exit {stage['status']}"
+        cpu = stage["cpu_user_s"] + stage["cpu_sys_s"]
+        # Stages shorter than one sampling interval have no RSS reading
+        rss = f"{stage['peak_rss_kb'] / 1024:.0f}" if stage["peak_rss_kb"] else "-"
+        lines.append(
+            f"| {name} | {status} | {stage['wall_s']:.1f} | {cpu:.1f} | {rss} "
+            f"| {_mib(stage['read_bytes'])} | {_mib(stage['write_bytes'])} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_json(stages, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump({"stages": stages}, handle, indent=2)
+        handle.write("\n")
@@ -3,7 +3,10 @@
 # Usage: source ./helper.sh
 # Exposes: init_env, ensure_tools, decompile_jar, recompile_jar, backup_original_jar,
 #          add_static_return_patch, patch_return_void_method,
-#          modify_invoke_custom_methods, create_magisk_module, find_smali_method_file
+#          modify_invoke_custom_methods, create_magisk_module, find_smali_method_file,
+#          find_smali_class_file, smali_index_build, fptools, run_jar_jobs,
+#          patch_cache_restore, patch_cache_store, apktool_run, d8_run,
+#          jvm_daemon_start, jvm_daemon_stop, manifest_apply, manifest_plan
 #
 # Designed for use in CI / GitHub workflow. Functions accept explicit decompile_dir
 # where appropriate so scripts can be called against multiple jars.
@@ -15,6 +18,9 @@
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 source "${SCRIPT_DIR}/core/logging.sh"
 source "${SCRIPT_DIR}/core/tools.sh"
+source "${SCRIPT_DIR}/core/jvm.sh"
 source "${SCRIPT_DIR}/core/apk_ops.sh"
 source "${SCRIPT_DIR}/core/patching.sh"
 source "${SCRIPT_DIR}/core/module.sh"
+source "${SCRIPT_DIR}/core/jobs.sh"
+source "${SCRIPT_DIR}/core/cache.sh"
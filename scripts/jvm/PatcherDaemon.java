@@ -0,0 +1,339 @@
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.StandardProtocolFamily;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.attribute.PosixFilePermissions;
+import java.security.Permission;
+import java.util.ArrayDeque;
+import java.util.Arrays;
+import java.util.Deque;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.Objects;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.Semaphore;
+import java.util.concurrent.atomic.AtomicInteger;
+
+/**
+ * Long-lived JVM that runs apktool and d8 for the patcher scripts.
+ *
+ * <p>Started by {@code jvm_daemon_start} (scripts/core/jvm.sh) as a
+ * single-file program:
+ * {@code java PatcherDaemon.java <socket> [idle seconds] [concurrent runs]}.
+ * Clients ({@code fptools jvm}, scripts/fptools/jvm.py) connect to the Unix
+ * socket and send one request: a count followed by that many strings (each an
+ * int length and UTF-8 bytes), namely the tool JAR, its main class and the
+ * arguments. The reply is a stream of frames, a type byte, an int length and
+ * the payload: 1 for stdout, 2 for stderr and a final 3 holding the exit
+ * status as an int.
+ *
+ * <p>Each tool JAR gets its own class loaders, kept in a pool and reused, so
+ * the classes stay loaded and JIT-compiled across JARs and jobs. Concurrent
+ * requests take separate loaders, so tools with static state never share it.
+ * A loader whose run failed is dropped. At most {@code concurrent runs} tools
+ * (default 1) run at once, the heap being sized for that many; further
+ * requests wait for a slot. Output is routed by class loader: while a
+ * request runs, its loader maps to its client, and a write goes to the
+ * client of the first loader found on the writing thread's stack (or its
+ * context loader). Threads a tool keeps in static pools thus write to
+ * whichever request is using that loader, never to an earlier one, and
+ * output from no request goes to the daemon log. System.exit from a tool
+ * ends the request rather than the daemon. That takes a SecurityManager, so
+ * on JVMs without one (JDK 24 and later) the daemon refuses to start and the
+ * scripts run each tool in a JVM of its own.
+ */
+public final class PatcherDaemon {
+    private static final int OUT = 1;
+    private static final int ERR = 2;
+    private static final int EXIT = 3;
+
+    private static final Map<ClassLoader, Sink> SINKS = new ConcurrentHashMap<>();
+    private static final ThreadLocal<Sink> REQUEST = new ThreadLocal<>();
+    private static final StackWalker STACK = StackWalker.getInstance(StackWalker.Option.RETAIN_CLASS_REFERENCE);
+    private static final Map<String, Deque<URLClassLoader>> IDLE = new HashMap<>();
+    private static final AtomicInteger ACTIVE = new AtomicInteger();
+    private static volatile long lastUsed = System.currentTimeMillis();
+    private static Semaphore runs;
+
+    private PatcherDaemon() {
+    }
+
+    /** Frames written back to one client; closed sinks drop their output. */
+    private static final class Sink {
+        private final DataOutputStream out;
+        private boolean closed;
+
+        Sink(OutputStream out) {
+            this.out = new DataOutputStream(out);
+        }
+
+        synchronized void frame(int type, byte[] data, int off, int len) {
+            if (closed) {
+                return;
+            }
+            try {
+                out.writeByte(type);
+                out.writeInt(len);
+                out.write(data, off, len);
+                out.flush();
+            } catch (IOException e) {
+                closed = true;
+            }
+        }
+
+        synchronized void exit(int status) {
+            byte[] data = {(byte) (status >>> 24), (byte) (status >>> 16), (byte) (status >>> 8), (byte) status};
+            frame(EXIT, data, 0, data.length);
+            closed = true;
+        }
+    }
+
+    /** The client of the request the current thread works for, or null. */
+    private static Sink currentSink() {
+        Sink sink = REQUEST.get();
+        if (sink != null || SINKS.isEmpty()) {
+            return sink;
+        }
+        sink = STACK.walk(frames -> frames.map(frame -> frame.getDeclaringClass().getClassLoader())
+                .filter(Objects::nonNull).map(SINKS::get).filter(Objects::nonNull).findFirst().orElse(null));
+        if (sink == null) {
+            ClassLoader context = Thread.currentThread().getContextClassLoader();
+            sink = context == null ? null : SINKS.get(context);
+        }
+        return sink;
+    }
+
+    /** System.out/err replacement that writes to the calling request's client. */
+    private static final class Dispatch extends OutputStream {
+        private final int type;
+        private final PrintStream fallback;
+
+        Dispatch(int type, PrintStream fallback) {
+            this.type = type;
+            this.fallback = fallback;
+        }
+
+        @Override
+        public void write(int b) {
+            write(new byte[] {(byte) b}, 0, 1);
+        }
+
+        @Override
+        public void write(byte[] data, int off, int len) {
+            Sink sink = currentSink();
+            if (sink == null) {
+                fallback.write(data, off, len);
+            } else {
+                sink.frame(type, data, off, len);
+            }
+        }
+    }
+
+    private static final class ExitTrap extends SecurityException {
+        private static final long serialVersionUID = 1L;
+        final int status;
+
+        ExitTrap(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /** Returns false when the JVM no longer supports a SecurityManager. */
+    @SuppressWarnings("removal")
+    private static boolean trapExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    if (currentSink() != null) {
+                        throw new ExitTrap(status);
+                    }
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException e) {
+            return false;
+        }
+    }
+
+    private static String loaderKey(Path jar) throws IOException {
+        return jar.toRealPath() + "@" + Files.getLastModifiedTime(jar).toMillis() + "+" + Files.size(jar);
+    }
+
+    private static URLClassLoader borrow(String key, Path jar) throws IOException {
+        synchronized (IDLE) {
+            Deque<URLClassLoader> idle = IDLE.get(key);
+            if (idle != null && !idle.isEmpty()) {
+                return idle.pop();
+            }
+        }
+        return new URLClassLoader(new URL[] {jar.toUri().toURL()}, ClassLoader.getPlatformClassLoader());
+    }
+
+    private static void giveBack(String key, URLClassLoader loader) {
+        synchronized (IDLE) {
+            IDLE.computeIfAbsent(key, k -> new ArrayDeque<>()).push(loader);
+        }
+    }
+
+    private static int run(Path jar, String mainClass, String[] args, Sink sink) throws Exception {
+        String key = loaderKey(jar);
+        URLClassLoader loader = borrow(key, jar);
+        SINKS.put(loader, sink);
+        Thread thread = Thread.currentThread();
+        ClassLoader previous = thread.getContextClassLoader();
+        int status = 1;
+        thread.setContextClassLoader(loader);
+        try {
+            Method main = Class.forName(mainClass, true, loader).getMethod("main", String[].class);
+            main.invoke(null, (Object) args);
+            status = 0;
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ExitTrap) {
+                status = ((ExitTrap) cause).status;
+            } else {
+                cause.printStackTrace();
+            }
+        } finally {
+            thread.setContextClassLoader(previous);
+            SINKS.remove(loader);
+            if (status == 0) {
+                giveBack(key, loader);
+            } else {
+                loader.close();
+            }
+        }
+        return status;
+    }
+
+    private static String readString(DataInputStream in) throws IOException {
+        byte[] data = new byte[in.readInt()];
+        in.readFully(data);
+        return new String(data, StandardCharsets.UTF_8);
+    }
+
+    private static void serve(SocketChannel channel) {
+        ACTIVE.incrementAndGet();
+        try (channel) {
+            DataInputStream in = new DataInputStream(Channels.newInputStream(channel));
+            String[] request = new String[in.readInt()];
+            for (int i = 0; i < request.length; i++) {
+                request[i] = readString(in);
+            }
+            Sink sink = new Sink(Channels.newOutputStream(channel));
+            if (request.length == 1 && request[0].equals("--ping")) {
+                sink.exit(0);
+                return;
+            }
+            if (request.length == 1 && request[0].equals("--stop")) {
+                sink.exit(0);
+                shutdown(0);
+            }
+            if (request.length < 2) {
+                sink.exit(2);
+                return;
+            }
+            REQUEST.set(sink);
+            int status;
+            runs.acquireUninterruptibly();
+            try {
+                status = run(Path.of(request[0]), request[1], Arrays.copyOfRange(request, 2, request.length), sink);
+            } catch (Exception | LinkageError e) {
+                e.printStackTrace();
+                status = 1;
+            } finally {
+                System.out.flush();
+                System.err.flush();
+                REQUEST.remove();
+                runs.release();
+            }
+            sink.exit(status);
+        } catch (IOException e) {
+            // The client went away; nothing to answer
+        } finally {
+            lastUsed = System.currentTimeMillis();
+            ACTIVE.decrementAndGet();
+        }
+    }
+
+    private static Path socket;
+
+    private static void shutdown(int status) {
+        try {
+            Files.deleteIfExists(socket);
+        } catch (IOException e) {
+            // Left for the next start to replace
+        }
+        System.exit(status);
+    }
+
+    public static void main(String[] argv) throws IOException {
+        if (argv.length < 1) {
+            System.err.println("usage: PatcherDaemon <socket> [idle seconds] [concurrent runs]");
+            System.exit(2);
+        }
+        socket = Path.of(argv[0]);
+        long idleMillis = argv.length > 1 ? Long.parseLong(argv[1]) * 1000L : 0L;
+        runs = new Semaphore(Math.max(1, argv.length > 2 ? Integer.parseInt(argv[2]) : 1), true);
+        // Before the socket exists, so clients never reach a daemon a tool could stop
+        if (!trapExit()) {
+            System.err.println("PatcherDaemon: no SecurityManager on this JVM to trap System.exit from a tool, not starting");
+            System.exit(1);
+        }
+
+        Files.deleteIfExists(socket);
+        ServerSocketChannel server = ServerSocketChannel.open(StandardProtocolFamily.UNIX);
+        server.bind(UnixDomainSocketAddress.of(socket));
+        Files.setPosixFilePermissions(socket, PosixFilePermissions.fromString("rw-------"));
+
+        System.setOut(new PrintStream(new Dispatch(OUT, System.out), true, StandardCharsets.UTF_8));
+        System.setErr(new PrintStream(new Dispatch(ERR, System.err), true, StandardCharsets.UTF_8));
+
+        if (idleMillis > 0) {
+            Thread watchdog = new Thread(() -> {
+                while (true) {
+                    try {
+                        Thread.sleep(Math.min(idleMillis, 10_000L));
+                    } catch (InterruptedException e) {
+                        return;
+                    }
+                    if (ACTIVE.get() == 0 && System.currentTimeMillis() - lastUsed >= idleMillis) {
+                        shutdown(0);
+                    }
+                }
+            }, "idle-watchdog");
+            watchdog.setDaemon(true);
+            watchdog.start();
+        }
+
+        System.out.println("PatcherDaemon listening on " + socket + ", " + runs.availablePermits() + " concurrent runs");
+        while (true) {
+            SocketChannel channel = server.accept();
+            Thread worker = new Thread(() -> serve(channel), "request");
+            worker.start();
+        }
+    }
+}
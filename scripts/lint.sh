@@ -34,6 +34,7 @@ echo "Linting shell scripts..."
 echo "============================"
 
 SCRIPTS=(
+    "scripts/bench.sh"
     "scripts/helper.sh"
     "scripts/module_creator.sh"
     "scripts/patcher_a13.sh"
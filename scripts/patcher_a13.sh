@@ -1,4 +1,8 @@
 #!/bin/bash
+# patcher_a13.sh - Android 13 and 14 framework/services patcher
+#
+# The edits come from the release's patch manifest (scripts/manifests/apiNN.tsv);
+# patcher_a14.sh runs this script with PATCH_API=34.
 
 # Set up environment variables for GitHub workflow
 TOOLS_DIR="$(pwd)/tools"
@@ -13,353 +17,21 @@ mkdir -p "$BACKUP_DIR"
 # ============================================
 FEATURE_DISABLE_SIGNATURE_VERIFICATION=0
 
-# Function to decompile JAR file
-decompile_jar() {
-    local jar_file="$1"
-    local base_name
-    base_name="$(basename "$jar_file" .jar)"
-    local output_dir="$WORK_DIR/${base_name}_decompile"
-
-    echo "Decompiling $jar_file with apktool..."
-
-    # Validate JAR file before processing
-    if [ ! -f "$jar_file" ]; then
-        echo "❌ Error: JAR file $jar_file not found!"
-        exit 1
-    fi
-
-    # Check if JAR file is valid ZIP
-    if ! unzip -t "$jar_file" >/dev/null 2>&1; then
-        echo "❌ Error: $jar_file is corrupted or not a valid ZIP file!"
-        echo "File size: $(stat -c%s "$jar_file") bytes"
-        echo "File type: $(file "$jar_file")"
-        echo "This usually means the download was incomplete or corrupted."
-        echo "Please check the download URL and try again."
-        exit 1
-    fi
-
-    rm -rf "$output_dir" "$base_name"
-    mkdir -p "$output_dir"
-
-    mkdir -p "$BACKUP_DIR/$base_name"
-    unzip -o "$jar_file" "META-INF/*" "res/*" -d "$BACKUP_DIR/$base_name" >/dev/null 2>&1
-
-    # Run apktool with better error handling
-    if ! java -jar "$TOOLS_DIR/apktool.jar" d -q -f "$jar_file" -o "$output_dir"; then
-        echo "❌ Error: Failed to decompile $jar_file with apktool"
-        echo "This may indicate the JAR file is corrupted or incompatible."
-        echo "File size: $(stat -c%s "$jar_file") bytes"
-        exit 1
-    fi
-
-    mkdir -p "$output_dir/unknown"
-    cp -r "$BACKUP_DIR/$base_name/res" "$output_dir/unknown/" 2>/dev/null
-    cp -r "$BACKUP_DIR/$base_name/META-INF" "$output_dir/unknown/" 2>/dev/null
-}
-
-# Function to recompile JAR file
-recompile_jar() {
-    local jar_file="$1"
-    local base_name
-    base_name="$(basename "$jar_file" .jar)"
-    local output_dir="$WORK_DIR/${base_name}_decompile"
-    local patched_jar="${base_name}_patched.jar"
-
-    echo "Recompiling $jar_file with apktool..."
-
-    # Check if decompiled directory exists
-    if [ ! -d "$output_dir" ]; then
-        echo "❌ Error: Decompiled directory $output_dir not found!"
-        echo "This means the decompilation step failed."
-        exit 1
-    fi
-
-    # Check if apktool.yml exists (required for recompilation)
-    if [ ! -f "$output_dir/apktool.yml" ]; then
-        echo "⚠️ Warning: apktool.yml not found in $output_dir"
-        echo "This usually means the decompilation didn't create proper metadata."
-        echo "Attempting to continue anyway..."
-    fi
-
-    # Run apktool with better error handling
-    if ! java -jar "$TOOLS_DIR/apktool.jar" b -q -f "$output_dir" -o "$patched_jar"; then
-        echo "❌ Error: Failed to recompile $output_dir with apktool"
-        echo "This may indicate issues with the decompiled files."
-        echo "Decompiled directory contents:"
-        ls -la "$output_dir" || echo "Directory not accessible"
-        exit 1
-    fi
-
-    echo "Created patched JAR: $patched_jar"
-}
-
-# Function to patch method with direct file path (no searching)
-patch_method_in_file() {
-    local method="$1"
-    local ret_val="$2"
-    local file="$3"
-
-    # Check if file exists
-    if [ ! -f "$file" ]; then
-        echo "⚠ File not found: $(basename "$file")"
-        return
-    fi
-
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* $method" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        echo "⚠ Method $method not found in $(basename "$file")"
-        return
-    }
-
-    local total_lines end=0 i="$start"
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
-    done
-
-    [ "$end" -eq 0 ] && {
-        echo "⚠ End not found for $method"
-        return
-    }
-
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    const/4 v0, 0x$ret_val\\
-    return v0\\
-.end method" "$file"
-
-    echo "✓ Patched $method to return $ret_val in $(basename "$file")"
-}
-
-# Function to add static return patch (legacy - searches for file)
-add_static_return_patch() {
-    local method="$1"
-    local ret_val="$2"
-    local decompile_dir="$3"
-    local file
-
-    # Simple working approach from old script
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l ".method.* $method" 2>/dev/null | head -n 1)
-
-    [ -z "$file" ] && return
-
-    # Call the new function with found file
-    patch_method_in_file "$method" "$ret_val" "$file"
-}
-
-# Function to patch return-void method with direct file path
-patch_return_void_in_file() {
-    local method="$1"
-    local file="$2"
-
-    # Check if file exists
-    if [ ! -f "$file" ]; then
-        echo "⚠ File not found: $(basename "$file")"
-        return
-    fi
-
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* $method" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        echo "⚠ Method $method not found in $(basename "$file")"
-        return
-    }
-
-    local total_lines end=0 i="$start"
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
-    done
-
-    [ "$end" -eq 0 ] && {
-        echo "⚠ Method $method end not found"
-        return
-    }
-
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    return-void\\
-.end method" "$file"
-
-    echo "✓ Patched $method → return-void in $(basename "$file")"
-}
-
-# Function to patch return-void method (legacy - searches for file)
-patch_return_void_method() {
-    local method="$1"
-    local decompile_dir="$2"
-    local file
-
-    # Simple working approach from old script
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l ".method.* $method" 2>/dev/null | head -n 1)
-    [ -z "$file" ] && {
-        echo "Method $method not found"
-        return
-    }
-
-    # Call the new function with found file
-    patch_return_void_in_file "$method" "$file"
-}
+# API level whose manifest is applied (33 = Android 13, 34 = Android 14)
+PATCH_API="${PATCH_API:-33}"
+ANDROID_RELEASE=$((PATCH_API - 20))
 
 # ============================================
 # Feature-specific patch functions for framework.jar
 # ============================================
 
-# Apply signature verification bypass patches to framework.jar (Android 13)
+# Apply signature verification bypass patches to framework.jar
 apply_framework_signature_patches() {
     local decompile_dir="$1"
 
-    echo "Applying signature verification patches to framework.jar (Android 13)..."
-
-    # Patch getMinimumSignatureSchemeVersionForTargetSdk to return 0
-    echo "Patching getMinimumSignatureSchemeVersionForTargetSdk..."
-    add_static_return_patch "getMinimumSignatureSchemeVersionForTargetSdk" 0 "$decompile_dir"
-
-    # Patch verifyMessageDigest to return 1
-    echo "Patching verifyMessageDigest..."
-    add_static_return_patch "verifyMessageDigest" 1 "$decompile_dir"
-
-    # Patch verifySignatures - find and patch invoke-interface result
-    echo "Patching verifySignatures..."
-    local file
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "invoke-interface.*ParseResult;->isError()Z" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-interface {v0}, Landroid/content/pm/parsing/result/ParseResult;->isError()Z"
-        local linenos
-        linenos=$(grep -nF "$pattern" "$file" | cut -d: -f1)
-
-        if [ -n "$linenos" ]; then
-            for lineno in $linenos; do
-                local move_result_lineno=$((lineno + 1))
-                local current_line
-                current_line=$(sed -n "${move_result_lineno}p" "$file" | sed 's/^[ \t]*//')
-                if [[ "$current_line" == "move-result v1" ]]; then
-                    local indent
-                    indent=$(sed -n "${move_result_lineno}p" "$file" | grep -o '^[ \t]*')
-                    sed -i "$((move_result_lineno + 1))i\\
-${indent}const/4 v1, 0x0" "$file"
-                    echo "Patched verifySignatures at line $((move_result_lineno + 1))"
-                    break
-                fi
-            done
-        fi
-    fi
-
-    # Patch verifyV1Signature
-    echo "Patching verifyV1Signature..."
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "verifyV1Signature.*ParseInput.*Ljava/lang/String;Z" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-static.*verifyV1Signature"
-        local lineno
-        lineno=$(grep -n "$pattern" "$file" | cut -d: -f1 | head -n1)
-        if [ -n "$lineno" ]; then
-            sed -i "${lineno}i\\
-    const/4 p3, 0x0" "$file"
-            echo "Patched verifyV1Signature at line $lineno"
-        fi
-    fi
-
-    # Patch verifyV2Signature
-    echo "Patching verifyV2Signature..."
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "verifyV2Signature.*ParseInput.*Ljava/lang/String;Z" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-static.*verifyV2Signature"
-        local lineno
-        lineno=$(grep -n "$pattern" "$file" | cut -d: -f1 | head -n1)
-        if [ -n "$lineno" ]; then
-            sed -i "${lineno}i\\
-    const/4 p3, 0x0" "$file"
-            echo "Patched verifyV2Signature at line $lineno"
-        fi
-    fi
-
-    # Patch verifyV3Signature
-    echo "Patching verifyV3Signature..."
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "verifyV3Signature.*ParseInput.*Ljava/lang/String;Z" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-static.*verifyV3Signature"
-        local lineno
-        lineno=$(grep -n "$pattern" "$file" | cut -d: -f1 | head -n1)
-        if [ -n "$lineno" ]; then
-            sed -i "${lineno}i\\
-    const/4 p3, 0x0" "$file"
-            echo "Patched verifyV3Signature at line $lineno"
-        fi
-    fi
-
-    # Patch verifyV3AndBelowSignatures
-    echo "Patching verifyV3AndBelowSignatures..."
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "verifyV3AndBelowSignatures.*ParseInput.*Ljava/lang/String;IZ" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-static.*verifyV3AndBelowSignatures"
-        local lineno
-        lineno=$(grep -n "$pattern" "$file" | cut -d: -f1 | head -n1)
-        if [ -n "$lineno" ]; then
-            sed -i "${lineno}i\\
-    const/4 p3, 0x0" "$file"
-            echo "Patched verifyV3AndBelowSignatures at line $lineno"
-        fi
-    fi
-
-    # Patch checkCapability to return 1
-    echo "Patching checkCapability..."
-    add_static_return_patch "checkCapability" 1 "$decompile_dir"
-
-    # Patch checkCapabilityRecover to return 1
-    echo "Patching checkCapabilityRecover..."
-    add_static_return_patch "checkCapabilityRecover" 1 "$decompile_dir"
-
-    # Patch isPackageWhitelistedForHiddenApis to return 1
-    echo "Patching isPackageWhitelistedForHiddenApis..."
-    add_static_return_patch "isPackageWhitelistedForHiddenApis" 1 "$decompile_dir"
-
-    # Patch StrictJarFile findEntry
-    echo "Patching StrictJarFile findEntry..."
-    file=$(find "$decompile_dir" -type f -name "StrictJarFile.smali" | head -n 1)
-    if [ -f "$file" ]; then
-        local start_line
-        start_line=$(grep -n "invoke-virtual.*findEntry.*Ljava/util/zip/ZipEntry;" "$file" | cut -d: -f1 | head -n1)
-
-        if [ -n "$start_line" ]; then
-            local i=$((start_line + 1))
-            local total_lines
-            total_lines=$(wc -l <"$file")
-
-            while [ "$i" -le "$total_lines" ]; do
-                line=$(sed -n "${i}p" "$file")
-                if [[ "$line" == *"if-eqz v6"* ]]; then
-                    # Remove the if-eqz line
-                    sed -i "${i}d" "$file"
-                    echo "Removed if-eqz at line $i"
-                    break
-                fi
-                i=$((i + 1))
-            done
-        fi
-    fi
-
-    echo "Signature verification patches applied to framework.jar (Android 13)"
+    echo "Applying signature verification patches to framework.jar (Android $ANDROID_RELEASE)..."
+    manifest_apply "$decompile_dir" framework signature
+    echo "Signature verification patches applied to framework.jar (Android $ANDROID_RELEASE)"
 }
 
 # Main framework patching function
@@ -387,7 +59,7 @@ patch_framework() {
     recompile_jar "$framework_path"
 
     # Clean up
-    rm -rf "$WORK_DIR/framework" "$decompile_dir"
+    rm -rf "$WORK_DIR/framework" "$decompile_dir" "${decompile_dir}.index"
 
     echo "Framework.jar patching completed."
 }
@@ -396,55 +68,13 @@ patch_framework() {
 # Feature-specific patch functions for services.jar
 # ============================================
 
-# Apply signature verification bypass patches to services.jar (Android 13)
+# Apply signature verification bypass patches to services.jar
 apply_services_signature_patches() {
     local decompile_dir="$1"
 
-    echo "Applying signature verification patches to services.jar (Android 13)..."
-
-    # Patch checkDowngrade to return-void
-    echo "Patching checkDowngrade..."
-    patch_return_void_method "checkDowngrade" "$decompile_dir"
-
-    # Patch shouldCheckUpgradeKeySetLocked to return 0
-    echo "Patching shouldCheckUpgradeKeySetLocked..."
-    add_static_return_patch "shouldCheckUpgradeKeySetLocked" 0 "$decompile_dir"
-
-    # Patch verifySignatures to return 0
-    echo "Patching verifySignatures..."
-    add_static_return_patch "verifySignatures" 0 "$decompile_dir"
-
-    # Patch matchSignaturesCompat to return 1
-    echo "Patching matchSignaturesCompat..."
-    add_static_return_patch "matchSignaturesCompat" 1 "$decompile_dir"
-
-    # Patch isPersistent check
-    echo "Patching isPersistent check..."
-    local file
-    file=$(find "$decompile_dir" -type f -name "*.smali" -print0 | xargs -0 grep -l "invoke-interface.*isPersistent()Z" 2>/dev/null | head -n 1)
-    if [ -f "$file" ]; then
-        local pattern="invoke-interface {v4}, Lcom/android/server/pm/pkg/AndroidPackage;->isPersistent()Z"
-        local linenos
-        linenos=$(grep -nF "$pattern" "$file" | cut -d: -f1)
-
-        if [ -n "$linenos" ]; then
-            for lineno in $linenos; do
-                local move_result_lineno=$((lineno + 1))
-                local current_line
-                current_line=$(sed -n "${move_result_lineno}p" "$file" | sed 's/^[ \t]*//')
-                if [[ "$current_line" == "move-result v2" ]]; then
-                    local indent
-                    indent=$(sed -n "${move_result_lineno}p" "$file" | grep -o '^[ \t]*')
-                    sed -i "$((move_result_lineno + 1))i\\
-${indent}const/4 v2, 0x0" "$file"
-                    echo "Patched isPersistent check at line $((move_result_lineno + 1))"
-                    break
-                fi
-            done
-        fi
-    fi
-
-    echo "Signature verification patches applied to services.jar (Android 13)"
+    echo "Applying signature verification patches to services.jar (Android $ANDROID_RELEASE)..."
+    manifest_apply "$decompile_dir" services signature
+    echo "Signature verification patches applied to services.jar (Android $ANDROID_RELEASE)"
 }
 
 # Main services patching function
@@ -472,7 +102,7 @@ patch_services() {
     recompile_jar "$services_path"
 
     # Clean up
-    rm -rf "$WORK_DIR/services" "$decompile_dir"
+    rm -rf "$WORK_DIR/services" "$decompile_dir" "${decompile_dir}.index"
 
     echo "Services.jar patching completed."
 }
@@ -481,17 +111,15 @@ patch_services() {
 # Feature-specific patch functions for miui-services.jar
 # ============================================
 
-# Apply signature verification bypass patches to miui-services.jar (Android 13)
+# Apply signature verification bypass patches to miui-services.jar
 apply_miui_services_signature_patches() {
     local decompile_dir="$1"
 
-    echo "Applying signature verification patches to miui-services.jar (Android 13)..."
-
-    # Note: Android 13 miui-services.jar typically doesn't require signature patches
-    # as most signature verification is handled in framework.jar and services.jar
-    echo "No miui-services.jar signature patches required for Android 13"
-
-    echo "Signature verification patches applied to miui-services.jar (Android 13)"
+    echo "Applying signature verification patches to miui-services.jar (Android $ANDROID_RELEASE)..."
+    # Most signature verification is handled in framework.jar and services.jar,
+    # so the manifest usually has no miui-services.jar rows
+    manifest_apply "$decompile_dir" miui-services signature
+    echo "Signature verification patches applied to miui-services.jar (Android $ANDROID_RELEASE)"
 }
 
 # Main miui-services patching function
@@ -519,7 +147,7 @@ patch_miui_services() {
     recompile_jar "$miui_services_path"
 
     # Clean up
-    rm -rf "$WORK_DIR/miui-services" "$decompile_dir"
+    rm -rf "$WORK_DIR/miui-services" "$decompile_dir" "${decompile_dir}.index"
 
     echo "Miui-services.jar patching completed."
 }
@@ -527,6 +155,7 @@ patch_miui_services() {
 # Source helper functions
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 source "$SCRIPT_DIR/helper.sh"
+PATCH_MANIFEST="${PATCH_MANIFEST:-$SCRIPT_DIR/manifests/api${PATCH_API}.tsv}"
 
 # Main function
 main() {
@@ -541,15 +170,22 @@ JAR OPTIONS (specify which JARs to patch):
   --miui-services       Patch miui-services.jar
   (If no JAR option specified, all JARs will be patched)
 
+PLAN OPTIONS:
+  --plan                Only check that every patch target exists in the input JARs
+                        (reads their dex tables without decoding) and exit
+
 FEATURE OPTIONS (specify which features to apply):
   --disable-signature-verification    Disable signature verification (default if no feature specified)
 
 EXAMPLES:
   # Apply signature verification bypass to all JARs (backward compatible)
-  $0 33 xiaomi 1.0.0
+  $0 $PATCH_API xiaomi 1.0.0
 
   # Apply signature verification to framework only
-  $0 33 xiaomi 1.0.0 --framework --disable-signature-verification
+  $0 $PATCH_API xiaomi 1.0.0 --framework --disable-signature-verification
+
+  # Check the patch targets for all JARs without patching
+  $0 $PATCH_API xiaomi 1.0.0 --plan
 
 Creates a single module compatible with Magisk, KSU, and SUFS
 EOF
@@ -566,6 +202,7 @@ EOF
     PATCH_FRAMEWORK=0
     PATCH_SERVICES=0
     PATCH_MIUI_SERVICES=0
+    PLAN_ONLY=0
 
     while [ $# -gt 0 ]; do
         case "$1" in
@@ -578,6 +215,9 @@ EOF
             --miui-services)
                 PATCH_MIUI_SERVICES=1
                 ;;
+            --plan)
+                PLAN_ONLY=1
+                ;;
             --disable-signature-verification)
                 FEATURE_DISABLE_SIGNATURE_VERIFICATION=1
                 ;;
@@ -608,6 +248,16 @@ EOF
     [ $FEATURE_DISABLE_SIGNATURE_VERIFICATION -eq 1 ] && echo "  ✓ Disable Signature Verification"
     echo "============================================"
 
+    # --plan: resolve the manifest rows against the input JARs and stop
+    if [ $PLAN_ONLY -eq 1 ]; then
+        PLAN_JARS=()
+        [ $PATCH_FRAMEWORK -eq 1 ] && PLAN_JARS+=(framework)
+        [ $PATCH_SERVICES -eq 1 ] && PLAN_JARS+=(services)
+        [ $PATCH_MIUI_SERVICES -eq 1 ] && PLAN_JARS+=(miui-services)
+        manifest_plan "${PLAN_JARS[@]}"
+        exit $?
+    fi
+
     # Patch requested JARs
     if [ $PATCH_FRAMEWORK -eq 1 ]; then
         patch_framework
@@ -627,5 +277,13 @@ EOF
     echo "All patching completed successfully!"
 }
 
+# scripts/bench.sh sources the patcher for its functions only
+if [ "${PATCHER_SOURCE_ONLY:-0}" = "1" ]; then
+    return 0
+fi
+
+# Time each stage when PATCH_TIMELINE is set
+timeline_instrument
+
 # Run main function with all arguments
 main "$@"
@@ -0,0 +1,322 @@
+"""dex_engine edits on a classes.dex built here, checked unit by unit."""
+
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import dex_engine, manifest_plan  # noqa: E402
+from fptools.dex import OP_GOTO, OP_NOP, OP_RETURN, OP_RETURN_VOID, DexFile, const4, smali_string  # noqa: E402
+
+CLS = "La/Target;"
+
+
+def _uleb(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _align(data: bytearray, size: int = 4) -> None:
+    data.extend(b"\0" * (-len(data) % size))
+
+
+class DexBuilder:
+    """Writes a minimal dex: id tables, one class_def per class and its code items.
+
+    ``add_method`` takes the code as 16-bit units; ``catch_all`` puts the
+    first unit in a try block whose catch-all handler is at that address.
+    """
+
+    def __init__(self):
+        self.strings, self.types, self.protos, self.fields, self.method_ids = [], [], [], [], []
+        self.classes = {}
+
+    def _index(self, table, item) -> int:
+        if item not in table:
+            table.append(item)
+        return table.index(item)
+
+    def string(self, text: str) -> int:
+        return self._index(self.strings, text)
+
+    def type(self, descriptor: str) -> int:
+        return self._index(self.types, self.string(descriptor))
+
+    def proto(self, ret: str, params=()) -> int:
+        shorty = "".join("L" if t[0] in "L[" else t for t in (ret, *params))
+        return self._index(self.protos, (self.string(shorty), self.type(ret), tuple(self.type(p) for p in params)))
+
+    def field(self, cls: str, name: str, type_: str) -> int:
+        return self._index(self.fields, (self.type(cls), self.type(type_), self.string(name)))
+
+    def method(self, cls: str, name: str, ret: str, params=()) -> int:
+        return self._index(self.method_ids, (self.type(cls), self.proto(ret, params), self.string(name)))
+
+    def add_method(self, cls: str, name: str, ret: str, insns, registers: int = 4, ins: int = 0,
+                   params=(), catch_all=None) -> int:
+        idx = self.method(cls, name, ret, params)
+        self.classes.setdefault(cls, []).append((idx, registers, ins, list(insns), catch_all))
+        return idx
+
+    def build(self) -> bytes:
+        for cls in self.classes:
+            self.type(cls)
+        self.type("Ljava/lang/Object;")
+        # Sizes of everything before the data section
+        header = 0x70
+        offsets = {}
+        off = header
+        for name, size, count in (("strings", 4, len(self.strings)), ("types", 4, len(self.types)),
+                                  ("protos", 12, len(self.protos)), ("fields", 8, len(self.fields)),
+                                  ("methods", 8, len(self.method_ids)), ("classes", 32, len(self.classes))):
+            offsets[name] = off
+            off += size * count
+        data = bytearray(off)
+        data_off = off
+
+        string_offs = []
+        for text in self.strings:
+            string_offs.append(len(data))
+            data += _uleb(len(text)) + text.encode("utf-8") + b"\0"
+        _align(data)
+        param_offs = []
+        for _, _, params in self.protos:
+            if not params:
+                param_offs.append(0)
+                continue
+            param_offs.append(len(data))
+            data += struct.pack(f"<I{len(params)}H", len(params), *params)
+            _align(data)
+
+        class_data_offs = []
+        for methods in self.classes.values():
+            code_offs = []
+            for _, registers, ins, insns, catch_all in methods:
+                _align(data)
+                code_offs.append(len(data))
+                data += struct.pack("<4HII", registers, ins, 0, 1 if catch_all is not None else 0, 0, len(insns))
+                data += struct.pack(f"<{len(insns)}H", *insns)
+                if catch_all is not None:
+                    _align(data)
+                    # One try over the first unit, a catch-all handler list at offset 1
+                    data += struct.pack("<IHH", 0, 1, 1) + _uleb(1) + b"\0" + _uleb(catch_all)
+            class_data_offs.append(len(data))
+            data += _uleb(0) + _uleb(0) + _uleb(len(methods)) + _uleb(0)
+            previous = 0
+            for (idx, *_), code_off in sorted(zip(methods, code_offs)):
+                data += _uleb(idx - previous) + _uleb(0x9) + _uleb(code_off)
+                previous = idx
+        _align(data)
+        map_off = len(data)
+        data += struct.pack("<I", 0)
+
+        for i, string_off in enumerate(string_offs):
+            struct.pack_into("<I", data, offsets["strings"] + 4 * i, string_off)
+        for i, string_idx in enumerate(self.types):
+            struct.pack_into("<I", data, offsets["types"] + 4 * i, string_idx)
+        for i, ((shorty, ret, _), params_off) in enumerate(zip(self.protos, param_offs)):
+            struct.pack_into("<3I", data, offsets["protos"] + 12 * i, shorty, ret, params_off)
+        for i, entry in enumerate(self.fields):
+            struct.pack_into("<HHI", data, offsets["fields"] + 8 * i, *entry)
+        for i, entry in enumerate(self.method_ids):
+            struct.pack_into("<HHI", data, offsets["methods"] + 8 * i, *entry)
+        for i, (cls, class_data_off) in enumerate(zip(self.classes, class_data_offs)):
+            struct.pack_into("<8I", data, offsets["classes"] + 32 * i, self.type(cls), 1,
+                             self.type("Ljava/lang/Object;"), 0, 0xFFFFFFFF, 0, class_data_off, 0)
+
+        data[0:8] = b"dex\n035\0"
+        struct.pack_into("<4I", data, 0x20, len(data), header, 0x12345678, 0)
+        struct.pack_into("<I", data, 0x30, 0)
+        struct.pack_into("<I", data, 0x34, map_off)
+        struct.pack_into("<12I", data, 0x38,
+                         len(self.strings), offsets["strings"], len(self.types), offsets["types"],
+                         len(self.protos), offsets["protos"], len(self.fields), offsets["fields"],
+                         len(self.method_ids), offsets["methods"], len(self.classes), offsets["classes"])
+        struct.pack_into("<2I", data, 0x68, len(data) - data_off, data_off)
+        data[12:32] = hashlib.sha1(data[32:]).digest()
+        struct.pack_into("<I", data, 8, zlib.adler32(data[12:]))
+        return bytes(data)
+
+
+def _invoke_static(method_idx: int, *regs) -> list:
+    args = 0
+    for i, reg in enumerate(regs):
+        args |= reg << (4 * i)
+    return [0x71 | (len(regs) << 12), method_idx, args]
+
+
+def _code(dex: DexFile, name: str, cls: str = CLS):
+    for method_idx, code_off in dex.methods(cls):
+        if dex.method_name(method_idx) == name:
+            return dex.code(code_off)
+    raise KeyError(name)
+
+
+def _units(dex: DexFile, name: str, cls: str = CLS):
+    return list(_code(dex, name, cls).units)
+
+
+class DexEngineTest(unittest.TestCase):
+    def setUp(self):
+        b = DexBuilder()
+        check = b.method("La/Other;", "check", "Z")
+        unsafe = b.method("La/Other;", "unsafe", "V", ["I"])
+        intl = b.field("La/Build;", "IS_INTERNATIONAL_BUILD", "Z")
+        text = b.string("<manifest> specifies bad sharedUserId name")
+        # invoke-static, move-result v0, return v0
+        b.add_method(CLS, "isOk", "Z", _invoke_static(check) + [0x000A, OP_RETURN])
+        b.add_method(CLS, "small", "I", [const4(0, 5), OP_RETURN])
+        b.add_method(CLS, "run", "V", _invoke_static(check) + [OP_RETURN_VOID])
+        # 0: invoke check  3: move-result v0  4: if-eqz v0, +5 (-> 9)  6: const-string v1  8/9: return-void
+        b.add_method(CLS, "parse", "V", _invoke_static(check) + [0x000A, 0x0038, 5, 0x011A, text,
+                                                                OP_RETURN_VOID, OP_RETURN_VOID])
+        # 0: const/4 v1, 0  1: invoke unsafe(v1)  4: return-void
+        b.add_method("La/Collect;", "collect", "V", [const4(1, 0)] + _invoke_static(unsafe, 1) + [OP_RETURN_VOID])
+        # Same, with a goto back to the invoke
+        b.add_method("La/Loop;", "loop", "V", [const4(1, 0)] + _invoke_static(unsafe, 1) + [OP_GOTO | (0xFD << 8)])
+        # Same, with a catch-all handler at the invoke
+        b.add_method("La/Guarded;", "guarded", "V", [const4(1, 0)] + _invoke_static(unsafe, 1) + [OP_RETURN_VOID],
+                     catch_all=1)
+        # sget-boolean v2, IS_INTERNATIONAL_BUILD; return v2
+        b.add_method(CLS, "intl", "Z", [0x0263, intl, 0x020F])
+        self.data = b.build()
+
+    def dexes(self):
+        return [DexFile(self.data)]
+
+    def test_return_const_pads_with_nop(self):
+        dexes = self.dexes()
+        self.assertEqual(dex_engine.return_const(dexes, CLS, "isOk", "1"), 1)
+        self.assertEqual(_units(dexes[0], "isOk"), [const4(0, 1), OP_RETURN, OP_NOP, OP_NOP, OP_NOP])
+
+        dexes = self.dexes()
+        dex_engine.return_const(dexes, CLS, "isOk", "100")
+        self.assertEqual(_units(dexes[0], "isOk"), [0x0013, 0x100, OP_RETURN, OP_NOP, OP_NOP])
+
+    def test_return_const_that_does_not_fit(self):
+        with self.assertRaises(dex_engine.Unsupported):
+            dex_engine.return_const(self.dexes(), CLS, "small", "100")
+
+    def test_return_void_pads_with_nop(self):
+        dexes = self.dexes()
+        self.assertEqual(dex_engine.return_void(dexes, CLS, "run"), 1)
+        self.assertEqual(_units(dexes[0], "run"), [OP_RETURN_VOID, OP_NOP, OP_NOP, OP_NOP])
+
+    def test_const_before_if_not_taken(self):
+        dexes = self.dexes()
+        hits = dex_engine.const_before_if(dexes, CLS, "specifies bad sharedUserId", "if-eqz v0, :", "v0", "1")
+        self.assertEqual(hits, 1)
+        self.assertEqual(_units(dexes[0], "parse")[4:6], [const4(0, 1), OP_NOP])
+
+    def test_const_before_if_taken(self):
+        dexes = self.dexes()
+        dex_engine.const_before_if(dexes, CLS, "specifies bad sharedUserId", "if-eqz v0, :", "v0", "0")
+        units = _units(dexes[0], "parse")
+        # The goto sits one unit after the branch, so it jumps 4 to reach the same target
+        self.assertEqual(units[4:6], [const4(0, 0), OP_GOTO | (4 << 8)])
+        self.assertIn(9, _code(dexes[0], "parse").branch_targets())
+
+    def test_const_before_reuses_the_const(self):
+        dexes = self.dexes()
+        self.assertEqual(dex_engine.const_before(dexes, "La/Collect;", "La/Other;->unsafe(I)V", "const/4 v1, 0x1"), 1)
+        self.assertEqual(_units(dexes[0], "collect", "La/Collect;")[0], const4(1, 1))
+
+    def test_const_before_refuses_a_branch_target(self):
+        for cls, name in (("La/Loop;", "loop"), ("La/Guarded;", "guarded")):
+            with self.subTest(cls=cls):
+                dexes = self.dexes()
+                self.assertIn(1, _code(dexes[0], name, cls).branch_targets())
+                with self.assertRaises(dex_engine.Unsupported):
+                    dex_engine.const_before(dexes, cls, "La/Other;->unsafe(I)V", "const/4 v1, 0x1")
+                self.assertFalse(dexes[0].dirty)
+
+    def test_sget_to_const(self):
+        dexes = self.dexes()
+        sget = "sget-boolean v2, La/Build;->IS_INTERNATIONAL_BUILD:Z"
+        self.assertEqual(dex_engine.sget_to_const(dexes, CLS, sget, "v2", "1"), 1)
+        self.assertEqual(_units(dexes[0], "intl"), [const4(2, 1), OP_NOP, 0x020F])
+
+    def test_finish_checksum_and_signature(self):
+        dexes = self.dexes()
+        dex_engine.return_void(dexes, CLS, "run")
+        data = dexes[0].finish()
+        self.assertNotEqual(data, self.data)
+        self.assertEqual(data[12:32], hashlib.sha1(data[32:]).digest())
+        self.assertEqual(struct.unpack_from("<I", data, 8)[0], zlib.adler32(data[12:]))
+        self.assertEqual(_units(DexFile(data), "run")[0], OP_RETURN_VOID)
+
+    def test_patch_jar_copies_other_entries(self):
+        other = DexBuilder()
+        other.add_method("Lb/Untouched;", "run", "V", [OP_RETURN_VOID])
+        entries = {"classes.dex": self.data, "classes2.dex": other.build(),
+                   "META-INF/MANIFEST.MF": b"Manifest-Version: 1.0\r\n\r\n",
+                   "res/values.xml": b"<resources/>" * 100}
+        with tempfile.TemporaryDirectory() as tmp:
+            jar, out = os.path.join(tmp, "in.jar"), os.path.join(tmp, "out.jar")
+            with zipfile.ZipFile(jar, "w") as archive:
+                for name, data in entries.items():
+                    compression = zipfile.ZIP_STORED if name.endswith(".dex") else zipfile.ZIP_DEFLATED
+                    archive.writestr(name, data, compress_type=compression)
+            total = dex_engine.patch_jar(jar, out, [("return_void", CLS, ["run"])])
+            self.assertEqual(total, 1)
+            self.assertEqual(_raw_entries(out).keys(), _raw_entries(jar).keys())
+            before, after = _raw_entries(jar), _raw_entries(out)
+            for name in entries:
+                if name != "classes.dex":
+                    self.assertEqual(after[name], before[name], name)
+            with zipfile.ZipFile(out) as archive:
+                self.assertEqual(archive.testzip(), None)
+                patched = archive.read("classes.dex")
+        self.assertEqual(_units(DexFile(patched), "run")[0], OP_RETURN_VOID)
+        self.assertEqual(struct.unpack_from("<I", patched, 8)[0], zlib.adler32(patched[12:]))
+
+
+class RenderTest(unittest.TestCase):
+    TEXT = "tab\there \"q\" 'a' \\ \u00e9\x01\n"
+    ESCAPED = "tab\\there \\\"q\\\" \\'a\\' \\\\ \\u00e9\\u0001\\n"
+
+    def setUp(self):
+        b = DexBuilder()
+        text = b.string(self.TEXT)
+        b.add_method(CLS, "strings", "V", [0x001A, text, 0x011B, text, 0, OP_RETURN_VOID])
+        self.dex = DexFile(b.build())
+
+    def test_const_string_is_escaped_like_baksmali(self):
+        code = _code(self.dex, "strings")
+        lines = [code.render(pc, op) for pc, op in code.instructions()]
+        self.assertEqual(lines[:2], [f'const-string v0, "{self.ESCAPED}"', f'const-string/jumbo v1, "{self.ESCAPED}"'])
+
+    def test_dry_run_symbol_is_the_escaped_table_string(self):
+        anchor = f'const-string/jumbo v1, "{self.ESCAPED}"'
+        self.assertEqual(manifest_plan._symbol(anchor), smali_string(self.TEXT))
+
+
+def _raw_entries(path: str):
+    """Maps entry names to (compression, CRC, stored bytes) as they sit in the file."""
+    entries = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as handle:
+        for info in archive.infolist():
+            handle.seek(info.header_offset)
+            header = handle.read(30)
+            name_len, extra_len = struct.unpack_from("<HH", header, 26)
+            handle.seek(info.header_offset + 30 + name_len + extra_len)
+            entries[info.filename] = (info.compress_type, info.CRC, handle.read(info.compress_size))
+    return entries
+
+
+if __name__ == "__main__":
+    unittest.main()
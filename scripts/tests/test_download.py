@@ -0,0 +1,181 @@
+"""download.py against a local HTTP server that drops, ignores ranges and serves bad bodies."""
+
+import hashlib
+import http.server
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import download  # noqa: E402
+
+RANGE = re.compile(r"bytes=(\d+)-$")
+
+
+def _jar(*names) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\r\n\r\n")
+        for name in names:
+            archive.writestr(name, os.urandom(48 * 1024), compress_type=zipfile.ZIP_STORED)
+    return buf.getvalue()
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    """Serves /<mode>/<name> from files; see _Handler for the modes."""
+
+    def __init__(self, files):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.files = files
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, mode: str, name: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/{mode}/{name}"
+
+    def seen(self, mode: str, name: str):
+        """Returns the Range headers of the requests for one URL, in order."""
+        return [rng for path, rng in self.requests if path == f"/{mode}/{name}"]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """ok: honours Range.  drop: the first response stops halfway.
+    norange: like drop, but every response is the whole file with status 200."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        _, mode, name = self.path.split("/", 2)
+        rng = self.headers.get("Range")
+        with self.server.lock:
+            first = not self.server.seen(mode, name)
+            self.server.requests.append((self.path, rng))
+        data = self.server.files.get(name)
+        if data is None:
+            self.send_error(404)
+            return
+        start = 0
+        match = RANGE.match(rng or "")
+        if match and mode != "norange":
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if first and mode in ("drop", "norange"):
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.out = tmp.name
+        self.jar = _jar("classes.dex", "classes2.dex")
+        self.server = FileServer({
+            "framework.jar": self.jar,
+            "services.jar": _jar("classes.dex"),
+            "page.jar": b"<!DOCTYPE html><html><body>Download</body></html>\n" * 40,
+            "truncated.jar": self.jar[:len(self.jar) // 2],
+            "nodex.jar": _jar(),
+        })
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def fetch(self, mode: str, name: str, **kwargs):
+        kwargs.setdefault("delay", 0.01)
+        return download.fetch(name, self.server.url(mode, name), self.out, **kwargs)
+
+    def assert_fetched(self, path, digest, size, data):
+        with open(path, "rb") as handle:
+            self.assertEqual(handle.read(), data)
+        self.assertEqual((digest, size), (hashlib.sha256(data).hexdigest(), len(data)))
+        self.assertFalse(os.path.exists(path + ".part"))
+
+    def test_dropped_connection_resumes_with_range(self):
+        self.assert_fetched(*self.fetch("drop", "framework.jar"), self.jar)
+        ranges = self.server.seen("drop", "framework.jar")
+        self.assertEqual(len(ranges), 2)
+        self.assertIsNone(ranges[0])
+        self.assertEqual(ranges[1], f"bytes={len(self.jar) // 2}-")
+
+    def test_server_ignoring_the_range_restarts(self):
+        self.assert_fetched(*self.fetch("norange", "framework.jar"), self.jar)
+        ranges = self.server.seen("norange", "framework.jar")
+        self.assertEqual(len(ranges), 2)
+        self.assertIsNotNone(ranges[1])
+
+    def test_stale_partial_file_starts_over(self):
+        with open(os.path.join(self.out, "framework.jar.part"), "wb") as handle:
+            handle.write(b"x" * (len(self.jar) + 10))
+        self.assert_fetched(*self.fetch("ok", "framework.jar"), self.jar)
+        self.assertEqual(self.server.seen("ok", "framework.jar"), [f"bytes={len(self.jar) + 10}-", None])
+
+    def test_partial_file_of_an_earlier_run_is_resumed(self):
+        with open(os.path.join(self.out, "framework.jar.part"), "wb") as handle:
+            handle.write(self.jar[:1000])
+        self.assert_fetched(*self.fetch("ok", "framework.jar"), self.jar)
+        self.assertEqual(self.server.seen("ok", "framework.jar"), ["bytes=1000-"])
+
+    def test_bodies_that_are_no_jar_are_rejected(self):
+        for name, problem in (("page.jar", "not a readable ZIP"), ("truncated.jar", "not a readable ZIP"),
+                              ("nodex.jar", "no classes*.dex entry")):
+            with self.subTest(name=name):
+                with self.assertRaises(download.DownloadError) as caught:
+                    self.fetch("ok", name)
+                self.assertIn(name, str(caught.exception))
+                self.assertIn(problem, str(caught.exception))
+
+    def test_client_error_is_not_retried(self):
+        with self.assertRaises(download.DownloadError) as caught:
+            self.fetch("ok", "missing.jar")
+        self.assertIn("HTTP 404", str(caught.exception))
+        self.assertEqual(self.server.seen("ok", "missing.jar"), [None])
+
+    def test_sha256_mismatch_fails_the_command(self):
+        wrong = "0" * 64
+        result = subprocess.run(
+            [sys.executable, "-m", "fptools", "jar-fetch", self.out,
+             f"framework.jar={self.server.url('ok', 'framework.jar')}",
+             f"services.jar={self.server.url('ok', 'services.jar')}",
+             "--sha256", f"framework.jar={wrong}",
+             "--sha256", f"services.jar={hashlib.sha256(self.server.files['services.jar']).hexdigest()}"],
+            env=dict(os.environ, PYTHONPATH=SCRIPTS), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            timeout=60)
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn(f"does not match {wrong}", result.stderr)
+        self.assertEqual([line.split("\t")[0] for line in result.stdout.splitlines()], ["services.jar"])
+
+    def test_fetch_all_finishes_the_others(self):
+        downloads = [("framework.jar", self.server.url("drop", "framework.jar")),
+                     ("page.jar", self.server.url("ok", "page.jar")),
+                     ("services.jar", self.server.url("ok", "services.jar"))]
+        results, errors = download.fetch_all(downloads, self.out, delay=0.01)
+        self.assertEqual(sorted(results), ["framework.jar", "services.jar"])
+        self.assertEqual(list(errors), ["page.jar"])
+        self.assert_fetched(*results["framework.jar"], self.jar)
+        self.assert_fetched(*results["services.jar"], self.server.files["services.jar"])
+
+
+if __name__ == "__main__":
+    unittest.main()
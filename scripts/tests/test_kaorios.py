@@ -0,0 +1,113 @@
+"""insert_template_block against targets whose registers and field types differ from the template."""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import smali_engine  # noqa: E402
+
+KEYBOX = ("invoke-static {v0}, Lcom/android/internal/util/kaorios/ToolboxUtils;->"
+          "KaoriosKeybox(Landroid/system/keystore2/KeyEntryResponse;)Landroid/system/keystore2/KeyEntryResponse;")
+GET_KEY_ENTRY = "getKeyEntry(Landroid/system/keystore2/KeyDescriptor;)Landroid/system/keystore2/KeyEntryResponse;"
+
+KEYSTORE2 = f"""\
+.class public Landroid/security/KeyStore2;
+.super Ljava/lang/Object;
+
+.method public {GET_KEY_ENTRY}
+    .registers 4
+
+    invoke-direct {{p0, p1}}, Landroid/security/KeyStore2;->get(Landroid/system/keystore2/KeyDescriptor;)Ljava/lang/Object;
+
+    move-result-object v1
+
+    check-cast v1, Landroid/system/keystore2/KeyEntryResponse;
+
+    return-object v1
+.end method
+"""
+
+APM = """\
+.class public Landroid/app/ApplicationPackageManager;
+.super Ljava/lang/Object;
+
+.field private static final mHasSystemFeatureCache:Landroid/app/ApplicationPackageManager$FeatureCache;
+
+.method public hasSystemFeature(Ljava/lang/String;I)Z
+    .registers 4
+
+    sget-object v2, Landroid/app/ApplicationPackageManager;->mHasSystemFeatureCache:Landroid/app/ApplicationPackageManager$FeatureCache;
+
+    const/4 v0, 0x0
+
+    return v0
+.end method
+"""
+
+
+class InsertTemplateBlockTest(unittest.TestCase):
+    def _apply(self, text: str, *args):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "Target.smali")
+            path.write_text(text)
+            buf = smali_engine.Buffer(path)
+            status = smali_engine.insert_template_block(buf, *args)
+            buf.save()
+            return status, [line.strip() for line in path.read_text().splitlines() if line.strip()]
+
+    def test_block_registers_follow_the_anchor(self):
+        block = f"    {KEYBOX}\n\n    move-result-object v0\n"
+        status, lines = self._apply(KEYSTORE2, GET_KEY_ENTRY, "last", "return-object v0", "1", KEYBOX, block)
+        self.assertEqual(status, smali_engine.OK)
+        self.assertEqual(lines[-4:], [KEYBOX.replace("{v0}", "{v1}"), "move-result-object v1", "return-object v1",
+                                      ".end method"])
+
+    def test_marker_in_other_registers_counts_as_patched(self):
+        block = f"    {KEYBOX}\n\n    move-result-object v0\n"
+        args = (GET_KEY_ENTRY, "last", "return-object v0", "1", KEYBOX, block)
+        _, once = self._apply(KEYSTORE2, *args)
+        status, twice = self._apply("\n".join(once) + "\n", *args)
+        self.assertEqual(status, smali_engine.OK)
+        self.assertEqual(twice, once)
+
+    def test_own_field_anchor_matches_by_name(self):
+        anchor = ("sget-object v1, Landroid/app/ApplicationPackageManager;->mHasSystemFeatureCache:"
+                  "Landroid/app/PropertyInvalidatedCache;")
+        marker = "invoke-static {}, Lcom/android/internal/util/kaorios/KaoriFeaturesUtils;->getAppLog()Ljava/lang/String;"
+        block = f"    {marker}\n\n    move-result-object v1\n"
+        status, lines = self._apply(APM, "hasSystemFeature(Ljava/lang/String;I)Z", "first", anchor, "3", marker, block)
+        self.assertEqual(status, smali_engine.OK)
+        at = lines.index(marker)
+        self.assertEqual(lines[at + 1], "move-result-object v2")
+        self.assertTrue(lines[at + 2].startswith("sget-object v2, "))
+
+    def test_missing_anchor_is_no_match(self):
+        status, _ = self._apply(KEYSTORE2, GET_KEY_ENTRY, "last", "return-wide v0", "1", KEYBOX, KEYBOX)
+        self.assertEqual(status, smali_engine.NO_MATCH)
+
+
+class ApplyPlanTest(unittest.TestCase):
+    def test_missing_file_reports_its_own_ops(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            present = Path(tmp, "KeyStore2.smali")
+            present.write_text(KEYSTORE2)
+            gone = str(Path(tmp, "Moved.smali"))
+            block = f"    {KEYBOX}\n\n    move-result-object v0\n"
+            ops = [
+                ("insert_template_block", gone, ["first()V", "last", "return-void", "0", KEYBOX, block]),
+                ("insert_template_block", gone, ["second()V", "last", "return-void", "0", KEYBOX, block]),
+                ("insert_template_block", str(present),
+                 [GET_KEY_ENTRY, "last", "return-object v0", "1", KEYBOX, block]),
+            ]
+            misses = []
+            smali_engine.apply_plan(ops, misses)
+        self.assertEqual([(path, args[0]) for _, path, args in misses], [(gone, "first()V"), (gone, "second()V")])
+
+
+if __name__ == "__main__":
+    unittest.main()
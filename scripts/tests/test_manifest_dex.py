@@ -0,0 +1,96 @@
+"""DEX plans generated from the patch manifest."""
+
+import os
+import sys
+import unittest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import dex_engine, manifest, manifest_dex  # noqa: E402
+
+INTL = "Lmiui/os/Build;->IS_INTERNATIONAL_BUILD:Z"
+
+# The plans patcher_a16.sh used to list by hand, which the manifest now has to produce
+API36 = {
+    ("framework", "signature"): [
+        ("const_before", "Landroid/content/pm/PackageParser;",
+         ["ApkSignatureVerifier;->unsafeGetCertsWithoutVerification", "const/4 v1, 0x1"]),
+        ("const_before_if", "Landroid/content/pm/PackageParser;",
+         ["<manifest> specifies bad sharedUserId name", "if-nez v14, :", "v14", "1", "10"]),
+        ("const_before", "Landroid/content/pm/PackageParser$PackageParserException;",
+         ["iput p1, p0, Landroid/content/pm/PackageParser$PackageParserException;->error:I", "const/4 p1, 0x0"]),
+        ("return_const", "Landroid/content/pm/PackageParser$SigningDetails;", ["checkCapability", "1"]),
+        ("return_const", "Landroid/content/pm/SigningDetails;", ["checkCapability", "1"]),
+        ("return_const", "Landroid/content/pm/SigningDetails;", ["checkCapabilityRecover", "1"]),
+        ("return_const", "Landroid/content/pm/SigningDetails;", ["hasAncestorOrSelf", "1"]),
+        ("move_result_to_const", "Landroid/util/apk/ApkSignatureSchemeV2Verifier;",
+         ["invoke-static {v8, v4}, Ljava/security/MessageDigest;->isEqual([B[B)Z", "const/4 v0, 0x1"]),
+        ("move_result_to_const", "Landroid/util/apk/ApkSignatureSchemeV3Verifier;",
+         ["invoke-static {v9, v3}, Ljava/security/MessageDigest;->isEqual([B[B)Z", "const/4 v0, 0x1"]),
+        ("return_const", "Landroid/util/apk/ApkSignatureVerifier;", ["getMinimumSignatureSchemeVersionForTargetSdk", "0"]),
+        ("const_before", "Landroid/util/apk/ApkSignatureVerifier;",
+         ["ApkSignatureVerifier;->verifyV1Signature", "const p3, 0x0"]),
+        ("move_result_to_const", "Landroid/util/apk/ApkSigningBlockUtils;",
+         ["invoke-static {v5, v6}, Ljava/security/MessageDigest;->isEqual([B[B)Z", "const/4 v7, 0x1"]),
+        ("return_const", "Landroid/util/jar/StrictJarVerifier;", ["verifyMessageDigest", "1"]),
+        ("drop_if_after", "Landroid/util/jar/StrictJarFile;",
+         ["invoke-virtual {p0, v5}, Landroid/util/jar/StrictJarFile;->findEntry(Ljava/lang/String;)Ljava/util/zip/ZipEntry;",
+          "if-eqz v6, :"]),
+        ("const_before_if", "Lcom/android/internal/pm/pkg/parsing/ParsingPackageUtils;",
+         ["<manifest> specifies bad sharedUserId name", "if-eqz v4, :", "v4", "0", "10"]),
+    ],
+    ("services", "signature"): [
+        ("return_void", "*", ["checkDowngrade"]),
+        ("return_const", "Lcom/android/server/pm/PackageManagerServiceUtils;", ["verifySignatures", "0"]),
+        ("return_const", "Lcom/android/server/pm/PackageManagerServiceUtils;", ["matchSignaturesCompat", "1"]),
+        ("return_const", "Lcom/android/server/pm/KeySetManagerService;,*", ["shouldCheckUpgradeKeySetLocked", "0"]),
+        ("const_before_if", "Lcom/android/server/pm/InstallPackageHelper;,*",
+         ["invoke-interface {p5}, Lcom/android/server/pm/pkg/AndroidPackage;->isLeavingSharedUser()Z",
+          "if-eqz v3, :", "v3", "1"]),
+        ("clinit_const_flip", "Lcom/android/server/pm/ReconcilePackageUtils;", []),
+    ],
+    ("services", "secure"): [
+        ("return_const", "Lcom/android/server/wm/WindowState;", ["isSecureLocked()Z", "0", "first"]),
+    ],
+    ("miui-services", "signature"): [
+        ("return_void", "*", ["verifyIsolationViolation"]),
+        ("return_void", "*", ["canBeUpdate"]),
+    ],
+    ("miui-services", "cn"): [
+        ("sget_to_const", "Lcom/android/server/am/BroadcastQueueModernStubImpl;", [f"sget-boolean v2, {INTL}", "v2", "1"]),
+        ("sget_to_const", "Lcom/android/server/am/ActivityManagerServiceImpl;", [f"sget-boolean v1, {INTL}", "v1", "1"]),
+        ("sget_to_const", "Lcom/android/server/am/ActivityManagerServiceImpl;", [f"sget-boolean v4, {INTL}", "v4", "1"]),
+        ("sget_to_const", "Lcom/android/server/am/ProcessManagerService;", [f"sget-boolean v0, {INTL}", "v0", "1"]),
+        ("sget_to_const", "Lcom/android/server/am/ProcessSceneCleaner;", [f"sget-boolean v4, {INTL}", "v0", "1"]),
+    ],
+    ("miui-services", "secure"): [
+        ("return_const", "Lcom/android/server/wm/WindowManagerServiceImpl;",
+         ["notAllowCaptureDisplay(Lcom/android/server/wm/RootWindowContainer;I)Z", "0", "first"]),
+    ],
+}
+
+
+class ManifestDexTest(unittest.TestCase):
+    def test_api36_plans(self):
+        rows = manifest.load(os.path.join(SCRIPTS, "manifests", "api36.tsv"))
+        for (jar, feature), expected in API36.items():
+            with self.subTest(jar=jar, feature=feature):
+                ops = manifest_dex.dex_ops(manifest.select(rows, jar, [feature]))
+                self.assertEqual(ops, expected)
+                self.assertTrue(all(op in dex_engine.OPS for op, _, _ in ops))
+
+    def test_body_without_dex_equivalent(self):
+        row = ("services", "secure", "class:com/android/server/wm/WindowState.smali", "replace_method",
+               ["isSecureLocked()Z", "    .registers 6\\n\\n    invoke-static {}, La/B;->c()Z\\n\\n    return v0"])
+        with self.assertRaises(manifest_dex.NoDexEquivalent):
+            manifest_dex.dex_ops([row])
+
+    def test_unknown_op_has_no_dex_equivalent(self):
+        row = ("framework", "signature", "class:a/B.smali", "insert_before_last_return", ["x"])
+        with self.assertRaises(manifest_dex.NoDexEquivalent):
+            manifest_dex.dex_ops([row])
+
+
+if __name__ == "__main__":
+    unittest.main()
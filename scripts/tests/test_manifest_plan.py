@@ -0,0 +1,71 @@
+"""manifest_plan rows resolved against stub dex tables."""
+
+import os
+import sys
+import unittest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import manifest, manifest_plan  # noqa: E402
+
+PERSISTENT = "Lcom/android/server/pm/pkg/AndroidPackage;->isPersistent()Z"
+
+
+class StubTables:
+    """The JarTables lookups over a fixed set of method/field refs and strings."""
+
+    def __init__(self, ids, classes=()):
+        self.path = "stub.jar"
+        self.ids = list(ids)
+        self.classes = set(classes)
+
+    def in_tables(self, text: str) -> bool:
+        return any(text in entry for entry in self.ids)
+
+    def find_class(self, rel: str):
+        return [(None, f"L{rel[:-6]};")] if rel in self.classes else []
+
+    def find_methods(self, text: str):
+        return []
+
+    def lines(self, dex_file, descriptor: str):
+        return []
+
+
+def _row(api: str, jar: str, needle: str):
+    rows = manifest.load(os.path.join(SCRIPTS, "manifests", f"{api}.tsv"))
+    return next(row for row in rows if row[0] == jar and needle in row[2])
+
+
+class ScanTargetTest(unittest.TestCase):
+    def test_is_persistent_resolves_from_its_reference(self):
+        row = _row("api33", "services", "isPersistent")
+        entry = manifest_plan.check_row(StubTables([PERSISTENT]), row)
+        self.assertEqual(entry["status"], manifest_plan.OK, entry)
+
+    def test_opcode_is_not_looked_up(self):
+        self.assertEqual(manifest_plan._scan_symbols("invoke-interface.*isPersistent()Z"), ["isPersistent()Z"])
+        self.assertEqual(manifest_plan._scan_symbols("invoke-interface {p5}, La/B;->c()Z"), ["La/B;->c()Z"])
+
+    def test_missing_reference_fails(self):
+        row = _row("api33", "services", "isPersistent")
+        entry = manifest_plan.check_row(StubTables(["Lcom/android/server/pm/pkg/AndroidPackage;->isSystem()Z"]), row)
+        self.assertEqual(entry["status"], manifest_plan.NO_TARGET)
+
+
+class OptionalRowTest(unittest.TestCase):
+    def test_optional_row_is_skipped(self):
+        row = _row("api35", "framework", "PackageParser$SigningDetails.smali")
+        self.assertTrue(manifest.alternatives(row[2])[0])
+        entry = manifest_plan.check_row(StubTables([]), row)
+        self.assertEqual(entry["status"], manifest_plan.SKIP)
+
+    def test_required_row_still_fails(self):
+        row = _row("api35", "framework", "android/content/pm/SigningDetails.smali")
+        entry = manifest_plan.check_row(StubTables([]), row)
+        self.assertEqual(entry["status"], manifest_plan.NO_TARGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""smali_index.refresh_many after methods were renamed, removed or deleted."""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+from fptools import smali_index  # noqa: E402
+
+
+def _class(name: str, *methods: str) -> str:
+    body = "".join(f".method public {method}()V\n    .registers 1\n\n    return-void\n.end method\n\n"
+                   for method in methods)
+    return f".class public La/{name};\n.super Ljava/lang/Object;\n\n{body}"
+
+
+class RefreshTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, "framework")
+        os.makedirs(os.path.join(self.root, "smali", "a"))
+        self.foo = os.path.join(self.root, "smali", "a", "Foo.smali")
+        Path(self.foo).write_text(_class("Foo", "checkCapability", "verify"))
+        Path(self.root, "smali", "a", "Bar.smali").write_text(_class("Bar", "checkOther"))
+        smali_index.build(self.root)
+
+    def test_renamed_method_leaves_no_row(self):
+        Path(self.foo).write_text(_class("Foo", "renamed", "verify"))
+        smali_index.refresh_many(self.root, [self.foo])
+        self.assertEqual(smali_index.find_methods(self.root, "checkCapability"), [])
+        self.assertEqual(smali_index.find_methods(self.root, "renamed"), [self.foo])
+        self.assertEqual(smali_index.find_methods(self.root, "checkOther"),
+                         [os.path.join(self.root, "smali", "a", "Bar.smali")])
+
+    def test_deleted_file_leaves_no_row(self):
+        os.unlink(self.foo)
+        smali_index.refresh_many(self.root, [self.foo])
+        self.assertEqual(smali_index.find_methods(self.root, "verify"), [])
+        self.assertEqual(smali_index.find_class(self.root, "a/Foo.smali"), "")
+
+    def test_index_without_bucket_listing(self):
+        (smali_index.index_dir_for(self.root) / smali_index.BUCKETS).unlink()
+        Path(self.foo).write_text(_class("Foo", "verify"))
+        smali_index.refresh_many(self.root, [self.foo])
+        self.assertEqual(smali_index.find_methods(self.root, "checkCapability"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""update_kaorios.sh against a local stand-in of the GitHub releases API, offline.
+
+The stand-in serves one release whose assets are generated here, answers
+If-None-Match with 304 and logs every request. baksmali is a fake ``java``
+on PATH that writes three utility classes, so the run needs bash and
+python3 but no JDK and no network.
+"""
+
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TAG = "V1.0.5"
+REPO = "Wuang26/Kaorios-Toolbox"
+
+FAKE_JAVA = """#!/usr/bin/env bash
+# java -jar baksmali.jar d DEX -o OUT
+echo "$*" >>"$FAKE_JAVA_LOG"
+out="${@: -1}"
+mkdir -p "$out/com/android/internal/util/kaorios"
+for name in ToolboxUtils KaoriFeaturesUtils SettingsHelper; do
+    echo ".class public Lcom/android/internal/util/kaorios/$name;" >"$out/com/android/internal/util/kaorios/$name.smali"
+done
+"""
+
+
+class ReleasesStandIn(http.server.ThreadingHTTPServer):
+    """Serves /repos/<REPO>/releases/latest and /download/<asset>."""
+
+    def __init__(self, assets):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.assets = assets
+        self.requests = []
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def release(self) -> bytes:
+        return json.dumps({"tag_name": TAG, "assets": [
+            {"id": index, "name": name, "size": len(data), "updated_at": "2025-11-28T00:00:00Z",
+             "digest": "sha256:" + hashlib.sha256(data).hexdigest(),
+             "browser_download_url": f"{self.base}/download/{name}"}
+            for index, (name, data) in enumerate(sorted(self.assets.items()))]}).encode()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes = b"", etag: str = ""):
+        self.send_response(code)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == f"/repos/{REPO}/releases/latest":
+            body = self.server.release()
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+            if self.headers.get("If-None-Match") == etag:
+                self.server.requests.append(("304", self.path))
+                return self._send(304, etag=etag)
+            self.server.requests.append(("200", self.path))
+            return self._send(200, body, etag)
+        name = self.path.rsplit("/", 1)[-1]
+        if self.path.startswith("/download/") and name in self.server.assets:
+            self.server.requests.append(("200", self.path))
+            return self._send(200, self.server.assets[name])
+        self.server.requests.append(("404", self.path))
+        self._send(404)
+
+
+class UpdateKaoriosTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="kaorios_update_test.")
+        self.addCleanup(shutil.rmtree, self.tmp)
+        root = os.path.join(self.tmp, "project")
+        os.makedirs(os.path.join(root, "scripts"))
+        shutil.copy(os.path.join(SCRIPTS, "update_kaorios.sh"), os.path.join(root, "scripts"))
+        shutil.copytree(os.path.join(SCRIPTS, "fptools"), os.path.join(root, "scripts", "fptools"),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+        os.makedirs(os.path.join(root, "kaorios_toolbox"))
+        os.makedirs(os.path.join(root, "tools"))
+        with open(os.path.join(root, "tools", "baksmali.jar"), "wb") as handle:
+            handle.write(b"not a jar; java is faked")
+        bin_dir = os.path.join(self.tmp, "bin")
+        os.makedirs(bin_dir)
+        java = os.path.join(bin_dir, "java")
+        with open(java, "w") as handle:
+            handle.write(FAKE_JAVA)
+        os.chmod(java, 0o755)
+        self.root = root
+        self.java_log = os.path.join(self.tmp, "java.log")
+
+        self.server = ReleasesStandIn({
+            "KaoriosToolbox-v105.apk": os.urandom(4096),
+            "privapp_whitelist_com.kousei.kaorios.xml": b"<permissions>" + b" " * 200 + b"</permissions>\n",
+            "classes.dex": b"dex\n035\0" + os.urandom(2048),
+        })
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.stop_server)
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+                        KAORIOS_API_BASE=self.server.base, KAORIOS_STORE=os.path.join(self.tmp, "store"),
+                        FAKE_JAVA_LOG=self.java_log)
+        self.env.pop("GITHUB_TOKEN", None)
+        self.env.pop("KAORIOS_API_URL", None)
+
+    def stop_server(self):
+        if self.server.socket.fileno() != -1:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run_script(self, *args):
+        result = subprocess.run(["bash", os.path.join(self.root, "scripts", "update_kaorios.sh"), *args],
+                                env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True, timeout=120)
+        return result.returncode, result.stdout
+
+    def downloads(self):
+        return [path for code, path in self.server.requests if path.startswith("/download/")]
+
+    def installed(self, *parts):
+        return os.path.join(self.root, "kaorios_toolbox", *parts)
+
+    def test_store_flow(self):
+        code, out = self.run_script("--force")
+        self.assertEqual(code, 0, out)
+        self.assertEqual(len(self.downloads()), 3)
+        with open(self.installed("version.txt")) as handle:
+            self.assertEqual(handle.read().strip(), TAG)
+        self.assertEqual(len(os.listdir(self.installed("utils", "kaorios"))), 3)
+
+        # Rerun: the API answers 304 and nothing is transferred or extracted again
+        del self.server.requests[:]
+        code, out = self.run_script("--force")
+        self.assertEqual(code, 0, out)
+        self.assertEqual(self.downloads(), [])
+        self.assertTrue(self.server.requests)
+        self.assertTrue(all(code == "304" for code, _ in self.server.requests), self.server.requests)
+        with open(self.java_log) as handle:
+            self.assertEqual(len(handle.readlines()), 1)
+
+        # Offline with the server down: provisioned from the store alone
+        self.stop_server()
+        shutil.rmtree(self.installed("utils"))
+        code, out = self.run_script("--offline", "--force")
+        self.assertEqual(code, 0, out)
+        self.assertEqual(len(os.listdir(self.installed("utils", "kaorios"))), 3)
+        code, out = self.run_script("--offline", "--tag", TAG, "--force")
+        self.assertEqual(code, 0, out)
+
+        # --verify passes on the install and catches a tampered utils tree
+        code, out = self.run_script("--verify")
+        self.assertEqual(code, 0, out)
+        with open(self.installed("utils", "kaorios", "ToolboxUtils.smali"), "a") as handle:
+            handle.write("# edited\n")
+        code, out = self.run_script("--verify")
+        self.assertEqual(code, 1, out)
+        self.assertIn("differs from the tree derived from", out)
+
+    def test_offline_without_store_fails(self):
+        self.stop_server()
+        code, out = self.run_script("--offline", "--force")
+        self.assertEqual(code, 1, out)
+        self.assertIn("was never fetched", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
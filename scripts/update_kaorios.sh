@@ -1,6 +1,13 @@
 #!/usr/bin/env bash
 # update_kaorios.sh - Kaorios Toolbox Component Updater
 # Fetches latest release from GitHub and updates components
+#
+# Release assets go through a content-addressed store (KAORIOS_STORE, see
+# scripts/fptools/release_store.py): the releases API is asked with the ETag
+# of the last answer, assets already stored are never downloaded again, and
+# the utility smali baksmali extracts is kept per classes.dex digest. A rerun,
+# or a runner provisioned with a copy of the store (--offline), costs no
+# transfer.
 
 set -e
 
@@ -9,9 +16,24 @@ PROJECT_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 KAORIOS_DIR="$PROJECT_ROOT/kaorios_toolbox"
 TOOLS_DIR="$PROJECT_ROOT/tools"
 
-# GitHub repository
-KAORIOS_REPO="Wuang26/Kaorios-Toolbox"
-KAORIOS_API_URL="https://api.github.com/repos/$KAORIOS_REPO/releases/latest"
+# GitHub repository; the base URLs can point at a mirror or a local stand-in
+KAORIOS_REPO="${KAORIOS_REPO:-Wuang26/Kaorios-Toolbox}"
+KAORIOS_API_BASE="${KAORIOS_API_BASE:-https://api.github.com}"
+KAORIOS_API_URL="${KAORIOS_API_URL:-$KAORIOS_API_BASE/repos/$KAORIOS_REPO/releases/latest}"
+BAKSMALI_URL="${BAKSMALI_URL:-https://bitbucket.org/JesusFreke/smali/downloads/baksmali-2.5.2.jar}"
+KAORIOS_STORE="${KAORIOS_STORE:-${XDG_CACHE_HOME:-$HOME/.cache}/FrameworkPatcher/kaorios-releases}"
+
+# Local asset name = regex over the release's asset names
+RELEASE_ASSETS=(
+    --asset 'KaoriosToolbox.apk=KaoriosToolbox.*\.apk$'
+    --asset 'privapp_whitelist_com.kousei.kaorios.xml=privapp_whitelist.*\.xml$'
+    --asset 'classes.dex=^classes\.dex$'
+)
+
+OFFLINE=0
+FORCE=0
+VERIFY_ONLY=0
+RELEASE_TAG=""
 
 # Colors for output
 RED='\033[0;31m'
@@ -37,44 +59,66 @@ info() {
     echo -e "${BLUE}[*]${NC} $1"
 }
 
-# Get latest release information from GitHub API
+fptools() {
+    PYTHONPATH="${SCRIPT_DIR}${PYTHONPATH:+:$PYTHONPATH}" python3 -m fptools "$@"
+}
+
+usage() {
+    cat <<EOF
+Usage: $0 [OPTIONS]
+
+OPTIONS:
+  --tag TAG       Install release TAG instead of the latest one
+  --offline       Use only the local store (no network)
+  --force         Reinstall even when already up to date
+  --verify        Check the installed components against the store and exit
+  --store DIR     Release store (default: $KAORIOS_STORE)
+  -h, --help      Show this help
+
+ENVIRONMENT:
+  KAORIOS_API_BASE, KAORIOS_REPO, KAORIOS_API_URL, BAKSMALI_URL, KAORIOS_STORE, GITHUB_TOKEN
+EOF
+}
+
+# release_fetch [fptools release-fetch options]: sets LATEST_VERSION and the
+# store paths of the assets (empty when not stored yet)
+release_fetch() {
+    local output name path
+    local -a mode=()
+    [ "$OFFLINE" -eq 1 ] && mode+=(--offline)
+    [ -n "$RELEASE_TAG" ] && mode+=(--tag "$RELEASE_TAG")
+
+    output=$(fptools release-fetch "$KAORIOS_STORE" "$KAORIOS_API_URL" "${RELEASE_ASSETS[@]}" "${mode[@]}" "$@") ||
+        return 1
+    while IFS=$'\t' read -r name path; do
+        case "$name" in
+            tag) LATEST_VERSION="$path" ;;
+            KaoriosToolbox.apk) APK_PATH="$path" ;;
+            privapp_whitelist_com.kousei.kaorios.xml) XML_PATH="$path" ;;
+            classes.dex) DEX_PATH="$path" ;;
+        esac
+    done <<<"$output"
+}
+
+# Get latest release information from GitHub API (or the store)
 get_latest_release_info() {
     log "Fetching latest Kaorios Toolbox release information..."
-    
-    local response
-    response=$(curl -s "$KAORIOS_API_URL")
-    
-    if [ -z "$response" ]; then
-        err "Failed to fetch release information from GitHub API"
+
+    if ! release_fetch --no-download; then
+        err "Failed to fetch release information from $KAORIOS_API_URL"
         return 1
     fi
-    
-    # Extract version tag
-    LATEST_VERSION=$(echo "$response" | grep -o '"tag_name": *"[^"]*"' | head -1 | sed 's/"tag_name": *"\(.*\)"/\1/')
-    
+
     if [ -z "$LATEST_VERSION" ]; then
         err "Could not parse release version"
         return 1
     fi
-    
-    # Extract download URLs for individual assets
-    APK_URL=$(echo "$response" | grep -o '"browser_download_url": *"[^"]*KaoriosToolbox.*\.apk"' | sed 's/"browser_download_url": *"\(.*\)"/\1/')
-    XML_URL=$(echo "$response" | grep -o '"browser_download_url": *"[^"]*privapp_whitelist[^"]*\.xml"' | sed 's/"browser_download_url": *"\(.*\)"/\1/')
-    DEX_URL=$(echo "$response" | grep -o '"browser_download_url": *"[^"]*classes\.dex"' | sed 's/"browser_download_url": *"\(.*\)"/\1/')
-    
-    if [ -z "$APK_URL" ] || [ -z "$XML_URL" ] || [ -z "$DEX_URL" ]; then
-        err "Could not find required assets in release"
-        echo "APK URL: $APK_URL"
-        echo "XML URL: $XML_URL"
-        echo "DEX URL: $DEX_URL"
-        return 1
-    fi
-    
+
     info "Latest version: $LATEST_VERSION"
-    info "APK: $(basename $APK_URL)"
-    info "XML: $(basename $XML_URL)"
-    info "DEX: $(basename $DEX_URL)"
-    
+    info "APK: ${APK_PATH:-not stored yet}"
+    info "XML: ${XML_PATH:-not stored yet}"
+    info "DEX: ${DEX_PATH:-not stored yet}"
+
     return 0
 }
 
@@ -89,68 +133,61 @@ get_current_version() {
     fi
 }
 
-# Download and extract latest release
+# Bring the release assets into the store; only missing ones are downloaded
 download_kaorios_release() {
-    local temp_dir="/tmp/kaorios_update_$$"
-    mkdir -p "$temp_dir"
-    
-    log "Downloading Kaorios Toolbox $LATEST_VERSION components..."
-    
-    # Download APK
-    if ! curl -L -o "$temp_dir/KaoriosToolbox.apk" "$APK_URL"; then
-        err "Failed to download APK"
-        rm -rf "$temp_dir"
-        return 1
-    fi
-    
-    # Download permission XML
-    if ! curl -L -o "$temp_dir/privapp_whitelist_com.kousei.kaorios.xml" "$XML_URL"; then
-        err "Failed to download permission XML"
-        rm -rf "$temp_dir"
-        return 1
-    fi
-    
-    # Download classes.dex
-    if ! curl -L -o "$temp_dir/classes.dex" "$DEX_URL"; then
-        err "Failed to download classes.dex"
-        rm -rf "$temp_dir"
+    log "Fetching Kaorios Toolbox $LATEST_VERSION components..."
+
+    if ! release_fetch; then
+        err "Failed to download release assets"
         return 1
     fi
-    
+
     # Verify files exist and have reasonable sizes
-    for file in KaoriosToolbox.apk privapp_whitelist_com.kousei.kaorios.xml classes.dex; do
-        if [ ! -f "$temp_dir/$file" ]; then
+    local file size
+    for file in "$APK_PATH" "$XML_PATH" "$DEX_PATH"; do
+        if [ ! -f "$file" ]; then
             err "$file not found after download"
-            rm -rf "$temp_dir"
             return 1
         fi
-        
-        local size=$(stat -f%z "$temp_dir/$file" 2>/dev/null || stat -c%s "$temp_dir/$file")
+
+        size=$(stat -f%z "$file" 2>/dev/null || stat -c%s "$file")
         if [ "$size" -lt 100 ]; then
             err "$file is too small ($size bytes), download may have failed"
-            rm -rf "$temp_dir"
             return 1
         fi
     done
-    
-    TEMP_DIR="$temp_dir"
-    log "✓ Components downloaded successfully"
-    
+
+    log "✓ Components available in $KAORIOS_STORE"
+
     return 0
 }
 
-# Extract utility classes from classes.dex
+# Extract utility classes from classes.dex (once per dex digest)
 extract_utility_classes() {
+    local dex_path="$DEX_PATH"
+    local derived
+    derived="$KAORIOS_STORE/derived/$(basename "$dex_path")"
+
+    if [ -d "$derived/kaorios" ]; then
+        UTILS_SOURCE="$derived/kaorios"
+        log "✓ Reusing $(find "$UTILS_SOURCE" -name "*.smali" | wc -l) utility classes extracted earlier"
+        return 0
+    fi
+    if [ "$OFFLINE" -eq 1 ]; then
+        err "Utility classes of $LATEST_VERSION were never extracted into $KAORIOS_STORE"
+        return 1
+    fi
+
     log "Decompiling classes.dex to extract utility smali classes..."
-    
-    local dex_path="$TEMP_DIR/classes.dex"
+
+    TEMP_DIR=$(mktemp -d "${TMPDIR:-/tmp}/kaorios_update.XXXXXX")
     local extract_dir="$TEMP_DIR/dex_decompiled"
-    
+
     # Ensure baksmali exists
     if [ ! -f "$TOOLS_DIR/baksmali.jar" ]; then
         warn "baksmali.jar not found, downloading..."
-        wget -q -O "$TOOLS_DIR/baksmali.jar" "https://bitbucket.org/JesusFreke/smali/downloads/baksmali-2.5.2.jar"
-        if [ ! -f "$TOOLS_DIR/baksmali.jar" ]; then
+        wget -q -O "$TOOLS_DIR/baksmali.jar" "$BAKSMALI_URL"
+if [ ! -f "$TOOLS_DIR/baksmali.jar" ]; then
             err "Failed to download baksmali.jar"
             return 1
         fi
@@ -174,9 +211,14 @@ extract_utility_classes() {
         return 1
     fi
     
-    UTILS_SOURCE="$utils_source"
+    # Renamed in whole, so an interrupted run leaves nothing half-written
+    mkdir -p "$TEMP_DIR/derived" "$(dirname "$derived")"
+    cp -r "$utils_source" "$TEMP_DIR/derived/kaorios"
+    mv -T "$TEMP_DIR/derived" "$derived" 2>/dev/null || [ -d "$derived/kaorios" ] || return 1
+
+    UTILS_SOURCE="$derived/kaorios"
     local class_count=$(find "$UTILS_SOURCE" -name "*.smali" | wc -l)
-    
+
     log "✓ Found $class_count utility classes"
     
     return 0
@@ -199,12 +241,12 @@ update_components() {
     
     # Copy APK
     log "Updating KaoriosToolbox.apk..."
-    cp "$TEMP_DIR/KaoriosToolbox.apk" "$KAORIOS_DIR/"
-    
+    cp "$APK_PATH" "$KAORIOS_DIR/KaoriosToolbox.apk"
+
     # Copy permission XML
     log "Updating privapp_whitelist XML..."
-    cp "$TEMP_DIR/privapp_whitelist_com.kousei.kaorios.xml" "$KAORIOS_DIR/"
-    
+    cp "$XML_PATH" "$KAORIOS_DIR/privapp_whitelist_com.kousei.kaorios.xml"
+
     # Copy utility classes
     log "Updating utility classes..."
     cp -r "$UTILS_SOURCE" "$KAORIOS_DIR/utils/"
@@ -270,6 +312,27 @@ verify_components() {
     return 0
 }
 
+# Compare the installed components with the stored release of version.txt
+verify_against_store() {
+    log "Verifying installed components against $KAORIOS_STORE..."
+
+    if [ "$CURRENT_VERSION" = "unknown" ]; then
+        err "No version.txt, nothing to verify"
+        return 1
+    fi
+
+    if ! fptools release-verify "$KAORIOS_STORE" "$CURRENT_VERSION" \
+        --file "KaoriosToolbox.apk=$KAORIOS_DIR/KaoriosToolbox.apk" \
+        --file "privapp_whitelist_com.kousei.kaorios.xml=$KAORIOS_DIR/privapp_whitelist_com.kousei.kaorios.xml" \
+        --tree "classes.dex=$KAORIOS_DIR/utils"; then
+        err "Installed components do not match $CURRENT_VERSION in the store"
+        return 1
+    fi
+
+    log "✓ Installed components match $CURRENT_VERSION"
+    return 0
+}
+
 # Cleanup temporary files
 cleanup() {
     if [ -n "$TEMP_DIR" ] && [ -d "$TEMP_DIR" ]; then
@@ -287,11 +350,45 @@ main() {
     echo "╚════════════════════════════════════════════════╝"
     echo ""
     
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            --tag)
+                RELEASE_TAG="$2"
+                shift
+                ;;
+            --offline) OFFLINE=1 ;;
+            --force) FORCE=1 ;;
+            --verify) VERIFY_ONLY=1 ;;
+            --store)
+                KAORIOS_STORE="$2"
+                shift
+                ;;
+            -h | --help)
+                usage
+                exit 0
+                ;;
+            *)
+                err "Unknown option: $1"
+                usage
+                exit 1
+                ;;
+        esac
+        shift
+    done
+    if [ -n "$RELEASE_TAG" ]; then
+        KAORIOS_API_URL="$KAORIOS_API_BASE/repos/$KAORIOS_REPO/releases/tags/$RELEASE_TAG"
+    fi
+
     # Set trap for cleanup
     trap cleanup EXIT
-    
+
     # Get current version
     get_current_version
+
+    if [ "$VERIFY_ONLY" -eq 1 ]; then
+        verify_against_store
+        exit $?
+    fi
     
     # Get latest release info
     if ! get_latest_release_info; then
@@ -300,20 +397,23 @@ main() {
     fi
     
     # Check if update is needed
-    if [ "$CURRENT_VERSION" = "$LATEST_VERSION" ]; then
+    if [ "$CURRENT_VERSION" = "$LATEST_VERSION" ] && [ "$FORCE" -eq 0 ]; then
         info "Already up to date! ($CURRENT_VERSION)"
         echo ""
-        read -p "Force re-download? (y/N): " -n 1 -r
-        echo
+        REPLY=""
+        if [ -t 0 ]; then
+            read -p "Force reinstall? (y/N): " -n 1 -r
+            echo
+        fi
         if [[ ! $REPLY =~ ^[Yy]$ ]]; then
             log "No update needed. Exiting."
             exit 0
         fi
-    else
+    elif [ "$CURRENT_VERSION" != "$LATEST_VERSION" ]; then
         warn "Update available: $CURRENT_VERSION → $LATEST_VERSION"
     fi
     
-    # Download and extract
+    # Download (what the store lacks) and extract
     if ! download_kaorios_release; then
         err "Failed to download release"
         exit 1